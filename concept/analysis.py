@@ -28,7 +28,7 @@ from commons import *
 cimport('from mesh import diff_domain')
 cimport('from communication import communicate_domain, domain_volume')
 cimport('from graphics import plot_powerspec')
-cimport('from mesh import CIC_components2φ, fft, slab_decompose')
+cimport('from mesh import CIC_components2slab_fourier, fourier_offsets')
 
 
 
@@ -66,13 +66,14 @@ cimport('from mesh import CIC_components2φ, fft, slab_decompose')
                 row_quantity='list',
                 row_type='list',
                 row_σ_tophat='list',
-                slab='double[:, :, ::1]',
-                slab_jik='double*',
+                slab='real[:, :, ::1]',
+                slab_jik='real*',
+                slab_start_j='Py_ssize_t',
+                slab_start_kk='Py_ssize_t',
                 spectrum_plural='str',
                 symmetry_multiplicity='int',
                 totmass='double',
                 Σmass='double',
-                φ='double[:, :, ::1]',
                 σ_tophat='dict',
                 σ_tophat_σ='dict',
                 )
@@ -128,8 +129,9 @@ def powerspec(components, filename):
         # Assign short names for the arrays storing the results
         power    = power_dict[component.name]
         power_σ2 = power_σ2_dict[component.name]
-        # We now do the CIC interpolation of the component onto a grid
-        # and perform the FFT on this grid. Here the φ grid is used.
+        # We now interpolate the component onto a grid using the
+        # pm_assignment scheme and perform the FFT on this grid.
+        # Here the φ grid is used.
         # We choose to interpolate the mass of the component onto the
         # grid. For particles, this simply means that each particle
         # contribute by their mass, which is constant in time and
@@ -150,7 +152,7 @@ def powerspec(components, filename):
                                                *(boxsize/component_i.gridsize)**3
                                                for component_i in components]),
                                         ]
-            φ = CIC_components2φ(components, interpolation_quantities)
+            slab = CIC_components2slab_fourier(components, interpolation_quantities)
         else:
             interpolation_quantities = [# Particle components
                                         ('particles', [component.mass]),
@@ -158,20 +160,23 @@ def powerspec(components, filename):
                                         ('ϱ', [universals.a**(-3*component.w())
                                                *(boxsize/component.gridsize)**3]),
                                         ]
-            φ = CIC_components2φ(component, interpolation_quantities)
+            slab = CIC_components2slab_fourier(component, interpolation_quantities)
+        # The global indices of the first element of the local slab.
+        # For a slab this is (slab.shape[0]*rank, 0) while for a pencil
+        # the k-dimension is distributed as well.
+        slab_start_j, slab_start_kk = fourier_offsets(slab)
         # We want to normalize the powerspectrum with respect to the box
         # volume. Since we interpolated the mass to the grid and then
         # square each grid value to compute the power, the
         # normalization will be boxsize**3/Σmass**2. Here we could be
-        # clever and calculate Σmass, but instead we simply measure it.
-        Σmass = allreduce(np.sum(φ[2:(φ.shape[0] - 3),
-                                   2:(φ.shape[1] - 3),
-                                   2:(φ.shape[2] - 3)]),
-                          op=MPI.SUM)
+        # clever and calculate Σmass, but instead we simply measure it,
+        # as the real part of the k = 0 mode of the Fourier transformed
+        # grid, residing on a single process.
+        Σmass = 0
+        if slab_start_j == 0 and slab_start_kk == 0:
+            Σmass = slab[0, 0, 0]
+        Σmass = allreduce(Σmass, op=MPI.SUM)
         normalization = boxsize**3/Σmass**2
-        # Fourier transform the grid
-        slab = slab_decompose(φ, prepare_fft=True)
-        fft(slab, 'forward')
         # Reset power, power multiplicity and power variance
         power   [:] = 0
         power_N [:] = 0
@@ -181,7 +186,7 @@ def powerspec(components, filename):
         nyquist = φ_gridsize//2
         for j in range(ℤ[slab.shape[0]]):
             # The j-component of the wave vector
-            j_global = ℤ[slab.shape[0]*rank] + j
+            j_global = slab_start_j + j
             if j_global > ℤ[φ_gridsize//2]:
                 kj = j_global - φ_gridsize
             else:
@@ -205,7 +210,7 @@ def powerspec(components, filename):
                 # imaginary part of the same complex number.
                 for k in range(0, ℤ[slab.shape[2]], 2):
                     # The k-component of the wave vector
-                    kk = k//2
+                    kk = slab_start_kk + k//2
                     # The squared magnitude of the wave vector
                     k2 = ℤ[ki**2 + kj2] + kk**2
                     # Pointer to the [j, i, k]'th element of the slab.
@@ -217,8 +222,8 @@ def powerspec(components, filename):
                         if component.representation == 'particles':
                             reciprocal_sqrt_deconv_ijk = (reciprocal_sqrt_deconv_ij
                                                           *sinc(kk*ℝ[π/φ_gridsize]))
-                            slab_jik[0] *= ℝ[1/(reciprocal_sqrt_deconv_ijk)**2]  # Real part
-                            slab_jik[1] *= ℝ[1/(reciprocal_sqrt_deconv_ijk)**2]  # Imag part
+                            slab_jik[0] *= ℝ[1/reciprocal_sqrt_deconv_ijk**pm_assignment_order]  # Real
+                            slab_jik[1] *= ℝ[1/reciprocal_sqrt_deconv_ijk**pm_assignment_order]  # Imag
                     # The power is the squared magnitude
                     # of the complex number
                     P = slab_jik[0]**2 + slab_jik[1]**2
@@ -466,12 +471,12 @@ def σ2_integrand(power, k2):
                quantity='str',
                # Locals
                J_arr='object', # np.ndarray
-               J_noghosts='double[:, :, :]',
+               J_noghosts='real[:, :, :]',
                N='Py_ssize_t',
                N_elements='Py_ssize_t',
                Vcell='double',
-               diff_backward='double[:, :, ::1]',
-               diff_forward='double[:, :, ::1]',
+               diff_backward='real[:, :, ::1]',
+               diff_forward='real[:, :, ::1]',
                diff_max='double[::1]',
                diff_max_dim='double',
                diff_size='double',
@@ -501,8 +506,8 @@ def σ2_integrand(power, k2):
                ϱ='FluidScalar',
                ϱ_arr='object',  # np.ndarray
                ϱ_min='double',
-               ϱ_mv='double[:, :, ::1]',
-               ϱ_noghosts='double[:, :, :]',
+               ϱ_mv='real[:, :, ::1]',
+               ϱ_noghosts='real[:, :, :]',
                σ2mom_dim='double',
                σ2ϱ='double',
                σmom='double[::1]',
@@ -31,8 +31,8 @@
 ############################################
 from __future__ import division  # Needed for Python3 division in Cython
 # Miscellaneous modules
-import collections, contextlib, ctypes, cython, functools, imp, inspect, itertools
-import os, re, shutil, sys, textwrap, types, unicodedata
+import collections, contextlib, ctypes, cython, functools, imp, inspect, itertools, json
+import os, re, shutil, socket, sys, textwrap, types, unicodedata
 # For math
 # (note that numpy.array is purposely not imported directly into the
 # global namespace, as this does not play well with Cython).
@@ -78,9 +78,13 @@ master = (rank == master_rank)
 # MPI functions for communication
 Allgather  = comm.Allgather
 Allgatherv = comm.Allgatherv
+Allreduce  = comm.Allreduce
+Alltoall   = comm.Alltoall
+Alltoallv  = comm.Alltoallv
 Barrier    = comm.Barrier
 Bcast      = lambda buf, root=master_rank: comm.Bcast(buf, root)
 Gather     = comm.Gather
+Irecv      = comm.Irecv
 Isend      = comm.Isend
 Reduce     = comm.Reduce
 Recv       = comm.Recv
@@ -88,6 +92,7 @@ Send       = comm.Send
 Sendrecv   = comm.Sendrecv
 allreduce  = comm.allreduce
 bcast      = lambda obj, root=master_rank: comm.bcast(obj, root)
+gather     = lambda obj, root=master_rank: comm.gather(obj, root)
 iprobe     = comm.iprobe
 isend      = comm.isend
 recv       = comm.recv
@@ -421,6 +426,23 @@ if not cython.compiled:
     C2np['unsigned long int'] = C2np['long int']
     C2np['unsigned long long int'] = C2np['long long int']
     C2np['size_t'] = C2np['ptrdiff_t']
+# The values of mesh grids (the potential, fluid and FFT grids) are of
+# the type real, which is double unless the code is built with single
+# precision (see precision.h), in which case it is float.
+# In pure Python, real is always double.
+pxd = """
+cdef extern from "precision.h":
+    ctypedef double real
+"""
+if not cython.compiled:
+    C2np['real'] = C2np['double']
+else:
+    """
+    C2np['real'] = C2np['float'] if sizeof(real) == sizeof(float) else C2np['double']
+    """
+# The MPI datatype corresponding to real
+cython.declare(MPI_real='object')  # mpi4py.MPI.Datatype
+MPI_real = MPI.FLOAT if C2np['real'] is C2np['float'] else MPI.DOUBLE
 
 
 
@@ -519,6 +541,7 @@ if not cython.compiled:
                        exp, log, log2, log10,
                        sqrt,
                        floor, ceil, round,
+                       fmod,
                        )
     cbrt = lambda x: x**(1/3)
     from math import erf, erfc
@@ -555,6 +578,12 @@ if not cython.compiled:
         def __exit__(self, *exc_info):
             ...
     unswitch = DummyContextManager()
+    # Parallel (OpenMP) loops are run serially, with the arguments
+    # specific to prange (nogil, schedule, num_threads) ignored.
+    def prange(*args, **kwargs):
+        return range(*args)
+    def threadid():
+        return 0
 # Function for building "structs" (really simple namespaces).
 # In compiled mode, this function body will be copied and
 # specialised for each kind of struct created.
@@ -893,6 +922,7 @@ def sensible_path(path):
 cython.declare(argd='dict',
                globals_dict='dict',
                jobid='unsigned long long int',
+               memory_report='bint',
                )
 argd = {}
 for arg in sys.argv:
@@ -909,6 +939,8 @@ paths['params'] = argd.get('params', '')
 paths['params_cp'] = argd.get('params_cp', '')
 # The jobid of the current run
 jobid = int(argd.get('jobid', 0))
+# Whether to print reports of the memory used by buffers and grids
+memory_report = (argd.get('memory_report', 'False') == 'True')
 
 
 
@@ -1273,9 +1305,16 @@ cython.declare(# Input/output
                # Numerical parameter
                boxsize='double',
                ewald_gridsize='Py_ssize_t',
+               ewald_interpolation='str',
+               ewald_storage='str',
                φ_gridsize='ptrdiff_t',
                p3m_scale='double',
                p3m_cutoff='double',
+               tree_opening_angle='double',
+               pp_kernel='str',
+               pm_differentiation='str',
+               pm_assignment='str',
+               pm_interlacing='bint',
                softeningfactors='dict',
                R_tophat='double',
                modes_per_decade='double',
@@ -1299,10 +1338,18 @@ cython.declare(# Input/output
                # Simlation options
                fftw_wisdom_rigor='str',
                fftw_wisdom_reuse='bint',
+               fft_decomposition='str',
+               fourier_density_caching='bint',
+               load_balancing_interval='Py_ssize_t',
                master_seed='unsigned long int',
+               num_threads='int',
+               particle_exchange='str',
+               particle_growth_factor='double',
+               particle_ids='bint',
+               particle_sorting='str',
+               particle_sorting_interval='Py_ssize_t',
                vacuum_corrections='dict',
                # Debugging options
-               enable_Ewald='bint',
                enable_Hubble='bint',
                enable_class='bint',
                enable_debugging='bint',
@@ -1375,9 +1422,16 @@ if autosave < 0:
 # Numerical parameters
 boxsize = float(user_params.get('boxsize', 1))
 ewald_gridsize = to_int(user_params.get('ewald_gridsize', 64))
+ewald_interpolation = str(user_params.get('ewald_interpolation', 'CIC')).lower()
+ewald_storage = str(user_params.get('ewald_storage', 'octant')).lower()
 φ_gridsize = to_int(user_params.get('φ_gridsize', 64))
 p3m_scale = float(user_params.get('p3m_scale', 1.25))
 p3m_cutoff = float(user_params.get('p3m_cutoff', 4.8))
+tree_opening_angle = float(user_params.get('tree_opening_angle', 0.5))
+pp_kernel = str(user_params.get('pp_kernel', 'plain')).lower()
+pm_differentiation = str(user_params.get('pm_differentiation', 'real')).lower()
+pm_assignment = str(user_params.get('pm_assignment', 'CIC')).upper()
+pm_interlacing = bool(user_params.get('pm_interlacing', False))
 softeningfactors = dict(user_params.get('softeningfactors', {}))
 replace_ellipsis(softeningfactors)
 R_tophat = float(user_params.get('R_tophat', 8*units.Mpc))
@@ -1435,8 +1489,17 @@ w_eos = dict(user_params.get('w_eos', {}))
 replace_ellipsis(w_eos)
 # Simulation options
 fftw_wisdom_rigor = user_params.get('fftw_wisdom_rigor', 'estimate').lower()
-fftw_wisdom_reuse = bool(user_params.get('fftw_wisdom_reuse', False))
+fftw_wisdom_reuse = bool(user_params.get('fftw_wisdom_reuse', True))
+fft_decomposition = str(user_params.get('fft_decomposition', 'slab')).lower()
+fourier_density_caching = bool(user_params.get('fourier_density_caching', False))
+load_balancing_interval = to_int(user_params.get('load_balancing_interval', 0))
 master_seed = int(user_params.get('master_seed', 1))
+num_threads = to_int(user_params.get('num_threads', 1))
+particle_exchange = str(user_params.get('particle_exchange', 'alltoallv')).lower()
+particle_growth_factor = float(user_params.get('particle_growth_factor', 1.25))
+particle_ids = bool(user_params.get('particle_ids', False))
+particle_sorting = str(user_params.get('particle_sorting', 'hilbert')).lower()
+particle_sorting_interval = to_int(user_params.get('particle_sorting_interval', 0))
 vacuum_corrections = {'all': True}
 if 'vacuum_corrections' in user_params:
     if isinstance(user_params['vacuum_corrections'], dict):
@@ -1461,8 +1524,6 @@ terminal_render_resolution = to_int(user_params.get('terminal_render_resolution'
 terminal_render_colormap = str(user_params.get('terminal_render_colormap', 'gnuplot2'))
 # Debugging options
 enable_class = bool(user_params.get('enable_class', True))
-enable_Ewald = bool(user_params.get('enable_Ewald',  # !!! Only used by gravity_old.py
-                                    True if 'pp' in force_methods else False))
 enable_Hubble = bool(user_params.get('enable_Hubble', True))
 enable_debugging = bool(user_params.get('enable_debugging', False))
 # Extra hidden parameters via the special_params variable
@@ -1521,10 +1582,9 @@ cython.declare(snapshot_dir='str',
                Ωm='double',
                ϱ_mbar='double',
                slab_size_padding='ptrdiff_t',
-               pm_fac_const='double',
-               longrange_exponent_fac='double',
                p3m_cutoff_phys='double',
                p3m_scale_phys='double',
+               pm_assignment_order='int',
                )
 # Extract output variables from output dicts
 snapshot_dir          = output_dirs['snapshot']
@@ -1553,30 +1613,15 @@ terminal_render_times = {time_param: output_times[time_param]['terminal render']
 ϱ_mbar = Ωm*ϱ_crit
 # The real size of the padded (last) dimension of global slab grid
 slab_size_padding = 2*(φ_gridsize//2 + 1)
-# All constant factors across the PM scheme is gathered in the
-# pm_fac_const variable. Its contributions are:
-# Normalization due to forwards and backwards Fourier transforms:
-#     1/φ_gridsize**3
-# Factor in the Greens function:
-#     -4*π*G_Newton/((2*π/((boxsize/φ_gridsize)*φ_gridsize))**2)   
-# The acceleration is the negative gradient of the potential:
-#     -1
-# For converting acceleration to momentum (for particles)
-#     particles.mass*Δt
-# Everything except the mass and the time are constant, and is condensed
-# into the pm_fac_const variable.
-pm_fac_const = G_Newton*boxsize**2/(π*φ_gridsize**3)  # ONLY USED BY gravity_old.py !!!
-# The exponential cutoff for the long-range force looks like
-# exp(-k2*rs2). In the code, the wave vector is in grid units in stead
-# of radians. The conversion is 2*π/φ_gridsize. The total factor on k2
-# in the exponential is then
-longrange_exponent_fac = -(2*π/φ_gridsize*p3m_scale)**2
 # The short-range/long-range force scale
 p3m_scale_phys = p3m_scale*boxsize/φ_gridsize
 # Particles within this distance to the surface of the domain should
 # interact with particles in the neighboring domain via the shortrange
 # force, when the P3M algorithm is used.
 p3m_cutoff_phys = p3m_scale_phys*p3m_cutoff
+# The number of grid points per dimension over which each particle is
+# assigned by the PM mass assignment scheme.
+pm_assignment_order = {'CIC': 2, 'TSC': 3, 'PCS': 4}.get(pm_assignment, 2)
 
 
 
@@ -1593,11 +1638,9 @@ units_dict.setdefault('G_Newton'              , G_Newton              )
 units_dict.setdefault('H0'                    , H0                    )
 units_dict.setdefault('p3m_cutoff_phys'       , p3m_cutoff_phys       )
 units_dict.setdefault('p3m_scale_phys'        , p3m_scale_phys        )
-units_dict.setdefault('pm_fac_const'          , pm_fac_const          )
 units_dict.setdefault('R_tophat'              , R_tophat              )
 units_dict.setdefault('a_begin'               , a_begin               )
 units_dict.setdefault('boxsize'               , boxsize               )
-units_dict.setdefault('longrange_exponent_fac', longrange_exponent_fac)
 units_dict.setdefault('t_begin'               , t_begin               )
 units_dict.setdefault(        'Ωcdm'          , Ωcdm                  )
 units_dict.setdefault(unicode('Ωcdm')         , Ωcdm                  )
@@ -1619,6 +1662,7 @@ units_dict.setdefault('render_resolution'         , render_resolution         )
 units_dict.setdefault('slab_size_padding'         , slab_size_padding         )
 units_dict.setdefault('softeningfactors'          , softeningfactors          )
 units_dict.setdefault('terminal_render_resolution', terminal_render_resolution)
+units_dict.setdefault('tree_opening_angle'        , tree_opening_angle        )
 units_dict.setdefault(        'φ_gridsize'        , φ_gridsize                )
 units_dict.setdefault(unicode('φ_gridsize')       , φ_gridsize                )
 # Add numbers
@@ -2008,6 +2052,62 @@ if snapshot_type not in ('standard', 'gadget2'):
 # Abort on illegal FFTW rigor
 if fftw_wisdom_rigor not in ('estimate', 'measure', 'patient', 'exhaustive'):
     abort('Does not recognize FFTW rigor "{}"'.format(user_params['fftw_wisdom_rigor']))
+# Abort on illegal FFT decomposition
+if fft_decomposition not in ('slab', 'pencil'):
+    abort('Does not recognize FFT decomposition "{}"'.format(user_params['fft_decomposition']))
+# Abort on illegal particle exchange
+if particle_exchange not in ('alltoallv', 'sendrecv'):
+    abort('Does not recognize particle exchange "{}"'.format(user_params['particle_exchange']))
+# Abort on illegal particle growth factor
+if particle_growth_factor < 1:
+    abort('A particle_growth_factor of {} was specified. This must be at least 1'
+          .format(particle_growth_factor))
+# Abort on illegal number of threads
+if num_threads < 1:
+    abort('A num_threads of {} was specified. This must be at least 1'.format(num_threads))
+# Abort on illegal particle sorting
+if particle_sorting not in ('morton', 'hilbert'):
+    abort('Does not recognize particle sorting "{}"'.format(user_params['particle_sorting']))
+if particle_sorting_interval < 0:
+    abort('A particle_sorting_interval of {} was specified. This must be at least 0'
+          .format(particle_sorting_interval))
+# Abort on illegal load balancing interval. Warn if load balancing
+# is combined with mesh-based methods, as the particles then need to
+# be redistributed back to the regular domains in every time step.
+if load_balancing_interval < 0:
+    abort('A load_balancing_interval of {} was specified. This must be at least 0'
+          .format(load_balancing_interval))
+if load_balancing_interval > 0 and force_methods - {'pp', 'ppnonperiodic', 'tree', 'treenonperiodic'}:
+    masterwarn('Load balancing is enabled, but the methods {} make use of meshes, which always '
+               'follow the regular domain decomposition. The particles will be redistributed '
+               'back to the regular domains whenever these methods are applied.'
+               .format(force_methods - {'pp', 'ppnonperiodic', 'tree', 'treenonperiodic'}))
+# Abort on illegal Ewald options
+if ewald_interpolation not in ('cic', 'tricubic'):
+    abort('Does not recognize Ewald interpolation "{}"'.format(user_params['ewald_interpolation']))
+if ewald_storage not in ('octant', 'wedge'):
+    abort('Does not recognize Ewald storage "{}"'.format(user_params['ewald_storage']))
+if ewald_interpolation == 'tricubic' and ewald_gridsize < 4:
+    abort('Tricubic Ewald interpolation requires an ewald_gridsize of at least 4')
+if (    (pp_kernel == 'tiled' or num_threads > 1)
+    and (ewald_interpolation != 'cic' or ewald_storage != 'octant')
+    and 'pp' in force_methods
+    ):
+    masterwarn('The tiled (threaded) PP kernel only supports CIC interpolation in the octant '
+               'storage of the Ewald grid. The plain PP kernel will be used for periodic gravity.')
+# Abort on illegal tree opening angle
+if tree_opening_angle <= 0:
+    abort('A tree_opening_angle of {} was specified. This must be > 0'
+          .format(tree_opening_angle))
+# Abort on illegal PP kernel
+if pp_kernel not in ('plain', 'tiled'):
+    abort('Does not recognize PP kernel "{}"'.format(user_params['pp_kernel']))
+# Abort on illegal PM differentiation
+if pm_differentiation not in ('real', 'fourier'):
+    abort('Does not recognize PM differentiation "{}"'.format(user_params['pm_differentiation']))
+# Abort on illegal PM mass assignment scheme
+if pm_assignment not in ('CIC', 'TSC', 'PCS'):
+    abort('Does not recognize PM assignment "{}"'.format(user_params['pm_assignment']))
 # Warn if master_seed is chosen to be 0, as this may lead to clashes
 # with the default seed used by GSL.
 if master_seed < 1:
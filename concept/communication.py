@@ -110,46 +110,24 @@ def find_N_recv(N_send):
 @cython.header(# Arguments
                component='Component',
                reset_buffers='bint',
+               owners='int[::1]',
                # Locals
-               ID_recv='int',
-               ID_send='int',
                N_local='Py_ssize_t',
-               N_needed='Py_ssize_t',
-               N_recv='Py_ssize_t[::1]',
-               N_recv_j='Py_ssize_t',
-               N_recv_max='Py_ssize_t',
-               N_recv_tot='Py_ssize_t',
-               N_send_j='Py_ssize_t',
-               N_send_max='Py_ssize_t',
-               N_send_owner='Py_ssize_t',
+               N_send_far='Py_ssize_t',
                N_send_tot='Py_ssize_t',
                N_send_tot_global='Py_ssize_t',
-               buffer_name='object',  # int or str
-               holes_filled='Py_ssize_t',
                i='Py_ssize_t',
-               index_recv_j='Py_ssize_t',
-               indices_send_j='Py_ssize_t*',
-               indices_send_owner='Py_ssize_t*',
                j='int',
-               k='Py_ssize_t',
-               k_start='Py_ssize_t',
-               momx='double*',
-               momx_mv='double[::1]',
-               momy='double*',
-               momy_mv='double[::1]',
-               momz='double*',
-               momz_mv='double[::1]',
+               neighbours_only='bint',
                owner='int',
+               owners_given='bint',
+               totals='Py_ssize_t[::1]',
                posx='double*',
-               posx_mv='double[::1]',
                posy='double*',
-               posy_mv='double[::1]',
                posz='double*',
-               posz_mv='double[::1]',
-               sendbuf_mv='double[::1]',
                Δmemory='Py_ssize_t',
                )
-def exchange(component, reset_buffers=False):
+def exchange(component, reset_buffers=False, owners=None):
     """This function will do an exchange of particles between processes,
     so that every particle resides on the process in charge of the
     domain where the particle is located. The variable indices_send
@@ -157,7 +135,15 @@ def exchange(component, reset_buffers=False):
     processes, while particle data is copied to sendbuf before it is
     send. These two variables will grow in size if needed. Call with
     reset_buffers=True to reset these variables to their most basic
-    forms, freeing up memory. 
+    forms, freeing up memory.
+    The communication itself is carried out according to the
+    particle_exchange parameter, by either exchange_alltoallv
+    or exchange_sendrecv. For the former, when no particle on any
+    process is to be send further than to one of the neighbouring
+    domains, only the neighbouring processes communicate.
+    If the ranks of the processes in charge of the particles are
+    already known (as found by Component.drift), these may be passed
+    as owners, in which case the positions are not looked at.
     """
     # No need to consider exchange of particles if running serially
     if nprocs == 1:
@@ -176,9 +162,14 @@ def exchange(component, reset_buffers=False):
     for j in range(nprocs):
         N_send[j] = 0
     # Find out where to send which particle
+    owners_given = (owners is not None)
     for i in range(N_local):
         # Rank of the process that local particle i belongs to
-        owner = which_domain(posx[i], posy[i], posz[i])
+        with unswitch:
+            if owners_given:
+                owner = owners[i]
+            else:
+                owner = which_domain(posx[i], posy[i], posz[i])
         if owner != rank:
             # Particle owned by nonlocal process owner.
             # Append the owner's index buffer with the particle index.
@@ -190,18 +181,320 @@ def exchange(component, reset_buffers=False):
                 indices_send_sizes[owner] += Δmemory
                 indices_send[owner] = realloc(indices_send[owner],
                                               indices_send_sizes[owner]*sizeof('Py_ssize_t'))
+    # Count the particles to be send to processes other than the
+    # neighbours. Typically there are none, as the particles move
+    # a distance short compared to the domain size in a time step.
+    N_send_far = 0
+    for j in range(nprocs):
+        if not exchange_neighbour_mask[j]:
+            N_send_far += N_send[j]
     # No need to continue if no particles should be exchanged
     N_send_tot = sum(N_send)
-    N_send_tot_global = allreduce(N_send_tot, op=MPI.SUM)
+    totals = allreduce(asarray([N_send_tot, N_send_far], dtype=C2np['Py_ssize_t']), op=MPI.SUM)
+    N_send_tot_global = totals[0]
     if N_send_tot_global == 0:
         return
+    # The exchange may be restricted to the neighbouring processes
+    # if no particles are to be send further away, on any process.
+    # For the load-balanced decomposition the neighbours of a domain
+    # are not given by the regular layout.
+    neighbours_only = (exchange_neighbours.shape[0] < nprocs - 1
+                       and not domains_balanced
+                       and totals[1] == 0
+                       )
     # Print out exchange message
     masterprint('Exchanging {} of the {} particles ...'.format(N_send_tot_global, component.name))
+    # Exchange particles between processes
+    if particle_exchange == 'alltoallv':
+        exchange_alltoallv(component, N_send_tot, neighbours_only)
+    else:
+        exchange_sendrecv(component, N_send_tot)
+    # If reset_buffers is True, reset the global indices_send and
+    # the send and receive buffers to their basic forms. These will
+    # then be rebuild in future calls.
+    if reset_buffers:
+        release_buffers(['send', 'exchange_owners', 'exchange_recv'])
+        for j in range(nprocs):
+            indices_send[j] = realloc(indices_send[j], 1*sizeof('Py_ssize_t'))
+            indices_send_sizes[j] = 1
+    # Finalize exchange message
+    masterprint('done')
+
+# Function carrying out the communication of the exchange function
+# by a single Alltoallv, with all variables of each particle packed
+# together into one record.
+@cython.header(# Arguments
+               component='Component',
+               N_send_tot='Py_ssize_t',
+               neighbours_only='bint',
+               # Locals
+               N_local='Py_ssize_t',
+               N_local_new='Py_ssize_t',
+               N_recv_tot='Py_ssize_t',
+               dest='Py_ssize_t',
+               i='Py_ssize_t',
+               ids='unsigned long long int*',
+               index='Py_ssize_t',
+               index_ids='Py_ssize_t',
+               indices_send_j='Py_ssize_t*',
+               j='int',
+               k='Py_ssize_t',
+               l='Py_ssize_t',
+               masses='double*',
+               momx='double*',
+               momy='double*',
+               momz='double*',
+               neighbour='int',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               record_size='Py_ssize_t',
+               requests='list',
+               recvbuf='double*',
+               recvbuf_ids='unsigned long long int*',
+               recvbuf_ids_mv='unsigned long long int[::1]',
+               recvbuf_mv='double[::1]',
+               sendbuf='double*',
+               sendbuf_ids='unsigned long long int*',
+               sendbuf_ids_mv='unsigned long long int[::1]',
+               sendbuf_mv='double[::1]',
+               use_ids='bint',
+               use_masses='bint',
+               )
+def exchange_alltoallv(component, N_send_tot, neighbours_only=False):
+    """The particles to send to each process are packed into a single
+    send buffer, ordered by the receiving process, with the six
+    variables (posx, posy, posz, momx, momy, momz) of each particle
+    stored contiguously. All particles are then communicated by a
+    single Alltoallv, rather than six Sendrecv's per process.
+    If in use, the individual mass and the ID of each particle are
+    appended to its record, the latter stored bitwise within the
+    (8 byte) double.
+    The received particles are first used to fill the holes left by
+    the sent particles, with any remaining received particles appended
+    to the end. If fewer particles are received than sent, the remaining
+    holes are filled by the last particles.
+    With neighbours_only, the caller guarantees that particles are only
+    exchanged between neighbouring domains (in the regular layout).
+    The Alltoall and Alltoallv are then replaced by point-to-point
+    communication between neighbouring processes only.
+    """
+    N_local = component.N_local
+    # The number of variables (doubles) of each particle
+    use_masses = component.use_masses
+    use_ids = component.use_ids
+    record_size = 6 + use_masses + use_ids
+    index_ids = record_size - 1
+    # Communicate the number of particles
+    # to send to and receive from each process.
+    if neighbours_only:
+        requests = []
+        for j in range(nprocs):
+            N_recv_exchange[j] = 0
+        for l in range(exchange_neighbours.shape[0]):
+            neighbour = exchange_neighbours[l]
+            requests.append(Isend(N_send[neighbour:neighbour + 1], dest=neighbour))
+        for l in range(exchange_neighbours.shape[0]):
+            neighbour = exchange_neighbours[l]
+            Recv(N_recv_exchange[neighbour:neighbour + 1], source=neighbour)
+        for request in requests:
+            request.wait()
+    else:
+        Alltoall(N_send, N_recv_exchange)
+    N_recv_tot = 0
+    for j in range(nprocs):
+        exchange_counts_send[j] = record_size*N_send[j]
+        exchange_counts_recv[j] = record_size*N_recv_exchange[j]
+        exchange_displs_send[j] = 0 if j == 0 else (
+            exchange_displs_send[j - 1] + exchange_counts_send[j - 1])
+        exchange_displs_recv[j] = 0 if j == 0 else (
+            exchange_displs_recv[j - 1] + exchange_counts_recv[j - 1])
+        N_recv_tot += N_recv_exchange[j]
+    # Enlarge the component data attributes, if needed
+    N_local_new = N_local - N_send_tot + N_recv_tot
+    if component.N_allocated < N_local_new:
+        component.resize(N_local_new)
+    posx = component.posx
+    posy = component.posy
+    posz = component.posz
+    momx = component.momx
+    momy = component.momy
+    momz = component.momz
+    masses = component.masses
+    ids = component.ids
+    # Pack the particles to be send, marking the holes
+    # left in the data by setting posx[hole] = -1.
+    # The IDs are written through a view of the same buffer.
+    sendbuf_mv = get_buffer(record_size*N_send_tot, 'send')
+    sendbuf = cython.address(sendbuf_mv[:])
+    if use_ids:
+        sendbuf_ids_mv = get_buffer(record_size*N_send_tot, 'send',
+                                    dtype='unsigned long long int')
+        sendbuf_ids = cython.address(sendbuf_ids_mv[:])
+    index = 0
+    for j in range(nprocs):
+        indices_send_j = indices_send[j]
+        for i in range(N_send[j]):
+            k = indices_send_j[i]
+            sendbuf[index    ] = posx[k]
+            sendbuf[index + 1] = posy[k]
+            sendbuf[index + 2] = posz[k]
+            sendbuf[index + 3] = momx[k]
+            sendbuf[index + 4] = momy[k]
+            sendbuf[index + 5] = momz[k]
+            with unswitch(2):
+                if use_masses:
+                    sendbuf[index + 6] = masses[k]
+            with unswitch(2):
+                if use_ids:
+                    sendbuf_ids[index + index_ids] = ids[k]
+            index += record_size
+            posx[k] = -1
+    # Communicate all particles at once
+    recvbuf_mv = get_buffer(record_size*N_recv_tot, 'exchange_recv')
+    recvbuf = cython.address(recvbuf_mv[:])
+    if use_ids:
+        recvbuf_ids_mv = get_buffer(record_size*N_recv_tot, 'exchange_recv',
+                                    dtype='unsigned long long int')
+        recvbuf_ids = cython.address(recvbuf_ids_mv[:])
+    if neighbours_only:
+        requests = []
+        for l in range(exchange_neighbours.shape[0]):
+            neighbour = exchange_neighbours[l]
+            if exchange_counts_send[neighbour] == 0:
+                continue
+            requests.append(Isend(
+                sendbuf_mv[exchange_displs_send[neighbour]:
+                           exchange_displs_send[neighbour] + exchange_counts_send[neighbour]],
+                dest=neighbour,
+            ))
+        for l in range(exchange_neighbours.shape[0]):
+            neighbour = exchange_neighbours[l]
+            if exchange_counts_recv[neighbour] == 0:
+                continue
+            Recv(recvbuf_mv[exchange_displs_recv[neighbour]:
+                            exchange_displs_recv[neighbour] + exchange_counts_recv[neighbour]],
+                 source=neighbour)
+        for request in requests:
+            request.wait()
+    else:
+        Alltoallv((sendbuf_mv, (exchange_counts_send, exchange_displs_send), MPI.DOUBLE),
+                  (recvbuf_mv, (exchange_counts_recv, exchange_displs_recv), MPI.DOUBLE))
+    # Unpack the received particles into the holes,
+    # appending those for which no hole is left.
+    k = 0
+    dest = N_local
+    index = 0
+    for i in range(N_recv_tot):
+        while k < N_local and posx[k] != -1:
+            k += 1
+        if k < N_local:
+            dest = k
+            k += 1
+        else:
+            dest = N_local + (i - N_send_tot)
+        posx[dest] = recvbuf[index    ]
+        posy[dest] = recvbuf[index + 1]
+        posz[dest] = recvbuf[index + 2]
+        momx[dest] = recvbuf[index + 3]
+        momy[dest] = recvbuf[index + 4]
+        momz[dest] = recvbuf[index + 5]
+        with unswitch:
+            if use_masses:
+                masses[dest] = recvbuf[index + 6]
+        with unswitch:
+            if use_ids:
+                ids[dest] = recvbuf_ids[index + index_ids]
+        index += record_size
+    # Fill the remaining holes (if any) by moving
+    # the particles at the end of the data.
+    if N_recv_tot < N_send_tot:
+        i = N_local - 1
+        while True:
+            while k < N_local and posx[k] != -1:
+                k += 1
+            while i >= 0 and posx[i] == -1:
+                i -= 1
+            if k >= i:
+                break
+            posx[k] = posx[i]
+            posy[k] = posy[i]
+            posz[k] = posz[i]
+            momx[k] = momx[i]
+            momy[k] = momy[i]
+            momz[k] = momz[i]
+            with unswitch:
+                if use_masses:
+                    masses[k] = masses[i]
+            with unswitch:
+                if use_ids:
+                    ids[k] = ids[i]
+            posx[i] = -1
+    # Update N_local
+    component.N_local = N_local_new
+
+# Function carrying out the communication of the exchange function
+# by one Sendrecv per variable (six, plus the masses and IDs if in use)
+# per process.
+@cython.header(# Arguments
+               component='Component',
+               N_send_tot='Py_ssize_t',
+               # Locals
+               ID_recv='int',
+               ID_send='int',
+               N_local='Py_ssize_t',
+               N_needed='Py_ssize_t',
+               N_recv='Py_ssize_t[::1]',
+               N_recv_j='Py_ssize_t',
+               N_recv_max='Py_ssize_t',
+               N_recv_tot='Py_ssize_t',
+               N_send_j='Py_ssize_t',
+               N_send_max='Py_ssize_t',
+               buffer_name='object',  # int or str
+               holes_filled='Py_ssize_t',
+               i='Py_ssize_t',
+               ids='unsigned long long int*',
+               ids_mv='unsigned long long int[::1]',
+               index_recv_j='Py_ssize_t',
+               indices_send_j='Py_ssize_t*',
+               j='int',
+               k='Py_ssize_t',
+               k_start='Py_ssize_t',
+               masses='double*',
+               masses_mv='double[::1]',
+               momx='double*',
+               momx_mv='double[::1]',
+               momy='double*',
+               momy_mv='double[::1]',
+               momz='double*',
+               momz_mv='double[::1]',
+               posx='double*',
+               posx_mv='double[::1]',
+               posy='double*',
+               posy_mv='double[::1]',
+               posz='double*',
+               posz_mv='double[::1]',
+               sendbuf_ids_mv='unsigned long long int[::1]',
+               sendbuf_mv='double[::1]',
+               use_ids='bint',
+               use_masses='bint',
+               )
+def exchange_sendrecv(component, N_send_tot):
+    # Extract some variables from component
+    N_local = component.N_local
+    posx = component.posx
+    posy = component.posy
+    posz = component.posz
+    use_masses = component.use_masses
+    use_ids = component.use_ids
     # Grab a buffer for holding the data to be send.
     # The 'send' buffer is also used internally by smart_mpi.
+    # The IDs are send through a view of the same buffer.
     buffer_name = 'send'
     N_send_max = max(N_send)
     sendbuf_mv = get_buffer(N_send_max, buffer_name) 
+    if use_ids:
+        sendbuf_ids_mv = get_buffer(N_send_max, buffer_name, dtype='unsigned long long int')
     # Find out how many particles to receive
     N_recv = find_N_recv(N_send)
     # The maximum number of particles to
@@ -228,6 +521,10 @@ def exchange(component, reset_buffers=False):
     momx_mv = component.momx_mv
     momy_mv = component.momy_mv
     momz_mv = component.momz_mv
+    masses = component.masses
+    masses_mv = component.masses_mv
+    ids = component.ids
+    ids_mv = component.ids_mv
     # Exchange particles between processes
     index_recv_j = N_local
     for j in range(1, nprocs):
@@ -282,6 +579,22 @@ def exchange(component, reset_buffers=False):
                  dest=ID_send,
                  recvbuf=momz_mv[index_recv_j:],
                  source=ID_recv)
+        # Send/receive masses, if in use
+        if use_masses:
+            for i in range(N_send_j):
+                sendbuf_mv[i] = masses[indices_send_j[i]]
+            Sendrecv(sendbuf_mv[:N_send_j],
+                     dest=ID_send,
+                     recvbuf=masses_mv[index_recv_j:],
+                     source=ID_recv)
+        # Send/receive IDs, if in use
+        if use_ids:
+            for i in range(N_send_j):
+                sendbuf_ids_mv[i] = ids[indices_send_j[i]]
+            Sendrecv(sendbuf_ids_mv[:N_send_j],
+                     dest=ID_send,
+                     recvbuf=ids_mv[index_recv_j:],
+                     source=ID_recv)
         # Update the start index for received data
         index_recv_j += N_recv_j
         # Mark the holes in the data by setting posx[hole] = -1
@@ -309,6 +622,10 @@ def exchange(component, reset_buffers=False):
                 momx[k] = momx[i]
                 momy[k] = momy[i]
                 momz[k] = momz[i]
+                if use_masses:
+                    masses[k] = masses[i]
+                if use_ids:
+                    ids[k] = ids[i]
                 k_start = k + 1
                 holes_filled += 1
                 break
@@ -317,21 +634,11 @@ def exchange(component, reset_buffers=False):
                 break
     # Update N_local
     component.N_local = N_needed - N_send_tot
-    # If reset_buffers is True, reset the global indices_send and
-    # sendbuf to their basic forms. This buffer will then be rebuild in
-    # future calls.
-    if reset_buffers:
-        resize_buffer(1, buffer_name)
-        for j in range(nprocs):
-            indices_send[j] = realloc(indices_send[j], 1*sizeof('Py_ssize_t'))
-            indices_send_sizes[j] = 1
-    # Finalize exchange message
-    masterprint('done')
 
 # Function for communicating boundary values of a
 # domain grid between processes.
 @cython.header(# Arguments
-               domain_grid='double[:, :, ::1]',
+               domain_grid='real[:, :, ::1]',
                mode='str',
                # Locals
                i='int',
@@ -573,11 +880,386 @@ def cutout_domains(n, basecall=True):
                returns='int',
                )
 def which_domain(x, y, z):
+    if domains_balanced:
+        # The load-balanced decomposition is in effect. The box is
+        # first cut along x, after which each slab is cut along y,
+        # after which each column is cut along z.
+        x_index = 0
+        while x_index < ℤ[domain_subdivisions[0] - 1] and x >= domain_cuts_x[x_index + 1]:
+            x_index += 1
+        y_index = 0
+        while y_index < ℤ[domain_subdivisions[1] - 1] and y >= domain_cuts_y[x_index, y_index + 1]:
+            y_index += 1
+        z_index = 0
+        while (    z_index < ℤ[domain_subdivisions[2] - 1]
+               and z >= domain_cuts_z[x_index, y_index, z_index + 1]):
+            z_index += 1
+        return domain_layout[x_index, y_index, z_index]
     x_index = int(x/domain_size_x)
     y_index = int(y/domain_size_y)
     z_index = int(z/domain_size_z)
     return domain_layout[x_index, y_index, z_index]
 
+# Function which redistributes the particles according to a new,
+# load-balanced decomposition of the box.
+@cython.pheader(# Arguments
+                components='list',
+                computation_time='double',
+                # Locals
+                N_local_total='Py_ssize_t',
+                binsize='double',
+                component='Component',
+                histograms_x='double[::1]',
+                histograms_x_local='double[::1]',
+                histograms_y='double[:, ::1]',
+                histograms_y_local='double[:, ::1]',
+                histograms_z='double[:, :, ::1]',
+                histograms_z_local='double[:, :, ::1]',
+                i='Py_ssize_t',
+                index='Py_ssize_t',
+                posx='double*',
+                posy='double*',
+                posz='double*',
+                weight='double',
+                x_index='int',
+                y_index='int',
+                )
+def rebalance_domains(components, computation_time):
+    """The box is recursively cut into domain_subdivisions[0] slabs
+    along x, each of which is cut into domain_subdivisions[1] columns
+    along y, each of which is cut into domain_subdivisions[2] domains
+    along z. The cuts are placed so that each domain holds the same
+    total cost, where the cost of a particle is taken to be the
+    computation_time spent on interactions by its current process,
+    divided equally among the local particles. Repeated rebalancing
+    thus converges towards equal computation times. The cuts are
+    determined from globally summed, finely binned histograms of the
+    particle costs.
+    Only the ownership of particles is affected by this decomposition.
+    Meshes are still distributed according to the regular domains, and
+    so the particles are redistributed back to these (by the
+    restore_domains function) whenever they are to be interpolated
+    onto a mesh or communicated as a halo.
+    All particle components should be passed together, and all are
+    exchanged according to the new decomposition.
+    """
+    global domains_balanced, balanced_components
+    if nprocs == 1:
+        return
+    components = [component for component in components
+                  if component.representation == 'particles']
+    if not components:
+        return
+    masterprint('Rebalancing the domain decomposition ...')
+    # The cost of each local particle
+    N_local_total = 0
+    for component in components:
+        N_local_total += component.N_local
+    weight = 0
+    if N_local_total > 0:
+        weight = computation_time/N_local_total
+    # If no computation time has been recorded on any process,
+    # all particles are given the same cost.
+    if allreduce(weight, op=MPI.MAX) == 0:
+        weight = 1
+    binsize = boxsize/ℤ[domain_balancing_bins]
+    # Place the cuts along x
+    histograms_x_local = zeros(domain_balancing_bins, dtype=C2np['double'])
+    for component in components:
+        posx = component.posx
+        for i in range(component.N_local):
+            index = cast(posx[i]*ℝ[1/binsize], 'Py_ssize_t')
+            if index >= domain_balancing_bins:
+                index = domain_balancing_bins - 1
+            histograms_x_local[index] += weight
+    histograms_x = zeros(domain_balancing_bins, dtype=C2np['double'])
+    Allreduce(histograms_x_local, histograms_x, op=MPI.SUM)
+    place_cuts(histograms_x, domain_cuts_x, binsize)
+    # Place the cuts along y within each slab.
+    # The weights of the particles are still those of the
+    # particles on the current process.
+    histograms_y_local = zeros((domain_subdivisions[0], domain_balancing_bins),
+                               dtype=C2np['double'])
+    for component in components:
+        posx = component.posx
+        posy = component.posy
+        for i in range(component.N_local):
+            x_index = 0
+            while (    x_index < ℤ[domain_subdivisions[0] - 1]
+                   and posx[i] >= domain_cuts_x[x_index + 1]):
+                x_index += 1
+            index = cast(posy[i]*ℝ[1/binsize], 'Py_ssize_t')
+            if index >= domain_balancing_bins:
+                index = domain_balancing_bins - 1
+            histograms_y_local[x_index, index] += weight
+    histograms_y = zeros((domain_subdivisions[0], domain_balancing_bins), dtype=C2np['double'])
+    Allreduce(histograms_y_local, histograms_y, op=MPI.SUM)
+    for x_index in range(domain_subdivisions[0]):
+        place_cuts(histograms_y[x_index, :], domain_cuts_y[x_index, :], binsize)
+    # Place the cuts along z within each column
+    histograms_z_local = zeros((domain_subdivisions[0], domain_subdivisions[1],
+                                domain_balancing_bins), dtype=C2np['double'])
+    for component in components:
+        posx = component.posx
+        posy = component.posy
+        posz = component.posz
+        for i in range(component.N_local):
+            x_index = 0
+            while (    x_index < ℤ[domain_subdivisions[0] - 1]
+                   and posx[i] >= domain_cuts_x[x_index + 1]):
+                x_index += 1
+            y_index = 0
+            while (    y_index < ℤ[domain_subdivisions[1] - 1]
+                   and posy[i] >= domain_cuts_y[x_index, y_index + 1]):
+                y_index += 1
+            index = cast(posz[i]*ℝ[1/binsize], 'Py_ssize_t')
+            if index >= domain_balancing_bins:
+                index = domain_balancing_bins - 1
+            histograms_z_local[x_index, y_index, index] += weight
+    histograms_z = zeros((domain_subdivisions[0], domain_subdivisions[1],
+                          domain_balancing_bins), dtype=C2np['double'])
+    Allreduce(histograms_z_local, histograms_z, op=MPI.SUM)
+    for x_index in range(domain_subdivisions[0]):
+        for y_index in range(domain_subdivisions[1]):
+            place_cuts(histograms_z[x_index, y_index, :], domain_cuts_z[x_index, y_index, :],
+                       binsize)
+    masterprint('done')
+    # Redistribute the particles according to the new decomposition
+    domains_balanced = True
+    balanced_components = components
+    for component in components:
+        exchange(component)
+
+# Helper function for rebalance_domains, placing the cuts along
+# a single dimension so as to divide the histogram evenly.
+@cython.header(# Arguments
+               histogram='double[::1]',
+               cuts='double[::1]',
+               binsize='double',
+               # Locals
+               cumulative='double',
+               i='Py_ssize_t',
+               index='Py_ssize_t',
+               n='Py_ssize_t',
+               target='double',
+               total='double',
+               )
+def place_cuts(histogram, cuts, binsize):
+    """The n + 1 cuts (including the two at the boundaries of the box)
+    are placed so that the histogram is divided into n parts of equal
+    sum, with linear interpolation used within the bins. An empty
+    histogram results in equally spaced cuts.
+    """
+    n = cuts.shape[0] - 1
+    total = 0
+    for index in range(histogram.shape[0]):
+        total += histogram[index]
+    cuts[0] = 0
+    cuts[n] = boxsize
+    if total == 0:
+        for i in range(1, n):
+            cuts[i] = i*ℝ[boxsize/n]
+        return
+    index = 0
+    cumulative = 0
+    for i in range(1, n):
+        target = i*ℝ[total/n]
+        while index < ℤ[histogram.shape[0] - 1] and cumulative + histogram[index] < target:
+            cumulative += histogram[index]
+            index += 1
+        cuts[i] = binsize*(index + (target - cumulative)/histogram[index]
+                           if histogram[index] > 0 else index + 1)
+        if cuts[i] > boxsize:
+            cuts[i] = boxsize
+
+# Function which redistributes the particles back to the regular
+# domains, in case the load-balanced decomposition is in effect.
+@cython.pheader(# Locals
+                component='Component',
+                components='list',
+                )
+def restore_domains():
+    """All particle components which were passed to rebalance_domains
+    are exchanged back to the regular domains. This is needed whenever
+    the particles are to interact with the domain grids, as these
+    always follow the regular domains.
+    """
+    global domains_balanced, balanced_components
+    if not domains_balanced:
+        return
+    domains_balanced = False
+    components = balanced_components
+    balanced_components = []
+    for component in components:
+        exchange(component)
+
+# Function returning whether the load-balanced domain decomposition is
+# currently in effect. Other modules should call this function rather
+# than import domains_balanced, as the imported value would not follow
+# later changes in pure Python.
+@cython.pheader(returns='bint')
+def get_domains_balanced():
+    return domains_balanced
+
+# Function which sorts the local particles of a component along a
+# space-filling curve.
+@cython.pheader(# Arguments
+                component='Component',
+                curve='str',
+                # Locals
+                i='Py_ssize_t',
+                ids='unsigned long long int*',
+                index_x='unsigned long long int',
+                index_y='unsigned long long int',
+                index_z='unsigned long long int',
+                keys='unsigned long long int[::1]',
+                order='Py_ssize_t[::1]',
+                sortbuf='double[::1]',
+                use_hilbert='bint',
+                var='double[::1]',
+                variables='list',
+                )
+def sort_particles(component, curve=''):
+    """The local particles are reordered so that particles close to
+    each other in space are also close to each other in memory. This
+    improves the cache utilisation of the mesh assignments and
+    interpolations as well as of the PP interactions. The curve can be
+    either 'morton' (Z-order) or 'hilbert', with the latter offering
+    better locality at a somewhat higher cost of computing the keys.
+    The particle positions are quantized onto a grid of 2²¹ cells
+    along each dimension, and all particle variables are permuted
+    together. As the order of the particles carries no meaning,
+    the sorting may be carried out at any time, though it is
+    only worthwhile right after the particles have been exchanged.
+    """
+    if component.representation != 'particles' or component.N_local < 2:
+        return
+    if not curve:
+        curve = particle_sorting
+    masterprint('Sorting {} along {} curve ...'.format(component.name, curve.capitalize()))
+    # Compute the key of each particle along the curve
+    use_hilbert = (curve == 'hilbert')
+    keys = empty(component.N_local, dtype=C2np['unsigned long long int'])
+    for i in range(component.N_local):
+        index_x = cast(component.posx[i]*ℝ[sorting_gridsize/boxsize], 'unsigned long long int')
+        index_y = cast(component.posy[i]*ℝ[sorting_gridsize/boxsize], 'unsigned long long int')
+        index_z = cast(component.posz[i]*ℝ[sorting_gridsize/boxsize], 'unsigned long long int')
+        if index_x >= sorting_gridsize:
+            index_x = ℤ[sorting_gridsize - 1]
+        if index_y >= sorting_gridsize:
+            index_y = ℤ[sorting_gridsize - 1]
+        if index_z >= sorting_gridsize:
+            index_z = ℤ[sorting_gridsize - 1]
+        with unswitch:
+            if use_hilbert:
+                keys[i] = hilbert_key(index_x, index_y, index_z)
+            else:
+                keys[i] = morton_key(index_x, index_y, index_z)
+    order = asarray(np.argsort(keys), dtype=C2np['Py_ssize_t'])
+    # Permute each particle variable according to the order,
+    # going through a buffer.
+    sortbuf = get_buffer(component.N_local, 'sort_particles')
+    variables = component.pos_mv + component.mom_mv
+    if component.use_masses:
+        variables.append(component.masses_mv)
+    for var in variables:
+        for i in range(component.N_local):
+            sortbuf[i] = var[order[i]]
+        for i in range(component.N_local):
+            var[i] = sortbuf[i]
+    # The keys are no longer needed,
+    # so these are reused as the buffer for the IDs.
+    if component.use_ids:
+        ids = component.ids
+        for i in range(component.N_local):
+            keys[i] = ids[order[i]]
+        for i in range(component.N_local):
+            ids[i] = keys[i]
+    masterprint('done')
+
+# The number of bits per dimension used for the keys
+# along the space-filling curves.
+cython.declare(sorting_bits='int', sorting_gridsize='unsigned long long int')
+sorting_bits = 21
+sorting_gridsize = 1 << sorting_bits
+
+# Helper function for sort_particles, spreading out the lower
+# sorting_bits bits of an integer so that two zero bits
+# are placed between each of them.
+@cython.header(# Arguments
+               v='unsigned long long int',
+               returns='unsigned long long int',
+               )
+def spread_bits(v):
+    v &= 0x1fffff
+    v = (v | v << 32) & 0x1f00000000ffff
+    v = (v | v << 16) & 0x1f0000ff0000ff
+    v = (v | v << 8)  & 0x100f00f00f00f00f
+    v = (v | v << 4)  & 0x10c30c30c30c30c3
+    v = (v | v << 2)  & 0x1249249249249249
+    return v
+
+# Helper function for sort_particles, computing the Morton key
+# by interleaving the bits of the three grid indices.
+@cython.header(# Arguments
+               index_x='unsigned long long int',
+               index_y='unsigned long long int',
+               index_z='unsigned long long int',
+               returns='unsigned long long int',
+               )
+def morton_key(index_x, index_y, index_z):
+    return spread_bits(index_x) << 2 | spread_bits(index_y) << 1 | spread_bits(index_z)
+
+# Helper function for sort_particles, computing the Hilbert key
+# of the three grid indices.
+@cython.header(# Arguments
+               index_x='unsigned long long int',
+               index_y='unsigned long long int',
+               index_z='unsigned long long int',
+               # Locals
+               p='unsigned long long int',
+               q='unsigned long long int',
+               t='unsigned long long int',
+               returns='unsigned long long int',
+               )
+def hilbert_key(index_x, index_y, index_z):
+    """The grid indices are transformed into the "transposed" Hilbert
+    index using the algorithm of J. Skilling (AIP Conf. Proc. 707, 381
+    (2004)), after which the bits are interleaved as for the Morton key.
+    """
+    # Undo excess work
+    q = ℤ[sorting_gridsize >> 1]
+    while q > 1:
+        p = q - 1
+        if index_x & q:
+            index_x ^= p
+        if index_y & q:
+            index_x ^= p
+        else:
+            t = (index_x ^ index_y) & p
+            index_x ^= t
+            index_y ^= t
+        if index_z & q:
+            index_x ^= p
+        else:
+            t = (index_x ^ index_z) & p
+            index_x ^= t
+            index_z ^= t
+        q >>= 1
+    # Gray encode
+    index_y ^= index_x
+    index_z ^= index_y
+    t = 0
+    q = ℤ[sorting_gridsize >> 1]
+    while q > 1:
+        if index_z & q:
+            t ^= q - 1
+        q >>= 1
+    index_x ^= t
+    index_y ^= t
+    index_z ^= t
+    return morton_key(index_x, index_y, index_z)
+
 # This function computes the ranks of the processes governing the
 # domain which is located i domains to the right, j domains forward and
 # k domains up, relative to the local domain.
@@ -629,6 +1311,9 @@ def sendrecv_component(component_send, variables, dest, source, component_recv=N
     The implemented variables are:
     - 'pos' (posx, posy and posz for particles)
     - 'mom' (momx, momy and momz for particles)
+    - 'masses' (individual particle masses, if in use)
+    - 'ids' (particle IDs, if in use)
+    The latter two are only communicated in communicate mode.
     """
     global component_buffer
     if component_send.representation != 'particles':  # !!! Generalize to fluids also
@@ -665,6 +1350,10 @@ def sendrecv_component(component_send, variables, dest, source, component_recv=N
         component_buffer.N_local = sendrecv(component_send.N_local, dest=dest, source=source)
         if component_buffer.N_allocated < component_buffer.N_local:
             component_buffer.resize(component_buffer.N_local)
+        if 'masses' in variables and component_send.use_masses:
+            component_buffer.enable_particle_variable('masses')
+        if 'ids' in variables and component_send.use_ids:
+            component_buffer.enable_particle_variable('ids')
         # Use component_buffer as component_recv
         component_recv = component_buffer
     # Do the communication
@@ -694,11 +1383,399 @@ def sendrecv_component(component_send, variables, dest, source, component_recv=N
                                                   mpifun='Sendrecv',
                                                   operation=operation,
                       )
+    if operation == '=':
+        if 'masses' in variables and component_send.use_masses:
+            Sendrecv(component_send.masses_mv[:component_send.N_local],
+                     dest=dest,
+                     recvbuf=component_recv.masses_mv[:component_recv.N_local],
+                     source=source)
+        if 'ids' in variables and component_send.use_ids:
+            Sendrecv(component_send.ids_mv[:component_send.N_local],
+                     dest=dest,
+                     recvbuf=component_recv.ids_mv[:component_recv.N_local],
+                     source=source)
     return component_recv
 # Declare the buffer component used by sendrecv_component
 cython.declare(component_buffer='Component')
 component_buffer = None
 
+# Function for posting non-blocking communication of component data
+@cython.header(# Arguments
+               component_send='Component',
+               variables='list',  # list of str's
+               dest='int',
+               source='int',
+               N_recv='Py_ssize_t',
+               buffer_index='int',
+               # Locals
+               component_recv='Component',
+               data_recv='list',
+               data_send='list',
+               dim='int',
+               requests='list',
+               variable='str',
+               returns='tuple',
+               )
+def isendrecv_component(component_send, variables, dest, source, N_recv, buffer_index):
+    """This is the non-blocking counterpart to sendrecv_component in
+    its communicate mode. The data of component_send is sent to dest,
+    while the data from source is received into the global prefetch
+    buffer component with the given buffer_index (0, 1 or 2). As the
+    receive is posted before the number of particles to be received is
+    known from the sender, this number must be passed as N_recv.
+    The receiving prefetch buffer component is returned together with
+    the list of posted requests, all of which must be completed (waited
+    upon) before the received data may be used or the data of
+    component_send may be altered. Note that the send buffers are the
+    data arrays of component_send itself.
+    The implemented variables are the same as for sendrecv_component.
+    The MPI tags 0 through 5 are used, with tags 12 and 13 used for the
+    individual masses and IDs.
+    """
+    if component_send.representation != 'particles':  # !!! Generalize to fluids also
+        abort('The isendrecv_component function is only implemented for particle components')
+    # Instantiate the prefetch buffers the first time they are needed,
+    # in the same manner as the component_buffer of the
+    # sendrecv_component function.
+    while len(prefetch_buffers) < 3:
+        prefetch_buffers.append(type(component_send)('', 'dark matter particles', 1))
+    component_recv = prefetch_buffers[buffer_index]
+    # Adjust important meta data on the buffer component
+    component_recv.name           = component_send.name
+    component_recv.species        = component_send.species
+    component_recv.representation = component_send.representation
+    component_recv.N              = component_send.N
+    component_recv.mass           = component_send.mass
+    component_recv.softening      = component_send.softening
+    component_recv.N_local        = N_recv
+    if component_recv.N_allocated < N_recv:
+        component_recv.resize(N_recv)
+    if 'masses' in variables and component_send.use_masses:
+        component_recv.enable_particle_variable('masses')
+    if 'ids' in variables and component_send.use_ids:
+        component_recv.enable_particle_variable('ids')
+    # Post the communication
+    requests = []
+    for variable in ('pos', 'mom'):
+        if variable not in variables:
+            continue
+        data_send = component_send.pos_mv if variable == 'pos' else component_send.mom_mv
+        data_recv = component_recv.pos_mv if variable == 'pos' else component_recv.mom_mv
+        for dim in range(3):
+            requests.append(Isend(data_send[dim][:component_send.N_local],
+                                  dest=dest, tag=(0 if variable == 'pos' else 3) + dim))
+            requests.append(Irecv(data_recv[dim][:N_recv],
+                                  source=source, tag=(0 if variable == 'pos' else 3) + dim))
+    if 'masses' in variables and component_send.use_masses:
+        requests.append(Isend(component_send.masses_mv[:component_send.N_local],
+                              dest=dest, tag=12))
+        requests.append(Irecv(component_recv.masses_mv[:N_recv], source=source, tag=12))
+    if 'ids' in variables and component_send.use_ids:
+        requests.append(Isend(component_send.ids_mv[:component_send.N_local],
+                              dest=dest, tag=13))
+        requests.append(Irecv(component_recv.ids_mv[:N_recv], source=source, tag=13))
+    return component_recv, requests
+# Declare the three buffer components used by isendrecv_component,
+# allowing for the prefetching of data.
+cython.declare(prefetch_buffers='list')
+prefetch_buffers = []
+
+# Function for posting non-blocking communication
+# of the Δ buffers of a component.
+@cython.header(# Arguments
+               component_send='Component',
+               variables='list',  # list of str's
+               dest='int',
+               source='int',
+               N_recv='Py_ssize_t',
+               buffer_name='object',  # Any hashable object
+               # Locals
+               Δ_send='list',
+               dim='int',
+               recvbuf_mv='double[::1]',
+               requests='list',
+               variable='str',
+               variable_index='int',
+               returns='tuple',
+               )
+def isendrecv_Δ(component_send, variables, dest, source, N_recv, buffer_name):
+    """This is the non-blocking counterpart to sendrecv_component in
+    its apply mode. The Δ buffers of component_send are sent to dest,
+    while the Δ buffers from source are received into the global buffer
+    with the given buffer_name, with the N_recv values of each
+    dimension of each variable placed contiguously after each other.
+    The receive buffer is returned together with the list of posted
+    requests. Once these are completed, the received values should be
+    applied to the receiving component using apply_Δ. The Δ buffers of
+    component_send may not be altered before then.
+    The MPI tags 6 through 11 are used.
+    """
+    if component_send.representation != 'particles':  # !!! Generalize to fluids also
+        abort('The isendrecv_Δ function is only implemented for particle components')
+    recvbuf_mv = get_buffer(3*len(variables)*N_recv, buffer_name)
+    requests = []
+    for variable_index, variable in enumerate(variables):
+        if variable == 'pos':
+            Δ_send = component_send.Δpos_mv
+        elif variable == 'mom':
+            Δ_send = component_send.Δmom_mv
+        else:
+            abort('The isendrecv_Δ function is not implemented for variable "{}"'
+                  .format(variable))
+        for dim in range(3):
+            requests.append(Isend(Δ_send[dim][:component_send.N_local],
+                                  dest=dest, tag=6 + 3*(variable == 'mom') + dim))
+            requests.append(Irecv(recvbuf_mv[(3*variable_index + dim)*N_recv:
+                                             (3*variable_index + dim + 1)*N_recv],
+                                  source=source, tag=6 + 3*(variable == 'mom') + dim))
+    return recvbuf_mv, requests
+
+# Function for applying Δ values received by isendrecv_Δ
+@cython.header(# Arguments
+               component='Component',
+               variables='list',  # list of str's
+               recvbuf_mv='double[::1]',
+               # Locals
+               data='double*',
+               dim='int',
+               i='Py_ssize_t',
+               offset='Py_ssize_t',
+               variable='str',
+               variable_index='int',
+               )
+def apply_Δ(component, variables, recvbuf_mv):
+    """The values in recvbuf_mv, as received by isendrecv_Δ, are added
+    to the corresponding data of the component.
+    """
+    for variable_index, variable in enumerate(variables):
+        for dim in range(3):
+            data = component.pos[dim] if variable == 'pos' else component.mom[dim]
+            offset = (3*variable_index + dim)*component.N_local
+            for i in range(component.N_local):
+                data[i] += recvbuf_mv[offset + i]
+
+# Function for communicating the halo of a component; copies of the
+# particles within a given distance (the reach) of the boundary of the
+# local domain, which are sent to the neighbouring domains.
+@cython.header(# Arguments
+               component='Component',
+               reach='double',
+               # Locals
+               N_recv_total='Py_ssize_t',
+               N_send_total='Py_ssize_t',
+               direction='int',
+               dim='int',
+               domain_sizes='double[::1]',
+               fill='bint',
+               halo_hi_x='bint',
+               halo_hi_y='bint',
+               halo_hi_z='bint',
+               halo_lo_x='bint',
+               halo_lo_y='bint',
+               halo_lo_z='bint',
+               i='Py_ssize_t',
+               index='Py_ssize_t',
+               l='int',
+               m='int',
+               n='int',
+               posx='double*',
+               posx_i='double',
+               posy='double*',
+               posy_i='double',
+               posz='double*',
+               posz_i='double',
+               recvbuf_mv='double[::1]',
+               requests='list',
+               sendbuf_mv='double[::1]',
+               returns='Component',
+               )
+def communicate_halo(component, reach):
+    """The particles of the local domain which lie within a distance
+    reach of any face, edge or corner of the domain are sent to the
+    corresponding (up to 26) neighbouring domains, while similar halo
+    particles are received from these neighbours. All sends are posted
+    at once (non-blocking), with only a single pass over the local
+    particles needed to sort them into the outgoing segments.
+    Only the positions are communicated.
+    Directions along which the box is not subdivided are skipped, as
+    the neighbour is then the local domain itself. The periodicity of
+    the box along such directions should be taken care of when
+    computing interactions, by the use of nearest images.
+    The received halo particles are placed in the global halo_buffer
+    component, which is then returned.
+    """
+    global halo_buffer
+    if component.representation != 'particles':
+        abort('The communicate_halo function is only implemented for particle components')
+    # The halo is defined with respect to the regular domains
+    restore_domains()
+    # Check that the domains are large enough for the halo particles
+    # to only be needed by the nearest neighbouring domains.
+    domain_sizes = asarray((domain_size_x, domain_size_y, domain_size_z), dtype=C2np['double'])
+    for dim in range(3):
+        if domain_subdivisions[dim] > 1 and domain_sizes[dim] < reach:
+            abort('A box of size {} {} and {} processes results in the domain partitioning {}, '
+                  'with a smallest domain width of {} {}. This needs to be at least {} {}.'
+                  .format(significant_figures(boxsize, 4, fmt='unicode'), unit_length,
+                          nprocs, list(domain_subdivisions),
+                          significant_figures(np.min(domain_sizes), 4, fmt='unicode'), unit_length,
+                          significant_figures(reach, 4, fmt='unicode'), unit_length,
+                          )
+                  )
+        if domain_subdivisions[dim] == 2 and domain_sizes[dim] < 2*reach:
+            # The left and the right neighbour is the same domain.
+            # If the domain is too narrow, some particles would then
+            # be sent to this neighbour twice.
+            abort('A box of size {} {} and {} processes results in the domain partitioning {}. '
+                  'With only two domains along the {}-direction, these need to be at least {} {} '
+                  'wide, but they are only {} {}.'
+                  .format(significant_figures(boxsize, 4, fmt='unicode'), unit_length,
+                          nprocs, list(domain_subdivisions), 'xyz'[dim],
+                          significant_figures(2*reach, 4, fmt='unicode'), unit_length,
+                          significant_figures(domain_sizes[dim], 4, fmt='unicode'), unit_length,
+                          )
+                  )
+    # Instantiate the halo_buffer the first time it is needed,
+    # in the same manner as the component_buffer of the
+    # sendrecv_component function.
+    if halo_buffer is None:
+        halo_buffer = type(component)('', 'dark matter particles', 1)
+    halo_buffer.name           = component.name
+    halo_buffer.species        = component.species
+    halo_buffer.representation = component.representation
+    halo_buffer.N              = component.N
+    halo_buffer.mass           = component.mass
+    halo_buffer.softening      = component.softening
+    # Sort the local halo particles according to their direction(s).
+    # The 27 directions (including the non-direction of the local
+    # domain itself) are indexed as 9*(l + 1) + 3*(m + 1) + (n + 1),
+    # with l, m, n ∈ {-1, 0, +1} the offsets along x, y and z.
+    # The outgoing data for each direction is placed contiguously
+    # in the send buffer, with first the x, then the y and then the
+    # z coordinates of the particles. The first pass counts the
+    # number of particles in each direction, while the second pass
+    # fills the send buffer.
+    posx = component.posx
+    posy = component.posy
+    posz = component.posz
+    for direction in range(27):
+        halo_N_send[direction] = 0
+    sendbuf_mv = None
+    for fill in (False, True):
+        if fill:
+            N_send_total = 0
+            for direction in range(27):
+                halo_offsets_send[direction] = N_send_total
+                N_send_total += 3*halo_N_send[direction]
+                halo_N_fill[direction] = 0
+            sendbuf_mv = get_buffer(N_send_total, 'halo_send')
+        for i in range(component.N_local):
+            posx_i = posx[i]
+            posy_i = posy[i]
+            posz_i = posz[i]
+            halo_lo_x = (domain_subdivisions[0] > 1 and posx_i < ℝ[domain_start_x + reach])
+            halo_hi_x = (domain_subdivisions[0] > 1 and posx_i > ℝ[domain_end_x   - reach])
+            halo_lo_y = (domain_subdivisions[1] > 1 and posy_i < ℝ[domain_start_y + reach])
+            halo_hi_y = (domain_subdivisions[1] > 1 and posy_i > ℝ[domain_end_y   - reach])
+            halo_lo_z = (domain_subdivisions[2] > 1 and posz_i < ℝ[domain_start_z + reach])
+            halo_hi_z = (domain_subdivisions[2] > 1 and posz_i > ℝ[domain_end_z   - reach])
+            if not (halo_lo_x or halo_hi_x or halo_lo_y or halo_hi_y or halo_lo_z or halo_hi_z):
+                continue
+            for l in range(-1, 2):
+                if (l == -1 and not halo_lo_x) or (l == +1 and not halo_hi_x):
+                    continue
+                for m in range(-1, 2):
+                    if (m == -1 and not halo_lo_y) or (m == +1 and not halo_hi_y):
+                        continue
+                    for n in range(-1, 2):
+                        if (n == -1 and not halo_lo_z) or (n == +1 and not halo_hi_z):
+                            continue
+                        if l == m == n == 0:
+                            continue
+                        direction = 9*(l + 1) + 3*(m + 1) + (n + 1)
+                        with unswitch(4):
+                            if fill:
+                                index = halo_offsets_send[direction] + halo_N_fill[direction]
+                                sendbuf_mv[index                                ] = posx_i
+                                sendbuf_mv[index +   halo_N_send[direction]] = posy_i
+                                sendbuf_mv[index + 2*halo_N_send[direction]] = posz_i
+                                halo_N_fill[direction] += 1
+                            else:
+                                halo_N_send[direction] += 1
+    # Communicate the number of halo particles in each direction.
+    # Particles sent in a given direction are received from the
+    # opposite direction. The direction is used as the MPI tag, as
+    # several directions may correspond to the same neighbour.
+    requests = []
+    for direction in range(27):
+        if direction == 13 or not halo_direction_active[direction]:
+            halo_N_recv[direction] = 0
+            continue
+        requests.append(Isend(halo_N_send[direction:direction + 1],
+                              dest=halo_ranks[direction], tag=direction))
+    for direction in range(27):
+        if direction == 13 or not halo_direction_active[direction]:
+            continue
+        Recv(halo_N_recv[direction:direction + 1],
+             source=halo_ranks[26 - direction], tag=direction)
+    for request in requests:
+        request.wait()
+    # Enlarge the halo_buffer if necessary
+    N_recv_total = 0
+    for direction in range(27):
+        halo_offsets_recv[direction] = N_recv_total
+        N_recv_total += 3*halo_N_recv[direction]
+    halo_buffer.N_local = N_recv_total//3
+    if halo_buffer.N_allocated < halo_buffer.N_local:
+        halo_buffer.resize(halo_buffer.N_local)
+    recvbuf_mv = get_buffer(N_recv_total, 'halo_recv')
+    # Communicate the halo particles in all directions
+    requests = []
+    for direction in range(27):
+        if halo_N_send[direction] == 0:
+            continue
+        requests.append(Isend(sendbuf_mv[halo_offsets_send[direction]:
+                                         halo_offsets_send[direction] + 3*halo_N_send[direction]],
+                              dest=halo_ranks[direction], tag=direction))
+    for direction in range(27):
+        if halo_N_recv[direction] == 0:
+            continue
+        Recv(recvbuf_mv[halo_offsets_recv[direction]:
+                        halo_offsets_recv[direction] + 3*halo_N_recv[direction]],
+             source=halo_ranks[26 - direction], tag=direction)
+    # Copy the received positions into the halo_buffer
+    posx = halo_buffer.posx
+    posy = halo_buffer.posy
+    posz = halo_buffer.posz
+    i = 0
+    for direction in range(27):
+        for index in range(halo_offsets_recv[direction],
+                           halo_offsets_recv[direction] + halo_N_recv[direction]):
+            posx[i] = recvbuf_mv[index                          ]
+            posy[i] = recvbuf_mv[index +   halo_N_recv[direction]]
+            posz[i] = recvbuf_mv[index + 2*halo_N_recv[direction]]
+            i += 1
+    # Wait for the sends to complete before the send buffer
+    # can be reused.
+    for request in requests:
+        request.wait()
+    return halo_buffer
+# Declare the buffer component and the bookkeeping arrays
+# used by the communicate_halo function.
+cython.declare(halo_buffer='Component',
+               halo_N_fill='Py_ssize_t[::1]',
+               halo_N_recv='Py_ssize_t[::1]',
+               halo_N_send='Py_ssize_t[::1]',
+               halo_offsets_recv='Py_ssize_t[::1]',
+               halo_offsets_send='Py_ssize_t[::1]',
+               )
+halo_buffer = None
+halo_N_fill       = zeros(27, dtype=C2np['Py_ssize_t'])
+halo_N_recv       = zeros(27, dtype=C2np['Py_ssize_t'])
+halo_N_send       = zeros(27, dtype=C2np['Py_ssize_t'])
+halo_offsets_recv = zeros(27, dtype=C2np['Py_ssize_t'])
+halo_offsets_send = zeros(27, dtype=C2np['Py_ssize_t'])
+
 # Very general function for different MPI communications
 @cython.pheader(# Arguments
                 block_send='object',  # Memoryview of dimension 1, 2 or 3
@@ -711,6 +1788,7 @@ component_buffer = None
                 operation='str',
                 # Local
                 arr_recv='object',  # NumPy aray
+                arr_recv_single='object',  # NumPy aray or None
                 arr_send='object',  # NumPy aray
                 block_recv_passed_as_scalar='bint',
                 contiguous_recv='bint',
@@ -853,6 +1931,18 @@ def smart_mpi(block_send=(), block_recv=(), dest=-1, source=-1, root=master_rank
         elif (    arr_send.dtype != np.dtype(C2np['double'])
               and arr_recv.dtype == np.dtype(C2np['double'])):
               arr_send = arr_send.astype(C2np['double'])
+    # Single-precision blocks (mesh grids when building with single
+    # precision) are communicated through double-precision copies,
+    # as the buffers contain doubles. As this is done regardless of
+    # the contiguity of the blocks, the sender and the receiver always
+    # agree on the type of the communicated data. The received data
+    # are copied back into the passed block_recv at the end.
+    arr_recv_single = None
+    if arr_send.dtype == np.dtype(C2np['float']):
+        arr_send = arr_send.astype(C2np['double'])
+    if arr_recv.dtype == np.dtype(C2np['float']) and arr_recv.size > 0:
+        arr_recv_single = arr_recv
+        arr_recv = arr_recv.astype(C2np['double'])
     # Are the passed arrays contiguous?
     contiguous_send = arr_send.flags.c_contiguous
     contiguous_recv = arr_recv.flags.c_contiguous
@@ -1014,6 +2104,11 @@ def smart_mpi(block_send=(), block_recv=(), dest=-1, source=-1, root=master_rank
     # as that which was send.
     if mpifun == 'bcast' and using_recvbuf:
         arr_recv = arr_recv.reshape(shape_recv)
+    # Copy the received data back into the passed single-precision
+    # block_recv, if a double-precision copy was used.
+    if arr_recv_single is not None:
+        arr_recv_single[...] = arr_recv.reshape(arr_recv_single.shape)
+        arr_recv = arr_recv_single
     # Return the now populated arr_recv
     return arr_recv
 
@@ -1022,18 +2117,21 @@ def smart_mpi(block_send=(), block_recv=(), dest=-1, source=-1, root=master_rank
                 size_or_shape='object',  # Py_ssize_t or tuple
                 buffer_name='object',  # Any hashable object
                 nullify='bint',
+                dtype='str',
                 # Local
                 N_buffers='Py_ssize_t',
                 buffer='double*',
                 buffer_mv='double[::1]',
                 i='Py_ssize_t',
                 index='Py_ssize_t',
+                itemsize='Py_ssize_t',
                 shape='tuple',
                 size='Py_ssize_t',
+                size_doubles='Py_ssize_t',
                 size_given='bint',
-                returns='object',  # multi-dimensional array of doubles
+                returns='object',  # multi-dimensional array of doubles or reals
                 )
-def get_buffer(size_or_shape=-1, buffer_name=0, nullify=False):
+def get_buffer(size_or_shape=-1, buffer_name=0, nullify=False, dtype='double'):
     """This function returns a contiguous buffer containing doubles.
     The buffer will be exactly of size 'size'. If no size is given,
     the buffer will be returned with whatever size it happens to have.
@@ -1041,7 +2139,9 @@ def get_buffer(size_or_shape=-1, buffer_name=0, nullify=False):
     requested by passing a buffer_name, which can be any hashable type.
     A buffer with the given name does not have to exist beforehand.
     A given buffer will be reallocated (enlarged) if necessary.
-    If nullify is True, all elements of the buffer will be set to 0. 
+    If nullify is True, all elements of the buffer will be set to 0.
+    For buffers used as mesh grids, pass dtype='real', in which case
+    the returned buffer contains reals instead of doubles.
     """
     global buffers
     # Get shape and size from argument
@@ -1056,6 +2156,10 @@ def get_buffer(size_or_shape=-1, buffer_name=0, nullify=False):
     if size == 0:
         size = 1
         shape = (1, )
+    # All buffers are stored as (8 byte) doubles.
+    # Find the number of doubles needed to store the elements.
+    itemsize = np.dtype(C2np[dtype]).itemsize
+    size_doubles = (size*itemsize + 7)//8
     # Fetch or create the buffer
     if buffer_name in buffers_mv:
         # This buffer already exists
@@ -1066,29 +2170,62 @@ def get_buffer(size_or_shape=-1, buffer_name=0, nullify=False):
             index += 1
         buffer = buffers[index]
         buffer_mv = buffers_mv[buffer_name]
-        if size > buffer_mv.shape[0]:
+        if size_doubles > buffer_mv.shape[0]:
             # Enlarge this buffer
-            resize_buffer(size, buffer_name)
+            resize_buffer(size_doubles, buffer_name)
             buffer = buffers[index]
             buffer_mv = buffers_mv[buffer_name]
         elif not size_given:
             # No size was given. Use the entire array.
-            size = buffer_mv.shape[0]
+            size_doubles = buffer_mv.shape[0]
+            size = 8*size_doubles//itemsize
             shape = (size, )
     else:
         # This buffer does not exist yet. Create it.
-        buffer = malloc(size*sizeof('double'))
+        buffer = malloc(size_doubles*sizeof('double'))
         N_buffers = len(buffers_mv) + 1
         buffers = realloc(buffers, N_buffers*sizeof('double*'))
         buffers[N_buffers - 1] = buffer
-        buffer_mv = cast(buffer, 'double[:size]')
+        buffer_mv = cast(buffer, 'double[:size_doubles]')
         buffers_mv[buffer_name] = buffer_mv
+        record_buffer_size(size_doubles, buffer_name)
     # Nullify the buffer, if required
     if nullify:
-        for i in range(size):
+        for i in range(size_doubles):
             buffer[i] = 0
     # Return the buffer in the requsted shape
-    return np.reshape(buffer_mv[:size], shape)
+    if dtype == 'double':
+        return np.reshape(buffer_mv[:size], shape)
+    return np.reshape(asarray(buffer_mv[:size_doubles]).view(C2np[dtype])[:size], shape)
+# Function for allocating an array of doubles in memory shared
+# between all processes on the same node.
+@cython.pheader(# Arguments
+                shape='tuple',
+                # Locals
+                buf='object',
+                itemsize='int',
+                size='Py_ssize_t',
+                window='object',  # mpi4py.MPI.Win
+                returns='object',  # NumPy array
+                )
+def get_shared_array(shape):
+    """The memory is allocated in an MPI shared memory window by the
+    node master, with all processes on the node getting a NumPy array
+    of the given shape viewing this memory. The array should only be
+    written to by the node master, after which the processes on the
+    node should synchronize (e.g. by comm_node.Barrier()) before
+    reading. To distribute data to all nodes, the node masters
+    can communicate through comm_node_masters.
+    The memory is never freed.
+    """
+    size = np.prod(shape)
+    itemsize = MPI.DOUBLE.Get_size()
+    window = MPI.Win.Allocate_shared(size*itemsize if node_master else 0, itemsize,
+                                     comm=comm_node)
+    shared_windows.append(window)
+    buf, itemsize = window.Shared_query(0)
+    return np.ndarray(buffer=buf, dtype=C2np['double'], shape=shape)
+
 # Function which resizes one of the global buffers
 @cython.header(# Arguments
                buffer_name='object',  # Any hashable object
@@ -1111,6 +2248,67 @@ def resize_buffer(size, buffer_name):
     buffers[index] = buffer
     buffer_mv = cast(buffer, 'double[:size]')
     buffers_mv[buffer_name] = buffer_mv
+    record_buffer_size(size, buffer_name)
+
+# Function which updates the high-water mark of a global buffer
+@cython.header(# Arguments
+               size='Py_ssize_t',
+               buffer_name='object',  # Any hashable object
+               # Locals
+               key='object',  # Any hashable object
+               nbytes='Py_ssize_t',
+               total='Py_ssize_t',
+               )
+def record_buffer_size(size, buffer_name):
+    global buffers_highwater_total
+    nbytes = 8*size
+    if nbytes > buffers_highwater.get(buffer_name, 0):
+        buffers_highwater[buffer_name] = nbytes
+    total = 0
+    for key in buffers_mv:
+        total += 8*buffers_mv[key].shape[0]
+    if total > buffers_highwater_total:
+        buffers_highwater_total = total
+
+# Function which shrinks global buffers to their smallest size
+@cython.pheader(# Arguments
+                buffer_names='object',  # list, tuple or None
+                # Locals
+                buffer_name='object',  # Any hashable object
+                freed='Py_ssize_t',
+                returns='Py_ssize_t',
+                )
+def release_buffers(buffer_names=None):
+    """Buffers obtained through get_buffer are only ever enlarged,
+    meaning that the memory used at the peak of the run stays resident.
+    Call this function at points where no arrays handed out by
+    get_buffer are in use, to shrink the buffers with the given names
+    (all buffers if no names are given) down to a single element.
+    The buffers will be enlarged again on demand by get_buffer.
+    The number of bytes freed is returned.
+    """
+    if buffer_names is None:
+        buffer_names = list(buffers_mv)
+    freed = 0
+    for buffer_name in buffer_names:
+        if buffer_name not in buffers_mv:
+            continue
+        freed += 8*(buffers_mv[buffer_name].shape[0] - 1)
+        if buffers_mv[buffer_name].shape[0] > 1:
+            resize_buffer(1, buffer_name)
+    return freed
+
+# Function returning the current and peak number of bytes
+# of each of the global buffers.
+@cython.pheader(# Locals
+                buffer_name='object',  # Any hashable object
+                returns='dict',
+                )
+def get_buffers_memory():
+    return {buffer_name: (8*buffers_mv[buffer_name].shape[0],
+                          buffers_highwater.get(buffer_name, 0))
+            for buffer_name in buffers_mv}
+
 # Initialize buffers
 cython.declare(buffers='double**',
                buffer='double*',
@@ -1123,6 +2321,12 @@ buffers[0] = buffer
 buffer_mv = cast(buffer, 'double[:1]')
 buffers_mv = collections.OrderedDict()
 buffers_mv[0] = buffer_mv
+# Peak number of bytes used by each buffer and by all buffers together
+cython.declare(buffers_highwater='dict',
+               buffers_highwater_total='Py_ssize_t',
+               )
+buffers_highwater = {0: 8}
+buffers_highwater_total = 8
 
 # Cutout domains at import time
 cython.declare(domain_subdivisions='int[::1]',
@@ -1160,8 +2364,66 @@ domain_start_x = domain_layout_local_indices[0]*domain_size_x
 domain_start_y = domain_layout_local_indices[1]*domain_size_y
 domain_start_z = domain_layout_local_indices[2]*domain_size_z
 domain_end_x = domain_start_x + domain_size_x
-domain_end_y = domain_start_x + domain_size_x
-domain_end_z = domain_start_x + domain_size_x
+domain_end_y = domain_start_y + domain_size_y
+domain_end_z = domain_start_z + domain_size_z
+# The load-balanced decomposition used by rebalance_domains. The cuts
+# along x are shared by all domains, while the cuts along y are
+# specific to each slab along x and the cuts along z are specific to
+# each column along x and y. Initially, the load-balanced decomposition
+# is identical to the regular one, but it is not in effect.
+cython.declare(balanced_components='list',
+               domain_balancing_bins='Py_ssize_t',
+               domain_cuts_x='double[::1]',
+               domain_cuts_y='double[:, ::1]',
+               domain_cuts_z='double[:, :, ::1]',
+               domains_balanced='bint',
+               )
+balanced_components = []
+domain_balancing_bins = 256*np.max(domain_subdivisions)
+domain_cuts_x = np.linspace(0, boxsize, domain_subdivisions[0] + 1)
+domain_cuts_y = np.tile(np.linspace(0, boxsize, domain_subdivisions[1] + 1),
+                        (domain_subdivisions[0], 1))
+domain_cuts_z = np.tile(np.linspace(0, boxsize, domain_subdivisions[2] + 1),
+                        (domain_subdivisions[0], domain_subdivisions[1], 1))
+domains_balanced = False
+# The ranks of the 26 neighbouring domains (and the local domain
+# itself), indexed as 9*(l + 1) + 3*(m + 1) + (n + 1), with l, m and n
+# the offsets along x, y and z. Directions with a non-zero offset along
+# a dimension in which the box is not subdivided are flagged as
+# inactive, as the neighbour is then the local domain itself.
+# These are used by the communicate_halo function.
+cython.declare(halo_direction_active='int[::1]',
+               halo_ranks='int[::1]',
+               l='int',
+               m='int',
+               n='int',
+               )
+halo_direction_active = ones(27, dtype=C2np['int'])
+halo_ranks = empty(27, dtype=C2np['int'])
+for l in range(-1, 2):
+    for m in range(-1, 2):
+        for n in range(-1, 2):
+            halo_ranks[9*(l + 1) + 3*(m + 1) + (n + 1)] = rank_neighboring_domain(l, m, n)
+            if (   (l != 0 and domain_subdivisions[0] == 1)
+                or (m != 0 and domain_subdivisions[1] == 1)
+                or (n != 0 and domain_subdivisions[2] == 1)
+                ):
+                halo_direction_active[9*(l + 1) + 3*(m + 1) + (n + 1)] = False
+
+# Communicators and flags used for sharing memory between
+# the processes on the same node. The node master is the process
+# with the lowest rank on each node.
+cython.declare(comm_node='object',          # mpi4py.MPI.Intracomm
+               comm_node_masters='object',  # mpi4py.MPI.Intracomm
+               node_master='bint',
+               rank_node='int',
+               shared_windows='list',
+               )
+comm_node = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+rank_node = comm_node.rank
+node_master = (rank_node == 0)
+comm_node_masters = comm.Split(0 if node_master else MPI.UNDEFINED, key=rank)
+shared_windows = []
 
 # Initialize variables used in the exchange function
 cython.declare(N_send='Py_ssize_t[::1]',
@@ -1178,4 +2440,31 @@ for j in range(nprocs):
     indices_send[j] = malloc(1*sizeof('Py_ssize_t'))
 # The size of the allocated indices_send[:] memory
 indices_send_sizes = ones(nprocs, dtype=C2np['Py_ssize_t'])
+# Variables used by exchange_alltoallv, storing the number of
+# particles to receive from each process as well as the counts and
+# displacements (in doubles) of the send and receive buffers.
+cython.declare(N_recv_exchange='Py_ssize_t[::1]',
+               exchange_counts_recv='int[::1]',
+               exchange_counts_send='int[::1]',
+               exchange_displs_recv='int[::1]',
+               exchange_displs_send='int[::1]',
+               )
+N_recv_exchange = empty(nprocs, dtype=C2np['Py_ssize_t'])
+exchange_counts_recv = empty(nprocs, dtype=C2np['int'])
+exchange_counts_send = empty(nprocs, dtype=C2np['int'])
+exchange_displs_recv = empty(nprocs, dtype=C2np['int'])
+exchange_displs_send = empty(nprocs, dtype=C2np['int'])
+# The ranks of the processes governing the neighbouring domains
+# (excluding the local process), in the regular domain layout,
+# as well as a mask over all ranks flagging these neighbours.
+cython.declare(exchange_neighbour_mask='int[::1]',
+               exchange_neighbours='int[::1]',
+               )
+exchange_neighbours = asarray(
+    sorted({halo_ranks[l] for l in range(27) if halo_direction_active[l]} - {rank}),
+    dtype=C2np['int'],
+)
+exchange_neighbour_mask = zeros(nprocs, dtype=C2np['int'])
+for l in range(exchange_neighbours.shape[0]):
+    exchange_neighbour_mask[exchange_neighbours[l]] = 1
 
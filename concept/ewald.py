@@ -25,7 +25,9 @@
 from commons import *
 
 # Cython imports
-cimport('from mesh import CIC_vectorgrid2coordinates, tabulate_vectorfield')
+cimport('from communication import comm_node, comm_node_masters, get_shared_array, node_master, '
+        '                          partition, smart_mpi')
+cimport('from mesh import CIC_vectorgrid2coordinates')
 
 
 
@@ -129,10 +131,20 @@ def summation(x, y, z):
                dim='int',
                force='double*',
                grid='double[:, :, :, ::1]',
+               i='Py_ssize_t',
                isnegative_x='bint',
                isnegative_y='bint',
                isnegative_z='bint',
+               j='Py_ssize_t',
+               k='Py_ssize_t',
+               lower_x='Py_ssize_t',
+               lower_y='Py_ssize_t',
+               lower_z='Py_ssize_t',
                r3='double',
+               weight='double',
+               weights_x='double[::1]',
+               weights_y='double[::1]',
+               weights_z='double[::1]',
                returns='double*',
                )
 def ewald(x, y, z):
@@ -145,6 +157,8 @@ def ewald(x, y, z):
     0 <= |x|, |y|, |z| < boxsize/2. The returned value is thus the force
     arising on the first particle due to all periodic images of the
     second particle, except for the nearest one.
+    The look-up is done using either CIC or tricubic (Lagrange)
+    interpolation, as specified by the ewald_interpolation parameter.
     """
     grid = get_grid()
     # Only the positive octant of the box is tabulated. Flip the sign of
@@ -164,13 +178,36 @@ def ewald(x, y, z):
     else:
         z *= -1
         isnegative_z = True
-    # Look up Ewald force and do a CIC interpolation. Since the
+    # Look up Ewald force and do the interpolation. Since the
     # coordinates are to the nearest image, they must be scaled by
     # 2/boxsize to reside in the range 0 <= x, y, z < 1.
-    force = CIC_vectorgrid2coordinates(grid, x*ℝ[2/boxsize],
-                                             y*ℝ[2/boxsize],
-                                             z*ℝ[2/boxsize],
-                                       )
+    if ewald_cic and ewald_octant:
+        force = CIC_vectorgrid2coordinates(grid, x*ℝ[2/boxsize],
+                                                 y*ℝ[2/boxsize],
+                                                 z*ℝ[2/boxsize],
+                                           )
+    else:
+        # Scale the coordinates to grid units
+        x *= ℝ[2*(ewald_gridsize - 1)/boxsize]
+        y *= ℝ[2*(ewald_gridsize - 1)/boxsize]
+        z *= ℝ[2*(ewald_gridsize - 1)/boxsize]
+        # Find the grid points and weights of the interpolation stencil
+        weights_x = stencil_weights(x, 0)
+        weights_y = stencil_weights(y, 1)
+        weights_z = stencil_weights(z, 2)
+        lower_x = stencil_lower[0]
+        lower_y = stencil_lower[1]
+        lower_z = stencil_lower[2]
+        # Add up the weighted contributions of the grid points
+        force = vector
+        force[0] = force[1] = force[2] = 0
+        for i in range(stencil_size):
+            for j in range(stencil_size):
+                for k in range(stencil_size):
+                    weight = weights_x[i]*weights_y[j]*weights_z[k]
+                    fetch(lower_x + i, lower_y + j, lower_z + k)
+                    for dim in range(3):
+                        force[dim] += weight*fetched[dim]
     # Put the sign back in for negative input
     if isnegative_x:
         force[0] *= -1
@@ -183,52 +220,387 @@ def ewald(x, y, z):
         force[dim] *= ℝ[1/boxsize**2]
     return force
 
+# Helper function for the ewald function, computing the interpolation
+# weights along a single dimension.
+@cython.header(# Arguments
+               u='double',
+               dim='int',
+               # Locals
+               lower='Py_ssize_t',
+               t='double',
+               weights='double[::1]',
+               returns='double[::1]',
+               )
+def stencil_weights(u, dim):
+    """Given the coordinate u in grid units along dimension dim,
+    the weights of the stencil_size consecutive grid points starting
+    at the index stored in stencil_lower[dim] are computed and returned.
+    For tricubic interpolation, the stencil is shifted inwards at the
+    upper boundary of the grid, as the Ewald correction (unlike at the
+    lower boundary) cannot be continued beyond this boundary
+    by symmetry.
+    """
+    weights = weights_stencil[dim, :]
+    if u >= ℝ[ewald_gridsize - 1]:
+        u = ℝ[(ewald_gridsize - 1)*(1 - machine_ϵ)]
+    lower = cast(u, 'Py_ssize_t')
+    if ewald_cic:
+        t = u - lower
+        weights[0] = 1 - t
+        weights[1] = t
+    else:
+        # Lagrange weights of the four points lower - 1, ..., lower + 2
+        lower -= 1
+        if lower > ℤ[ewald_gridsize - 4]:
+            lower = ℤ[ewald_gridsize - 4]
+        t = u - lower
+        weights[0] = -(t - 1)*(t - 2)*(t - 3)*ℝ[1/6]
+        weights[1] = t*(t - 2)*(t - 3)*0.5
+        weights[2] = -t*(t - 1)*(t - 3)*0.5
+        weights[3] = t*(t - 1)*(t - 2)*ℝ[1/6]
+    stencil_lower[dim] = lower
+    return weights
+
+# Helper function for the ewald function, fetching the Ewald correction
+# at a given grid point into the global fetched array.
+@cython.header(# Arguments
+               i='Py_ssize_t',
+               j='Py_ssize_t',
+               k='Py_ssize_t',
+               # Locals
+               dim='int',
+               index='Py_ssize_t',
+               order_0='int',
+               order_1='int',
+               order_2='int',
+               sign_x='double',
+               sign_y='double',
+               sign_z='double',
+               value='Py_ssize_t',
+               )
+def fetch(i, j, k):
+    """The Ewald correction is odd in each of x, y and z separately,
+    and so grid points with a negative index are mapped to the
+    corresponding positive index, with the sign of the corresponding
+    component flipped. For the wedge storage, the cubic symmetry is
+    further used to map the (sorted) point into the wedge
+    i >= j >= k, with the components permuted back afterwards.
+    """
+    sign_x = sign_y = sign_z = 1
+    if i < 0:
+        i = -i
+        sign_x = -1
+    if j < 0:
+        j = -j
+        sign_y = -1
+    if k < 0:
+        k = -k
+        sign_z = -1
+    if ewald_octant:
+        fetched[0] = sign_x*grid[i, j, k, 0]
+        fetched[1] = sign_y*grid[i, j, k, 1]
+        fetched[2] = sign_z*grid[i, j, k, 2]
+        return
+    # Sort the indices in descending order,
+    # keeping track of the original dimensions.
+    order_0, order_1, order_2 = 0, 1, 2
+    if j > i:
+        i, j = j, i
+        order_0, order_1 = order_1, order_0
+    if k > j:
+        j, k = k, j
+        order_1, order_2 = order_2, order_1
+        if j > i:
+            i, j = j, i
+            order_0, order_1 = order_1, order_0
+    index = wedge_index(i, j, k)
+    fetched[order_0] = grid_wedge[index, 0]
+    fetched[order_1] = grid_wedge[index, 1]
+    fetched[order_2] = grid_wedge[index, 2]
+    fetched[0] *= sign_x
+    fetched[1] *= sign_y
+    fetched[2] *= sign_z
+
+# Function returning the index into the wedge storage of the grid point
+# (i, j, k), with i >= j >= k.
+@cython.header(# Arguments
+               i='Py_ssize_t',
+               j='Py_ssize_t',
+               k='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def wedge_index(i, j, k):
+    return i*(i + 1)*(i + 2)//6 + j*(j + 1)//2 + k
+
 # Function for loading the Ewald grid from disk.
-# The result is stored as the global variable 'grid',
-# which will be fetched when called repeatedly.
-@cython.header(found_on_disk='bint',
+# The result is stored as the global variable 'grid' (octant storage)
+# or 'grid_wedge' (wedge storage), which will be fetched when
+# called repeatedly.
+@cython.header(# Locals
+               data='object',  # NumPy array
+               found_on_disk='bint',
+               grid_global='double[::1]',
                shape='tuple',
                returns='double[:, :, :, ::1]',
                )
 def get_grid():
-    global grid
+    """The grid is placed in memory shared between all processes on
+    each node, so that only a single copy is held per node. The grid
+    is read from disk by the master process and then broadcasted to the
+    other nodes, or tabulated if it does not exist on disk.
+    With the wedge storage, the returned octant grid is a dummy.
+    """
+    global grid, grid_wedge, grid_loaded
     # If the Ewald grid already exist in memory, return it
-    if grid.shape[0] != 1:
+    if grid_loaded:
         return grid
+    # Allocate the grid in shared memory
+    if ewald_octant:
+        shape = (ewald_gridsize, )*3 + (3, )
+    else:
+        shape = (n_points, 3)
+    data = get_shared_array(shape)
     # Let the master process read in the Ewald grid from disk,
     # if it exists.
-    shape = (ewald_gridsize, )*3 + (3, )
     found_on_disk = False
     if master:
         if os.path.isfile(filename):
             # Ewald grid already tabulated. Load it from disk.
             found_on_disk = True
             with h5py.File(filename, mode='r') as hdf5_file:
-                grid = hdf5_file['data'][...].reshape(shape)
+                data[...] = hdf5_file['data'][...].reshape(shape)
     found_on_disk = bcast(found_on_disk)
     if found_on_disk:
         # Ewald grid loaded by the master process.
-        # Broadcast it to all slave processes.
-        if not master:
-            grid = np.empty(shape, dtype=C2np['double'])
-        Bcast(grid)
+        # Broadcast it to the masters of all other nodes.
+        if node_master:
+            comm_node_masters.Bcast(data, root=0)
     else:
-        # No tabulated Ewald grid found. Compute it. The factor 0.5
-        # ensures that only the first octant of the box is tabulated.
-        grid = tabulate()
+        # No tabulated Ewald grid found. Compute it.
+        grid_global = tabulate()
+        if node_master:
+            data[...] = asarray(grid_global).reshape(shape)
+    comm_node.Barrier()
+    if ewald_octant:
+        grid = data
+    else:
+        grid_wedge = data
+    grid_loaded = True
     return grid
-cython.declare(grid='double[:, :, :, ::1]', filename='str')
+cython.declare(ewald_cic='bint',
+               ewald_octant='bint',
+               fetched='double*',
+               filename='str',
+               grid='double[:, :, :, ::1]',
+               grid_loaded='bint',
+               grid_wedge='double[:, ::1]',
+               n_points='Py_ssize_t',
+               stencil_lower='Py_ssize_t[::1]',
+               stencil_size='Py_ssize_t',
+               weights_stencil='double[:, ::1]',
+               )
 grid = np.empty((1, 1, 1, 1), dtype=C2np['double'])
-filename = '{}/.ewald_gridsize={}.hdf5'.format(paths['concept_dir'], ewald_gridsize)
+grid_wedge = np.empty((1, 1), dtype=C2np['double'])
+grid_loaded = False
+# The ewald_interpolation and ewald_storage parameters resolved into
+# flags, so that no strings are compared by the ewald function.
+ewald_cic = (ewald_interpolation == 'cic')
+ewald_octant = (ewald_storage == 'octant')
+if ewald_octant:
+    n_points = ewald_gridsize**3
+    filename = '{}/.ewald_gridsize={}.hdf5'.format(paths['concept_dir'], ewald_gridsize)
+else:
+    n_points = ewald_gridsize*(ewald_gridsize + 1)*(ewald_gridsize + 2)//6
+    filename = '{}/.ewald_gridsize={}_wedge.hdf5'.format(paths['concept_dir'], ewald_gridsize)
+# Storage used by the interpolation
+fetched = malloc(3*sizeof('double'))
+stencil_size = 2 if ewald_cic else 4
+stencil_lower = empty(3, dtype=C2np['Py_ssize_t'])
+weights_stencil = empty((3, stencil_size), dtype=C2np['double'])
 
 # Function for tabulation of the Ewald grid
-@cython.pheader(returns='double[:, :, :, ::1]')
+@cython.pheader(# Locals
+                batch='Py_ssize_t',
+                batch_end='Py_ssize_t',
+                batch_start='Py_ssize_t',
+                batch_size='Py_ssize_t',
+                chunk='Py_ssize_t',
+                chunk_end='Py_ssize_t',
+                chunk_start='Py_ssize_t',
+                coordinates='double[:, ::1]',
+                dist='double',
+                dist2='double',
+                dist_x='double',
+                dist_y='double',
+                dist_z='double',
+                eta='double',
+                factor='double',
+                fourier_coefficient='double',
+                grid_global='double[::1]',
+                grid_local='double[:, ::1]',
+                i='Py_ssize_t',
+                image='Py_ssize_t',
+                j='Py_ssize_t',
+                k='Py_ssize_t',
+                kx='double',
+                ky='double',
+                kz='double',
+                n_chunks='Py_ssize_t',
+                n_points_local='Py_ssize_t',
+                nx='double',
+                ny='double',
+                nz='double',
+                p='Py_ssize_t',
+                r3='double',
+                real_fac_erfc='double',
+                real_fac_exp='double',
+                real_fac_gauss='double',
+                scalarpart='double',
+                start_local='Py_ssize_t',
+                t_start='double',
+                x='double',
+                y='double',
+                z='double',
+                ℓ='Py_ssize_t',
+                returns='double[::1]',
+                )
 def tabulate():
-    global grid
+    """The positive octant of the box (normalized to unity) is tabulated
+    on a grid of linear size ewald_gridsize, with the grid points
+    distributed evenly among the processes. The local grid points are
+    processed in batches, after each of which the progress and the
+    estimated remaining time is reported. Within each batch, the grid
+    points are split into small chunks, which are distributed among the
+    threads. For each chunk, the real and Fourier space sums are
+    carried out with the loop over images outermost, using the images
+    and Fourier coefficients precomputed at import time, while the
+    innermost loop runs over the grid points of the chunk. This results
+    in simple, vectorizable inner loops.
+    The result is the same as that of the summation function applied to
+    each grid point. Only the points of the irreducible wedge are
+    tabulated when using the wedge storage.
+    The tabulated grid is saved to disk and returned as a flat array
+    on all processes.
+    """
     masterprint('Tabulating Ewald grid of linear size {} ...'.format(ewald_gridsize))
-    grid = tabulate_vectorfield(ewald_gridsize, summation, 0.5/(ewald_gridsize - 1), filename)
+    # Distribute the grid points among the processes
+    start_local, n_points_local = partition(n_points)
+    # The normalized coordinates of the local grid points
+    factor = 0.5/(ewald_gridsize - 1)
+    coordinates = empty((n_points_local, 3), dtype=C2np['double'])
+    if ewald_octant:
+        for p in range(n_points_local):
+            ℓ = start_local + p
+            i = ℓ//ewald_gridsize**2
+            ℓ -= i*ewald_gridsize**2
+            j = ℓ//ewald_gridsize
+            k = ℓ - j*ewald_gridsize
+            coordinates[p, 0] = i*factor
+            coordinates[p, 1] = j*factor
+            coordinates[p, 2] = k*factor
+    else:
+        # Only the wedge i >= j >= k is tabulated,
+        # with the points ordered as given by wedge_index.
+        ℓ = 0
+        for i in range(ewald_gridsize):
+            for j in range(i + 1):
+                for k in range(j + 1):
+                    p = ℓ - start_local
+                    if 0 <= p < n_points_local:
+                        coordinates[p, 0] = i*factor
+                        coordinates[p, 1] = j*factor
+                        coordinates[p, 2] = k*factor
+                    ℓ += 1
+    grid_local = empty((n_points_local, 3), dtype=C2np['double'])
+    # Constant factors of the real space sum
+    real_fac_erfc  = 1/(2*rs)
+    real_fac_gauss = 1/(sqrt(π)*rs)
+    real_fac_exp   = -1/(4*rs**2)
+    # Tabulate the local grid points in 10 batches
+    batch_size = (n_points_local + 9)//10
+    n_chunks = 0
+    t_start = time()
+    for batch in range(10):
+        batch_start = batch*batch_size
+        batch_end = batch_start + batch_size
+        if batch_end > n_points_local:
+            batch_end = n_points_local
+        if batch_start >= batch_end:
+            break
+        n_chunks = (batch_end - batch_start + ℤ[ewald_chunksize - 1])//ewald_chunksize
+        for chunk in prange(n_chunks, nogil=True, num_threads=num_threads, schedule='dynamic'):
+            chunk_start = batch_start + chunk*ewald_chunksize
+            chunk_end = chunk_start + ewald_chunksize
+            if chunk_end > batch_end:
+                chunk_end = batch_end
+            # Remove the direct force, as we
+            # are interested in the correction only.
+            for p in range(chunk_start, chunk_end):
+                x = coordinates[p, 0]
+                y = coordinates[p, 1]
+                z = coordinates[p, 2]
+                r3 = x*x + y*y + z*z
+                if r3 == 0:
+                    r3 = 1
+                r3 = r3*sqrt(r3)
+                grid_local[p, 0] = x/r3
+                grid_local[p, 1] = y/r3
+                grid_local[p, 2] = z/r3
+            # The short range (real space) sum
+            for image in range(n_images_real):
+                nx = images_real[image, 0]
+                ny = images_real[image, 1]
+                nz = images_real[image, 2]
+                for p in range(chunk_start, chunk_end):
+                    dist_x = coordinates[p, 0] - nx
+                    dist_y = coordinates[p, 1] - ny
+                    dist_z = coordinates[p, 2] - nz
+                    dist2 = dist_x*dist_x + dist_y*dist_y + dist_z*dist_z
+                    if dist2 > ℝ[maxdist**2] or dist2 == 0:
+                        continue
+                    dist = sqrt(dist2)
+                    scalarpart = -(erfc(dist*real_fac_erfc)
+                                   + dist*real_fac_gauss*exp(dist2*real_fac_exp))/(dist2*dist)
+                    grid_local[p, 0] += dist_x*scalarpart
+                    grid_local[p, 1] += dist_y*scalarpart
+                    grid_local[p, 2] += dist_z*scalarpart
+            # The long range (Fourier space) sum
+            for image in range(n_images_fourier):
+                kx = images_fourier[image, 0]
+                ky = images_fourier[image, 1]
+                kz = images_fourier[image, 2]
+                fourier_coefficient = images_fourier[image, 3]
+                for p in range(chunk_start, chunk_end):
+                    scalarpart = fourier_coefficient*sin(kx*coordinates[p, 0]
+                                                         + ky*coordinates[p, 1]
+                                                         + kz*coordinates[p, 2])
+                    grid_local[p, 0] += kx*scalarpart
+                    grid_local[p, 1] += ky*scalarpart
+                    grid_local[p, 2] += kz*scalarpart
+            # The image is on top of the particle: No force
+            for p in range(chunk_start, chunk_end):
+                if coordinates[p, 0] == 0 and coordinates[p, 1] == 0 and coordinates[p, 2] == 0:
+                    grid_local[p, 0] = 0
+                    grid_local[p, 1] = 0
+                    grid_local[p, 2] = 0
+        # Report the progress of the master process,
+        # which is representative for all processes.
+        eta = (time() - t_start)*(n_points_local - batch_end)/batch_end
+        masterprint('{}% tabulated, {} remaining'
+                    .format(100*batch_end//n_points_local,
+                            time_since(time() - eta),  # Formats the duration eta
+                            )
+                    )
+    # Gather the tabulated local grid parts into the common, global grid
+    grid_global = empty(3*n_points, dtype=C2np['double'])
+    smart_mpi(asarray(grid_local).reshape(3*n_points_local), grid_global, mpifun='allgatherv')
+    # Save grid to disk using parallel HDF5
+    with h5py.File(filename, mode='w', driver='mpio', comm=comm) as hdf5_file:
+        dset = hdf5_file.create_dataset('data', (3*n_points, ), dtype=C2np['double'])
+        dset[3*start_local:3*(start_local + n_points_local)] = asarray(grid_local).reshape(
+            3*n_points_local)
     masterprint('done')
-    return grid
+    return grid_global
 
 
 # Set parameters for the Ewald summation at import time
@@ -251,3 +623,39 @@ h_lower = int(-sqrt(maxh2))      # GADGET: -4 (same here for maxh2 = 10)
 h_upper = int(+sqrt(maxh2)) + 1  # GADGET:  5 (same here for maxh2 = 10)
 n_lower = int(-(maxdist + 1))    # GADGET: -4 (same here for maxdist = 3.6)
 n_upper = int(maxdist + 1) + 1   # GADGET:  5 (same here for maxdist = 3.6) 
+# The images of the real space sum and the wave vectors together with
+# the Fourier coefficients of the Fourier space sum, as used by the
+# tabulate function. The number of grid points processed together
+# by a thread is given by ewald_chunksize.
+cython.declare(ewald_chunksize='Py_ssize_t',
+               h2='int',
+               images_fourier='double[:, ::1]',
+               images_real='double[:, ::1]',
+               k2='double',
+               n_images_fourier='Py_ssize_t',
+               n_images_real='Py_ssize_t',
+               sumindex_x='int',
+               sumindex_y='int',
+               sumindex_z='int',
+               )
+ewald_chunksize = 64
+images_real = asarray([(sumindex_x, sumindex_y, sumindex_z)
+                       for sumindex_x in range(n_lower, n_upper)
+                       for sumindex_y in range(n_lower, n_upper)
+                       for sumindex_z in range(n_lower, n_upper)
+                       ], dtype=C2np['double'])
+n_images_real = images_real.shape[0]
+images_fourier = empty(((h_upper - h_lower)**3, 4), dtype=C2np['double'])
+n_images_fourier = 0
+for sumindex_x in range(h_lower, h_upper):
+    for sumindex_y in range(h_lower, h_upper):
+        for sumindex_z in range(h_lower, h_upper):
+            h2 = sumindex_x**2 + sumindex_y**2 + sumindex_z**2
+            if h2 > maxh2 or h2 == 0:
+                continue
+            k2 = (2*π)**2*h2
+            images_fourier[n_images_fourier, 0] = 2*π*sumindex_x
+            images_fourier[n_images_fourier, 1] = 2*π*sumindex_y
+            images_fourier[n_images_fourier, 2] = 2*π*sumindex_z
+            images_fourier[n_images_fourier, 3] = -4*π/k2*exp(-k2*rs**2)
+            n_images_fourier += 1
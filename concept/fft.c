@@ -24,13 +24,42 @@ https://github.com/jmd-dk/concept/
 
 #include <fftw3-mpi.h>
 #include <stdbool.h>
+#include <stdlib.h>
 #include <string.h>
 #include <stdio.h>
+#include "precision.h"
 
-/* This file defines the functions fftw_setup and fftw_clean, which
-together with fftw_execute (included in fftw3-mpi.h) constitutes the
-necessary functions for using FFTW to do parallel, real, 3D in-place
-transforms through Cython.
+/* When building with single precision, all FFTW functionality used
+(here as well as in the Cython code including this file) is taken
+from the single-precision FFTW library, the functions and types of
+which are named as the double-precision ones but with the fftw prefix
+replaced by fftwf.
+*/
+#ifdef SINGLE_PRECISION
+#define fftw_alloc_real                     fftwf_alloc_real
+#define fftw_complex                        fftwf_complex
+#define fftw_destroy_plan                   fftwf_destroy_plan
+#define fftw_execute                        fftwf_execute
+#define fftw_export_wisdom_to_string        fftwf_export_wisdom_to_string
+#define fftw_forget_wisdom                  fftwf_forget_wisdom
+#define fftw_free                           fftwf_free
+#define fftw_import_wisdom_from_string      fftwf_import_wisdom_from_string
+#define fftw_mpi_broadcast_wisdom           fftwf_mpi_broadcast_wisdom
+#define fftw_mpi_cleanup                    fftwf_mpi_cleanup
+#define fftw_mpi_gather_wisdom              fftwf_mpi_gather_wisdom
+#define fftw_mpi_init                       fftwf_mpi_init
+#define fftw_mpi_local_size_many_transposed fftwf_mpi_local_size_many_transposed
+#define fftw_mpi_plan_many_dft_c2r          fftwf_mpi_plan_many_dft_c2r
+#define fftw_mpi_plan_many_dft_r2c          fftwf_mpi_plan_many_dft_r2c
+#define fftw_plan                           fftwf_plan
+#define fftw_version                        fftwf_version
+#endif
+
+/* This file defines the functions fftw_setup, fftw_free_grid and
+fftw_clean, which together with fftw_execute (included in fftw3-mpi.h)
+constitutes the necessary functions for using FFTW to do parallel,
+real, 3D in-place transforms through Cython. FFTW wisdom is passed in and out as
+strings, leaving the storage of the wisdom to the Python side.
 */
 
 /* Note on indexing.
@@ -44,8 +73,8 @@ transforms through Cython.
       for (j = 0; j < gridsize_j; ++j){
           for (k = 0; k < gridsize_k; ++k){
               // This is the [i + gridstart_local_i, j, k]'th element
-              double element = grid[(i*gridsize_j + j)
-                                    *gridsize_padding + k];
+              real element = grid[(i*gridsize_j + j)
+                                  *gridsize_padding + k];
           }
       }
   }
@@ -59,8 +88,8 @@ transforms through Cython.
       for (j = 0; j < gridsize_local_j; ++j){
           for (k = 0; k < gridsize_k; ++k){
               // This is the [i, j + gridstart_local_j, k]'th element
-              double element = grid[(j*gridsize_i + i)
-                                    *gridsize_padding + k];
+              real element = grid[(j*gridsize_i + i)
+                                  *gridsize_padding + k];
           }
       }
   }
@@ -72,9 +101,10 @@ struct fftw_return_struct{
     ptrdiff_t gridsize_local_j;
     ptrdiff_t gridstart_local_i;
     ptrdiff_t gridstart_local_j;
-    double* grid;
+    real* grid;
     fftw_plan plan_forward;
     fftw_plan plan_backward;
+    char* wisdom;
 };
 // This function initializes fftw_mpi, allocates a grid,
 // desides the local lengths and starting indices and
@@ -82,19 +112,33 @@ struct fftw_return_struct{
 struct fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
                                      ptrdiff_t gridsize_j,
                                      ptrdiff_t gridsize_k,
+                                     ptrdiff_t howmany,
                                      char* fftw_wisdom_rigor,
-                                     bool fftw_wisdom_reuse){
+                                     char* fftw_wisdom){
     // Arguments to this function:
     // - Linear gridsize of dimension 1.
     // - Linear gridsize of dimension 2.
     // - Linear gridsize of dimension 3.
+    // - Number of grids transformed together. With howmany > 1, the
+    //   grids are stored interleaved, so that the howmany values
+    //   belonging to the same grid point are contiguous in memory.
+    //   The local sizes and starts are the same as for a single grid,
+    //   but the all-to-all communication of all the grids is carried
+    //   out at once.
     // - FFTW planning-rigor, determining the optimization level of
     //   of the wisdom. In order of patience:
     //   "estimate", "measure", "patient", "exhaustive".
-    // - Flag specifying whether or not to use pre-existing FFTW wisdom.
+    // - Pre-existing FFTW wisdom, needed by the master process only.
+    //   Pass an empty string to acquire new wisdom.
+    // The wisdom in use after the planning is returned as a string on
+    // the master process, which should be freed using
+    // fftw_free_wisdom. On all other processes, NULL is returned.
 
-    // Size of last dimension with padding
-    ptrdiff_t gridsize_padding = 2*(gridsize_k/2 + 1);
+    // Sizes of the grids, with the last dimension given in complex
+    // numbers (as needed for the local size) and in real numbers
+    // (as needed for the planning).
+    ptrdiff_t gridsizes_complex[3] = {gridsize_i, gridsize_j, gridsize_k/2 + 1};
+    ptrdiff_t gridsizes_real[3] = {gridsize_i, gridsize_j, gridsize_k};
 
     // Initialize parallel fftw (note that MPI_Init should not be
     // called, as MPI is already running via MPI4Py).
@@ -111,31 +155,30 @@ struct fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
     // also initializes gridsize_local_(i/j) and gridstart_local_(i/j).
     ptrdiff_t gridsize_local_i, gridstart_local_i,
               gridsize_local_j, gridstart_local_j;
-    double* grid = fftw_alloc_real(
-                       fftw_mpi_local_size_3d_transposed(gridsize_i,
-                                                         gridsize_j,
-                                                         gridsize_padding,
-                                                         MPI_COMM_WORLD,
-                                                         &gridsize_local_i,
-                                                         &gridstart_local_i,
-                                                         &gridsize_local_j,
-                                                         &gridstart_local_j)
+    real* grid = fftw_alloc_real(
+                       2*fftw_mpi_local_size_many_transposed(3,
+                                                             gridsizes_complex,
+                                                             howmany,
+                                                             FFTW_MPI_DEFAULT_BLOCK,
+                                                             FFTW_MPI_DEFAULT_BLOCK,
+                                                             MPI_COMM_WORLD,
+                                                             &gridsize_local_i,
+                                                             &gridstart_local_i,
+                                                             &gridsize_local_j,
+                                                             &gridstart_local_j)
                                    );
 
-    // The filename of the wisdom file
-    char wisdom_filename_buffer[128];
-    const char *wisdom_filename;
-    sprintf(wisdom_filename_buffer, ".fftw_wisdom_gridsize=%td_nprocs=%i_rigor=%s",
-            gridsize_i,
-            nprocs,
-            fftw_wisdom_rigor);
-    wisdom_filename = &wisdom_filename_buffer[0];
-
-    // The master process reads in previous wisdom and broadcasts it
-    int previous_wisdom = 0;
-    if (fftw_wisdom_reuse){
+    // Forget about wisdom from earlier calls, so that the returned
+    // wisdom only concerns the present problem. Existing plans
+    // are not affected by this.
+    fftw_forget_wisdom();
+
+    // The master process imports previous wisdom and broadcasts it
+    bool reuse = (strlen(fftw_wisdom) > 0);
+    MPI_Bcast(&reuse, 1, MPI_C_BOOL, root, MPI_COMM_WORLD);
+    if (reuse){
         if (master){
-            previous_wisdom = fftw_import_wisdom_from_filename(wisdom_filename);
+            fftw_import_wisdom_from_string(fftw_wisdom);
         }
         fftw_mpi_broadcast_wisdom(MPI_COMM_WORLD);
     }
@@ -156,25 +199,30 @@ struct fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
     }
 
     // Create the two plans
-    fftw_plan plan_forward  = fftw_mpi_plan_dft_r2c_3d(gridsize_i,
-                                                       gridsize_j,
-                                                       gridsize_k,  
-                                                       grid,
-                                                       (fftw_complex*) grid,
-                                                       MPI_COMM_WORLD,
-                                                       rigor_flag | FFTW_MPI_TRANSPOSED_OUT);
-    fftw_plan plan_backward = fftw_mpi_plan_dft_c2r_3d(gridsize_i,
-                                                       gridsize_j,
-                                                       gridsize_k,
-                                                       (fftw_complex*) grid,
-                                                       grid,
-                                                       MPI_COMM_WORLD,
-                                                       rigor_flag | FFTW_MPI_TRANSPOSED_IN);
-
-    // If new wisdom is acquired, the master process saves it to disk
+    fftw_plan plan_forward  = fftw_mpi_plan_many_dft_r2c(3,
+                                                         gridsizes_real,
+                                                         howmany,
+                                                         FFTW_MPI_DEFAULT_BLOCK,
+                                                         FFTW_MPI_DEFAULT_BLOCK,
+                                                         grid,
+                                                         (fftw_complex*) grid,
+                                                         MPI_COMM_WORLD,
+                                                         rigor_flag | FFTW_MPI_TRANSPOSED_OUT);
+    fftw_plan plan_backward = fftw_mpi_plan_many_dft_c2r(3,
+                                                         gridsizes_real,
+                                                         howmany,
+                                                         FFTW_MPI_DEFAULT_BLOCK,
+                                                         FFTW_MPI_DEFAULT_BLOCK,
+                                                         (fftw_complex*) grid,
+                                                         grid,
+                                                         MPI_COMM_WORLD,
+                                                         rigor_flag | FFTW_MPI_TRANSPOSED_IN);
+
+    // Gather the wisdom on the master process, which exports it
+    char* wisdom = NULL;
     fftw_mpi_gather_wisdom(MPI_COMM_WORLD);
-    if (master && ! previous_wisdom){
-        fftw_export_wisdom_to_filename(wisdom_filename);
+    if (master){
+        wisdom = fftw_export_wisdom_to_string();
     }
 
     // Return a struct with variables
@@ -184,14 +232,31 @@ struct fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
                                              gridstart_local_j,
                                              grid,
                                              plan_forward,
-                                             plan_backward};
+                                             plan_backward,
+                                             wisdom};
     return fftw_struct;
 }
 
-// Call this function when all FFT work is done
-void fftw_clean(double* grid, fftw_plan plan_forward, fftw_plan plan_backward){
-    fftw_free(grid);
+// Call this function to free wisdom returned by fftw_setup
+void fftw_free_wisdom(char* wisdom){
+    free(wisdom);
+}
+
+// This function returns the version string of the linked FFTW library
+const char* fftw_get_version(void){
+    return fftw_version;
+}
+
+// Call this function to free a grid returned by fftw_setup
+// together with its plans. All other plans remain valid.
+void fftw_free_grid(real* grid, fftw_plan plan_forward, fftw_plan plan_backward){
     fftw_destroy_plan(plan_forward);
     fftw_destroy_plan(plan_backward);
+    fftw_free(grid);
+}
+
+// Call this function when all FFT work is done, i.e. at program exit,
+// as it invalidates all plans still in existence.
+void fftw_clean(void){
     fftw_mpi_cleanup();
 }
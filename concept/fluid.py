@@ -120,14 +120,14 @@ maccormack_steps = generate_maccormack_steps()
                steps='Py_ssize_t[::1]',
                mc_step='int',
                # Locals
-               J_div='double[:, :, ::1]',
-               J_el='double[:, :, ::1]',
-               Jˣ_el='double[:, :, ::1]',
+               J_div='real[:, :, ::1]',
+               J_el='real[:, :, ::1]',
+               Jˣ_el='real[:, :, ::1]',
                dim_div='int',
                dim_el='int',
                fluidscalar='FluidScalar',
-               grid='double*',
-               gridˣ='double*',
+               grid='real*',
+               gridˣ='real*',
                h='double',
                indices_local_end='Py_ssize_t[::1]',
                indices_local_start='Py_ssize_t[::1]',
@@ -142,9 +142,9 @@ maccormack_steps = generate_maccormack_steps()
                step_i='Py_ssize_t',
                step_j='Py_ssize_t',
                step_k='Py_ssize_t',
-               σ_multi_index='double[:, :, ::1]',
-               ϱ='double[:, :, ::1]',
-               ϱˣ='double[:, :, ::1]',
+               σ_multi_index='real[:, :, ::1]',
+               ϱ='real[:, :, ::1]',
+               ϱˣ='real[:, :, ::1]',
                )
 def evolve_fluid(component, ᔑdt, steps, mc_step):
     """It is assumed that the unstarred and starred grids have
@@ -278,19 +278,19 @@ def finalize_maccormack_step(component, mc_step):
                ᔑdt='dict',
                # Locals
                Jᵢ='FluidScalar',
-               Jᵢ_ptr='double*',
+               Jᵢ_ptr='real*',
                h='double',
                i='Py_ssize_t',
                j='Py_ssize_t',
                multi_index='tuple',
                multi_index_list='list',
-               potential='double[:, :, ::1]',
+               potential='real[:, :, ::1]',
                n='Py_ssize_t',
-               source='double[:, :, ::1]',
-               source_ptr='double*',
+               source='real[:, :, ::1]',
+               source_ptr='real*',
                σᵢⱼ='FluidScalar',
-               σᵢⱼ_ptr='double*',
-               ϱ_ptr='double*',
+               σᵢⱼ_ptr='real*',
+               ϱ_ptr='real*',
                ẇ='double',
                )
 def apply_internal_sources(component, ᔑdt):
@@ -362,7 +362,7 @@ def apply_internal_sources(component, ᔑdt):
                # Locals
                any_vacuum='bint',
                i='Py_ssize_t',
-               ϱ='double*',
+               ϱ='real*',
                )
 def check_vacuum(component, mc_step):
     # Grab pointer to the density. After the first MacCormack step,
@@ -392,18 +392,18 @@ def check_vacuum(component, mc_step):
                component='Component',
                mc_step='int',
                # Locals
-               Jx='double[:, :, ::1]',
+               Jx='real[:, :, ::1]',
                Jx_correction='double',
-               Jx_ptr='double*',
-               Jxˣ='double[:, :, ::1]',
-               Jy='double[:, :, ::1]',
+               Jx_ptr='real*',
+               Jxˣ='real[:, :, ::1]',
+               Jy='real[:, :, ::1]',
                Jy_correction='double',
-               Jy_ptr='double*',
-               Jyˣ='double[:, :, ::1]',
-               Jz='double[:, :, ::1]',
+               Jy_ptr='real*',
+               Jyˣ='real[:, :, ::1]',
+               Jz='real[:, :, ::1]',
                Jz_correction='double',
-               Jz_ptr='double*',
-               Jzˣ='double[:, :, ::1]',
+               Jz_ptr='real*',
+               Jzˣ='real[:, :, ::1]',
                dist2='Py_ssize_t',
                fac_smoothing='double',
                fac_time='double',
@@ -423,19 +423,19 @@ def check_vacuum(component, mc_step):
                shape='tuple',
                timespan='double',
                vacuum_imminent='bint',
-               ΔJx='double[:, :, ::1]',
-               ΔJx_ptr='double*',
-               ΔJy='double[:, :, ::1]',
-               ΔJy_ptr='double*',
-               ΔJz='double[:, :, ::1]',
-               ΔJz_ptr='double*',
-               Δϱ='double[:, :, ::1]',
-               Δϱ_ptr='double*',
-               ϱ='double[:, :, ::1]',
+               ΔJx='real[:, :, ::1]',
+               ΔJx_ptr='real*',
+               ΔJy='real[:, :, ::1]',
+               ΔJy_ptr='real*',
+               ΔJz='real[:, :, ::1]',
+               ΔJz_ptr='real*',
+               Δϱ='real[:, :, ::1]',
+               Δϱ_ptr='real*',
+               ϱ='real[:, :, ::1]',
                ϱ_correction='double',
                ϱ_ijk='double',
-               ϱ_ptr='double*',
-               ϱˣ='double[:, :, ::1]',
+               ϱ_ptr='real*',
+               ϱˣ='real[:, :, ::1]',
                ϱˣ_ijk='double',
                returns='bint',
                )
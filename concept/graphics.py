@@ -220,7 +220,7 @@ def plot_powerspec(data_list, filename, power_dict):
                α_factor='double',
                α_homogeneous='double',
                α_min='double',
-               ϱ_noghosts='double[:, :, :]',
+               ϱ_noghosts='real[:, :, :]',
                ϱbar_component='double',
                )
 def render(components, filename, cleanup=True, tmp_dirname='.renders'):
@@ -693,7 +693,7 @@ def add_background():
                size_z='Py_ssize_t',
                total_mass='double',
                Σmass='double',
-               ϱ_noghosts='double[:, :, :]',
+               ϱ_noghosts='real[:, :, :]',
                )
 def terminal_render(components):
     # Project all particle positions onto the 2D projection array,
@@ -28,8 +28,8 @@ from commons import *
 cimport('from communication import communicate_domain')
 cimport('from communication import domain_size_x , domain_size_y , domain_size_z' )
 cimport('from communication import domain_start_x, domain_start_y, domain_start_z')
-cimport('from ewald import ewald')
-cimport('from mesh import CIC_grid2grid, CIC_scalargrid2coordinates')
+cimport('from ewald import ewald, ewald_cic, ewald_octant, get_grid')
+cimport('from mesh import CIC_grid2grid')
 
 
 
@@ -68,10 +68,7 @@ cimport('from mesh import CIC_grid2grid, CIC_scalargrid2coordinates')
                posy_2='double*',
                posz_1='double*',
                posz_2='double*',
-               r='double',
-               r_scaled='double',
                r3='double',
-               shortrange_fac='double',
                softening_1='double',
                softening_2='double',
                x_ji='double',
@@ -94,6 +91,24 @@ def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, ext
     # Extract extra arguments
     only_short_range = extra_args.get('only_short_range', False)
     periodic         = extra_args.get('periodic',         True)
+    # The short-range force vanishes beyond p3m_cutoff_phys and so
+    # only pairs of particles in neighbouring cells of a chaining mesh
+    # need to be considered. This is handled by a separate function.
+    if only_short_range:
+        gravity_pairwise_shortrange(component_1, component_2, rank_2, ᔑdt,
+                                    local, mutual, extra_args)
+        return
+    # Use the tiled implementation if specified. As only the tiled
+    # implementation makes use of threads, it is also used whenever
+    # more than a single thread is requested. The tiled implementation
+    # carries out the Ewald look-up itself, which is only implemented
+    # for CIC interpolation in the octant storage.
+    if (    (pp_kernel == 'tiled' or num_threads > 1)
+        and (not periodic or (ewald_cic and ewald_octant))
+        ):
+        gravity_pairwise_tiled(component_1, component_2, rank_2, ᔑdt,
+                               local, mutual, extra_args)
+        return
     # Extract variables from the first (the local) component
     N_1 = component_1.N_local
     mass_1 = component_1.mass
@@ -134,33 +149,11 @@ def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, ext
             x_ji = xi - posx_2[j]
             y_ji = yi - posy_2[j]
             z_ji = zi - posz_2[j]
-            # Evaluate the gravitational force in one of three ways:
-            # Just the short range force, the total force with Ewald
-            # corrections or the total force without Ewald corrections.
+            # Evaluate the gravitational force in one of two ways:
+            # The total force with Ewald corrections or the total force
+            # without Ewald corrections.
             with unswitch:
-                if only_short_range:
-                    # Translate coordinates so they
-                    # correspond to the nearest image.
-                    if x_ji > ℝ[0.5*boxsize]:
-                        x_ji -= boxsize
-                    elif x_ji < ℝ[-0.5*boxsize]:
-                        x_ji += boxsize
-                    if y_ji > ℝ[0.5*boxsize]:
-                        y_ji -= boxsize
-                    elif y_ji < ℝ[-0.5*boxsize]:
-                        y_ji += boxsize
-                    if z_ji > ℝ[0.5*boxsize]:
-                        z_ji -= boxsize
-                    elif z_ji < ℝ[-0.5*boxsize]:
-                        z_ji += boxsize
-                    r = sqrt(x_ji**2 + y_ji**2 + z_ji**2 + ℝ[(0.5*(softening_1 + softening_2))**2])
-                    r_scaled = r*ℝ[1/p3m_scale_phys]
-                    shortrange_fac = (  r_scaled*ℝ[1/sqrt(π)]*exp(-0.25*r_scaled**2)
-                                      + erfc(0.5*r_scaled))
-                    forcex_ij = x_ji*ℝ[-shortrange_fac/r**3]
-                    forcey_ij = y_ji*ℝ[-shortrange_fac/r**3]
-                    forcez_ij = z_ji*ℝ[-shortrange_fac/r**3]
-                elif periodic:
+                if periodic:
                     # Translate coordinates so they
                     # correspond to the nearest image.
                     if x_ji > ℝ[0.5*boxsize]:
@@ -220,6 +213,1225 @@ def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, ext
                     Δmomy_2[j] -= Δmomy_ij
                     Δmomz_2[j] -= Δmomz_ij
 
+# Function implementing pairwise gravity, with the particles of
+# component_2 processed in tiles of pp_tile_size particles.
+@cython.header(# Arguments
+               component_1='Component',
+               component_2='Component',
+               rank_2='int',
+               ᔑdt='dict',
+               local='bint',
+               mutual='bint',
+               extra_args='dict',
+               # Locals
+               N_1='Py_ssize_t',
+               N_2='Py_ssize_t',
+               N_tile='Py_ssize_t',
+               Wxl='double',
+               Wxu='double',
+               Wyl='double',
+               Wyu='double',
+               Wzl='double',
+               Wzu='double',
+               ewald_grid='double[:, :, :, ::1]',
+               ewald_x='double',
+               ewald_y='double',
+               ewald_z='double',
+               forcex_i='double',
+               forcex_ij='double',
+               forcex_j='double',
+               forcey_i='double',
+               forcey_ij='double',
+               forcey_j='double',
+               forcez_i='double',
+               forcez_ij='double',
+               forcez_j='double',
+               i='Py_ssize_t',
+               i_end='Py_ssize_t',
+               j='Py_ssize_t',
+               j_tile='Py_ssize_t',
+               jj='Py_ssize_t',
+               jj_start='Py_ssize_t',
+               mass_1='double',
+               mass_2='double',
+               momentum_fac='double',
+               momx_1='double*',
+               momx_2='double*',
+               momy_1='double*',
+               momy_2='double*',
+               momz_1='double*',
+               momz_2='double*',
+               periodic='bint',
+               posx_1='double*',
+               posx_2='double*',
+               posy_1='double*',
+               posy_2='double*',
+               posz_1='double*',
+               posz_2='double*',
+               r2='double',
+               r3_inv='double',
+               softening_1='double',
+               softening_2='double',
+               thread='int',
+               thread_offset='Py_ssize_t',
+               x_ji='double',
+               x_lower='Py_ssize_t',
+               xi='double',
+               y_ji='double',
+               y_lower='Py_ssize_t',
+               yi='double',
+               z_ji='double',
+               z_lower='Py_ssize_t',
+               zi='double',
+               Δmomx_2='double*',
+               Δmomy_2='double*',
+               Δmomz_2='double*',
+               returns='void',
+               )
+def gravity_pairwise_tiled(component_1, component_2, rank_2, ᔑdt, local, mutual, extra_args):
+    """This function computes the same forces as the plain loop of
+    gravity_pairwise, but is organised so that the innermost loop
+    may be auto-vectorized by the C compiler. The particles of
+    component_2 are processed a tile at a time, with their positions
+    copied into the contiguous pp_tile_pos* arrays. The minimum image
+    convention is implemented without branches, and the reaction
+    forces on the tile particles are accumulated in the pp_tile_force*
+    arrays, which are written back only once per tile. Similarly, the
+    force on particle i is summed up over the tile before being
+    applied.
+    The particles i of component_1 are distributed over num_threads
+    OpenMP threads. Each thread accumulates the reaction forces in its
+    own segment of the pp_tile_force* arrays, which are then summed.
+    """
+    # Extract extra arguments
+    periodic = extra_args.get('periodic', True)
+    # Extract variables from the first (the local) component
+    N_1 = component_1.N_local
+    mass_1 = component_1.mass
+    softening_1 = component_1.softening
+    posx_1 = component_1.posx
+    posy_1 = component_1.posy
+    posz_1 = component_1.posz
+    momx_1 = component_1.momx
+    momy_1 = component_1.momy
+    momz_1 = component_1.momz
+    # Extract variables from the second (the external) component
+    N_2 = component_2.N_local
+    mass_2 = component_2.mass
+    softening_2 = component_2.softening
+    posx_2 = component_2.posx
+    posy_2 = component_2.posy
+    posz_2 = component_2.posz
+    momx_2 = component_2.momx
+    momy_2 = component_2.momy
+    momz_2 = component_2.momz
+    Δmomx_2 = component_2.Δmomx
+    Δmomy_2 = component_2.Δmomy
+    Δmomz_2 = component_2.Δmomz
+    # Factor converting forces to momentum changes
+    momentum_fac = G_Newton*mass_1*mass_2*ᔑdt['a⁻¹']
+    # Fetch the grid of Ewald corrections
+    if periodic:
+        ewald_grid = get_grid()
+    # Loop over tiles of particles of component_2
+    for j_tile in range(0, N_2, pp_tile_size):
+        N_tile = N_2 - j_tile
+        if N_tile > pp_tile_size:
+            N_tile = pp_tile_size
+        # Load the tile
+        for jj in range(N_tile):
+            j = j_tile + jj
+            pp_tile_posx[jj] = posx_2[j]
+            pp_tile_posy[jj] = posy_2[j]
+            pp_tile_posz[jj] = posz_2[j]
+        for jj in range(ℤ[num_threads*pp_tile_size]):
+            pp_tile_forcex[jj] = 0
+            pp_tile_forcey[jj] = 0
+            pp_tile_forcez[jj] = 0
+        # If the interaction is completely local, make sure not to
+        # double count by only pairing i with j > i.
+        with unswitch(1):
+            if local:
+                i_end = j_tile + N_tile - 1
+            else:
+                i_end = N_1
+        for i in prange(i_end, nogil=True, num_threads=num_threads, schedule='guided'):
+            thread_offset = threadid()*pp_tile_size
+            xi = posx_1[i]
+            yi = posy_1[i]
+            zi = posz_1[i]
+            with unswitch(2):
+                if local:
+                    jj_start = i + 1 - j_tile
+                    if jj_start < 0:
+                        jj_start = 0
+                else:
+                    jj_start = 0
+            forcex_i = 0
+            forcey_i = 0
+            forcez_i = 0
+            for jj in range(jj_start, N_tile):
+                # "Vector" from particle j to particle i
+                x_ji = xi - pp_tile_posx[jj]
+                y_ji = yi - pp_tile_posy[jj]
+                z_ji = zi - pp_tile_posz[jj]
+                # Translate coordinates so they
+                # correspond to the nearest image.
+                with unswitch(3):
+                    if periodic:
+                        x_ji = x_ji - boxsize*round(x_ji*ℝ[1/boxsize])
+                        y_ji = y_ji - boxsize*round(y_ji*ℝ[1/boxsize])
+                        z_ji = z_ji - boxsize*round(z_ji*ℝ[1/boxsize])
+                # The force from the particle's nearest image
+                r2 = x_ji**2 + y_ji**2 + z_ji**2 + ℝ[(0.5*(softening_1 + softening_2))**2]
+                r3_inv = 1/(r2*sqrt(r2))
+                forcex_ij = -x_ji*r3_inv
+                forcey_ij = -y_ji*r3_inv
+                forcez_ij = -z_ji*r3_inv
+                # The Ewald correction force for all images except
+                # the nearest one, which might not be the actual
+                # particle. This is the look-up of the ewald function
+                # (which cannot be called within the parallel loop),
+                # carried out directly on the Ewald grid.
+                with unswitch(3):
+                    if periodic:
+                        # Only the positive octant is tabulated,
+                        # with 0 <= x, y, z < boxsize/2 mapped
+                        # to the grid indices 0 <= ewald_x, ewald_y,
+                        # ewald_z < ewald_gridsize - 1.
+                        ewald_x = x_ji*ℝ[2*(ewald_gridsize - 1)/boxsize]
+                        ewald_y = y_ji*ℝ[2*(ewald_gridsize - 1)/boxsize]
+                        ewald_z = z_ji*ℝ[2*(ewald_gridsize - 1)/boxsize]
+                        if ewald_x < 0:
+                            ewald_x = -ewald_x
+                        if ewald_y < 0:
+                            ewald_y = -ewald_y
+                        if ewald_z < 0:
+                            ewald_z = -ewald_z
+                        if ewald_x >= ℝ[ewald_gridsize - 1]:
+                            ewald_x = ℝ[(ewald_gridsize - 1)*(1 - machine_ϵ)]
+                        if ewald_y >= ℝ[ewald_gridsize - 1]:
+                            ewald_y = ℝ[(ewald_gridsize - 1)*(1 - machine_ϵ)]
+                        if ewald_z >= ℝ[ewald_gridsize - 1]:
+                            ewald_z = ℝ[(ewald_gridsize - 1)*(1 - machine_ϵ)]
+                        x_lower = cast(ewald_x, 'Py_ssize_t')
+                        y_lower = cast(ewald_y, 'Py_ssize_t')
+                        z_lower = cast(ewald_z, 'Py_ssize_t')
+                        Wxu = ewald_x - x_lower
+                        Wyu = ewald_y - y_lower
+                        Wzu = ewald_z - z_lower
+                        Wxl = 1 - Wxu
+                        Wyl = 1 - Wyu
+                        Wzl = 1 - Wzu
+                        forcex_ij = forcex_ij + (1 - 2*(x_ji < 0))*ℝ[1/boxsize**2]*(
+                              ewald_grid[x_lower    , y_lower    , z_lower    , 0]*Wxl*Wyl*Wzl
+                            + ewald_grid[x_lower    , y_lower    , z_lower + 1, 0]*Wxl*Wyl*Wzu
+                            + ewald_grid[x_lower    , y_lower + 1, z_lower    , 0]*Wxl*Wyu*Wzl
+                            + ewald_grid[x_lower    , y_lower + 1, z_lower + 1, 0]*Wxl*Wyu*Wzu
+                            + ewald_grid[x_lower + 1, y_lower    , z_lower    , 0]*Wxu*Wyl*Wzl
+                            + ewald_grid[x_lower + 1, y_lower    , z_lower + 1, 0]*Wxu*Wyl*Wzu
+                            + ewald_grid[x_lower + 1, y_lower + 1, z_lower    , 0]*Wxu*Wyu*Wzl
+                            + ewald_grid[x_lower + 1, y_lower + 1, z_lower + 1, 0]*Wxu*Wyu*Wzu)
+                        forcey_ij = forcey_ij + (1 - 2*(y_ji < 0))*ℝ[1/boxsize**2]*(
+                              ewald_grid[x_lower    , y_lower    , z_lower    , 1]*Wxl*Wyl*Wzl
+                            + ewald_grid[x_lower    , y_lower    , z_lower + 1, 1]*Wxl*Wyl*Wzu
+                            + ewald_grid[x_lower    , y_lower + 1, z_lower    , 1]*Wxl*Wyu*Wzl
+                            + ewald_grid[x_lower    , y_lower + 1, z_lower + 1, 1]*Wxl*Wyu*Wzu
+                            + ewald_grid[x_lower + 1, y_lower    , z_lower    , 1]*Wxu*Wyl*Wzl
+                            + ewald_grid[x_lower + 1, y_lower    , z_lower + 1, 1]*Wxu*Wyl*Wzu
+                            + ewald_grid[x_lower + 1, y_lower + 1, z_lower    , 1]*Wxu*Wyu*Wzl
+                            + ewald_grid[x_lower + 1, y_lower + 1, z_lower + 1, 1]*Wxu*Wyu*Wzu)
+                        forcez_ij = forcez_ij + (1 - 2*(z_ji < 0))*ℝ[1/boxsize**2]*(
+                              ewald_grid[x_lower    , y_lower    , z_lower    , 2]*Wxl*Wyl*Wzl
+                            + ewald_grid[x_lower    , y_lower    , z_lower + 1, 2]*Wxl*Wyl*Wzu
+                            + ewald_grid[x_lower    , y_lower + 1, z_lower    , 2]*Wxl*Wyu*Wzl
+                            + ewald_grid[x_lower    , y_lower + 1, z_lower + 1, 2]*Wxl*Wyu*Wzu
+                            + ewald_grid[x_lower + 1, y_lower    , z_lower    , 2]*Wxu*Wyl*Wzl
+                            + ewald_grid[x_lower + 1, y_lower    , z_lower + 1, 2]*Wxu*Wyl*Wzu
+                            + ewald_grid[x_lower + 1, y_lower + 1, z_lower    , 2]*Wxu*Wyu*Wzl
+                            + ewald_grid[x_lower + 1, y_lower + 1, z_lower + 1, 2]*Wxu*Wyu*Wzu)
+                # Accumulate the force on particle i and the reaction
+                # force on particle j. Note that in-place operators
+                # are avoided on the scalars, as these would be
+                # interpreted as reductions over the parallel loop.
+                forcex_i = forcex_i + forcex_ij
+                forcey_i = forcey_i + forcey_ij
+                forcez_i = forcez_i + forcez_ij
+                pp_tile_forcex[thread_offset + jj] -= forcex_ij
+                pp_tile_forcey[thread_offset + jj] -= forcey_ij
+                pp_tile_forcez[thread_offset + jj] -= forcez_ij
+            # Convert the force on particle i from the tile to
+            # momentum change and apply it to particle i of
+            # component_1 (the local component).
+            momx_1[i] += forcex_i*momentum_fac
+            momy_1[i] += forcey_i*momentum_fac
+            momz_1[i] += forcez_i*momentum_fac
+        # Apply or save the momentum changes of the tile particles
+        # of component_2 (the external component), summing up the
+        # contributions from all threads.
+        if not local and not mutual:
+            continue
+        for jj in range(N_tile):
+            forcex_j = 0
+            forcey_j = 0
+            forcez_j = 0
+            for thread in range(num_threads):
+                forcex_j += pp_tile_forcex[thread*pp_tile_size + jj]
+                forcey_j += pp_tile_forcey[thread*pp_tile_size + jj]
+                forcez_j += pp_tile_forcez[thread*pp_tile_size + jj]
+            j = j_tile + jj
+            with unswitch(1):
+                if local:
+                    momx_2[j] += forcex_j*momentum_fac
+                    momy_2[j] += forcey_j*momentum_fac
+                    momz_2[j] += forcez_j*momentum_fac
+                else:
+                    Δmomx_2[j] += forcex_j*momentum_fac
+                    Δmomy_2[j] += forcey_j*momentum_fac
+                    Δmomz_2[j] += forcez_j*momentum_fac
+# Declare and allocate the module level arrays storing a tile of
+# particles, used by gravity_pairwise_tiled. Each thread has its own
+# segment of the reaction force arrays.
+cython.declare(pp_tile_forcex='double*',
+               pp_tile_forcey='double*',
+               pp_tile_forcez='double*',
+               pp_tile_posx='double*',
+               pp_tile_posy='double*',
+               pp_tile_posz='double*',
+               pp_tile_size='Py_ssize_t',
+               )
+pp_tile_size = 256
+pp_tile_forcex = malloc(num_threads*pp_tile_size*sizeof('double'))
+pp_tile_forcey = malloc(num_threads*pp_tile_size*sizeof('double'))
+pp_tile_forcez = malloc(num_threads*pp_tile_size*sizeof('double'))
+pp_tile_posx   = malloc(pp_tile_size*sizeof('double'))
+pp_tile_posy   = malloc(pp_tile_size*sizeof('double'))
+pp_tile_posz   = malloc(pp_tile_size*sizeof('double'))
+
+# Function implementing the pairwise short-range gravity of the P³M
+# method, making use of a chaining mesh so that only particles in
+# neighbouring cells are paired.
+@cython.header(# Arguments
+               component_1='Component',
+               component_2='Component',
+               rank_2='int',
+               ᔑdt='dict',
+               local='bint',
+               mutual='bint',
+               extra_args='dict',
+               # Locals
+               N_1='Py_ssize_t',
+               N_neighbours_x='Py_ssize_t',
+               N_neighbours_y='Py_ssize_t',
+               N_neighbours_z='Py_ssize_t',
+               cell='Py_ssize_t',
+               cell_x='Py_ssize_t',
+               cell_y='Py_ssize_t',
+               cell_z='Py_ssize_t',
+               forcex_ij='double',
+               forcey_ij='double',
+               forcez_ij='double',
+               i='Py_ssize_t',
+               index='Py_ssize_t',
+               j='Py_ssize_t',
+               l='Py_ssize_t',
+               m='Py_ssize_t',
+               mass_1='double',
+               mass_2='double',
+               momx_1='double*',
+               momx_2='double*',
+               momy_1='double*',
+               momy_2='double*',
+               momz_1='double*',
+               momz_2='double*',
+               n='Py_ssize_t',
+               posx_1='double*',
+               posx_2='double*',
+               posy_1='double*',
+               posy_2='double*',
+               posz_1='double*',
+               posz_2='double*',
+               r2='double',
+               r2_softened='double',
+               shortrange_fac='double',
+               shortrange_table='double*',
+               softening_1='double',
+               softening_2='double',
+               table_index='Py_ssize_t',
+               table_index_real='double',
+               x_ji='double',
+               xi='double',
+               y_ji='double',
+               yi='double',
+               z_ji='double',
+               zi='double',
+               Δmomx_2='double*',
+               Δmomx_ij='double',
+               Δmomy_2='double*',
+               Δmomy_ij='double',
+               Δmomz_2='double*',
+               Δmomz_ij='double',
+               returns='void',
+               )
+def gravity_pairwise_shortrange(component_1, component_2, rank_2, ᔑdt, local, mutual, extra_args):
+    # Extract variables from the first (the local) component
+    N_1 = component_1.N_local
+    mass_1 = component_1.mass
+    softening_1 = component_1.softening
+    posx_1 = component_1.posx
+    posy_1 = component_1.posy
+    posz_1 = component_1.posz
+    momx_1 = component_1.momx
+    momy_1 = component_1.momy
+    momz_1 = component_1.momz
+    # Extract variables from the second (the external) component
+    mass_2 = component_2.mass
+    softening_2 = component_2.softening
+    posx_2 = component_2.posx
+    posy_2 = component_2.posy
+    posz_2 = component_2.posz
+    momx_2 = component_2.momx
+    momy_2 = component_2.momy
+    momz_2 = component_2.momz
+    Δmomx_2 = component_2.Δmomx
+    Δmomy_2 = component_2.Δmomy
+    Δmomz_2 = component_2.Δmomz
+    if N_1 == 0 or component_2.N_local == 0:
+        return
+    # Fetch the tabulated short-range force factor
+    shortrange_table = get_shortrange_table()
+    # Sort the particles of component_2 into the chaining mesh
+    build_chainingmesh(component_2)
+    # Loop over all particles of component_1
+    for i in range(N_1):
+        xi = posx_1[i]
+        yi = posy_1[i]
+        zi = posz_1[i]
+        # Find the cells of the chaining mesh neighbouring particle i.
+        # If no such cells exist, particle i is too far away from all
+        # particles of component_2 to interact with any of them.
+        N_neighbours_x = chainingmesh_neighbours(xi, 0)
+        if N_neighbours_x == 0:
+            continue
+        N_neighbours_y = chainingmesh_neighbours(yi, 1)
+        if N_neighbours_y == 0:
+            continue
+        N_neighbours_z = chainingmesh_neighbours(zi, 2)
+        if N_neighbours_z == 0:
+            continue
+        # Loop over all particles in the neighbouring cells
+        for l in range(N_neighbours_x):
+            cell_x = chainingmesh_neighbour_cells[l]
+            for m in range(N_neighbours_y):
+                cell_y = chainingmesh_neighbour_cells[3 + m]
+                for n in range(N_neighbours_z):
+                    cell_z = chainingmesh_neighbour_cells[6 + n]
+                    cell = (cell_x*chainingmesh_shape[1] + cell_y)*chainingmesh_shape[2] + cell_z
+                    for index in range(chainingmesh_cell_start[cell],
+                                       chainingmesh_cell_start[cell + 1]):
+                        j = chainingmesh_indices[index]
+                        # If the interaction is completely local,
+                        # make sure not to double count.
+                        with unswitch:
+                            if local:
+                                if j <= i:
+                                    continue
+                        # "Vector" from particle j to particle i
+                        x_ji = xi - posx_2[j]
+                        y_ji = yi - posy_2[j]
+                        z_ji = zi - posz_2[j]
+                        # Translate coordinates so they
+                        # correspond to the nearest image.
+                        if x_ji > ℝ[0.5*boxsize]:
+                            x_ji -= boxsize
+                        elif x_ji < ℝ[-0.5*boxsize]:
+                            x_ji += boxsize
+                        if y_ji > ℝ[0.5*boxsize]:
+                            y_ji -= boxsize
+                        elif y_ji < ℝ[-0.5*boxsize]:
+                            y_ji += boxsize
+                        if z_ji > ℝ[0.5*boxsize]:
+                            z_ji -= boxsize
+                        elif z_ji < ℝ[-0.5*boxsize]:
+                            z_ji += boxsize
+                        # The short-range force is cut off
+                        # beyond p3m_cutoff_phys.
+                        r2 = x_ji**2 + y_ji**2 + z_ji**2
+                        if r2 > ℝ[p3m_cutoff_phys**2]:
+                            continue
+                        r2_softened = r2 + ℝ[(0.5*(softening_1 + softening_2))**2]
+                        # Look up the short-range force factor,
+                        # linearly interpolating in the table.
+                        table_index_real = r2_softened*ℝ[shortrange_table_size
+                                                         /(shortrange_table_maxr2*p3m_scale_phys**2)]
+                        table_index = cast(table_index_real, 'Py_ssize_t')
+                        if table_index >= shortrange_table_size:
+                            continue
+                        shortrange_fac = (shortrange_table[table_index]
+                            + (table_index_real - table_index)*(
+                                shortrange_table[table_index + 1] - shortrange_table[table_index]))
+                        shortrange_fac *= -1/(r2_softened*sqrt(r2_softened))
+                        forcex_ij = x_ji*shortrange_fac
+                        forcey_ij = y_ji*shortrange_fac
+                        forcez_ij = z_ji*shortrange_fac
+                        # Convert force on particle i from particle j
+                        # to momentum change of partcicle i due to
+                        # particle j.
+                        Δmomx_ij = forcex_ij*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a⁻¹']]
+                        Δmomy_ij = forcey_ij*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a⁻¹']]
+                        Δmomz_ij = forcez_ij*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a⁻¹']]
+                        # Apply momentum change to particle i
+                        # of component_1 (the local component).
+                        momx_1[i] += Δmomx_ij
+                        momy_1[i] += Δmomy_ij
+                        momz_1[i] += Δmomz_ij
+                        # Apply or save the momentum change of
+                        # particle j of component_2
+                        # (the external component).
+                        with unswitch:
+                            if local:
+                                momx_2[j] -= Δmomx_ij
+                                momy_2[j] -= Δmomy_ij
+                                momz_2[j] -= Δmomz_ij
+                            elif mutual:
+                                Δmomx_2[j] -= Δmomx_ij
+                                Δmomy_2[j] -= Δmomy_ij
+                                Δmomz_2[j] -= Δmomz_ij
+
+# Function returning the tabulated short-range force factor
+# r/(√π rₛ)exp(-r²/(4rₛ²)) + erfc(r/(2rₛ)) of the P³M method,
+# with rₛ = p3m_scale_phys. The table is computed the first time it is
+# needed and then reused. The entries are equally spaced in r²/rₛ²,
+# ranging from 0 to shortrange_table_maxr2. As the softening is added
+# to r² before the look-up, the factor varies on the scale of rₛ only,
+# and so the same table serves all pairs of components.
+@cython.header(# Locals
+               i='Py_ssize_t',
+               r_scaled='double',
+               returns='double*',
+               )
+def get_shortrange_table():
+    global shortrange_table_tabulated
+    if shortrange_table_tabulated:
+        return shortrange_table
+    for i in range(shortrange_table_size + 1):
+        r_scaled = sqrt(i*ℝ[shortrange_table_maxr2/shortrange_table_size])
+        shortrange_table[i] = (  r_scaled*ℝ[1/sqrt(π)]*exp(-0.25*r_scaled**2)
+                               + erfc(0.5*r_scaled))
+    shortrange_table_tabulated = True
+    return shortrange_table
+# Declare and allocate the short-range force table. The table extends
+# to twice the cutoff, leaving room for the softening. An additional
+# element is allocated for the interpolation at the last entry.
+cython.declare(shortrange_table='double*',
+               shortrange_table_maxr2='double',
+               shortrange_table_size='Py_ssize_t',
+               shortrange_table_tabulated='bint',
+               )
+shortrange_table_size = 2**14
+shortrange_table_maxr2 = (2*p3m_cutoff)**2
+shortrange_table = malloc((shortrange_table_size + 1)*sizeof('double'))
+shortrange_table_tabulated = False
+
+# Function which sorts the local particles of a component into a
+# chaining mesh; a grid of cells each with a side length of at least
+# p3m_cutoff_phys. Along dimensions where the particles span (almost)
+# the entire box, the mesh covers the box and is periodic. Along other
+# dimensions, the mesh covers just the extent of the particles.
+# The particle indices are stored in chainingmesh_indices, sorted
+# according to cell, with the particles of cell c located between
+# chainingmesh_cell_start[c] and chainingmesh_cell_start[c + 1].
+@cython.header(# Arguments
+               component='Component',
+               # Locals
+               N='Py_ssize_t',
+               N_cells='Py_ssize_t',
+               cell='Py_ssize_t',
+               cell_dim='Py_ssize_t',
+               count_cumulative='Py_ssize_t',
+               dim='int',
+               extent='double',
+               i='Py_ssize_t',
+               pos_dim='double*',
+               pos_max='double',
+               pos_min='double',
+               returns='void',
+               )
+def build_chainingmesh(component):
+    global chainingmesh_N_cells_allocated, chainingmesh_N_particles_allocated
+    global chainingmesh_cell_start, chainingmesh_cells, chainingmesh_indices
+    N = component.N_local
+    # Determine the layout of the chaining mesh
+    for dim in range(3):
+        pos_dim = component.pos[dim]
+        pos_min = +ထ
+        pos_max = -ထ
+        for i in range(N):
+            if pos_dim[i] < pos_min:
+                pos_min = pos_dim[i]
+            if pos_dim[i] > pos_max:
+                pos_max = pos_dim[i]
+        extent = pos_max - pos_min
+        if extent > ℝ[boxsize - 2*p3m_cutoff_phys]:
+            # Periodic mesh covering the entire box
+            chainingmesh_periodic[dim] = True
+            chainingmesh_origin[dim] = 0
+            chainingmesh_shape[dim] = ℤ[int(boxsize/p3m_cutoff_phys)]
+            if chainingmesh_shape[dim] == 0:
+                chainingmesh_shape[dim] = 1
+            chainingmesh_cellsize[dim] = boxsize/chainingmesh_shape[dim]
+        else:
+            # Mesh covering just the extent of the particles
+            chainingmesh_periodic[dim] = False
+            chainingmesh_origin[dim] = pos_min
+            chainingmesh_shape[dim] = int(extent*ℝ[1/p3m_cutoff_phys])
+            if chainingmesh_shape[dim] == 0:
+                chainingmesh_shape[dim] = 1
+            chainingmesh_cellsize[dim] = extent/chainingmesh_shape[dim]
+            if chainingmesh_cellsize[dim] < p3m_cutoff_phys:
+                chainingmesh_cellsize[dim] = p3m_cutoff_phys
+    # Enlarge the chaining mesh arrays if necessary
+    N_cells = chainingmesh_shape[0]*chainingmesh_shape[1]*chainingmesh_shape[2]
+    if chainingmesh_N_cells_allocated < N_cells:
+        chainingmesh_N_cells_allocated = N_cells
+        chainingmesh_cell_start = realloc(chainingmesh_cell_start,
+                                          (N_cells + 1)*sizeof('Py_ssize_t'))
+    if chainingmesh_N_particles_allocated < N:
+        chainingmesh_N_particles_allocated = N
+        chainingmesh_cells   = realloc(chainingmesh_cells  , N*sizeof('Py_ssize_t'))
+        chainingmesh_indices = realloc(chainingmesh_indices, N*sizeof('Py_ssize_t'))
+    # Count the number of particles in each cell
+    for cell in range(N_cells + 1):
+        chainingmesh_cell_start[cell] = 0
+    for i in range(N):
+        cell = 0
+        for dim in range(3):
+            cell_dim = int((component.pos[dim][i] - chainingmesh_origin[dim])
+                           *(1/chainingmesh_cellsize[dim]))
+            if cell_dim >= chainingmesh_shape[dim]:
+                # Only possible due to round-off errors
+                cell_dim = chainingmesh_shape[dim] - 1
+            cell = cell*chainingmesh_shape[dim] + cell_dim
+        chainingmesh_cells[i] = cell
+        chainingmesh_cell_start[cell] += 1
+    # Convert the counts to (exclusive) cumulative counts
+    # (the start index of each cell).
+    count_cumulative = 0
+    for cell in range(N_cells):
+        count_cumulative += chainingmesh_cell_start[cell]
+        chainingmesh_cell_start[cell] = count_cumulative - chainingmesh_cell_start[cell]
+    # Place the particle indices at their sorted location. This shifts
+    # each cell start to the start of the following cell.
+    for i in range(N):
+        cell = chainingmesh_cells[i]
+        chainingmesh_indices[chainingmesh_cell_start[cell]] = i
+        chainingmesh_cell_start[cell] += 1
+    # Shift the cell starts back in place
+    for cell in range(N_cells, 0, -1):
+        chainingmesh_cell_start[cell] = chainingmesh_cell_start[cell - 1]
+    chainingmesh_cell_start[0] = 0
+
+# Function which finds the (at most 3) cells of the chaining mesh
+# along the dim'th dimension which neighbour the given coordinate.
+# These cell indices are stored in chainingmesh_neighbour_cells[3*dim:],
+# while the number of neighbouring cells is returned.
+@cython.header(# Arguments
+               x='double',
+               dim='int',
+               # Locals
+               N_neighbours='Py_ssize_t',
+               cell='Py_ssize_t',
+               cell_neighbour='Py_ssize_t',
+               l='Py_ssize_t',
+               shape='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def chainingmesh_neighbours(x, dim):
+    shape = chainingmesh_shape[dim]
+    N_neighbours = 0
+    if chainingmesh_periodic[dim]:
+        if shape < 3:
+            # Too few cells to have distinct neighbours.
+            # All cells neighbour each other.
+            for l in range(shape):
+                chainingmesh_neighbour_cells[3*dim + l] = l
+            return shape
+        cell = int(x*(1/chainingmesh_cellsize[dim]))
+        for l in range(-1, 2):
+            chainingmesh_neighbour_cells[3*dim + N_neighbours] = mod(cell + l, shape)
+            N_neighbours += 1
+        return N_neighbours
+    # Non-periodic mesh. Find the nearest image of the coordinate
+    # relative to the centre of the mesh.
+    x -= chainingmesh_origin[dim] + 0.5*shape*chainingmesh_cellsize[dim]
+    if x > ℝ[0.5*boxsize]:
+        x -= boxsize
+    elif x < ℝ[-0.5*boxsize]:
+        x += boxsize
+    x += 0.5*shape*chainingmesh_cellsize[dim]
+    cell = int(floor(x*(1/chainingmesh_cellsize[dim])))
+    for l in range(-1, 2):
+        cell_neighbour = cell + l
+        if 0 <= cell_neighbour < shape:
+            chainingmesh_neighbour_cells[3*dim + N_neighbours] = cell_neighbour
+            N_neighbours += 1
+    return N_neighbours
+# Declare and allocate the module level arrays storing the chaining mesh
+cython.declare(chainingmesh_N_cells_allocated='Py_ssize_t',
+               chainingmesh_N_particles_allocated='Py_ssize_t',
+               chainingmesh_cell_start='Py_ssize_t*',
+               chainingmesh_cells='Py_ssize_t*',
+               chainingmesh_cellsize='double*',
+               chainingmesh_indices='Py_ssize_t*',
+               chainingmesh_neighbour_cells='Py_ssize_t*',
+               chainingmesh_origin='double*',
+               chainingmesh_periodic='bint*',
+               chainingmesh_shape='Py_ssize_t*',
+               )
+chainingmesh_N_cells_allocated = 1
+chainingmesh_N_particles_allocated = 1
+chainingmesh_cell_start      = malloc((chainingmesh_N_cells_allocated + 1)*sizeof('Py_ssize_t'))
+chainingmesh_cells           = malloc(chainingmesh_N_particles_allocated*sizeof('Py_ssize_t'))
+chainingmesh_cellsize        = malloc(3*sizeof('double'))
+chainingmesh_indices         = malloc(chainingmesh_N_particles_allocated*sizeof('Py_ssize_t'))
+chainingmesh_neighbour_cells = malloc(3*3*sizeof('Py_ssize_t'))
+chainingmesh_origin          = malloc(3*sizeof('double'))
+chainingmesh_periodic        = malloc(3*sizeof('bint'))
+chainingmesh_shape           = malloc(3*sizeof('Py_ssize_t'))
+
+# Function implementing gravity via a Barnes-Hut octree
+@cython.header(# Arguments
+               component_1='Component',
+               component_2='Component',
+               rank_2='int',
+               ᔑdt='dict',
+               local='bint',
+               mutual='bint',
+               extra_args='dict',
+               # Locals
+               N_1='Py_ssize_t',
+               N_2='Py_ssize_t',
+               child='Py_ssize_t',
+               force_ij='double*',
+               forcex_i='double',
+               forcey_i='double',
+               forcez_i='double',
+               halfwidth='double',
+               i='Py_ssize_t',
+               index='Py_ssize_t',
+               j='Py_ssize_t',
+               mass_1='double',
+               mass_2='double',
+               mass_node='double',
+               momx_1='double*',
+               momy_1='double*',
+               momz_1='double*',
+               multipole_fac='double',
+               node='Py_ssize_t',
+               octant='int',
+               periodic='bint',
+               posx_1='double*',
+               posx_2='double*',
+               posy_1='double*',
+               posy_2='double*',
+               posz_1='double*',
+               posz_2='double*',
+               quadrupole='double*',
+               r2='double',
+               r3_inv='double',
+               r5_inv='double',
+               softening_1='double',
+               softening_2='double',
+               stack_size='Py_ssize_t',
+               x_ji='double',
+               x_Q_x='double',
+               xc='double',
+               xi='double',
+               y_ji='double',
+               yc='double',
+               yi='double',
+               z_ji='double',
+               zc='double',
+               zi='double',
+               Qx='double',
+               Qy='double',
+               Qz='double',
+               returns='void',
+               )
+def gravity_tree(component_1, component_2, rank_2, ᔑdt, local, mutual, extra_args):
+    """The gravitational force on the particles of component_1 due to
+    the particles of component_2 is computed by walking an octree
+    built over component_2. Nodes which are sufficiently far away
+    compared to their size (as determined by tree_opening_angle)
+    are represented by their monopole and quadrupole moments, while
+    leaf nodes which cannot be approximated in this way have their
+    particles summed over directly. The force is one-sided, meaning
+    that component_2 is never updated and so the mutual argument is
+    ignored. With the 'periodic' extra argument set, the nearest image
+    is used together with Ewald corrections, exactly as for the
+    pairwise gravity.
+    """
+    if component_1.representation != 'particles' or component_2.representation != 'particles':
+        abort('gravity_tree is only implemented for particle components')
+    # Extract extra arguments
+    periodic = extra_args.get('periodic', True)
+    # Extract variables from the first (the local) component
+    N_1 = component_1.N_local
+    mass_1 = component_1.mass
+    softening_1 = component_1.softening
+    posx_1 = component_1.posx
+    posy_1 = component_1.posy
+    posz_1 = component_1.posz
+    momx_1 = component_1.momx
+    momy_1 = component_1.momy
+    momz_1 = component_1.momz
+    # Extract variables from the second (the external) component
+    N_2 = component_2.N_local
+    mass_2 = component_2.mass
+    softening_2 = component_2.softening
+    posx_2 = component_2.posx
+    posy_2 = component_2.posy
+    posz_2 = component_2.posz
+    if N_1 == 0 or N_2 == 0:
+        return
+    # Build the octree over the particles of component_2
+    build_tree(component_2)
+    # Walk the tree for each particle in component_1
+    for i in range(N_1):
+        xi = posx_1[i]
+        yi = posy_1[i]
+        zi = posz_1[i]
+        forcex_i = 0
+        forcey_i = 0
+        forcez_i = 0
+        # Start the walk at the root node
+        tree_stack[0] = 0
+        stack_size = 1
+        while stack_size > 0:
+            stack_size -= 1
+            node = tree_stack[stack_size]
+            # "Vector" from the geometric centre of the node
+            # to particle i, used to check whether particle i
+            # is located within the node.
+            xc = xi - tree_center[3*node    ]
+            yc = yi - tree_center[3*node + 1]
+            zc = zi - tree_center[3*node + 2]
+            # "Vector" from the centre of mass of the node
+            # to particle i.
+            x_ji = xi - tree_com[3*node    ]
+            y_ji = yi - tree_com[3*node + 1]
+            z_ji = zi - tree_com[3*node + 2]
+            with unswitch:
+                if periodic:
+                    # Translate coordinates so they
+                    # correspond to the nearest image.
+                    if xc > ℝ[0.5*boxsize]:
+                        xc -= boxsize
+                    elif xc < ℝ[-0.5*boxsize]:
+                        xc += boxsize
+                    if yc > ℝ[0.5*boxsize]:
+                        yc -= boxsize
+                    elif yc < ℝ[-0.5*boxsize]:
+                        yc += boxsize
+                    if zc > ℝ[0.5*boxsize]:
+                        zc -= boxsize
+                    elif zc < ℝ[-0.5*boxsize]:
+                        zc += boxsize
+                    if x_ji > ℝ[0.5*boxsize]:
+                        x_ji -= boxsize
+                    elif x_ji < ℝ[-0.5*boxsize]:
+                        x_ji += boxsize
+                    if y_ji > ℝ[0.5*boxsize]:
+                        y_ji -= boxsize
+                    elif y_ji < ℝ[-0.5*boxsize]:
+                        y_ji += boxsize
+                    if z_ji > ℝ[0.5*boxsize]:
+                        z_ji -= boxsize
+                    elif z_ji < ℝ[-0.5*boxsize]:
+                        z_ji += boxsize
+            r2 = x_ji**2 + y_ji**2 + z_ji**2
+            # Apply the opening criterion. The node may be approximated
+            # by its multipole moments if it appears small as seen
+            # from particle i and particle i is not inside of it.
+            halfwidth = tree_halfwidth[node]
+            if (    tree_N_children[node] > 0
+                and tree_bmax[node]**2 < ℝ[tree_opening_angle**2]*r2
+                and (abs(xc) > halfwidth or abs(yc) > halfwidth or abs(zc) > halfwidth)
+                ):
+                # Monopole and quadrupole contribution
+                # from the node as a whole.
+                mass_node = tree_mass[node]
+                quadrupole = cython.address(tree_quadrupole[6*node:])
+                r2 += ℝ[(0.5*(softening_1 + softening_2))**2]
+                r3_inv = 1/(r2*sqrt(r2))
+                r5_inv = r3_inv/r2
+                Qx = quadrupole[0]*x_ji + quadrupole[1]*y_ji + quadrupole[2]*z_ji
+                Qy = quadrupole[1]*x_ji + quadrupole[3]*y_ji + quadrupole[4]*z_ji
+                Qz = quadrupole[2]*x_ji + quadrupole[4]*y_ji + quadrupole[5]*z_ji
+                x_Q_x = x_ji*Qx + y_ji*Qy + z_ji*Qz
+                multipole_fac = -mass_node*r3_inv - 2.5*x_Q_x*r5_inv/r2
+                forcex_i += multipole_fac*x_ji + Qx*r5_inv
+                forcey_i += multipole_fac*y_ji + Qy*r5_inv
+                forcez_i += multipole_fac*z_ji + Qz*r5_inv
+                with unswitch:
+                    if periodic:
+                        # The Ewald correction force for all images
+                        # of the node except the nearest one.
+                        force_ij = ewald(x_ji, y_ji, z_ji)
+                        forcex_i += mass_node*force_ij[0]
+                        forcey_i += mass_node*force_ij[1]
+                        forcez_i += mass_node*force_ij[2]
+            elif tree_N_children[node] == 0:
+                # Leaf node which cannot be approximated.
+                # Sum over its particles directly.
+                for index in range(tree_start[node], tree_start[node] + tree_count[node]):
+                    j = tree_indices[index]
+                    # Do not let particle i interact with itself
+                    with unswitch:
+                        if local:
+                            if j == i:
+                                continue
+                    x_ji = xi - posx_2[j]
+                    y_ji = yi - posy_2[j]
+                    z_ji = zi - posz_2[j]
+                    with unswitch:
+                        if periodic:
+                            # Translate coordinates so they
+                            # correspond to the nearest image.
+                            if x_ji > ℝ[0.5*boxsize]:
+                                x_ji -= boxsize
+                            elif x_ji < ℝ[-0.5*boxsize]:
+                                x_ji += boxsize
+                            if y_ji > ℝ[0.5*boxsize]:
+                                y_ji -= boxsize
+                            elif y_ji < ℝ[-0.5*boxsize]:
+                                y_ji += boxsize
+                            if z_ji > ℝ[0.5*boxsize]:
+                                z_ji -= boxsize
+                            elif z_ji < ℝ[-0.5*boxsize]:
+                                z_ji += boxsize
+                            # The Ewald correction force for all
+                            # images except the nearest one.
+                            force_ij = ewald(x_ji, y_ji, z_ji)
+                            forcex_i += force_ij[0]
+                            forcey_i += force_ij[1]
+                            forcez_i += force_ij[2]
+                    r2 = x_ji**2 + y_ji**2 + z_ji**2 + ℝ[(0.5*(softening_1 + softening_2))**2]
+                    r3_inv = 1/(r2*sqrt(r2))
+                    forcex_i -= x_ji*r3_inv
+                    forcey_i -= y_ji*r3_inv
+                    forcez_i -= z_ji*r3_inv
+            else:
+                # Open the node
+                for octant in range(8):
+                    child = tree_children[8*node + octant]
+                    if child != -1:
+                        tree_stack[stack_size] = child
+                        stack_size += 1
+        # Convert the total force on particle i to a momentum change
+        # and apply it to particle i of component_1.
+        momx_1[i] += forcex_i*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a⁻¹']]
+        momy_1[i] += forcey_i*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a⁻¹']]
+        momz_1[i] += forcez_i*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a⁻¹']]
+
+# Function which builds an octree over the local particles of a
+# component. The tree is stored in the tree_* module level arrays,
+# with the root node having index 0.
+@cython.header(# Arguments
+               component='Component',
+               # Locals
+               N='Py_ssize_t',
+               extent='double',
+               i='Py_ssize_t',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               x_max='double',
+               x_min='double',
+               y_max='double',
+               y_min='double',
+               z_max='double',
+               z_min='double',
+               returns='void',
+               )
+def build_tree(component):
+    global tree_indices, tree_N_particles_allocated, tree_N_nodes
+    N = component.N_local
+    posx = component.posx
+    posy = component.posy
+    posz = component.posz
+    # Enlarge the array of particle indices if necessary
+    if tree_N_particles_allocated < N:
+        tree_N_particles_allocated = N
+        tree_indices = realloc(tree_indices, N*sizeof('Py_ssize_t'))
+    # Find the bounding box of the particles
+    x_min = y_min = z_min = +ထ
+    x_max = y_max = z_max = -ထ
+    for i in range(N):
+        tree_indices[i] = i
+        if posx[i] < x_min:
+            x_min = posx[i]
+        if posx[i] > x_max:
+            x_max = posx[i]
+        if posy[i] < y_min:
+            y_min = posy[i]
+        if posy[i] > y_max:
+            y_max = posy[i]
+        if posz[i] < z_min:
+            z_min = posz[i]
+        if posz[i] > z_max:
+            z_max = posz[i]
+    # The root node is the smallest cube containing the bounding box,
+    # enlarged slightly so that no particle lies exactly on its surface.
+    extent = max([x_max - x_min, y_max - y_min, z_max - z_min])
+    extent = (1 + 1e-6)*extent + machine_ϵ*boxsize
+    # Recursively construct all nodes, starting from the root
+    tree_N_nodes = 0
+    build_tree_node(posx, posy, posz, 0, N,
+                    0.5*(x_min + x_max), 0.5*(y_min + y_max), 0.5*(z_min + z_max),
+                    0.5*extent, 0,
+                    )
+
+# Function which constructs a single node of the octree, recursively
+# constructing all of its children. The index of the node is returned.
+@cython.header(# Arguments
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               start='Py_ssize_t',
+               end='Py_ssize_t',
+               centerx='double',
+               centery='double',
+               centerz='double',
+               halfwidth='double',
+               depth='int',
+               # Locals
+               bmax2='double',
+               comx='double',
+               comy='double',
+               comz='double',
+               count='Py_ssize_t',
+               index='Py_ssize_t',
+               j='Py_ssize_t',
+               node='Py_ssize_t',
+               quadrupole='double*',
+               r2='double',
+               x='double',
+               y='double',
+               z='double',
+               returns='Py_ssize_t',
+               )
+def build_tree_node(posx, posy, posz, start, end, centerx, centery, centerz, halfwidth, depth):
+    node = new_tree_node()
+    count = end - start
+    tree_start[node] = start
+    tree_count[node] = count
+    tree_mass[node] = count
+    tree_center[3*node    ] = centerx
+    tree_center[3*node + 1] = centery
+    tree_center[3*node + 2] = centerz
+    tree_halfwidth[node] = halfwidth
+    # Compute the centre of mass. As all particles within a component
+    # have the same mass, the mass of the node is simply the number of
+    # particles it contains, in units of the particle mass.
+    comx = comy = comz = 0
+    for index in range(start, end):
+        j = tree_indices[index]
+        comx += posx[j]
+        comy += posy[j]
+        comz += posz[j]
+    comx /= count
+    comy /= count
+    comz /= count
+    tree_com[3*node    ] = comx
+    tree_com[3*node + 1] = comy
+    tree_com[3*node + 2] = comz
+    # Subdivide the node into up to eight children
+    if count > tree_leafsize and depth < tree_max_depth:
+        subdivide_tree_node(posx, posy, posz, node, start, end, 0, 0, depth)
+    # Compute the traceless quadrupole moment about the centre of mass,
+    # stored in the order xx, xy, xz, yy, yz, zz. Also record the
+    # largest distance from the centre of mass to any particle,
+    # used in the opening criterion.
+    quadrupole = cython.address(tree_quadrupole[6*node:])
+    for j in range(6):
+        quadrupole[j] = 0
+    bmax2 = 0
+    for index in range(start, end):
+        j = tree_indices[index]
+        x = posx[j] - comx
+        y = posy[j] - comy
+        z = posz[j] - comz
+        r2 = x**2 + y**2 + z**2
+        quadrupole[0] += 3*x*x - r2
+        quadrupole[1] += 3*x*y
+        quadrupole[2] += 3*x*z
+        quadrupole[3] += 3*y*y - r2
+        quadrupole[4] += 3*y*z
+        quadrupole[5] += 3*z*z - r2
+        if r2 > bmax2:
+            bmax2 = r2
+    tree_bmax[node] = sqrt(bmax2)
+    return node
+
+# Function which sorts the particles of a node (those with
+# tree_indices in [start, end)) into octants, one dimension at a time,
+# and constructs a child node for each non-empty octant.
+@cython.header(# Arguments
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               node='Py_ssize_t',
+               start='Py_ssize_t',
+               end='Py_ssize_t',
+               dim='int',
+               octant='int',
+               depth='int',
+               # Locals
+               centerx_child='double',
+               centery_child='double',
+               centerz_child='double',
+               child='Py_ssize_t',
+               halfwidth_child='double',
+               pos_dim='double*',
+               split='Py_ssize_t',
+               returns='void',
+               )
+def subdivide_tree_node(posx, posy, posz, node, start, end, dim, octant, depth):
+    if start == end:
+        return
+    if dim == 3:
+        # The particles are now sorted into the given octant.
+        # Construct the corresponding child node.
+        halfwidth_child = 0.5*tree_halfwidth[node]
+        centerx_child = tree_center[3*node    ] - halfwidth_child
+        centery_child = tree_center[3*node + 1] - halfwidth_child
+        centerz_child = tree_center[3*node + 2] - halfwidth_child
+        if octant & 1:
+            centerx_child += 2*halfwidth_child
+        if octant & 2:
+            centery_child += 2*halfwidth_child
+        if octant & 4:
+            centerz_child += 2*halfwidth_child
+        child = build_tree_node(posx, posy, posz, start, end,
+                                centerx_child, centery_child, centerz_child,
+                                halfwidth_child, depth + 1,
+                                )
+        tree_children[8*node + octant] = child
+        tree_N_children[node] += 1
+        return
+    # Partition the particles along the dim'th dimension about the
+    # centre of the node, placing the lower half first.
+    if dim == 0:
+        pos_dim = posx
+    elif dim == 1:
+        pos_dim = posy
+    else:
+        pos_dim = posz
+    split = partition_tree_indices(pos_dim, start, end, tree_center[3*node + dim])
+    subdivide_tree_node(posx, posy, posz, node, start, split, dim + 1, octant           , depth)
+    subdivide_tree_node(posx, posy, posz, node, split, end  , dim + 1, octant | (1 << dim), depth)
+
+# Function which reorders tree_indices[start:end] so that the
+# particles with pos < center come first. The index of the first
+# particle with pos >= center is returned.
+@cython.header(# Arguments
+               pos='double*',
+               start='Py_ssize_t',
+               end='Py_ssize_t',
+               center='double',
+               # Locals
+               i='Py_ssize_t',
+               index='Py_ssize_t',
+               j='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def partition_tree_indices(pos, start, end, center):
+    i = start
+    j = end - 1
+    while i <= j:
+        if pos[tree_indices[i]] < center:
+            i += 1
+        else:
+            index = tree_indices[i]
+            tree_indices[i] = tree_indices[j]
+            tree_indices[j] = index
+            j -= 1
+    return i
+
+# Function which allocates a new (empty) node in the octree,
+# enlarging the tree arrays if necessary.
+@cython.header(# Locals
+               node='Py_ssize_t',
+               octant='int',
+               returns='Py_ssize_t',
+               )
+def new_tree_node():
+    global tree_N_nodes, tree_N_nodes_allocated
+    global tree_bmax, tree_center, tree_children, tree_com, tree_count
+    global tree_halfwidth, tree_mass, tree_N_children, tree_quadrupole, tree_start
+    if tree_N_nodes == tree_N_nodes_allocated:
+        tree_N_nodes_allocated *= 2
+        tree_bmax       = realloc(tree_bmax      ,   tree_N_nodes_allocated*sizeof('double'    ))
+        tree_center     = realloc(tree_center    , 3*tree_N_nodes_allocated*sizeof('double'    ))
+        tree_children   = realloc(tree_children  , 8*tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+        tree_com        = realloc(tree_com       , 3*tree_N_nodes_allocated*sizeof('double'    ))
+        tree_count      = realloc(tree_count     ,   tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+        tree_halfwidth  = realloc(tree_halfwidth ,   tree_N_nodes_allocated*sizeof('double'    ))
+        tree_mass       = realloc(tree_mass      ,   tree_N_nodes_allocated*sizeof('double'    ))
+        tree_N_children = realloc(tree_N_children,   tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+        tree_quadrupole = realloc(tree_quadrupole, 6*tree_N_nodes_allocated*sizeof('double'    ))
+        tree_start      = realloc(tree_start     ,   tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+    node = tree_N_nodes
+    tree_N_nodes += 1
+    for octant in range(8):
+        tree_children[8*node + octant] = -1
+    tree_N_children[node] = 0
+    return node
+# Declare and allocate the module level arrays storing the octree
+cython.declare(tree_N_nodes='Py_ssize_t',
+               tree_N_nodes_allocated='Py_ssize_t',
+               tree_N_particles_allocated='Py_ssize_t',
+               tree_N_children='Py_ssize_t*',
+               tree_bmax='double*',
+               tree_center='double*',
+               tree_children='Py_ssize_t*',
+               tree_com='double*',
+               tree_count='Py_ssize_t*',
+               tree_halfwidth='double*',
+               tree_indices='Py_ssize_t*',
+               tree_leafsize='Py_ssize_t',
+               tree_mass='double*',
+               tree_max_depth='int',
+               tree_quadrupole='double*',
+               tree_stack='Py_ssize_t*',
+               tree_start='Py_ssize_t*',
+               )
+# Nodes with no more particles than tree_leafsize are not subdivided.
+# As the size of nodes is halved at each level, no more than
+# tree_max_depth levels are allowed, protecting against runaway
+# subdivision of (nearly) coincident particles.
+tree_leafsize = 8
+tree_max_depth = 48
+tree_N_nodes = 0
+tree_N_nodes_allocated = 1
+tree_N_particles_allocated = 1
+tree_N_children = malloc(  tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+tree_bmax       = malloc(  tree_N_nodes_allocated*sizeof('double'    ))
+tree_center     = malloc(3*tree_N_nodes_allocated*sizeof('double'    ))
+tree_children   = malloc(8*tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+tree_com        = malloc(3*tree_N_nodes_allocated*sizeof('double'    ))
+tree_count      = malloc(  tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+tree_halfwidth  = malloc(  tree_N_nodes_allocated*sizeof('double'    ))
+tree_indices    = malloc(  tree_N_particles_allocated*sizeof('Py_ssize_t'))
+tree_mass       = malloc(  tree_N_nodes_allocated*sizeof('double'    ))
+tree_quadrupole = malloc(6*tree_N_nodes_allocated*sizeof('double'    ))
+tree_start      = malloc(  tree_N_nodes_allocated*sizeof('Py_ssize_t'))
+# The stack used when walking the tree. At most 7 siblings can be left
+# waiting on the stack at each level, plus the 8 children at the
+# deepest level.
+tree_stack = malloc((7*tree_max_depth + 8 + 1)*sizeof('Py_ssize_t'))
+
 # Function implementing the gravitational potential (in Fouier space).
 # Here k2 = k² is the squared magnitude of the wave vector,
 # in physical units.
@@ -229,23 +1441,47 @@ def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, ext
 def gravity_potential(k2):
     return ℝ[-4*π*G_Newton]/k2
 
+# Function implementing the long-range part of the gravitational
+# potential (in Fourier space) of the P³M method, complementing the
+# short-range force of the gravity_pairwise_shortrange function.
+# Here k2 = k² is the squared magnitude of the wave vector,
+# in physical units.
+@cython.header(k2='double',
+               returns='double',
+               )
+def gravity_longrange_potential(k2):
+    return ℝ[-4*π*G_Newton]/k2*exp(-k2*ℝ[p3m_scale_phys**2])
+
 # Function that applies the differentiated gravitational potential
 # to a component.
 @cython.header(# Arguments
                component='Component',
                ᔑdt='dict',
-               gradφ_dim='double[:, :, ::1]',
+               gradφ_dim='real[:, :, ::1]',
                dim='int',
                # Locals
                J_dim='FluidScalar',
+               Wxl='double',
+               Wxu='double',
+               Wyl='double',
+               Wyu='double',
+               Wzl='double',
+               Wzu='double',
                i='Py_ssize_t',
                mom_dim='double*',
+               momentum_fac='double',
                posx='double*',
                posy='double*',
                posz='double*',
+               scale_x='double',
+               scale_y='double',
+               scale_z='double',
                x='double',
+               x_lower='Py_ssize_t',
                y='double',
+               y_lower='Py_ssize_t',
                z='double',
+               z_lower='Py_ssize_t',
                returns='void',
                )
 def apply_gravity_potential(component, ᔑdt, gradφ_dim, dim):
@@ -258,20 +1494,54 @@ def apply_gravity_potential(component, ᔑdt, gradφ_dim, dim):
         posy    = component.posy
         posz    = component.posz
         mom_dim = component.mom[dim]
-        # Update the dim momentum component of particle i
-        for i in range(component.N_local):
-            # The coordinates of the i'th particle,
-            # transformed so that 0 <= x, y, z < 1.
-            x = (posx[i] - domain_start_x)/domain_size_x
-            y = (posy[i] - domain_start_y)/domain_size_y
-            z = (posz[i] - domain_start_z)/domain_size_z
+        # The factor with which to multiply gradφ_dim by to get
+        # momentum updates is -mass*Δt, where Δt = ᔑdt['1'].
+        momentum_fac = component.mass*ᔑdt['1']
+        # Factors scaling the coordinates within the domain
+        # to grid indices of gradφ_dim.
+        scale_x = (gradφ_dim.shape[0] - 1)/domain_size_x
+        scale_y = (gradφ_dim.shape[1] - 1)/domain_size_y
+        scale_z = (gradφ_dim.shape[2] - 1)/domain_size_z
+        # Update the dim momentum component of particle i.
+        # The particles are distributed over num_threads threads.
+        for i in prange(component.N_local, nogil=True, num_threads=num_threads):
+            # The coordinates of the i'th particle, transformed so
+            # that 0 <= x, y, z < shape - 1, with shape the shape of
+            # gradφ_dim. Coordinates exactly at the upper domain
+            # boundary are corrected.
+            x = (posx[i] - domain_start_x)*scale_x
+            y = (posy[i] - domain_start_y)*scale_y
+            z = (posz[i] - domain_start_z)*scale_z
+            if x >= ℝ[gradφ_dim.shape[0] - 1]:
+                x = ℝ[(gradφ_dim.shape[0] - 1)*(1 - machine_ϵ)]
+            if y >= ℝ[gradφ_dim.shape[1] - 1]:
+                y = ℝ[(gradφ_dim.shape[1] - 1)*(1 - machine_ϵ)]
+            if z >= ℝ[gradφ_dim.shape[2] - 1]:
+                z = ℝ[(gradφ_dim.shape[2] - 1)*(1 - machine_ϵ)]
             # Look up the force via a CIC interpolation,
             # convert it to momentum units and subtract it from the
             # momentum of particle i (subtraction because the force is
-            # the negative gradient of the potential).
-            # The factor with which to multiply gradφ_dim by to get
-            # momentum updates is -mass*Δt, where Δt = ᔑdt['1'].
-            mom_dim[i] -= ℝ[component.mass*ᔑdt['1']]*CIC_scalargrid2coordinates(gradφ_dim, x, y, z)
+            # the negative gradient of the potential). The
+            # interpolation is that of CIC_scalargrid2coordinates,
+            # written out so that it can run without the GIL.
+            x_lower = cast(x, 'Py_ssize_t')
+            y_lower = cast(y, 'Py_ssize_t')
+            z_lower = cast(z, 'Py_ssize_t')
+            Wxu = x - x_lower
+            Wyu = y - y_lower
+            Wzu = z - z_lower
+            Wxl = 1 - Wxu
+            Wyl = 1 - Wyu
+            Wzl = 1 - Wzu
+            mom_dim[i] -= momentum_fac*(
+                  gradφ_dim[x_lower    , y_lower    , z_lower    ]*Wxl*Wyl*Wzl
+                + gradφ_dim[x_lower    , y_lower    , z_lower + 1]*Wxl*Wyl*Wzu
+                + gradφ_dim[x_lower    , y_lower + 1, z_lower    ]*Wxl*Wyu*Wzl
+                + gradφ_dim[x_lower    , y_lower + 1, z_lower + 1]*Wxl*Wyu*Wzu
+                + gradφ_dim[x_lower + 1, y_lower    , z_lower    ]*Wxu*Wyl*Wzl
+                + gradφ_dim[x_lower + 1, y_lower    , z_lower + 1]*Wxu*Wyl*Wzu
+                + gradφ_dim[x_lower + 1, y_lower + 1, z_lower    ]*Wxu*Wyu*Wzl
+                + gradφ_dim[x_lower + 1, y_lower + 1, z_lower + 1]*Wxu*Wyu*Wzu)
     elif component.representation == 'fluid':
         # Simply scale and extrapolate the values in gradφ_dim
         # to the grid points of the dim'th component of the
@@ -292,3 +1562,137 @@ def apply_gravity_potential(component, ᔑdt, gradφ_dim, dim):
                       )
         # Communicate the pseudo and ghost points of J_dim
         communicate_domain(J_dim.grid_mv, mode='populate')
+
+# Function that applies all three components of the gradient of the
+# gravitational potential to a component at once.
+@cython.header(# Arguments
+               component='Component',
+               ᔑdt='dict',
+               gradφx='real[:, :, ::1]',
+               gradφy='real[:, :, ::1]',
+               gradφz='real[:, :, ::1]',
+               # Locals
+               J_dim='FluidScalar',
+               Wxl='double',
+               Wxu='double',
+               Wyl='double',
+               Wyu='double',
+               Wzl='double',
+               Wzu='double',
+               dim='int',
+               gradφ_dim='real[:, :, :]',
+               i='Py_ssize_t',
+               momx='double*',
+               momy='double*',
+               momz='double*',
+               momentum_fac='double',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               scale_x='double',
+               scale_y='double',
+               scale_z='double',
+               x='double',
+               x_lower='Py_ssize_t',
+               y='double',
+               y_lower='Py_ssize_t',
+               z='double',
+               z_lower='Py_ssize_t',
+               returns='void',
+               )
+def apply_gravity_gradient(component, ᔑdt, gradφx, gradφy, gradφz):
+    """The arguments gradφx, gradφy and gradφz are the three components
+    of the gradient of the potential in physical units, as domain grids
+    including pseudo points and ghost layers. For particles, all three
+    components are interpolated in a single pass, sharing the CIC
+    weights between them.
+    """
+    if component.representation == 'particles':
+        # Extract variables from component
+        posx = component.posx
+        posy = component.posy
+        posz = component.posz
+        momx = component.momx
+        momy = component.momy
+        momz = component.momz
+        # The factor with which to multiply the gradient by to get
+        # momentum updates is -mass*Δt, where Δt = ᔑdt['1'].
+        momentum_fac = component.mass*ᔑdt['1']
+        # Factors scaling the coordinates within the domain to grid
+        # indices of the gradient grids, excluding the ghost layers.
+        scale_x = (gradφx.shape[0] - 5)/domain_size_x
+        scale_y = (gradφx.shape[1] - 5)/domain_size_y
+        scale_z = (gradφx.shape[2] - 5)/domain_size_z
+        # Update the momentum of particle i.
+        # The particles are distributed over num_threads threads.
+        for i in prange(component.N_local, nogil=True, num_threads=num_threads):
+            # The coordinates of the i'th particle, transformed so
+            # that 0 <= x, y, z < shape - 5. Coordinates exactly at
+            # the upper domain boundary are corrected.
+            x = (posx[i] - domain_start_x)*scale_x
+            y = (posy[i] - domain_start_y)*scale_y
+            z = (posz[i] - domain_start_z)*scale_z
+            if x >= ℝ[gradφx.shape[0] - 5]:
+                x = ℝ[(gradφx.shape[0] - 5)*(1 - machine_ϵ)]
+            if y >= ℝ[gradφx.shape[1] - 5]:
+                y = ℝ[(gradφx.shape[1] - 5)*(1 - machine_ϵ)]
+            if z >= ℝ[gradφx.shape[2] - 5]:
+                z = ℝ[(gradφx.shape[2] - 5)*(1 - machine_ϵ)]
+            # The CIC weights, shared by all three components.
+            # The lower grid indices are offset by the
+            # two ghost layers.
+            x_lower = cast(x, 'Py_ssize_t')
+            y_lower = cast(y, 'Py_ssize_t')
+            z_lower = cast(z, 'Py_ssize_t')
+            Wxu = x - x_lower
+            Wyu = y - y_lower
+            Wzu = z - z_lower
+            Wxl = 1 - Wxu
+            Wyl = 1 - Wyu
+            Wzl = 1 - Wzu
+            x_lower = x_lower + 2
+            y_lower = y_lower + 2
+            z_lower = z_lower + 2
+            # Look up the force components, convert them to momentum
+            # units and subtract them from the momentum of particle i.
+            momx[i] -= momentum_fac*(
+                  gradφx[x_lower    , y_lower    , z_lower    ]*Wxl*Wyl*Wzl
+                + gradφx[x_lower    , y_lower    , z_lower + 1]*Wxl*Wyl*Wzu
+                + gradφx[x_lower    , y_lower + 1, z_lower    ]*Wxl*Wyu*Wzl
+                + gradφx[x_lower    , y_lower + 1, z_lower + 1]*Wxl*Wyu*Wzu
+                + gradφx[x_lower + 1, y_lower    , z_lower    ]*Wxu*Wyl*Wzl
+                + gradφx[x_lower + 1, y_lower    , z_lower + 1]*Wxu*Wyl*Wzu
+                + gradφx[x_lower + 1, y_lower + 1, z_lower    ]*Wxu*Wyu*Wzl
+                + gradφx[x_lower + 1, y_lower + 1, z_lower + 1]*Wxu*Wyu*Wzu)
+            momy[i] -= momentum_fac*(
+                  gradφy[x_lower    , y_lower    , z_lower    ]*Wxl*Wyl*Wzl
+                + gradφy[x_lower    , y_lower    , z_lower + 1]*Wxl*Wyl*Wzu
+                + gradφy[x_lower    , y_lower + 1, z_lower    ]*Wxl*Wyu*Wzl
+                + gradφy[x_lower    , y_lower + 1, z_lower + 1]*Wxl*Wyu*Wzu
+                + gradφy[x_lower + 1, y_lower    , z_lower    ]*Wxu*Wyl*Wzl
+                + gradφy[x_lower + 1, y_lower    , z_lower + 1]*Wxu*Wyl*Wzu
+                + gradφy[x_lower + 1, y_lower + 1, z_lower    ]*Wxu*Wyu*Wzl
+                + gradφy[x_lower + 1, y_lower + 1, z_lower + 1]*Wxu*Wyu*Wzu)
+            momz[i] -= momentum_fac*(
+                  gradφz[x_lower    , y_lower    , z_lower    ]*Wxl*Wyl*Wzl
+                + gradφz[x_lower    , y_lower    , z_lower + 1]*Wxl*Wyl*Wzu
+                + gradφz[x_lower    , y_lower + 1, z_lower    ]*Wxl*Wyu*Wzl
+                + gradφz[x_lower    , y_lower + 1, z_lower + 1]*Wxl*Wyu*Wzu
+                + gradφz[x_lower + 1, y_lower    , z_lower    ]*Wxu*Wyl*Wzl
+                + gradφz[x_lower + 1, y_lower    , z_lower + 1]*Wxu*Wyl*Wzu
+                + gradφz[x_lower + 1, y_lower + 1, z_lower    ]*Wxu*Wyu*Wzl
+                + gradφz[x_lower + 1, y_lower + 1, z_lower + 1]*Wxu*Wyu*Wzu)
+    elif component.representation == 'fluid':
+        # Apply each component of the gradient separately,
+        # as in apply_gravity_potential.
+        for dim in range(3):
+            J_dim = component.J[dim]
+            gradφ_dim = (gradφx, gradφy, gradφz)[dim]
+            CIC_grid2grid(J_dim.grid_noghosts,
+                          gradφ_dim[2:(gradφ_dim.shape[0] - 2),
+                                    2:(gradφ_dim.shape[1] - 2),
+                                    2:(gradφ_dim.shape[2] - 2)],
+                          fac=-ᔑdt['a⁻³ʷ', component],
+                          fac_grid=component.ϱ.grid_noghosts,
+                          )
+            communicate_domain(J_dim.grid_mv, mode='populate')
@@ -25,12 +25,12 @@
 from commons import *
 
 # Cython imports
-cimport('from communication import sendrecv_component')
-cimport('from mesh import CIC_components2φ, diff_domain, domain_decompose, fft, slab_decompose')
+cimport('from communication import apply_Δ, communicate_halo, get_buffer, isendrecv_component,\n'
+        '                          isendrecv_Δ, sendrecv_component, smart_mpi')
+cimport('from mesh import CIC_components2slab_fourier, diff_domain, domain_decompose, fft,\n'
+        '                  fourier_offsets')
 # Import interactions defined in other modules
 cimport('from gravity import *')
-# DELETE WHEN DONE with gravity_old.py !!!
-cimport('from gravity_old import build_φ, p3m, pm, pp')
 
 
 # Generic function implementing domain-domain pairing
@@ -46,10 +46,12 @@ cimport('from gravity_old import build_φ, p3m, pm, pp')
               extra_args='dict',
               # Locals
               N_domain_pairs='Py_ssize_t',
+              N_locals='object',  # NumPy array
               assisted='bint',
               components='list',
               component_1='Component',
               component_2_extrl='Component',
+              component_2_extrls='list',
               component_2_local='Component',
               i='Py_ssize_t',
               index_component_1='Py_ssize_t',
@@ -57,9 +59,20 @@ cimport('from gravity_old import build_φ, p3m, pm, pp')
               local='bint',
               mutual='bint',
               only_supply='bint',
-              rank_send='int',
               rank_recv='int',
+              rank_send='int',
+              request='object',  # mpi4py.MPI.Request
+              requests_data='list',
+              requests_Δ='list',
+              slot='int',
               synchronous='bint',
+              t_compute='double',
+              t_inflight='double',
+              t_posted='list',
+              t_wait='double',
+              t0='double',
+              variable='str',
+              Δ_recvbufs='list',
               )
 def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
                   dependent, affected, deterministic, extra_args={}):
@@ -79,7 +92,20 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
     If affected is an empty list, this is not really an interaction.
     In this case, every domain will both send and receive from every
     other domain.
+    
+    All communication is non-blocking, with the data of component_2
+    needed for the next domain pair prefetched while the interaction
+    of the current domain pair is being computed. Likewise, the
+    updates to component_2 (the Δ buffers) are sent back while the
+    following domain pairs are being computed. Three external
+    component_2 buffers are cycled through, so that the Δ buffers
+    sent back from one domain pair are not overwritten until the
+    computation of the next domain pair has finished.
+    As the updates are applied to the local component_2 while its
+    dependent variables are still being sent, the dependent and the
+    affected variables must be disjoint.
     """
+    global computation_time
     # List of all particles participating in this interaction
     components = receivers + suppliers
     # Determine whether this "interaction" have any direct effect
@@ -88,6 +114,10 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
     assisted = True
     if not affected:
         assisted = False
+    for variable in affected:
+        if variable in dependent:
+            abort('The domain_domain function cannot handle the variable "{}" being both '
+                  'dependent and affected'.format(variable))
     # Pair each receiver with all receivers and suppliers
     for     index_component_1, component_1       in enumerate(receivers):
         for index_component_2, component_2_local in enumerate(components[index_component_1:]):
@@ -120,10 +150,60 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
             # On each process, the local component_1 and the external
             # (received) component_2 then interact.
             N_domain_pairs = ℤ[1 + nprocs//2] if assisted else nprocs
+            # As the receives are posted before the data arrives,
+            # the number of local particles of component_2 on
+            # all processes are needed beforehand.
+            N_locals = smart_mpi(component_2_local.N_local, mpifun='allgather')
+            # The external component_2, the posted requests and the
+            # times of posting for each of the three slots,
+            # as well as the timings.
+            component_2_extrls = [None]*3
+            requests_data      = [[], [], []]
+            requests_Δ         = [[], [], []]
+            Δ_recvbufs         = [None]*3
+            t_posted           = [0.0]*3
+            t_compute = t_inflight = t_wait = 0
             for i in range(N_domain_pairs):
                 # Process ranks to send to and receive from
                 rank_send = mod(rank + i, nprocs)
                 rank_recv = mod(rank - i, nprocs)
+                slot = i % 3
+                # The first domain pair is really just the local
+                # domain, for which no communication is needed.
+                if i == 0:
+                    component_2_extrls[slot] = component_2_local
+                # Prefetch the dependent variables (e.g. pos for
+                # gravity) of component_2 for the next domain pair. The slot of this next domain
+                # pair was last used two domain pairs ago. The sending
+                # back of the Δ buffers from then should be complete
+                # before the slot can be reused.
+                if i + 1 < N_domain_pairs:
+                    t0 = time()
+                    complete_Δ(component_2_local, affected, component_2_extrls[(i + 1) % 3],
+                               requests_Δ[(i + 1) % 3], Δ_recvbufs[(i + 1) % 3])
+                    t_wait += time() - t0
+                    if requests_Δ[(i + 1) % 3]:
+                        t_inflight += time() - t_posted[(i + 1) % 3]
+                    requests_Δ[(i + 1) % 3] = []
+                    component_2_extrls[(i + 1) % 3], requests_data[(i + 1) % 3] = (
+                        isendrecv_component(component_2_local, dependent,
+                                            dest=mod(rank + i + 1, nprocs),
+                                            source=mod(rank - (i + 1), nprocs),
+                                            N_recv=int(N_locals[mod(rank - (i + 1), nprocs)]),
+                                            buffer_index=(i + 1) % 3,
+                                            )
+                    )
+                    t_posted[(i + 1) % 3] = time()
+                # Wait for the dependent variables of component_2
+                # for this domain pair to arrive.
+                if requests_data[slot]:
+                    t0 = time()
+                    for request in requests_data[slot]:
+                        request.wait()
+                    t_wait += time() - t0
+                    t_inflight += time() - t_posted[slot]
+                    requests_data[slot] = []
+                component_2_extrl = component_2_extrls[slot]
                 # Determine whther component_2 should be updated due to
                 # its interaction with component_1. This is usually the
                 # case. The exceptions are
@@ -157,12 +237,6 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
                 mutual = True
                 if only_supply or local or (synchronous and deterministic) or not assisted:
                     mutual = False
-                # Communicate the dependent variables
-                # (e.g. pos for gravity) of component_2.
-                component_2_extrl = sendrecv_component(component_2_local,
-                                                       dependent, dest=rank_send,
-                                                                  source=rank_recv,
-                                                       )
                 # Let the local component_1 interaction with the
                 # external component_2. This will update the affected
                 # variables (e.g. mom for gravity) of the local
@@ -173,24 +247,159 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
                 # and also non-deterministic, perform the interaction
                 # only on one of the two processes. The process with
                 # the lower rank is chosen for the job.
+                t0 = time()
                 if (    not synchronous
                     or (    synchronous and     deterministic)
                     or (    synchronous and not deterministic and rank < rank_send)
                     ):
                     interaction(component_1, component_2_extrl, rank_recv, ᔑdt, local, mutual, extra_args)
+                t_compute += time() - t0
                 if mutual:
-                    # Send the populated buffers back to the process
-                    # from which the external component_2 came.
-                    # Add the received values in the buffers to the
-                    # affected variables (e.g. mom for gravity) of
-                    # the local component_2.
-                    sendrecv_component(component_2_extrl, affected, dest=rank_recv,
-                                                                    source=rank_send,
-                                                                    component_recv=component_2_local,
-                                       )
-                    # Nullify the Δ buffers of the external component_2,
-                    # leaving this with no leftover junk.
-                    component_2_extrl.nullify_Δ(affected)
+                    if rank_send == rank == rank_recv:
+                        # The external component_2 is really the
+                        # local component_2. Add the values in its
+                        # buffers to its affected variables directly.
+                        sendrecv_component(component_2_extrl, affected, dest=rank,
+                                                                        source=rank,
+                                                                        component_recv=component_2_local,
+                                           )
+                        component_2_extrl.nullify_Δ(affected)
+                    else:
+                        # Send the populated buffers back to the process
+                        # from which the external component_2 came,
+                        # while receiving the buffers populated by the
+                        # process to which the local component_2 was
+                        # sent. The received values are added to the
+                        # affected variables (e.g. mom for gravity) of
+                        # the local component_2 once the slot is
+                        # needed again, or at the end.
+                        Δ_recvbufs[slot], requests_Δ[slot] = isendrecv_Δ(
+                            component_2_extrl, affected, dest=rank_recv,
+                                                         source=rank_send,
+                                                         N_recv=component_2_local.N_local,
+                                                         buffer_name='Δ_recv_{}'.format(slot),
+                        )
+                        t_posted[slot] = time()
+            # Complete the sending back of the remaining Δ buffers
+            t0 = time()
+            for slot in range(3):
+                if requests_Δ[slot]:
+                    complete_Δ(component_2_local, affected, component_2_extrls[slot],
+                               requests_Δ[slot], Δ_recvbufs[slot])
+                    t_inflight += time() - t_posted[slot]
+            t_wait += time() - t0
+            masterprint('done')
+            # Record the computation time, for use with load balancing
+            computation_time += t_compute
+            # Print out the timing breakdown. The in-flight time is the
+            # total time from the posting of communication until its
+            # completion, while the exposed time is the part of this
+            # during which the process waited. The remainder was
+            # hidden behind computation.
+            if interaction_name and nprocs > 1:
+                t_compute  = allreduce(t_compute,  op=MPI.MAX)
+                t_inflight = allreduce(t_inflight, op=MPI.MAX)
+                t_wait     = allreduce(t_wait,     op=MPI.MAX)
+                masterprint(
+                    'Computation: {} s, communication hidden: {} s, '
+                    'communication exposed: {} s (maximum over processes)'
+                    .format(significant_figures(t_compute, 3, fmt='unicode'),
+                            significant_figures(np.max([t_inflight - t_wait, 0]), 3, fmt='unicode'),
+                            significant_figures(t_wait, 3, fmt='unicode'),
+                            ),
+                    indent=4,
+                )
+
+# Helper function for domain_domain, completing the non-blocking
+# sending back of the Δ buffers of an external component.
+@cython.header(# Arguments
+               component_2_local='Component',
+               affected='list',   # list of str's
+               component_2_extrl='Component',
+               requests='list',
+               Δ_recvbuf='object',  # double[::1] or None
+               # Locals
+               request='object',  # mpi4py.MPI.Request
+               )
+def complete_Δ(component_2_local, affected, component_2_extrl, requests, Δ_recvbuf):
+    """Once the requests are completed, the received Δ values are added
+    to the affected variables of the local component_2, while the
+    sent Δ buffers of the external component_2 are nullified.
+    """
+    if not requests:
+        return
+    for request in requests:
+        request.wait()
+    apply_Δ(component_2_local, affected, Δ_recvbuf)
+    component_2_extrl.nullify_Δ(affected)
+
+# Function returning the time spent by the local process computing
+# interactions within domain_domain, since the previous call.
+@cython.pheader(# Locals
+                t='double',
+                returns='double',
+                )
+def pop_computation_time():
+    global computation_time
+    t = computation_time
+    computation_time = 0
+    return t
+# The accumulated computation time of domain_domain
+cython.declare(computation_time='double')
+computation_time = 0
+
+# Generic function implementing short-range interactions between
+# the local domain and its halo.
+@cython.header(# Arguments
+               receivers='list',
+               suppliers='list',
+               ᔑdt='dict',
+               interaction='func_interaction',
+               interaction_name='str',
+               reach='double',
+               extra_args='dict',
+               # Locals
+               component_1='Component',
+               component_2='Component',
+               component_2_halo='Component',
+               components='list',
+               )
+def domain_halo(receivers, suppliers, ᔑdt, interaction, interaction_name, reach, extra_args={}):
+    """This function takes care of interactions with a finite reach,
+    for which each domain only needs to see the particles of its
+    neighbouring domains lying within a distance reach of its boundary
+    (the halo). For each component_2 (receivers and suppliers alike),
+    the halo is communicated once, after which every receiver
+    component_1 interacts with first the local and then the halo
+    particles of component_2. As the halo particles are just copies,
+    no momentum updates are ever sent back. Instead, every process
+    computes the one-sided interactions of its own particles, the only
+    exception being the interaction of a component with its own local
+    particles, which is carried out as a local interaction.
+    """
+    # List of all particles participating in this interaction
+    components = receivers + suppliers
+    for component_2 in components:
+        if component_2.representation != 'particles':
+            abort('The domain_halo function is only implemented for particles')
+        # Communicate the halo of component_2
+        component_2_halo = communicate_halo(component_2, reach)
+        for component_1 in receivers:
+            # Display progress message
+            if interaction_name:
+                if component_1 is component_2:
+                    masterprint('Letting {} interact under {} ...'
+                                .format(component_1.name, interaction_name)
+                                )
+                else:
+                    masterprint('Letting {} interact with {} under {} ...'
+                                .format(component_1.name, component_2.name, interaction_name)
+                                )
+            # Interaction with the local particles of component_2
+            interaction(component_1, component_2, rank, ᔑdt,
+                        (component_1 is component_2), False, extra_args)
+            # Interaction with the halo particles of component_2
+            interaction(component_1, component_2_halo, rank, ᔑdt, False, False, extra_args)
             masterprint('done')
 
 # Generic function implementing particle-mesh interactions
@@ -202,16 +411,18 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
                potential_name='str',
                dependent='list',
                apply_potential='func_apply_potential',
+               apply_gradient='func_apply_gradient',
                # Locals
                component='Component',
                components='list',
                dim='int',
-               gradφ_dim='double[:, :, ::1]',
+               gradφ='list',
+               gradφ_dim='real[:, :, ::1]',
                h='double',
-               φ='double[:, :, ::1]',
+               φ='real[:, :, ::1]',
                )
 def particle_mesh(receivers, suppliers, ᔑdt, potential, potential_name,
-                  dependent, apply_potential):
+                  dependent, apply_potential, apply_gradient):
     """This function will update the affected variables of all receiver
     components due to an interaction. This is done by constructing a
     global field by interpolating the dependent variables of all
@@ -232,9 +443,26 @@ def particle_mesh(receivers, suppliers, ᔑdt, potential, potential_name,
     differentiated along each dimension to get the force. This force is
     is passed to the apply_potential function for each receiver and
     each dimension.
+
+    With pm_differentiation = 'fourier', the gradient is instead
+    computed in Fourier space, resulting in three grids which are
+    passed together to the apply_gradient function for each receiver.
     """
-    # Build the potential due to all components
     components = receivers + suppliers
+    if pm_differentiation == 'fourier':
+        # Build the gradient of the potential due to all components
+        masterprint('Constructing the gradient of the {} due to {} ...'
+                    .format(potential_name, ', '.join([component.name
+                                                       for component in components])))
+        gradφ = construct_potential_gradient(components, dependent, potential)
+        masterprint('done')
+        # Apply the force to all the receivers
+        for component in receivers:
+            masterprint('Applying the gradient to {} ...'.format(component.name))
+            apply_gradient(component, ᔑdt, gradφ[0], gradφ[1], gradφ[2])
+            masterprint('done')
+        return
+    # Build the potential due to all components
     masterprint('Constructing the {} due to {} ...'
                 .format(potential_name, ', '.join([component.name for component in components])))
     φ = construct_potential(components, dependent, potential)
@@ -262,24 +490,9 @@ def particle_mesh(receivers, suppliers, ᔑdt, potential, potential_name,
                quantities='list',
                potential='func_potential',
                # Locals
-               double_deconv='double',
-               fft_normalization_factor='double',
-               i='Py_ssize_t',
-               j='Py_ssize_t',
-               j_global='Py_ssize_t',
-               k='Py_ssize_t',
-               ki='Py_ssize_t',
-               kj='Py_ssize_t',
-               kj2='Py_ssize_t',
-               kk='Py_ssize_t',
-               k2='Py_ssize_t',
-               slab='double[:, :, ::1]',
-               slab_jik='double*',
-               reciprocalsqrt_deconv_ij='double',
-               reciprocalsqrt_deconv_ijk='double',
-               reciprocalsqrt_deconv_j='double',
-               φ='double[:, :, ::1]',
-               returns='double[:, :, ::1]',
+               slab='real[:, :, ::1]',
+               φ='real[:, :, ::1]',
+               returns='real[:, :, ::1]',
                )
 def construct_potential(components, quantities, potential):
     """This function populate the φ grid (including pseudo points and
@@ -306,12 +519,66 @@ def construct_potential(components, quantities, potential):
     (note: it is not allowed to actually pass a lambda function,
     in compiled mode anyway).
     """
-    # CIC interpolate the particles/fluid elements onto the slabs
-    φ = CIC_components2φ(components, quantities)
-    slab = slab_decompose(φ, prepare_fft=True)
-    # Do forward Fourier transform on the slabs
-    # containing the density field.
-    fft(slab, 'forward')
+    # Construct the potential in Fourier space
+    slab = construct_potential_fourier(components, quantities, potential)
+    # Fourier transform the slabs back to coordinate space.
+    # Now the slabs store potential values.
+    slab = fft(slab, 'backward')
+    # Communicate the potential stored in the slabs to φ
+    φ = domain_decompose(slab, 'φ')  # This also populates pseudo and ghost points
+    # Return the potential grid (though this is a global and is often
+    # imported directly into other modules).
+    return φ
+
+# Function constructing the Fourier space potential
+# due to components, with the potential function given.
+@cython.header(# Arguments
+               components='list',
+               quantities='list',
+               potential='func_potential',
+               # Locals
+               component='Component',
+               double_deconv='double',
+               fft_normalization_factor='double',
+               i='Py_ssize_t',
+               j='Py_ssize_t',
+               j_global='Py_ssize_t',
+               k='Py_ssize_t',
+               ki='Py_ssize_t',
+               kj='Py_ssize_t',
+               kj2='Py_ssize_t',
+               kk='Py_ssize_t',
+               k2='Py_ssize_t',
+               slab='real[:, :, ::1]',
+               slab_jik='real*',
+               slab_start_j='Py_ssize_t',
+               slab_start_kk='Py_ssize_t',
+               reciprocalsqrt_deconv_ij='double',
+               reciprocalsqrt_deconv_ijk='double',
+               reciprocalsqrt_deconv_j='double',
+               returns='real[:, :, ::1]',
+               )
+def construct_potential_fourier(components, quantities, potential):
+    """The returned Fourier space slab (or pencil) is normalized,
+    so that a backward transformation results in the real-space
+    potential. See construct_potential for details.
+    """
+    # Fluid components are always CIC-interpolated, while the
+    # deconvolution below is that of the pm_assignment scheme,
+    # applied to the summed contributions of all components.
+    if pm_assignment_order != 2:
+        for component in components:
+            if component.representation == 'fluid':
+                abort('Cannot construct the potential from fluid component "{}" using '
+                      'pm_assignment = "{}", as fluid components are always CIC-interpolated'
+                      .format(component.name, pm_assignment))
+    # Interpolate the particles/fluid elements onto the slabs
+    # and Fourier transform them.
+    slab = CIC_components2slab_fourier(components, quantities)
+    # The global indices of the first element of the local slab.
+    # For a slab this is (slab.shape[0]*rank, 0) while for a pencil
+    # the k-dimension is distributed as well.
+    slab_start_j, slab_start_kk = fourier_offsets(slab)
     # Multiplicative factor needed after a forward and a backward
     # Fourier transformation.
     fft_normalization_factor = 1/float(φ_gridsize)**3
@@ -320,7 +587,7 @@ def construct_potential(components, quantities, potential):
         # The j-component of the wave vector (grid units).
         # Since the slabs are distributed along the j-dimension,
         # an offset must be used.
-        j_global = ℤ[slab.shape[0]*rank] + j
+        j_global = slab_start_j + j
         if j_global > ℤ[φ_gridsize//2]:
             kj = j_global - φ_gridsize
         else:
@@ -342,7 +609,7 @@ def construct_potential(components, quantities, potential):
             # in steps of 2 (one complex number at a time).
             for k in range(0, ℤ[slab.shape[2]], 2):
                 # The k-component of the wave vector (grid units)
-                kk = k//2
+                kk = slab_start_kk + k//2
                 # The squared magnitude of the wave vector (grid units)
                 k2 = ℤ[ki**2 + kj2] + kk**2
                 # Pointer to the [j, i, k]'th element of the slab.
@@ -359,12 +626,14 @@ def construct_potential(components, quantities, potential):
                 # Reciprocal square root of the product of
                 # all components of the deconvolution.
                 reciprocal_sqrt_deconv_ijk = reciprocal_sqrt_deconv_ij*sinc(kk*ℝ[π/φ_gridsize])
-                # A full deconvolution is now
-                # 1/reciprocal_sqrt_deconv_ijk**2.
-                # We need however two such full deconvolutions, one for
-                # each CIC interpolation (the component assignment and
-                # the upcoming force interpolation).
-                double_deconv = 1/reciprocal_sqrt_deconv_ijk**4
+                # A full CIC deconvolution is now
+                # 1/reciprocal_sqrt_deconv_ijk**2, while the
+                # deconvolution of the assignment scheme of order
+                # pm_assignment_order is
+                # 1/reciprocal_sqrt_deconv_ijk**pm_assignment_order.
+                # We need to deconvolve both the component assignment
+                # and the upcoming (CIC) force interpolation.
+                double_deconv = 1/reciprocal_sqrt_deconv_ijk**ℤ[pm_assignment_order + 2]
                 # Get the factor from the potential function at this k².
                 # The physical squared length of the wave vector is
                 # given by (2π/boxsize*|k|)².
@@ -381,14 +650,98 @@ def construct_potential(components, quantities, potential):
                 #   backwards Fourier transformation.
                 slab_jik[0] *= ℝ[potential_factor*double_deconv*fft_normalization_factor]
                 slab_jik[1] *= ℝ[potential_factor*double_deconv*fft_normalization_factor]
-    # Fourier transform the slabs back to coordinate space.
-    # Now the slabs store potential values.
-    fft(slab, 'backward')
-    # Communicate the potential stored in the slabs to φ
-    domain_decompose(slab, φ)  # This also populates pseudo and ghost points
-    # Return the potential grid (though this is a global and is often
-    # imported directly into other modules).
-    return φ
+    return slab
+
+# Generic function capable of constructing the three components of the
+# gradient of a potential directly in Fourier space.
+@cython.header(# Arguments
+               components='list',
+               quantities='list',
+               potential='func_potential',
+               # Locals
+               dim='int',
+               gradφ='list',
+               i='Py_ssize_t',
+               j='Py_ssize_t',
+               j_global='Py_ssize_t',
+               k='Py_ssize_t',
+               k_dim='Py_ssize_t',
+               ki='Py_ssize_t',
+               kj='Py_ssize_t',
+               kk='Py_ssize_t',
+               slab='real[:, :, ::1]',
+               slab_fourier='real[:, :, ::1]',
+               slab_jik='real*',
+               slab_start_j='Py_ssize_t',
+               slab_start_kk='Py_ssize_t',
+               φ_fourier='real[:, :, ::1]',
+               φ_jik='real*',
+               returns='list',
+               )
+def construct_potential_gradient(components, quantities, potential):
+    """The potential is constructed in Fourier space as in
+    construct_potential, after which each component of its gradient is
+    obtained through multiplication by ik (in physical units) and a
+    backward Fourier transformation. Compared to finite differencing
+    in real space, this is exact up to the grid resolution and needs
+    no ghost layers. The returned list holds the three gradient
+    components as domain grids, including pseudo points and
+    ghost layers.
+    """
+    slab_fourier = construct_potential_fourier(components, quantities, potential)
+    slab_start_j, slab_start_kk = fourier_offsets(slab_fourier)
+    # Keep a copy of the Fourier space potential, as the slab itself
+    # is needed for the transformations of the gradient components.
+    φ_fourier = get_buffer(asarray(slab_fourier).shape, 'φ_fourier', dtype='real')
+    φ_fourier[...] = slab_fourier
+    gradφ = []
+    for dim in range(3):
+        # Loop through the local j-dimension
+        for j in range(ℤ[slab_fourier.shape[0]]):
+            # The j-component of the wave vector (grid units)
+            j_global = slab_start_j + j
+            if j_global > ℤ[φ_gridsize//2]:
+                kj = j_global - φ_gridsize
+            else:
+                kj = j_global
+            # Loop through the complete i-dimension
+            for i in range(φ_gridsize):
+                # The i-component of the wave vector (grid units)
+                if i > ℤ[φ_gridsize//2]:
+                    ki = i - φ_gridsize
+                else:
+                    ki = i
+                # Loop through the complete, padded k-dimension
+                # in steps of 2 (one complex number at a time).
+                for k in range(0, ℤ[slab_fourier.shape[2]], 2):
+                    # The k-component of the wave vector (grid units)
+                    kk = slab_start_kk + k//2
+                    # The component of the wave vector
+                    # along the differentiation.
+                    with unswitch(3):
+                        if dim == 0:
+                            k_dim = ki
+                        elif dim == 1:
+                            k_dim = kj
+                        else:
+                            k_dim = kk
+                    # The Nyquist frequency has no well-defined sign,
+                    # and so its derivative is set to zero in order
+                    # to keep the gradient real.
+                    if k_dim == ℤ[φ_gridsize//2]:
+                        k_dim = 0
+                    # Pointers to the [j, i, k]'th element of the slab
+                    # and of the Fourier space potential.
+                    slab_jik = cython.address(slab_fourier[j, i, k:])
+                    φ_jik = cython.address(φ_fourier[j, i, k:])
+                    # Multiply by ik_dim in physical units
+                    slab_jik[0] = ℝ[-2*π/boxsize]*k_dim*φ_jik[1]  # Real part
+                    slab_jik[1] = ℝ[ 2*π/boxsize]*k_dim*φ_jik[0]  # Imag part
+        # Fourier transform the gradient component back to coordinate
+        # space and communicate it to a domain grid.
+        slab = fft(slab_fourier, 'backward')
+        gradφ.append(domain_decompose(slab, 'gradφ{}'.format('xyz'[dim])))
+    return gradφ
 
 # Function implementing pairwise nearest neighbour search
 @cython.header(# Arguments
@@ -535,11 +888,6 @@ def find_nearest_neighbour(components, selected):
                 dependent='list',
                 Δt='double',
                 φ_Vcell='double',
-                # DELETE BELOW WHEN DONE WITH gravity_old.py !!!
-                dim='int',
-                gradφ_dim='double[:, :, ::1]',
-                h='double',
-                φ='double[:, :, ::1]',
                 )
 def gravity(method, receivers, suppliers, ᔑdt):
     # List of all particles participating in this interaction
@@ -561,8 +909,26 @@ def gravity(method, receivers, suppliers, ᔑdt):
                                   'only_short_range': False,
                                   },
                       )
-    elif method == 'pm':
-        # The particle-mesh method.
+    elif method in ('treenonperiodic', 'tree'):
+        # The Barnes-Hut tree method, either non-periodic or with
+        # Ewald-periodicity. As the tree force is not symmetric
+        # between particle pairs, momentum updates are never sent
+        # back (affected is empty), meaning that every domain sees
+        # every other domain. For the same reason, each receiver
+        # is treated separately, with all other components acting
+        # as suppliers.
+        for component in receivers:
+            domain_domain([component], [component_2 for component_2 in components
+                                        if component_2 is not component],
+                          ᔑdt, gravity_tree,
+                          'gravitation ({})'.format('tree' if method == 'tree'
+                                                    else 'tree (non-periodic)'),
+                          dependent=['pos'], affected=[], deterministic=True,
+                          extra_args={'periodic': (method == 'tree')},
+                          )
+    elif method in ('pm', 'p3m'):
+        # The particle-mesh method, or the long-range part of the
+        # particle-particle-mesh method.
         # The gravitational potential is given by the Poisson equation
         # ∇²φ = 4πGa²ρ = 4πGa⁻³ʷ⁻¹ϱ.
         # The factor in front of the dependent variable ϱ is thus
@@ -577,41 +943,30 @@ def gravity(method, receivers, suppliers, ᔑdt):
                      ('ϱ', [ᔑdt['a⁻³ʷ⁻¹', component]*ℝ[1/Δt]
                             for component in components]),
                      ]
-        particle_mesh(receivers, suppliers, ᔑdt, gravity_potential, 'gravitational potential (PM)',
-                      dependent, apply_gravity_potential)
-    elif method == 'p3m':
-        # List of all particles participating in this interaction
-        components = receivers + suppliers
-        # The particle-particle-mesh method.
-        # So far, this method is only implemented between particles
-        # in a single component.
-        if len(components) != 1:
-            abort('The P³M method can only be used with a single gravitating component')
-        component = components[0]
-        # So far, this method is only implemented for
-        # particle components, not fluids.
-        if component.representation != 'particles':
-            abort('The P³M method can only be used with particle components')
-        # Construct the long-range gravitational potential from all
-        # components which interacts gravitationally.
-        φ = build_φ(components, ᔑdt, only_long_range=True)
-        # For each dimension, differentiate φ and apply the force to
-        # all receiver components.
-        h = boxsize/φ_gridsize  # Physical grid spacing of φ
-        for dim in range(3):
-            # Do the differentiation of φ
-            gradφ_dim = diff_domain(φ, dim, h, order=4)
-            # Apply long-range P³M force to all the receivers
+        if method == 'pm':
+            particle_mesh(receivers, suppliers, ᔑdt, gravity_potential,
+                          'gravitational potential (PM)',
+                          dependent, apply_gravity_potential, apply_gravity_gradient)
+        else:
+            # The short-range force is computed via direct summation
+            # and so the receivers have to be particles. Fluid
+            # suppliers contribute with their long-range force only.
             for component in receivers:
-                masterprint('Applying gravitational (P³M, long-range) forces along the {}-direction to {} ...'
-                            .format('xyz'[dim], component.name)
-                            )
-                pm(component, ᔑdt, gradφ_dim, dim)
-                masterprint('done')
-        # Now apply the short-range gravitational forces
-        masterprint('Gravitationally (P³M, short-range) accelerating {} ...'.format(component.name))
-        p3m(component, ᔑdt)
-        masterprint('done')
+                if component.representation != 'particles':
+                    abort('The P³M method can only be used with particle receivers, '
+                          'but {} is a fluid'.format(component.name))
+            particle_mesh(receivers, suppliers, ᔑdt, gravity_longrange_potential,
+                          'gravitational long-range potential (P³M)',
+                          dependent, apply_gravity_potential, apply_gravity_gradient)
+            # The short-range force between particles within
+            # p3m_cutoff_phys of each other, either within the same
+            # domain or across a domain boundary via the halo.
+            domain_halo(receivers, [component for component in suppliers
+                                    if component.representation == 'particles'],
+                        ᔑdt, gravity_pairwise_shortrange, 'gravitation (P³M, short-range)',
+                        p3m_cutoff_phys,
+                        extra_args={'only_short_range': True},
+                        )
     elif master:
         abort('gravity was called with the "{}" method'.format(method))
 
@@ -685,10 +1040,12 @@ Interaction = collections.namedtuple('Interaction', ('force',
 # are computed and applied. Each element of the list should be a
 # 2-tuple in the format (force, method).
 cython.declare(forces_implemented='list')
-forces_implemented = [('gravity', 'ppnonperiodic'),
-                      ('gravity', 'pp'           ),
-                      ('gravity', 'p3m'          ),
-                      ('gravity', 'pm'           ),
+forces_implemented = [('gravity', 'ppnonperiodic'  ),
+                      ('gravity', 'pp'             ),
+                      ('gravity', 'treenonperiodic'),
+                      ('gravity', 'tree'           ),
+                      ('gravity', 'p3m'            ),
+                      ('gravity', 'pm'             ),
                       ]
 
 # Function pointer types used in this module
@@ -697,6 +1054,8 @@ pxd = """
 ctypedef void   (*func_interaction    )(Component  , Component  , int   , dict, bint , bint  , dict      )
 #                                       k2
 ctypedef double (*func_potential      )(double)
-#                                       component, ᔑdt , gradφ_dim        , dim
-ctypedef void   (*func_apply_potential)(Component, dict, double[:, :, ::1], int)
+#                                       component, ᔑdt , gradφ_dim      , dim
+ctypedef void   (*func_apply_potential)(Component, dict, real[:, :, ::1], int)
+#                                       component, ᔑdt , gradφx         , gradφy         , gradφz
+ctypedef void   (*func_apply_gradient )(Component, dict, real[:, :, ::1], real[:, :, ::1], real[:, :, ::1])
 """
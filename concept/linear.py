@@ -27,7 +27,7 @@ from commons import *
 # Cython imports
 cimport('from communication import domain_layout_local_indices, exchange, get_buffer, smart_mpi')
 cimport('from integration import Spline, hubble')
-cimport('from mesh import get_fftw_slab, domain_decompose, fft')
+cimport('from mesh import domain_decompose, fft_batch')
 
 
 
@@ -507,7 +507,8 @@ def k_float2str(k):
                # Locals
                A_s='double',
                H='double',
-               J_scalargrid='double*',
+               J_scalargrid='real*',
+               assign_ids='bint',
                buffer_number='Py_ssize_t',
                dim='int',
                displacement='double',
@@ -525,6 +526,7 @@ def k_float2str(k):
                gridsize='Py_ssize_t',
                i='Py_ssize_t',
                i_global='Py_ssize_t',
+               ids='unsigned long long int*',
                index='Py_ssize_t',
                index0='Py_ssize_t',
                index1='Py_ssize_t',
@@ -547,26 +549,30 @@ def k_float2str(k):
                mass='double',
                mom_dim='double*',
                multi_index='tuple',
+               multi_indices='list',
+               n='Py_ssize_t',
                n_s='double',
                nyquist='Py_ssize_t',
                pos_dim='double*',
                pos_gridpoint='double',
                processed_specific_multi_index='tuple',
                random_im='double',
-               random_jik='double*',
+               random_jik='real*',
                random_re='double',
-               random_slab='double[:, :, ::1]',
-               slab='double[:, :, ::1]',
-               slab_jik='double*',
+               random_slab='real[:, :, ::1]',
+               slab='real[:, :, ::1]',
+               slab_jik='real*',
+               slab_shape='tuple',
+               slabs='list',
                species_class='str',
                sqrt_power='double',
                sqrt_power_common='double[::1]',
                transfer='double',
                w='double',
                ρ_bar_a='double',
-               ψ_dim='double[:, :, ::1]',
-               ψ_dim_noghosts='double[:, :, :]',
-               ϱ='double*',
+               ψ_dim='real[:, :, ::1]',
+               ψ_dim_noghosts='real[:, :, :]',
+               ϱ='real*',
                )
 def realize(component, variable, transfer_spline, cosmoresults, specific_multi_index=None, a=-1):
     """This function realizes a single variable of a component,
@@ -631,8 +637,16 @@ def realize(component, variable, transfer_spline, cosmoresults, specific_multi_i
         abort(f'The realization uses a gridsize of {gridsize}, '
               f'which is not evenly divisible by {nprocs} processes.'
               )
-    # Fetch a slab decomposed grid
-    slab = get_fftw_slab(gridsize)
+    # Fetch a slab decomposed grid for each fluidscalar to be realized.
+    # These are all filled in Fourier space before being transformed
+    # together, amortizing the communication.
+    fluidvar = component.fluidvars[fluid_index]
+    multi_indices = (list(fluidvar.multi_indices) if specific_multi_index is None
+                                                  else [processed_specific_multi_index])
+    slab_shape = (gridsize//nprocs, gridsize, 2*(gridsize//2 + 1))
+    slabs = [get_buffer(slab_shape, ('realization', n), dtype='real')
+             for n in range(len(multi_indices))]
+    slab = slabs[0]
     # Extract some variables
     nyquist = gridsize//2
     species_class = component.species_class
@@ -669,9 +683,9 @@ def realize(component, variable, transfer_spline, cosmoresults, specific_multi_i
     # of the k vector (grid units).
     k_gridvec = empty(3, dtype=C2np['Py_ssize_t'])
     # Loop over all fluid scalars of the fluid variable
-    fluidvar = component.fluidvars[fluid_index]
-    for multi_index in (fluidvar.multi_indices if specific_multi_index is None
-                                               else [processed_specific_multi_index]):
+    for n in range(len(multi_indices)):
+        multi_index = multi_indices[n]
+        slab = slabs[n]
         # Extract individual indices from multi_index
         if ℤ[len(multi_index)] > 0:
             index0 = multi_index[0]
@@ -772,9 +786,12 @@ def realize(component, variable, transfer_spline, cosmoresults, specific_multi_i
                                     # gviven by multi_index.
                                     slab_jik[0] = sqrt_power*random_re
                                     slab_jik[1] = sqrt_power*random_im
-        # Fourier transform the slabs to coordinate space.
-        # Now the slabs store the realized fluid grid.
-        fft(slab, 'backward')
+    # Fourier transform the slabs to coordinate space.
+    # Now the slabs store the realized fluid grids.
+    fft_batch(slabs, 'backward')
+    for n in range(len(multi_indices)):
+        multi_index = multi_indices[n]
+        slab = slabs[n]
         # Populate the fluid grids for fluid components,
         # and create the particles via the zeldovich approximation
         # for particles.
@@ -839,6 +856,11 @@ def realize(component, variable, transfer_spline, cosmoresults, specific_multi_i
         domain_start_i = domain_layout_local_indices[0]*domain_size_i
         domain_start_j = domain_layout_local_indices[1]*domain_size_j
         domain_start_k = domain_layout_local_indices[2]*domain_size_k
+        # If in use, the particle IDs are set to the index of the grid
+        # point of the particle within the global grid, which does not
+        # depend on the number of processes.
+        assign_ids = (dim == 0 and component.use_ids)
+        ids = component.ids
         index = 0
         for         i in range(ℤ[ψ_dim_noghosts.shape[0] - 1]):
             for     j in range(ℤ[ψ_dim_noghosts.shape[1] - 1]):
@@ -860,6 +882,10 @@ def realize(component, variable, transfer_spline, cosmoresults, specific_multi_i
                     pos_dim[index] = mod(pos_gridpoint + displacement, boxsize)
                     # Assign momentum corresponding to the displacement
                     mom_dim[index] = displacement*ℝ[f_growth*H*mass*a**2]
+                    with unswitch(3):
+                        if assign_ids:
+                            ids[index] = (((domain_start_i + i)*gridsize + domain_start_j + j)
+                                          *gridsize + domain_start_k + k)
                     index += 1
     # Done realizing this variable
     masterprint('done')
@@ -915,7 +941,7 @@ def create_symmetric_plane(gridsize, seed=0):
 # Function that lays out the random grid,
 # used by all realisations.
 @cython.header(# Arguments
-               slab='double[:, :, ::1]',
+               slab='real[:, :, ::1]',
                # Locals
                existing_shape='tuple',
                gridsize='Py_ssize_t',
@@ -930,7 +956,7 @@ def create_symmetric_plane(gridsize, seed=0):
                random_im='double',
                random_re='double',
                shape='tuple',
-               returns='double[:, :, ::1]',
+               returns='real[:, :, ::1]',
                )
 def get_random_slab(slab):
     global random_slab
@@ -959,7 +985,7 @@ def get_random_slab(slab):
     # with the process specific seed.
     seed_rng()
     # Allocate random slab
-    random_slab = empty(shape, dtype=C2np['double'])
+    random_slab = empty(shape, dtype=C2np['real'])
     # Populate the random grid.
     # Loop through the local j-dimension.
     for j in range(ℤ[shape[0]]):
@@ -990,8 +1016,8 @@ def get_random_slab(slab):
                 random_slab[j, i, k + 1] = random_im
     return random_slab
 # The global random slab
-cython.declare(random_slab='double[:, :, ::1]')
-random_slab = empty((1, 1, 1), dtype=C2np['double'])
+cython.declare(random_slab='real[:, :, ::1]')
+random_slab = empty((1, 1, 1), dtype=C2np['real'])
 
 
 
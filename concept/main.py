@@ -27,6 +27,7 @@ from commons import *
 # Cython imports
 import interactions
 cimport('from analysis import debug, measure, powerspec')
+cimport('from communication import rebalance_domains, sort_particles')
 cimport('from graphics import render, terminal_render')
 cimport('from integration import cosmic_time,          '
         '                        expand,               '
@@ -34,8 +35,9 @@ cimport('from integration import cosmic_time,          '
         '                        initiate_time,        '
         '                        scalefactor_integral, '
         )
-cimport('from interactions import find_interactions')
-cimport('from snapshot import load, save')
+cimport('from interactions import find_interactions, pop_computation_time')
+cimport('from mesh import cleanup_fftw, print_memory_report, release_mesh_memory')
+cimport('from snapshot import individual_masses_differ, load, save')
 cimport('from species import Component, get_representation')
 cimport('from utilities import delegate')
 
@@ -193,6 +195,12 @@ def dump(components, output_filenames, final_render, op=None, do_autosave=False)
             if time_param == 't':
                 filename += unit_time
             render(components, filename, cleanup=((time_param, time_val) == final_render))
+    # Release the memory held by grids and buffers, as some of these
+    # may have been needed by the outputs only. They will be
+    # reallocated when needed again during the time stepping.
+    if memory_report:
+        print_memory_report('dump {}'.format(i_dump + 1))
+    release_mesh_memory()
     # Increment dump time
     i_dump += 1
     if i_dump < len(dumps):
@@ -364,6 +372,17 @@ def timeloop():
     time_step = -1
     while i_dump < len(dumps):
         time_step += 1
+        # Rebalance the domain decomposition according to
+        # the computation time spent since the last rebalancing.
+        if load_balancing_interval > 0 and time_step > 0 and time_step%load_balancing_interval == 0:
+            rebalance_domains(components, pop_computation_time())
+        # Sort the particles along a space-filling curve. As the
+        # particles have just been exchanged by the drift (or the
+        # rebalancing), they will keep most of this order until the
+        # next sorting.
+        if particle_sorting_interval > 0 and time_step%particle_sorting_interval == 0:
+            for component in components:
+                sort_particles(component)
         # Reduce time step size if it is larger than what is allowed
         Δt, bottleneck = reduce_Δt(components, Δt, Δt_begin, timespan)
         # Print out message at beginning of each time step
@@ -496,11 +515,11 @@ heading_ljust = 0
                H='double',
                J_over_ϱ_2_i='double',
                J_over_ϱ_2_max='double',
-               Jx='double[:, :, :]',
+               Jx='real[:, :, :]',
                Jx_ijk='double',
-               Jy='double[:, :, :]',
+               Jy='real[:, :, :]',
                Jy_ijk='double',
-               Jz='double[:, :, :]',
+               Jz='real[:, :, :]',
                Jz_ijk='double',
                bottleneck='str',
                component='Component',
@@ -545,7 +564,7 @@ heading_ljust = 0
                Δx_max='double',
                Σmass='double',
                ρ_bar='double',
-               ϱ='double[:, :, :]',
+               ϱ='real[:, :, :]',
                ϱ_ijk='double',
                returns='tuple',  # (Δt, bottleneck)
                )
@@ -653,7 +672,7 @@ def reduce_Δt(components, Δt, Δt_begin, timespan, worry=True):
                 if force == 'gravity':
                     if method == 'pm':
                         resolutions.append(φ_gridsize)
-                    elif method in ('pp', 'p3m'):
+                    elif method in ('pp', 'p3m', 'tree'):
                         resolutions.append(1/component.softening)
             Δx_max = boxsize/np.max(resolutions)
             # Find maximum speed of particles
@@ -790,7 +809,14 @@ def get_initial_conditions():
         ic_isfile = bcast(os.path.isfile(initial_conditions) if master else None)
         if ic_isfile:
             # Initial condition snapshot is given. Load it.
-            return load(sensible_path(initial_conditions), only_components=True)
+            components = load(sensible_path(initial_conditions), only_components=True)
+            # The forces use the common mass of each component
+            for component in components:
+                if individual_masses_differ(component):
+                    abort('The particles of component "{}" in "{}" have differing individual '
+                          'masses, which are not supported by the force computations'
+                          .format(component.name, initial_conditions))
+            return components
     if not ic_isfile:
         # Components to realize are given.
         # Parse the specifications further.
@@ -979,10 +1005,14 @@ else:
     # Run the time loop
     timeloop()
     # Simulation done
+    if memory_report:
+        print_memory_report('end of simulation')
     universals.any_warnings = allreduce(universals.any_warnings, op=MPI.LOR)
     if universals.any_warnings:
         masterprint('\nCO𝘕CEPT run finished')
     else:
         masterprint('\nCO𝘕CEPT run finished successfully', fun=terminal.bold_green)
+# Clean up FFTW, invalidating all remaining plans
+cleanup_fftw()
 # Shutdown CO𝘕CEPT properly
 abort(exit_code=0)
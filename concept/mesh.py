@@ -30,111 +30,15 @@ cimport('from communication import communicate_domain,
         '                          domain_size_x,  domain_size_y,  domain_size_z,  '
         '                          domain_start_x, domain_start_y, domain_start_z, '
         '                          domain_subdivisions,                            '
-        '                          get_buffer,                                     '
-        '                          partition,                                      '
+        '                          get_buffer, get_buffers_memory,                 '
         '                          rank_neighboring_domain,                        '
+        '                          release_buffers,                                '
+        '                          restore_domains,                                '
         '                          smart_mpi,                                      '
         )
 
 
 
-# Function for initializing and tabulating a cubic grid with
-# vector values of a given dimension.
-@cython.header(# Arguments
-               gridsize='Py_ssize_t',
-               func='func_dstar_ddd',
-               factor='double',
-               filename='str',
-               # Locals
-               dim='Py_ssize_t',
-               grid='double[:, :, :, ::1]',
-               grid_local='double[::1]',
-               i='Py_ssize_t',
-               j='Py_ssize_t',
-               k='Py_ssize_t',
-               m='Py_ssize_t',
-               n_vectors='Py_ssize_t',
-               n_vectors_local='Py_ssize_t',
-               size='Py_ssize_t',
-               size_edge='Py_ssize_t',
-               size_face='Py_ssize_t',
-               size_local='Py_ssize_t',
-               start_local='Py_ssize_t',
-               vector_value='double*',
-               ℓ_local='Py_ssize_t',
-               ℓ='Py_ssize_t',
-               returns='double[:, :, :, ::1]',
-               )
-def tabulate_vectorfield(gridsize, func, factor, filename=''):
-    """This function tabulates a cubic grid of size
-    gridsize*gridsize*gridsize with vector values computed by
-    the function func, as
-    grid[i, j, k] = func(i*factor, j*factor, k*factor).
-    If filename is set, the tabulated grid is saved to a hdf5 file
-    with this name.
-    The grid is not distributed. Each process will end up with its own
-    copy of the entire grid.
-    The first point grid[0, 0, 0] corresponds to the origin of the box,
-    while the last point grid[gridsize - 1, gridsize - 1, gridsize - 1]
-    corresponds to the physical point ((gridsize - 1)/gridsize*boxsize,
-                                       (gridsize - 1)/gridsize*boxsize,
-                                       (gridsize - 1)/gridsize*boxsize).
-    This means that grid[gridsize, gridsize, gridsize] is the corner
-    of the box the furthers away from the origin. This point is not
-    represented in the grid because of the periodicity of the box,
-    which means that physically, this point is the same as the origin.
-    The mapping from grid indices to physical coordinates is thus
-    (i, j, k) --> (i/gridsize*boxsize,
-                   j/gridsize*boxsize,
-                   k/gridsize*boxsize).
-    Therefore, if you wish to tabulate a global (and periodic) field,
-    extending over the entire box, the factor argument should be
-    proportional to boxsize/gridsize. If you wish to only tabulate say
-    one octant of the box, this volume is no more periodic, and so
-    the factor should be proportional to 0.5*boxsize/(gridsize - 1).
-    """
-    # The number of elements in each point, edge, face and bulk
-    # (the total), when the grid is viewed as a 3D box of vectors.
-    size_edge = gridsize*3
-    size_face = gridsize*size_edge
-    size      = gridsize*size_face
-    # Initialize the global grid to be
-    # of shape gridsize*gridsize*gridsize*3.
-    # That is, grid is not really cubic, but rather four-dimensional.
-    grid = empty([gridsize, gridsize, gridsize, 3], dtype=C2np['double'])
-    # Partition the grid fairly among the processes.
-    # Each part is defined by a linear size and starting index.
-    n_vectors = gridsize**3
-    start_local, n_vectors_local = partition(n_vectors)
-    # Each point really consists of three elements
-    start_local *= 3
-    size_local = 3*n_vectors_local
-    # Make a linear array for storing the local part of the grid
-    grid_local = empty(size_local, dtype=C2np['double'])
-    # Tabulate the local grid
-    for ℓ_local in range(0, size_local, 3):
-        ℓ = start_local + ℓ_local
-        # The global 3D indices
-        i = ℓ//size_face
-        ℓ -= i*size_face
-        j = ℓ//size_edge
-        ℓ -= j*size_edge
-        k = ℓ//3
-        # Fill grid_local
-        vector_value = func(i*factor, j*factor, k*factor)
-        for dim in range(3):
-            grid_local[ℓ_local + dim] = vector_value[dim]
-    # Gather the tabulated local grid parts into the common, global grid
-    smart_mpi(grid_local, grid, mpifun='allgatherv')
-    # Return now if the grid should not be saved to disk
-    if not filename:
-        return grid
-    # Save grid to disk using parallel HDF5
-    with h5py.File(filename, mode='w', driver='mpio', comm=comm) as hdf5_file:
-        dset = hdf5_file.create_dataset('data', (size, ), dtype=C2np['double'])
-        dset[start_local:(start_local + size_local)] = grid_local
-    return grid
-
 # Function for doing lookup in a grid with scalar values and
 # CIC-interpolating to specified coordinates.
 @cython.header(# Argument
@@ -280,10 +184,10 @@ def CIC_vectorgrid2coordinates(grid, x, y, z):
 # Function which interpolates one grid onto another grid,
 # optionally multiplying the interpolated values by a factor.
 @cython.pheader(# Arguments
-                gridA='double[:, :, :]',
-                gridB='double[:, :, :]',
+                gridA='real[:, :, :]',
+                gridB='real[:, :, :]',
                 fac='double',
-                fac_grid='double[:, :, :]',
+                fac_grid='real[:, :, :]',
                 # Locals
                 Wil='double',
                 Wjl='double',
@@ -420,27 +324,34 @@ def CIC_grid2grid(gridA, gridB, fac=1, fac_grid=None):
                         gridA[iA_upper, jA_upper, kA_lower] += ℝ[value*Wiu*Wju]*Wkl
                         gridA[iA_upper, jA_upper, kA_upper] += ℝ[value*Wiu*Wju]*Wku
 
-# Function for CIC-interpolating particles/fluid elements of
+# Function for interpolating particles/fluid elements of
 # components to a domain grid.
 @cython.header(# Argument
                component_or_components='object', # Component or list of Components
-               domain_grid='double[:, :, ::1]',
+               domain_grid='real[:, :, ::1]',
                quantities='list',
+               order='int',
+               shift='double',
                # Locals
-               Wxl='double',
-               Wyl='double',
-               Wzl='double',
-               Wxu='double',
-               Wyu='double',
-               Wzu='double',
+               W_ab='double',
+               a='int',
                amount='double',
+               b='int',
+               c='int',
                component='Component',
                components='list',
-               domain_grid_noghosts='double[:, :, :]',
+               domain_grid_noghosts='real[:, :, :]',
+               dx='double',
+               dy='double',
+               dz='double',
                factor='double',
                factors='double[::1]',
-               fluid_quantity='double[:, :, :]',
+               fluid_quantity='real[:, :, :]',
+               grids_threads='real[:, :, :, ::1]',
                i='Py_ssize_t',
+               index_x='Py_ssize_t',
+               index_y='Py_ssize_t',
+               index_z='Py_ssize_t',
                interpolated_particles='bint',
                interpolations='int',
                j='Py_ssize_t',
@@ -450,24 +361,37 @@ def CIC_grid2grid(gridA, gridB, fac=1, fac_grid=None):
                posz='double*',
                quantities_implemented='tuple',
                quantity='str',
+               scale_x='double',
+               scale_y='double',
+               scale_z='double',
                shape='tuple',
+               shape_x='double',
+               shape_y='double',
+               shape_z='double',
+               thread='int',
+               use_quantity='bint',
+               w='Py_ssize_t',
+               weights='double[::1]',
                x='double',
-               x_lower='int',
-               x_upper='int',
                y='double',
-               y_lower='int',
-               y_upper='int',
                z='double',
-               z_lower='int',
-               z_upper='int',
                )
-def CIC_components2domain_grid(component_or_components, domain_grid, quantities):
-    """This function CIC-interpolates particle/fluid elements
+def CIC_components2domain_grid(component_or_components, domain_grid, quantities,
+                               order=2, shift=0):
+    """This function interpolates particle/fluid elements
     to domain_grid storing scalar values. The physical extend of the
     passed domain_grid should match the domain exactly. The interpolated
     values will be added to the grid. Therefore, if the grid should
     contain the interpolated vales only, the grid must be nullified 
     beforehand.
+    Particles are assigned to the grid using the scheme of the given
+    order, which is the number of grid points per dimension receiving
+    contributions from each particle; 2 (CIC), 3 (TSC) or 4 (PCS).
+    All particles can further be shifted by shift grid units along
+    each dimension, as used for interlacing. Contributions from
+    the particles to points outside of the local domain are added to
+    the ghost layers, which are wide enough for all of these schemes.
+    Fluid elements are always CIC-interpolated, without any shift.
     The quantities argument is a list, but its elements can be
     structured in different ways. If quantities = [], a particle and a
     fluid element will each contribute to the domain_grid with an amount
@@ -492,6 +416,10 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities)
         components = component_or_components
     else:
         components = [component_or_components]
+    # The domain grid spans the regular domain. Redistribute the
+    # particles to the regular domains, should the load-balanced
+    # decomposition be in effect.
+    restore_domains()
     # Transform the supplied quantities so that it is a list of tuples
     # of the form (str, np.ndarray), where the array is of the same
     # length as components.
@@ -512,6 +440,22 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities)
                                        2:(domain_grid.shape[1] - 2),
                                        2:(domain_grid.shape[2] - 2)]
     shape = tuple([domain_grid_noghosts.shape[dim] - 1 for dim in range(3)])
+    shape_x, shape_y, shape_z = shape
+    # Factors scaling the coordinates within the domain
+    # to grid indices.
+    scale_x = shape_x/domain_size_x
+    scale_y = shape_y/domain_size_y
+    scale_z = shape_z/domain_size_z
+    # When running with several threads, each thread besides the first
+    # interpolates onto its own copy of the grid, avoiding race
+    # conditions. These copies are added to the domain grid afterwards.
+    if num_threads > 1:
+        grids_threads = get_buffer((num_threads - 1, ) + asarray(domain_grid).shape,
+                                   'CIC_threads', dtype='real')
+    # Buffer for the one-dimensional assignment weights, with a row of
+    # assignment_weights_stride elements for each thread. The first 12
+    # elements of each row (3 dimensions and up to 4 points) are used.
+    weights = get_buffer(assignment_weights_stride*num_threads, 'assignment_weights')
     # Do the interpolation(s)
     interpolations = 0
     interpolated_particles = False
@@ -543,55 +487,134 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities)
                 interpolated_particles = True
                 factor = factors[i]
                 # For quantity == 'particles', each particle should
-                # contribute with an amount equal to factor
-                # (for quantity != 'particles', this will be overwritten
-                # in the loop below).
-                amount = factor
-                # Interpolate each particle
-                for j in range(component.N_local):
+                # contribute with an amount equal to factor.
+                use_quantity = (quantity != 'particles')
+                # Nullify the grid copies of the threads
+                if num_threads > 1:
+                    grids_threads[...] = 0
+                # Interpolate each particle.
+                # The particles are distributed over num_threads threads.
+                for j in prange(component.N_local, nogil=True, num_threads=num_threads):
                     # Get the amount this particle contribute
                     # to the interpolated grid.
                     with unswitch(1):
-                        if quantity != 'particles':
+                        if use_quantity:
                             amount = factor*particle_quantity[j]
+                        else:
+                            amount = factor
                     # Get, translate and scale the coordinates so that
                     # 0 <= j < shape[j] - 1 for j in (x, y, z).
-                    x = (posx[j] - domain_start_x)*ℝ[shape[0]/domain_size_x]
-                    y = (posy[j] - domain_start_y)*ℝ[shape[1]/domain_size_y]
-                    z = (posz[j] - domain_start_z)*ℝ[shape[2]/domain_size_z]
+                    x = (posx[j] - domain_start_x)*scale_x
+                    y = (posy[j] - domain_start_y)*scale_y
+                    z = (posz[j] - domain_start_z)*scale_z
                     # Correct for coordinates which are
                     # exactly at an upper domain boundary.
-                    if x >= ℝ[shape[0]]:
-                        x = ℝ[shape[0]*(1 - machine_ϵ)]
-                    if y >= ℝ[shape[1]]:
-                        y = ℝ[shape[1]*(1 - machine_ϵ)]
-                    if z >= ℝ[shape[2]]:
-                        z = ℝ[shape[2]*(1 - machine_ϵ)]
-                    # Indices of the 8 vertices (6 faces)
-                    # of the grid surrounding (x, y, z).
-                    x_lower = int(x)
-                    y_lower = int(y)
-                    z_lower = int(z)
-                    x_upper = x_lower + 1
-                    y_upper = y_lower + 1
-                    z_upper = z_lower + 1
-                    # The linear weights according to the
-                    # CIC rule W = 1 - |dist| if |dist| < 1.
-                    Wxl = x_upper - x  # = 1 - (x - x_lower)
-                    Wyl = y_upper - y  # = 1 - (y - y_lower)
-                    Wzl = z_upper - z  # = 1 - (z - z_lower)
-                    Wxu = x - x_lower  # = 1 - (x_upper - x)
-                    Wyu = y - y_lower  # = 1 - (y_upper - y)
-                    Wzu = z - z_lower  # = 1 - (z_upper - z)
-                    # Assign the weights to the grid points
-                    domain_grid_noghosts[x_lower, y_lower, z_lower] += ℝ[amount*Wxl*Wyl]*Wzl
-                    domain_grid_noghosts[x_lower, y_lower, z_upper] += ℝ[amount*Wxl*Wyl]*Wzu
-                    domain_grid_noghosts[x_lower, y_upper, z_lower] += ℝ[amount*Wxl*Wyu]*Wzl
-                    domain_grid_noghosts[x_lower, y_upper, z_upper] += ℝ[amount*Wxl*Wyu]*Wzu
-                    domain_grid_noghosts[x_upper, y_lower, z_lower] += ℝ[amount*Wxu*Wyl]*Wzl
-                    domain_grid_noghosts[x_upper, y_lower, z_upper] += ℝ[amount*Wxu*Wyl]*Wzu
-                    domain_grid_noghosts[x_upper, y_upper, z_lower] += ℝ[amount*Wxu*Wyu]*Wzl
-                    domain_grid_noghosts[x_upper, y_upper, z_upper] += ℝ[amount*Wxu*Wyu]*Wzu
+                    if x >= shape_x:
+                        x = shape_x*ℝ[1 - machine_ϵ]
+                    if y >= shape_y:
+                        y = shape_y*ℝ[1 - machine_ϵ]
+                    if z >= shape_z:
+                        z = shape_z*ℝ[1 - machine_ϵ]
+                    # Shift the coordinates, as used for interlacing
+                    x = x + shift
+                    y = y + shift
+                    z = z + shift
+                    # Compute the lowest grid index (including the
+                    # offset due to the two lower ghost layers) and
+                    # the one-dimensional weights of each of the
+                    # order grid points the particle is assigned to,
+                    # along each dimension.
+                    # The weights of this thread are stored
+                    # in weights[w:w + 12].
+                    thread = threadid()
+                    w = thread*ℤ[assignment_weights_stride]
+                    with unswitch(1):
+                        if order == 2:
+                            # Cloud-in-cell
+                            index_x = cast(x, 'Py_ssize_t')
+                            index_y = cast(y, 'Py_ssize_t')
+                            index_z = cast(z, 'Py_ssize_t')
+                            dx = x - index_x
+                            dy = y - index_y
+                            dz = z - index_z
+                            weights[w + 0] = 1 - dx
+                            weights[w + 1] = dx
+                            weights[w + 4] = 1 - dy
+                            weights[w + 5] = dy
+                            weights[w + 8] = 1 - dz
+                            weights[w + 9] = dz
+                            index_x = index_x + 2
+                            index_y = index_y + 2
+                            index_z = index_z + 2
+                        elif order == 3:
+                            # Triangular-shaped cloud,
+                            # centred on the nearest grid point.
+                            index_x = cast(x + 0.5, 'Py_ssize_t')
+                            index_y = cast(y + 0.5, 'Py_ssize_t')
+                            index_z = cast(z + 0.5, 'Py_ssize_t')
+                            dx = x - index_x
+                            dy = y - index_y
+                            dz = z - index_z
+                            weights[w + 0] = 0.5*(0.5 - dx)**2
+                            weights[w + 1] = 0.75 - dx**2
+                            weights[w + 2] = 0.5*(0.5 + dx)**2
+                            weights[w + 4] = 0.5*(0.5 - dy)**2
+                            weights[w + 5] = 0.75 - dy**2
+                            weights[w + 6] = 0.5*(0.5 + dy)**2
+                            weights[w + 8] = 0.5*(0.5 - dz)**2
+                            weights[w + 9] = 0.75 - dz**2
+                            weights[w + 10] = 0.5*(0.5 + dz)**2
+                            index_x = index_x + 1
+                            index_y = index_y + 1
+                            index_z = index_z + 1
+                        else:
+                            # Piecewise cubic spline
+                            index_x = cast(x, 'Py_ssize_t')
+                            index_y = cast(y, 'Py_ssize_t')
+                            index_z = cast(z, 'Py_ssize_t')
+                            dx = x - index_x
+                            dy = y - index_y
+                            dz = z - index_z
+                            weights[w + 0] = ℝ[1/6.]*(1 - dx)**3
+                            weights[w + 1] = ℝ[1/6.]*(4 - 6*dx**2 + 3*dx**3)
+                            weights[w + 2] = ℝ[1/6.]*(4 - 6*(1 - dx)**2 + 3*(1 - dx)**3)
+                            weights[w + 3] = ℝ[1/6.]*dx**3
+                            weights[w + 4] = ℝ[1/6.]*(1 - dy)**3
+                            weights[w + 5] = ℝ[1/6.]*(4 - 6*dy**2 + 3*dy**3)
+                            weights[w + 6] = ℝ[1/6.]*(4 - 6*(1 - dy)**2 + 3*(1 - dy)**3)
+                            weights[w + 7] = ℝ[1/6.]*dy**3
+                            weights[w + 8] = ℝ[1/6.]*(1 - dz)**3
+                            weights[w + 9] = ℝ[1/6.]*(4 - 6*dz**2 + 3*dz**3)
+                            weights[w + 10] = ℝ[1/6.]*(4 - 6*(1 - dz)**2 + 3*(1 - dz)**3)
+                            weights[w + 11] = ℝ[1/6.]*dz**3
+                            index_x = index_x + 1
+                            index_y = index_y + 1
+                            index_z = index_z + 1
+                    # Assign the weights to the grid points,
+                    # either of the domain grid itself (first thread)
+                    # or of the grid copy of the thread. Points outside
+                    # the local domain fall within the ghost layers.
+                    for a in range(order):
+                        for b in range(order):
+                            W_ab = amount*weights[w + a]*weights[w + 4 + b]
+                            for c in range(order):
+                                if thread == 0:
+                                    domain_grid[index_x + a, index_y + b, index_z + c] += (
+                                        W_ab*weights[w + 8 + c])
+                                else:
+                                    grids_threads[thread - 1,
+                                                  index_x + a, index_y + b, index_z + c] += (
+                                        W_ab*weights[w + 8 + c])
+                # Add the grid copies of the threads
+                # to the domain grid.
+                if num_threads > 1:
+                    for index_x in prange(ℤ[domain_grid.shape[0]],
+                                          nogil=True, num_threads=num_threads):
+                        for index_y in range(ℤ[domain_grid.shape[1]]):
+                            for index_z in range(ℤ[domain_grid.shape[2]]):
+                                for thread in range(ℤ[num_threads - 1]):
+                                    domain_grid[index_x, index_y, index_z] += (
+                                        grids_threads[thread, index_x, index_y, index_z])
         elif component.representation == 'fluid':
             # Interpolate each fluid quantity
             for quantity, factors in quantities:
@@ -651,21 +674,26 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities)
                 masterwarn('Could not interpolate component quantity "{}" onto grid '
                            'as this quantity is not implemented.'
                            .format(quantity))
+# Number of assignment weights reserved for each thread. Besides the
+# 12 weights used, each row holds 8 doubles (64 bytes) of padding,
+# so that no two threads ever write to the same cache line.
+cython.declare(assignment_weights_stride='Py_ssize_t')
+assignment_weights_stride = 12 + 8
 
 # Function for CIC-interpolating particles of a particle component
 # to fluid grids.
 @cython.header(# Argument
                component='Component',
                # Locals
-               Jx='double*',
-               Jx_mv='double[:, :, ::1]',
-               Jx_noghosts='double[:, :, :]',
-               Jy='double*',
-               Jy_mv='double[:, :, ::1]',
-               Jy_noghosts='double[:, :, :]',
-               Jz='double*',
-               Jz_mv='double[:, :, ::1]',
-               Jz_noghosts='double[:, :, :]',
+               Jx='real*',
+               Jx_mv='real[:, :, ::1]',
+               Jx_noghosts='real[:, :, :]',
+               Jy='real*',
+               Jy_mv='real[:, :, ::1]',
+               Jy_noghosts='real[:, :, :]',
+               Jz='real*',
+               Jz_mv='real[:, :, ::1]',
+               Jz_noghosts='real[:, :, :]',
                N_vacuum='Py_ssize_t',
                Vcell='double',
                Wlll='double',
@@ -710,9 +738,9 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities)
                z_upper='int',
                Δϱ='double',
                Δϱ_tot='double',
-               ϱ_noghosts='double[:, :, :]',
-               ϱ='double*',
-               ϱ_mv='double[:, :, ::1]',
+               ϱ_noghosts='real[:, :, :]',
+               ϱ='real*',
+               ϱ_mv='real[:, :, ::1]',
                returns='Py_ssize_t',
                )
 def CIC_particles2fluid(component):
@@ -937,35 +965,39 @@ def CIC_particles2fluid(component):
     # Return the number of fluid elements not interpolated to
     return N_vacuum
 
-# Function for CIC interpolating components to the φ grid
+# Function for interpolating components to the φ grid
 @cython.header(# Arguments
                component_or_components='object', # Component or list of Components
                quantities='list',
+               shift='double',
                # Locals
-               φ='double[:, :, ::1]',
-               returns='double[:, :, ::1]',
+               φ='real[:, :, ::1]',
+               returns='real[:, :, ::1]',
                )
-def CIC_components2φ(component_or_components, quantities):
+def CIC_components2φ(component_or_components, quantities, shift=0):
     """Exactly what quantities of the components are interpolated to
     the global φ grid is determined by the quantities argument.
     For details on this argument,
     see the CIC_components2domain_grid function.
+    Particles are assigned using the pm_assignment scheme.
     """
     # If φ_gridsize is illegal, abort now
     if φ_illegal:
         abort(φ_illegal)
     # Fetch the φ grid
-    φ = get_buffer(φ_shape, 'φ', nullify=True)
+    φ = get_buffer(φ_shape, 'φ', nullify=True, dtype='real')
     # Interpolate component coordinates
     # weighted by the given quantities to φ.
-    CIC_components2domain_grid(component_or_components, φ, quantities)
+    CIC_components2domain_grid(component_or_components, φ, quantities,
+                               pm_assignment_order, shift)
     return φ
 # Check that φ_gridsize fulfills the requirements for FFT.
 # If not, the reason why will be stored in φ_illegal.
 cython.declare(φ_illegal='str')
 φ_illegal = ''
-if φ_gridsize%nprocs != 0:
-    φ_illegal = f'A φ_gridsize = {φ_gridsize} cannot be evenly divided by {nprocs} processes.'            
+if fft_decomposition == 'slab' and φ_gridsize%nprocs != 0:
+    φ_illegal = (f'A φ_gridsize = {φ_gridsize} cannot be evenly divided by {nprocs} processes. '
+                 f'Consider using fft_decomposition = \'pencil\'.')
 else:
     if (   φ_gridsize%domain_subdivisions[0] != 0
         or φ_gridsize%domain_subdivisions[1] != 0
@@ -982,41 +1014,37 @@ if φ_gridsize%2 != 0:
 cython.declare(φ_shape='tuple')
 φ_shape = tuple([φ_gridsize//domain_subdivisions[dim] + 1 + 2*2 for dim in range(3)])
 
-# Function that compute a lot of information needed by the
-# slab_decompose and domain_decompose functions.
+# Function that compute the MPI derived datatypes needed by the
+# slab_decompose and domain_decompose functions. For each process ℓ,
+# a subarray type describing the part of the local domain grid
+# overlapping with the slab of process ℓ and a subarray type
+# describing the part of the local slab overlapping with the domain
+# of process ℓ are constructed, allowing for the entire
+# redistribution to be done by a single Alltoallw without any
+# packing into intermediary buffers.
 @cython.header(# Arguments
-               domain_grid='double[:, :, ::1]',
-               slab='double[:, :, ::1]',
+               domain_grid='real[:, :, ::1]',
+               slab='real[:, :, ::1]',
                # Locals
-               N_domain2slabs_communications='Py_ssize_t',
+               domain_counts='int[::1]',
                domain_end_i='Py_ssize_t',
-               domain_end_j='Py_ssize_t',
-               domain_end_k='Py_ssize_t',
-               domain_grid_noghosts='double[:, :, :]',
                domain_grid_shape='tuple',
-               domain_sendrecv_i_end='int[::1]',
-               domain_sendrecv_i_start='int[::1]',
+               domain_indices='tuple',
                domain_size_i='Py_ssize_t',
                domain_size_j='Py_ssize_t',
                domain_size_k='Py_ssize_t',
                domain_start_i='Py_ssize_t',
-               domain_start_j='Py_ssize_t',
-               domain_start_k='Py_ssize_t',
-               domain2slabs_recvsend_ranks='int[::1]',
-               index='Py_ssize_t',
+               domain_types='list',
+               i_end='Py_ssize_t',
+               i_start='Py_ssize_t',
                info='tuple',
-               rank_recv='int',
-               rank_send='int',
-               recvtuple='tuple',
-               sendtuple='tuple',
-               slab_sendrecv_j_end='int[::1]',
-               slab_sendrecv_j_start='int[::1]',
-               slab_sendrecv_k_end='int[::1]',
-               slab_sendrecv_k_start='int[::1]',
+               slab_counts='int[::1]',
+               slab_end_i='Py_ssize_t',
                slab_shape='tuple',
                slab_size_i='Py_ssize_t',
-               slabs2domain_sendrecv_ranks='int[::1]',
-               ℓ='Py_ssize_t',
+               slab_start_i='Py_ssize_t',
+               slab_types='list',
+               ℓ='int',
                returns='tuple',
                )
 def prepare_decomposition(domain_grid, slab):
@@ -1027,96 +1055,71 @@ def prepare_decomposition(domain_grid, slab):
     info = decomposition_info.get((domain_grid_shape, slab_shape))
     if info:
         return info
-    # Memoryview of the domain grid without the ghost layers
-    domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 2),
-                                       2:(domain_grid.shape[1] - 2),
-                                       2:(domain_grid.shape[2] - 2),
-                                       ]
     # The size (number of grid points) of the truly local part of the
     # domain grid, excluding both ghost layers and pseudo points,
-    # for each dimension.
-    domain_size_i = domain_grid_noghosts.shape[0] - 1
-    domain_size_j = domain_grid_noghosts.shape[1] - 1
-    domain_size_k = domain_grid_noghosts.shape[2] - 1
-    # The global start and end indices of the local domain
+    # for each dimension. All domains have the same size.
+    domain_size_i = domain_grid.shape[0] - 5
+    domain_size_j = domain_grid.shape[1] - 5
+    domain_size_k = domain_grid.shape[2] - 5
+    # The global start and end i-indices of the local domain
     # in the global grid.
     domain_start_i = domain_layout_local_indices[0]*domain_size_i
-    domain_start_j = domain_layout_local_indices[1]*domain_size_j
-    domain_start_k = domain_layout_local_indices[2]*domain_size_k
     domain_end_i = domain_start_i + domain_size_i
-    domain_end_j = domain_start_j + domain_size_j
-    domain_end_k = domain_start_k + domain_size_k
     # When in real space, the slabs are distributed over the first
-    # dimension. Give the size of the slab in this dimension a name.
+    # dimension. The global start and end i-indices of the local slab.
     slab_size_i = slab.shape[0]
-    # Find local i-indices to send and to which process by
-    # shifting a piece of the number line in order to match
-    # the communication pattern used.
-    domain_sendrecv_i_start = np.roll(asarray([ℓ - domain_start_i
-                                               for ℓ in range(domain_start_i,
-                                                               domain_end_i,
-                                                               slab_size_i)
-                                               ], dtype=C2np['int']),
-                                      -rank)
-    domain_sendrecv_i_end = np.roll(asarray([ℓ - domain_start_i + slab_size_i
-                                             for ℓ in range(domain_start_i,
-                                                             domain_end_i,
-                                                             slab_size_i)
-                                             ], dtype=C2np['int']),
-                                    -rank)
-    slabs2domain_sendrecv_ranks = np.roll(asarray([ℓ//slab_size_i
-                                                  for ℓ in range(domain_start_i, 
-                                                                  domain_end_i,
-                                                                  slab_size_i)],
-                                                  dtype=C2np['int']),
-                                     -rank)
-    # Communicate the start and end (j, k)-indices of the slab,
-    # where parts of the local domains should be received into.
-    slab_sendrecv_j_start       = empty(nprocs, dtype=C2np['int'])
-    slab_sendrecv_k_start       = empty(nprocs, dtype=C2np['int'])
-    slab_sendrecv_j_end         = empty(nprocs, dtype=C2np['int'])
-    slab_sendrecv_k_end         = empty(nprocs, dtype=C2np['int'])
-    domain2slabs_recvsend_ranks = empty(nprocs, dtype=C2np['int'])
-    index = 0
+    slab_start_i = rank*slab_size_i
+    slab_end_i = slab_start_i + slab_size_i
+    # Construct the datatypes. Processes with which nothing should be
+    # exchanged get a count of 0.
+    domain_types = []
+    slab_types = []
+    domain_counts = zeros(nprocs, dtype=C2np['int'])
+    slab_counts = zeros(nprocs, dtype=C2np['int'])
     for ℓ in range(nprocs):
-        # Process ranks to send/receive to/from
-        rank_send = mod(rank + ℓ, nprocs)
-        rank_recv = mod(rank - ℓ, nprocs)
-        # Send the global y and z start and end indices of the domain
-        # to be send, if anything should be send to process rank_send.
-        # Otherwise send None.
-        sendtuple = ((domain_start_j, domain_start_k, domain_end_j, domain_end_k)
-                     if rank_send in asarray(slabs2domain_sendrecv_ranks) else None)
-        recvtuple = sendrecv(sendtuple, dest=rank_send, source=rank_recv)
-        if recvtuple is not None:
-            slab_sendrecv_j_start[index]       = recvtuple[0]
-            slab_sendrecv_k_start[index]       = recvtuple[1]
-            slab_sendrecv_j_end[index]         = recvtuple[2]
-            slab_sendrecv_k_end[index]         = recvtuple[3]
-            domain2slabs_recvsend_ranks[index] = rank_recv
-            index += 1
-    # Cut off the tails
-    slab_sendrecv_j_start = slab_sendrecv_j_start[:index]
-    slab_sendrecv_k_start = slab_sendrecv_k_start[:index]
-    slab_sendrecv_j_end = slab_sendrecv_j_end[:index]
-    slab_sendrecv_k_end = slab_sendrecv_k_end[:index]
-    domain2slabs_recvsend_ranks = domain2slabs_recvsend_ranks[:index]
-    # The maximum number of communications it takes to communicate
-    # the domain grid to the slabs (or vice versa).
-    N_domain2slabs_communications = np.max([slabs2domain_sendrecv_ranks.shape[0],
-                                            domain2slabs_recvsend_ranks.shape[0]])
+        # The part of the local domain overlapping with the slab
+        # of process ℓ. Since the slabs extend throughout the entire
+        # yz-plane, the entire yz-part of the domain (excluding ghost
+        # and pseudo points) is included.
+        i_start = ℓ*slab_size_i
+        i_end = i_start + slab_size_i
+        if i_start < domain_start_i:
+            i_start = domain_start_i
+        if i_end > domain_end_i:
+            i_end = domain_end_i
+        if i_start < i_end:
+            domain_types.append(MPI_real.Create_subarray(
+                domain_grid_shape,
+                (i_end - i_start, domain_size_j, domain_size_k),
+                (2 + i_start - domain_start_i, 2, 2),
+            ).Commit())
+            domain_counts[ℓ] = 1
+        else:
+            domain_types.append(MPI_real)
+        # The part of the local slab overlapping with the domain
+        # of process ℓ. In the x-dimension, the slabs are always
+        # thinner than (or at least as thin as) the domains.
+        domain_indices = np.unravel_index(ℓ, domain_subdivisions)
+        i_start = domain_indices[0]*domain_size_i
+        i_end = i_start + domain_size_i
+        if i_start < slab_start_i:
+            i_start = slab_start_i
+        if i_end > slab_end_i:
+            i_end = slab_end_i
+        if i_start < i_end:
+            slab_types.append(MPI_real.Create_subarray(
+                slab_shape,
+                (i_end - i_start, domain_size_j, domain_size_k),
+                (i_start - slab_start_i,
+                 domain_indices[1]*domain_size_j,
+                 domain_indices[2]*domain_size_k),
+            ).Commit())
+            slab_counts[ℓ] = 1
+        else:
+            slab_types.append(MPI_real)
     # Store and return all the resultant information,
     # needed for communicating between the domain and the slab.
-    info = (N_domain2slabs_communications,
-            domain2slabs_recvsend_ranks,
-            slabs2domain_sendrecv_ranks,
-            domain_sendrecv_i_start,
-            domain_sendrecv_i_end,
-            slab_sendrecv_j_start,
-            slab_sendrecv_j_end,
-            slab_sendrecv_k_start,
-            slab_sendrecv_k_end,
-            )
+    info = (domain_types, domain_counts, slab_types, slab_counts)
     decomposition_info[domain_grid_shape, slab_shape] = info
     return info
 # Cache storing results of the prepare_decomposition function.
@@ -1124,30 +1127,137 @@ def prepare_decomposition(domain_grid, slab):
 cython.declare(decomposition_info='dict')
 decomposition_info = {}
 
+# Function carrying out the redistribution between a domain grid and
+# a slab, in either direction. Where supported (MPI-4), a persistent
+# Alltoallw request is created once per pair of grids and then
+# restarted on subsequent calls. The time spent is reported when
+# running with enable_debugging.
+@cython.header(# Arguments
+               domain_grid='real[:, :, ::1]',
+               slab='real[:, :, ::1]',
+               direction='str',
+               # Locals
+               displs='int[::1]',
+               domain_counts='int[::1]',
+               domain_spec='list',
+               domain_types='list',
+               key='tuple',
+               key_oldest='tuple',
+               request='object',  # mpi4py.MPI.Prequest or None
+               request_oldest='object',  # mpi4py.MPI.Prequest or bint
+               slab_counts='int[::1]',
+               slab_spec='list',
+               slab_types='list',
+               t0='double',
+               t1='double',
+               returns='void',
+               )
+def redistribute_domain_slab(domain_grid, slab, direction):
+    global decomposition_persistent
+    t0 = time()
+    # The persistent request is bound to the memory of the grids,
+    # and so these enter the key.
+    key = (asarray(domain_grid).ctypes.data, asarray(domain_grid).shape,
+           asarray(slab).ctypes.data, asarray(slab).shape,
+           direction,
+           )
+    # As the addresses of the grids differ between the processes,
+    # the request may be cached on some processes but not on others.
+    # Since constructing the request involves collective calls,
+    # the decision to do so is made collectively.
+    request = decomposition_requests.get(key)
+    if allreduce(request is None, op=MPI.LOR):
+        if request:
+            request.Free()
+        request = None
+        decomposition_requests.pop(key, None)
+        domain_types, domain_counts, slab_types, slab_counts = prepare_decomposition(
+            domain_grid, slab)
+        # All types are described relative to the beginning
+        # of the grids, so the displacements are all zero.
+        displs = zeros(nprocs, dtype=C2np['int'])
+        domain_spec = [asarray(domain_grid), (asarray(domain_counts), asarray(displs)), domain_types]
+        slab_spec   = [asarray(slab),        (asarray(slab_counts),   asarray(displs)), slab_types]
+        if direction == 'domain2slab':
+            decomposition_specs[key] = (domain_spec, slab_spec)
+        elif direction == 'slab2domain':
+            decomposition_specs[key] = (slab_spec, domain_spec)
+        else:
+            abort(f'redistribute_domain_slab called with unknown direction "{direction}"')
+        # Attempt to create a persistent request. If the MPI library
+        # (or mpi4py) does not implement persistent collectives on any
+        # of the processes, fall back to calling Alltoallw directly.
+        if decomposition_persistent:
+            try:
+                request = comm.Alltoallw_init(*decomposition_specs[key])
+            except (AttributeError, NotImplementedError, MPI.Exception):
+                request = None
+        if allreduce(request is None, op=MPI.LOR):
+            if request is not None:
+                request.Free()
+            request = False
+            decomposition_persistent = False
+        decomposition_requests[key] = request
+        # Only keep the most recently constructed requests, as the
+        # grids of older requests have likely been reallocated.
+        while len(decomposition_requests) > decomposition_requests_max:
+            key_oldest = next(iter(decomposition_requests))
+            request_oldest = decomposition_requests.pop(key_oldest)
+            decomposition_specs.pop(key_oldest, None)
+            if request_oldest:
+                request_oldest.Free()
+    if request:
+        request.Start()
+        request.Wait()
+    else:
+        comm.Alltoallw(*decomposition_specs[key])
+    # Report the time spent
+    if enable_debugging:
+        t1 = allreduce(time() - t0, op=MPI.MAX)
+        masterprint('{} Redistribution {} ({}×{}×{} slab) took {} s'
+                    .format(terminal.bold_cyan('Debug info:'),
+                            direction.replace('2', ' → '),
+                            slab.shape[0], slab.shape[1], slab.shape[2],
+                            significant_figures(t1, 3, fmt='unicode'),
+                            )
+                    )
+# Caches of requests (persistent requests, or False when persistent
+# requests are not available) and buffer specifications used by the
+# redistribute_domain_slab function. The keys have the format
+# (domain_grid_address, domain_grid_shape,
+#  slab_address, slab_shape, direction).
+# At most decomposition_requests_max requests are kept.
+cython.declare(decomposition_persistent='bint',
+               decomposition_requests='dict',
+               decomposition_requests_max='Py_ssize_t',
+               decomposition_specs='dict',
+               )
+decomposition_persistent = True
+decomposition_requests_max = 8
+decomposition_requests = {}
+decomposition_specs = {}
+
 # Function for transfering data from slabs to domain grids
 @cython.pheader(# Arguments
-                slab='double[:, :, ::1]',
-                domain_grid_or_buffer_name='object',  # double[:, :, ::1], int or str
+                slab='real[:, :, ::1]',
+                domain_grid_or_buffer_name='object',  # real[:, :, ::1], int or str
                 # Locals
-                N_domain2slabs_communications='Py_ssize_t',
                 buffer_name='object',  # int or str
-                domain_grid='double[:, :, ::1]',
-                domain_grid_noghosts='double[:, :, :]',
-                domain_sendrecv_i_end='int[::1]',
-                domain_sendrecv_i_start='int[::1]',
-                domain2slabs_recvsend_ranks='int[::1]',
+                domain_grid='real[:, :, ::1]',
                 gridsize='Py_ssize_t',
-                request='object',  # mpi4py.MPI.Request
                 shape='tuple',
-                slab_sendrecv_j_end='int[::1]',
-                slab_sendrecv_j_start='int[::1]',
-                slab_sendrecv_k_end='int[::1]',
-                slab_sendrecv_k_start='int[::1]',
-                slabs2domain_sendrecv_ranks='int[::1]',
-                ℓ='Py_ssize_t',
-                returns='double[:, :, ::1]',
+                returns='real[:, :, ::1]',
                 )
 def domain_decompose(slab, domain_grid_or_buffer_name=0):
+    # Pencils are handled separately
+    if pencils_mapping and asarray(slab).ctypes.data in pencils_mapping:
+        gridsize = pencils_mapping[asarray(slab).ctypes.data][0]
+        shape = tuple([gridsize//domain_subdivisions[dim] + 1 + 2*2 for dim in range(3)])
+        if isinstance(domain_grid_or_buffer_name, (int, str)):
+            domain_grid = get_buffer(shape, domain_grid_or_buffer_name, dtype='real')
+        else:
+            domain_grid = domain_grid_or_buffer_name
+        return pencil_compose(slab, domain_grid, gridsize)
     if slab.shape[0] > slab.shape[1]:
         masterwarn('domain_decompose was called with a slab that appears to be transposed, '
                    'i.e. in Fourier space.')
@@ -1158,7 +1268,7 @@ def domain_decompose(slab, domain_grid_or_buffer_name=0):
     # If no domain grid is passed, fetch a buffer of the right shape
     if isinstance(domain_grid_or_buffer_name, (int, str)):
         buffer_name = domain_grid_or_buffer_name
-        domain_grid = get_buffer(shape, buffer_name)
+        domain_grid = get_buffer(shape, buffer_name, dtype='real')
     else:
         domain_grid = domain_grid_or_buffer_name
         if asarray(domain_grid).shape != shape:
@@ -1166,50 +1276,8 @@ def domain_decompose(slab, domain_grid_or_buffer_name=0):
                   'have incompatible shapes: {}, {}.'
                   .format(asarray(slab).shape, asarray(domain_grid).shape)
                   )
-    domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 2),
-                                       2:(domain_grid.shape[1] - 2),
-                                       2:(domain_grid.shape[2] - 2)]
-    # Compute needed communication variables
-    (N_domain2slabs_communications,
-     domain2slabs_recvsend_ranks,
-     slabs2domain_sendrecv_ranks,
-     domain_sendrecv_i_start,
-     domain_sendrecv_i_end,
-     slab_sendrecv_j_start,
-     slab_sendrecv_j_end,
-     slab_sendrecv_k_start,
-     slab_sendrecv_k_end,
-     ) = prepare_decomposition(domain_grid, slab)
     # Communicate the slabs to the domain grid
-    for ℓ in range(N_domain2slabs_communications):
-        # The lower ranks storing the slabs sends part of their slab
-        if ℓ < domain2slabs_recvsend_ranks.shape[0]:
-            # A non-blocking send is used, because the communication
-            # is not pairwise.
-            # In the x-dimension, the slabs are always thinner than (or
-            # at least as thin as) the domain.
-            request = smart_mpi(slab[:,
-                                     slab_sendrecv_j_start[ℓ]:slab_sendrecv_j_end[ℓ],
-                                     slab_sendrecv_k_start[ℓ]:slab_sendrecv_k_end[ℓ],
-                                     ],
-                                dest=domain2slabs_recvsend_ranks[ℓ],
-                                mpifun='Isend')
-        # The corresponding process receives the message.
-        # Since the slabs extend throughout the entire yz-plane,
-        # we receive into the entire yz-part of the domain grid
-        # (excluding ghost and pseudo points).
-        if ℓ < slabs2domain_sendrecv_ranks.shape[0]:
-            smart_mpi(domain_grid_noghosts[domain_sendrecv_i_start[ℓ]:domain_sendrecv_i_end[ℓ],
-                                           :ℤ[domain_grid_noghosts.shape[1] - 1],
-                                           :ℤ[domain_grid_noghosts.shape[2] - 1],
-                                           ],
-                      source=slabs2domain_sendrecv_ranks[ℓ],
-                      mpifun='Recv')
-        # Wait for the non-blockind send to be complete before
-        # continuing. Otherwise, data in the send buffer - which is
-        # still in use by the non-blocking send - might get overwritten
-        # by the next (non-blocking) send.
-        request.wait()
+    redistribute_domain_slab(domain_grid, slab, 'slab2domain')
     # The right/forward/upper boundaries (the layer of pseudo points,
     # not the ghost layer) of the domain grid should be a copy of the
     # left/backward/lower boundaries of the neighboring
@@ -1220,27 +1288,16 @@ def domain_decompose(slab, domain_grid_or_buffer_name=0):
 
 # Function for transfering data from domain grids to slabs
 @cython.pheader(# Arguments
-                domain_grid='double[:, :, ::1]',
-                slab_or_buffer_name='object',  # double[:, :, ::1], int or str
+                domain_grid='real[:, :, ::1]',
+                slab_or_buffer_name='object',  # real[:, :, ::1], int or str
                 prepare_fft='bint',
                 # Locals
-                N_domain2slabs_communications='Py_ssize_t',
                 buffer_name='object',  # int or str
-                domain_grid_noghosts='double[:, :, :]',
-                domain_sendrecv_i_end='int[::1]',
-                domain_sendrecv_i_start='int[::1]',
-                domain2slabs_recvsend_ranks='int[::1]',
+                domain_grid_noghosts='real[:, :, :]',
                 gridsize='Py_ssize_t',
-                request='object',  # mpi4py.MPI.Request object
                 shape='tuple',
-                slab='double[:, :, ::1]',
-                slab_sendrecv_j_end='int[::1]',
-                slab_sendrecv_j_start='int[::1]',
-                slab_sendrecv_k_end='int[::1]',
-                slab_sendrecv_k_start='int[::1]',
-                slabs2domain_sendrecv_ranks='int[::1]',
-                ℓ='Py_ssize_t',
-                returns='double[:, :, ::1]',
+                slab='real[:, :, ::1]',
+                returns='real[:, :, ::1]',
                 )
 def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
     """This function communicates a global grid decomposed into domain
@@ -1250,6 +1307,8 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
     second argument. If FFT's are to be carried out on the slab,
     you must give a buffer name as the second argument and specify
     prepare_fft=True, in which case the slab will be created via FFTW.
+    If fft_decomposition is 'pencil', a pencil (see get_pencil_layout)
+    will then be returned in place of the slab.
     """
     # Determine the correct shape of the slab grid corresponding to
     # the passed domain grid.
@@ -1257,6 +1316,10 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
                                        2:(domain_grid.shape[1] - 2),
                                        2:(domain_grid.shape[2] - 2)]
     gridsize = (domain_grid_noghosts.shape[0] - 1)*domain_subdivisions[0]
+    # When using pencil decomposition for FFT's,
+    # the grid should be communicated to pencils instead.
+    if prepare_fft and fft_decomposition == 'pencil':
+        return pencil_decompose(domain_grid, gridsize, slab_or_buffer_name)
     if gridsize%nprocs != 0:
         abort('A domain decomposed grid of gridsize {} was passed to the slab_decompose function. '
               'This gridsize is not evenly divisible by {} processes.'
@@ -1271,7 +1334,7 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
         if prepare_fft:
             slab = get_fftw_slab(gridsize, buffer_name)
         else:
-            slab = get_buffer(shape, buffer_name)
+            slab = get_buffer(shape, buffer_name, dtype='real')
     else:
         slab = slab_or_buffer_name
         if asarray(slab).shape != shape:
@@ -1279,48 +1342,8 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
                   'have incompatible shapes: {}, {}.'
                   .format(asarray(slab).shape, asarray(domain_grid).shape)
                   )
-    # Compute needed communication variables
-    (N_domain2slabs_communications,
-     domain2slabs_recvsend_ranks,
-     slabs2domain_sendrecv_ranks,
-     domain_sendrecv_i_start,
-     domain_sendrecv_i_end,
-     slab_sendrecv_j_start,
-     slab_sendrecv_j_end,
-     slab_sendrecv_k_start,
-     slab_sendrecv_k_end,
-     ) = prepare_decomposition(domain_grid, slab)
     # Communicate the domain grid to the slabs
-    for ℓ in range(N_domain2slabs_communications):
-        # Send part of the local domain
-        # grid to the corresponding process.
-        if ℓ < slabs2domain_sendrecv_ranks.shape[0]:
-            # A non-blocking send is used, because the communication
-            # is not pairwise.
-            # Since the slabs extend throughout the entire yz-plane,
-            # we should send the entire yz-part of domain
-            # (excluding ghost and pseudo points).
-            request = smart_mpi(domain_grid_noghosts[
-                                    domain_sendrecv_i_start[ℓ]:domain_sendrecv_i_end[ℓ],
-                                    :ℤ[domain_grid_noghosts.shape[1] - 1],
-                                    :ℤ[domain_grid_noghosts.shape[2] - 1],
-                                                     ],
-                                dest=slabs2domain_sendrecv_ranks[ℓ],
-                                mpifun='Isend')
-        # The lower ranks storing the slabs receives the message.
-        # In the x-dimension, the slabs are always thinner than (or at
-        # least as thin as) the domain.
-        if ℓ < domain2slabs_recvsend_ranks.shape[0]:
-            smart_mpi(slab[:,
-                           slab_sendrecv_j_start[ℓ]:slab_sendrecv_j_end[ℓ],
-                           slab_sendrecv_k_start[ℓ]:slab_sendrecv_k_end[ℓ]],
-                      source=domain2slabs_recvsend_ranks[ℓ],
-                      mpifun='Recv')
-        # Wait for the non-blockind send to be complete before
-        # continuing. Otherwise, data in the send buffer - which is
-        # still in use by the non-blocking send - might get overwritten
-        # by the next (non-blocking) send.
-        request.wait()
+    redistribute_domain_slab(domain_grid, slab, 'domain2slab')
     return slab
 
 # Function that returns a slab decomposed grid,
@@ -1330,26 +1353,17 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
                 buffer_name='object',  # int or str
                 nullify='bint',
                 # Locals
-                as_expected='bint',
                 fftw_plans_index='Py_ssize_t',
                 fftw_struct='fftw_return_struct',
                 plan_backward='fftw_plan',
                 plan_forward='fftw_plan',
-                rigor='str',
-                rigor_final='str',
                 shape='tuple',
-                slab='double[:, :, ::1]',
+                slab='real[:, :, ::1]',
                 slab_address='Py_ssize_t',
-                slab_ptr='double*',
-                slab_size_i='Py_ssize_t',
-                slab_size_j='Py_ssize_t',
-                slab_start_i='Py_ssize_t',
-                slab_start_j='Py_ssize_t',
-                wisdom_filename='str',
-                returns='double[:, :, ::1]',
+                slab_ptr='real*',
+                returns='real[:, :, ::1]',
                 )
 def get_fftw_slab(gridsize, buffer_name=0, nullify=False):
-    global fftw_plans_size, fftw_plans_forward, fftw_plans_backward
     # If this slab has already been constructed, fetch it
     slab = slabs.get((gridsize, buffer_name))
     if slab is not None:
@@ -1369,92 +1383,22 @@ def get_fftw_slab(gridsize, buffer_name=0, nullify=False):
     # is no needed preparations. In compiled mode we use FFTW,
     # which means that the grid and its plans must be prepared.
     if not cython.compiled:
-        slab = empty(shape, dtype=C2np['double'])
+        slab = empty(shape, dtype=C2np['real'])
     else:
-        # Determine what FFTW rigor to use.
-        # The rigor to use will be stored as rigor_final.
-        if master:
-            if fftw_wisdom_reuse:
-                for rigor in fftw_wisdom_rigors:
-                    wisdom_filename = ('.fftw_wisdom_gridsize={}_nprocs={}_rigor={}'
-                                       .format(gridsize, nprocs, rigor))
-                    # At least be as rigorous as defined by
-                    # the fftw_wisdom_rigor user parameter.
-                    if rigor == fftw_wisdom_rigor:
-                        break
-                    # Use a better rigor if wisdom already exist
-                    if os.path.isfile(wisdom_filename):
-                        break
-                rigor_final = rigor
-            else:
-                rigor_final = fftw_wisdom_rigor
-            # If less rigorous wisdom exists for the same problem,
-            # delete it.
-            for rigor in reversed(fftw_wisdom_rigors):
-                if rigor == rigor_final:
-                    break
-                wisdom_filename = ('.fftw_wisdom_gridsize={}_nprocs={}_rigor={}'
-                                   .format(gridsize, nprocs, rigor))
-                if os.path.isfile(wisdom_filename):
-                    os.remove(wisdom_filename)
-        rigor_final = bcast(rigor_final if master else None)
-        wisdom_filename = ('.fftw_wisdom_gridsize={}_nprocs={}_rigor={}'
-                           .format(gridsize, nprocs, rigor_final))
         # Initialize fftw_mpi, allocate the grid, initialize the
         # local grid sizes and start indices and do FFTW planning.
-        # All this is handled by fftw_setup from fft.c.
-        if master:
-            reuse = (fftw_wisdom_reuse and os.path.isfile(wisdom_filename))
-        reuse = bcast(reuse if master else None)
-        if not reuse:
-            masterprint('Acquiring FFTW wisdom ({}) for grid of linear size {} on {} {} ...'
-                        .format(rigor_final, gridsize, nprocs,
-                                'processes' if nprocs > 1 else 'process')
-                        )
-        fftw_struct = fftw_setup(gridsize, gridsize, gridsize,
-                                 bytes(rigor_final, encoding='ascii'),
-                                 reuse)
-        if not reuse:
-            masterprint('done')            
-        # Unpack every variable from fftw_struct
-        # and compare to expected values.
-        slab_size_i   = int(fftw_struct.gridsize_local_i)
-        slab_size_j   = int(fftw_struct.gridsize_local_j)
-        slab_start_i  = int(fftw_struct.gridstart_local_i)
-        slab_start_j  = int(fftw_struct.gridstart_local_j)
+        fftw_struct = setup_fftw(gridsize)
         plan_forward  = fftw_struct.plan_forward
         plan_backward = fftw_struct.plan_backward
         slab_ptr      = fftw_struct.grid
-        as_expected = True
-        if (   slab_size_i  != ℤ[shape[0]]
-            or slab_size_j  != ℤ[shape[0]]
-            or slab_start_i != ℤ[shape[0]*rank]
-            or slab_start_j != ℤ[shape[0]*rank]
-            ):
-            as_expected = False
-            warn(f'FFTW has distributed a slab of gridsize {gridsize} differently '
-                 f'from what was expected on rank {rank}:\n'
-                 f'    slab_size_i  = {slab_size_i}, expected {shape[0]},\n'
-                 f'    slab_size_j  = {slab_size_j}, expected {shape[0]},\n'
-                 f'    slab_start_i = {slab_start_i}, expected {shape[0]*rank},\n'
-                 f'    slab_start_j = {slab_start_j}, expected {shape[0]*rank},\n'
-                 )
-        as_expected = allreduce(as_expected, op=MPI.LOR)
-        if not as_expected:
-            abort('Refusing to carry on with this non-expected decomposition.')
         # Wrap the slab pointer in a memory view. Looping over this
         # memory view should be done as noted in fft.c, but use
         # slab[i, j, k] when in real space and slab[j, i, k]
         # when in Fourier space.
-        slab = cast(slab_ptr, 'double[:shape[0], :shape[1], :shape[2]]')
+        slab = cast(slab_ptr, 'real[:shape[0], :shape[1], :shape[2]]')
         # Store the plans for this slab in the global
         # fftw_plans_forward and fftw_plans_backward arrays.
-        fftw_plans_index = fftw_plans_size
-        fftw_plans_size += 1
-        fftw_plans_forward  = realloc(fftw_plans_forward , fftw_plans_size*sizeof('fftw_plan'))
-        fftw_plans_backward = realloc(fftw_plans_backward, fftw_plans_size*sizeof('fftw_plan'))
-        fftw_plans_forward [fftw_plans_index] = plan_forward
-        fftw_plans_backward[fftw_plans_index] = plan_backward
+        fftw_plans_index = store_fftw_plans(plan_forward, plan_backward)
         # Insert mapping from the slab to the index of its plans
         # in the global fftw_plans_forward and fftw_plans_backward
         # arrays, into the global fftw_plans_mapping dict.
@@ -1462,6 +1406,7 @@ def get_fftw_slab(gridsize, buffer_name=0, nullify=False):
         fftw_plans_mapping[slab_address] = fftw_plans_index
     # Store and return this slab
     slabs[gridsize, buffer_name] = slab
+    record_mesh_memory()
     if nullify:
         slab[...] = 0
     return slab
@@ -1479,18 +1424,225 @@ cython.declare(fftw_plans_size='Py_ssize_t',
 fftw_plans_size = 0
 fftw_plans_forward  = malloc(fftw_plans_size*sizeof('fftw_plan'))
 fftw_plans_backward = malloc(fftw_plans_size*sizeof('fftw_plan'))
+# Indices in fftw_plans_forward and fftw_plans_backward
+# of plans which have been destroyed, available for reuse.
+cython.declare(fftw_plans_vacant='list')
+fftw_plans_vacant = []
 # Mapping from memory addreses of slabs to indices in
 # fftw_plans_forward and fftw_plans_backward.
 cython.declare(fftw_plans_mapping='dict')
 fftw_plans_mapping = {}
 
+# Function storing a pair of FFTW plans in the global
+# fftw_plans_forward and fftw_plans_backward arrays, returning the
+# index of the plans within these. Indices of destroyed plans are
+# reused, so that the arrays do not grow when grids are repeatedly
+# freed and reallocated.
+@cython.header(# Arguments
+               plan_forward='fftw_plan',
+               plan_backward='fftw_plan',
+               # Locals
+               fftw_plans_index='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def store_fftw_plans(plan_forward, plan_backward):
+    global fftw_plans_size, fftw_plans_forward, fftw_plans_backward
+    if fftw_plans_vacant:
+        fftw_plans_index = fftw_plans_vacant.pop()
+    else:
+        fftw_plans_index = fftw_plans_size
+        fftw_plans_size += 1
+        fftw_plans_forward  = realloc(fftw_plans_forward , fftw_plans_size*sizeof('fftw_plan'))
+        fftw_plans_backward = realloc(fftw_plans_backward, fftw_plans_size*sizeof('fftw_plan'))
+    fftw_plans_forward [fftw_plans_index] = plan_forward
+    fftw_plans_backward[fftw_plans_index] = plan_backward
+    return fftw_plans_index
+
+# Function for deallocating a grid allocated by FFTW together with its
+# plans, the index of which in fftw_plans_forward and
+# fftw_plans_backward is made available for reuse.
+@cython.header(# Arguments
+               grid_ptr='real*',
+               fftw_plans_index='Py_ssize_t',
+               )
+def free_fftw_grid(grid_ptr, fftw_plans_index):
+    fftw_free_grid(grid_ptr,
+                   fftw_plans_forward[fftw_plans_index],
+                   fftw_plans_backward[fftw_plans_index],
+                   )
+    fftw_plans_vacant.append(fftw_plans_index)
+
+# Function which cleans up FFTW. As this invalidates all plans,
+# it should only be called at program exit.
+@cython.pheader()
+def cleanup_fftw():
+    if not cython.compiled:
+        return
+    fftw_clean()
+
+# Function which initializes FFTW, allocates a slab decomposed grid
+# (or howmany interleaved grids) and creates the FFTW plans,
+# making use of the FFTW wisdom store.
+@cython.header(# Arguments
+               gridsize='Py_ssize_t',
+               howmany='Py_ssize_t',
+               # Locals
+               as_expected='bint',
+               fftw_struct='fftw_return_struct',
+               reuse='bint',
+               rigor_final='str',
+               slab_size_i='Py_ssize_t',
+               slab_size_j='Py_ssize_t',
+               slab_start_i='Py_ssize_t',
+               slab_start_j='Py_ssize_t',
+               wisdom='str',
+               wisdom_entry='dict',
+               returns='fftw_return_struct',
+               )
+def setup_fftw(gridsize, howmany=1):
+    # Look up wisdom for this problem in the wisdom store. This
+    # wisdom is used if it is at least as rigorous as what is
+    # specified by the fftw_wisdom_rigor user parameter,
+    # in which case no planning delay occurs.
+    # The rigor to use will be stored as rigor_final.
+    rigor_final = fftw_wisdom_rigor
+    wisdom = ''
+    if master and fftw_wisdom_reuse:
+        wisdom_entry = load_fftw_wisdom(gridsize, howmany)
+        if wisdom_entry and (   fftw_wisdom_rigors.index(wisdom_entry['rigor'])
+                             <= fftw_wisdom_rigors.index(fftw_wisdom_rigor)):
+            rigor_final = wisdom_entry['rigor']
+            wisdom = wisdom_entry['wisdom']
+    rigor_final = bcast(rigor_final if master else None)
+    reuse = bcast(bool(wisdom) if master else None)
+    # Initialize fftw_mpi, allocate the grid, initialize the
+    # local grid sizes and start indices and do FFTW planning.
+    # All this is handled by fftw_setup from fft.c.
+    if not reuse:
+        masterprint('Acquiring FFTW wisdom ({}) for {} of linear size {} on {} {} ...'
+                    .format(rigor_final,
+                            'grid' if howmany == 1 else '{} grids'.format(howmany),
+                            gridsize, nprocs,
+                            'processes' if nprocs > 1 else 'process')
+                    )
+    fftw_struct = fftw_setup(gridsize, gridsize, gridsize, howmany,
+                             bytes(rigor_final, encoding='ascii'),
+                             bytes(wisdom, encoding='ascii'))
+    # Newly acquired wisdom is saved to the wisdom store
+    if master:
+        if not reuse:
+            save_fftw_wisdom(gridsize, rigor_final, fftw_struct.wisdom.decode('ascii'), howmany)
+        fftw_free_wisdom(fftw_struct.wisdom)
+    if not reuse:
+        masterprint('done')
+    # Compare the local sizes and starts to the expected values
+    slab_size_i  = int(fftw_struct.gridsize_local_i)
+    slab_size_j  = int(fftw_struct.gridsize_local_j)
+    slab_start_i = int(fftw_struct.gridstart_local_i)
+    slab_start_j = int(fftw_struct.gridstart_local_j)
+    as_expected = True
+    if (   slab_size_i  != ℤ[gridsize//nprocs]
+        or slab_size_j  != ℤ[gridsize//nprocs]
+        or slab_start_i != ℤ[gridsize//nprocs*rank]
+        or slab_start_j != ℤ[gridsize//nprocs*rank]
+        ):
+        as_expected = False
+        warn(f'FFTW has distributed a slab of gridsize {gridsize} differently '
+             f'from what was expected on rank {rank}:\n'
+             f'    slab_size_i  = {slab_size_i}, expected {gridsize//nprocs},\n'
+             f'    slab_size_j  = {slab_size_j}, expected {gridsize//nprocs},\n'
+             f'    slab_start_i = {slab_start_i}, expected {gridsize//nprocs*rank},\n'
+             f'    slab_start_j = {slab_start_j}, expected {gridsize//nprocs*rank},\n'
+             )
+    as_expected = allreduce(as_expected, op=MPI.LOR)
+    if not as_expected:
+        abort('Refusing to carry on with this non-expected decomposition.')
+    return fftw_struct
+
+# Function returning the entry of the FFTW wisdom store
+# matching the given gridsize (and number of interleaved grids) and the
+# current number of processes and FFTW version. If no such entry
+# exists, an empty dict is returned.
+@cython.pheader(# Arguments
+                gridsize='Py_ssize_t',
+                howmany='Py_ssize_t',
+                # Locals
+                returns='dict',
+                )
+def load_fftw_wisdom(gridsize, howmany=1):
+    """The wisdom store is a single JSON file per machine, placed in
+    the concept directory. Each entry holds the rigor used to acquire
+    the wisdom together with the exported wisdom itself.
+    """
+    return read_fftw_wisdom_store().get(get_fftw_wisdom_key(gridsize, howmany), {})
+
+# Function for saving newly acquired FFTW wisdom to the wisdom store
+@cython.pheader(# Arguments
+                gridsize='Py_ssize_t',
+                rigor='str',
+                wisdom='str',
+                howmany='Py_ssize_t',
+                # Locals
+                filename='str',
+                key='str',
+                store='dict',
+                )
+def save_fftw_wisdom(gridsize, rigor, wisdom, howmany=1):
+    """Existing wisdom is only replaced by wisdom of at least
+    the same rigor. As several jobs may share the same store, the store
+    is read in anew right before it is updated, and the updated store
+    is written to a temporary file which then replaces the store.
+    """
+    key = get_fftw_wisdom_key(gridsize, howmany)
+    store = read_fftw_wisdom_store()
+    if key in store and (  fftw_wisdom_rigors.index(store[key]['rigor'])
+                         < fftw_wisdom_rigors.index(rigor)):
+        return
+    store[key] = {'rigor': rigor, 'wisdom': wisdom}
+    filename = get_fftw_wisdom_store_filename()
+    with open('{}.{}'.format(filename, os.getpid()), 'w', encoding='utf-8') as store_file:
+        json.dump(store, store_file, indent=4, sort_keys=True)
+    os.replace('{}.{}'.format(filename, os.getpid()), filename)
+
+# Helper functions for the FFTW wisdom store
+@cython.pheader(# Locals
+                filename='str',
+                returns='dict',
+                )
+def read_fftw_wisdom_store():
+    filename = get_fftw_wisdom_store_filename()
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, encoding='utf-8') as store_file:
+        return json.load(store_file)
+@cython.pheader(returns='str')
+def get_fftw_wisdom_store_filename():
+    return '{}/.fftw_wisdom_{}'.format(paths['concept_dir'], socket.gethostname())
+@cython.pheader(# Arguments
+                gridsize='Py_ssize_t',
+                howmany='Py_ssize_t',
+                # Locals
+                returns='str',
+                )
+def get_fftw_wisdom_key(gridsize, howmany=1):
+    # Wisdom of the single and double precision
+    # FFTW libraries cannot be used interchangeably.
+    return 'gridsize={}{}_nprocs={}_fftw={}{}'.format(
+        gridsize,
+        '' if howmany == 1 else f'_howmany={howmany}',
+        nprocs,
+        fftw_get_version().decode('ascii'),
+        '_single' if C2np['real'] is C2np['float'] else '',
+    )
+
 # Function performing Fourier transformations of slab decomposed grids
 @cython.header(# Arguments
-               slab='double[:, :, ::1]',
+               slab='real[:, :, ::1]',
                direction='str',
                # Locals
                fftw_plans_index='Py_ssize_t',
                slab_address='Py_ssize_t',
+               returns='real[:, :, ::1]',
                )
 def fft(slab, direction):
     """Fourier transform the given slab decomposed grid.
@@ -1506,10 +1658,18 @@ def fft(slab, direction):
     In pure Python, NumPy is used to carry out the Fourier transforms.
     To emulate the effects of FFTW perfectly, a lot of extra steps
     are needed.
+
+    The transformed grid is returned. For slabs, this is the passed
+    slab itself, as the transformation is done in-place. For pencils,
+    this is the pencil in the other space, sharing memory with the
+    passed pencil but generally of a different shape.
     """
     if not direction in ('forward', 'backward'):
         abort('fft was called with the direction "{}", which is neither "forward" nor "backward".'
               .format(direction))
+    # Pencils are handled separately
+    if pencils_mapping and asarray(slab).ctypes.data in pencils_mapping:
+        return fft_pencil(slab, direction)
     if not cython.compiled:
         # The pure Python FFT implementation is serial.
         # Every process computes the entire FFT of the temporary
@@ -1574,6 +1734,121 @@ def fft(slab, direction):
             fftw_execute(fftw_plans_forward[fftw_plans_index])
         elif direction == 'backward':
             fftw_execute(fftw_plans_backward[fftw_plans_index])
+    return slab
+
+# Function performing Fourier transformations of several slab
+# decomposed grids together.
+@cython.pheader(# Arguments
+                slabs='list',
+                direction='str',
+                # Locals
+                batch='real*',
+                batch_mv='real[::1]',
+                c='Py_ssize_t',
+                fftw_plans_index='Py_ssize_t',
+                forward='bint',
+                gridsize='Py_ssize_t',
+                h='Py_ssize_t',
+                howmany='Py_ssize_t',
+                m='Py_ssize_t',
+                size='Py_ssize_t',
+                slab='real[:, :, ::1]',
+                slab_ptr='real*',
+                returns='list',
+                )
+def fft_batch(slabs, direction):
+    """The passed slabs all have to be of the same gridsize, but they
+    need not be obtained from get_fftw_slab; any contiguous arrays of
+    the slab shape will do. Each slab is transformed in-place exactly as
+    by the fft function, but the grids are transformed together using a
+    single FFTW plan for howmany interleaved grids. The all-to-all
+    communication of the transposition is then carried out once for all
+    grids, rather than once per grid. The slabs are copied to and from
+    the interleaved grid, which costs memory equal to that of the slabs.
+    In pure Python mode and for pencils, the slabs are simply
+    transformed one at a time. The list of transformed slabs
+    is returned.
+    """
+    if not direction in ('forward', 'backward'):
+        abort('fft_batch was called with the direction "{}", '
+              'which is neither "forward" nor "backward".'
+              .format(direction))
+    howmany = len(slabs)
+    if howmany == 0:
+        return slabs
+    if not cython.compiled or (
+        pencils_mapping and asarray(slabs[0]).ctypes.data in pencils_mapping):
+        return [fft(slab, direction) for slab in slabs]
+    slab = slabs[0]
+    gridsize = slab.shape[1]
+    size = slab.shape[0]*slab.shape[1]*slab.shape[2]
+    fftw_plans_index = get_fftw_batch(gridsize, howmany)
+    batch_mv = fftw_batch_grids[gridsize, howmany]
+    batch = cython.address(batch_mv[0])
+    forward = (direction == 'forward')
+    # Copy the slabs into the interleaved grid. In real space,
+    # the values of the different grids are interleaved one by one,
+    # while in Fourier space it is the complex numbers (pairs of
+    # values) which are interleaved.
+    for h in range(howmany):
+        slab = slabs[h]
+        slab_ptr = cython.address(slab[0, 0, 0])
+        with unswitch(1):
+            if forward:
+                for m in range(size):
+                    batch[m*howmany + h] = slab_ptr[m]
+            else:
+                for m in range(size):
+                    c = m%2
+                    batch[(m - c)*howmany + 2*h + c] = slab_ptr[m]
+    # Let FFTW do the Fourier transformation of all grids
+    if forward:
+        fftw_execute(fftw_plans_forward[fftw_plans_index])
+    else:
+        fftw_execute(fftw_plans_backward[fftw_plans_index])
+    # Copy the transformed grids back into the slabs
+    for h in range(howmany):
+        slab = slabs[h]
+        slab_ptr = cython.address(slab[0, 0, 0])
+        with unswitch(1):
+            if forward:
+                for m in range(size):
+                    c = m%2
+                    slab_ptr[m] = batch[(m - c)*howmany + 2*h + c]
+            else:
+                for m in range(size):
+                    slab_ptr[m] = batch[m*howmany + h]
+    return slabs
+
+# Function returning the index in fftw_plans_forward and
+# fftw_plans_backward of the plans used by fft_batch for the given
+# gridsize and number of grids. The interleaved grid itself is stored
+# in the global fftw_batch_grids dict.
+@cython.header(# Arguments
+               gridsize='Py_ssize_t',
+               howmany='Py_ssize_t',
+               # Locals
+               fftw_plans_index='Py_ssize_t',
+               fftw_struct='fftw_return_struct',
+               size='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def get_fftw_batch(gridsize, howmany):
+    fftw_plans_index = fftw_batches.get((gridsize, howmany), -1)
+    if fftw_plans_index == -1:
+        fftw_struct = setup_fftw(gridsize, howmany)
+        fftw_plans_index = store_fftw_plans(fftw_struct.plan_forward, fftw_struct.plan_backward)
+        fftw_batches[gridsize, howmany] = fftw_plans_index
+        size = gridsize//nprocs*gridsize*2*(gridsize//2 + 1)*howmany
+        fftw_batch_grids[gridsize, howmany] = cast(fftw_struct.grid, 'real[:size]')
+        record_mesh_memory()
+    return fftw_plans_index
+# Mapping from (gridsize, howmany) to the index of the plans in
+# fftw_plans_forward and fftw_plans_backward and to the interleaved
+# grid, for the grids used by fft_batch.
+cython.declare(fftw_batches='dict', fftw_batch_grids='dict')
+fftw_batches = {}
+fftw_batch_grids = {}
 
 # Function for deallocating a slab and its plans, allocated by FFTW
 @cython.header(# Arguments
@@ -1581,40 +1856,863 @@ def fft(slab, direction):
                buffer_name='object',  # int or str
                # Locals
                fftw_plans_index='Py_ssize_t',
-               plan_forward='fftw_plan',
-               plan_backward='fftw_plan',
-               slab='double[:, :, ::1]',
-               slab_ptr='double*',
+               slab='real[:, :, ::1]',
+               slab_address='Py_ssize_t',
+               slab_ptr='real*',
                )
 def free_fftw_slab(gridsize, buffer_name):
     # Fetch the slab from the slab cache and remove it
     slab = slabs.pop((gridsize, buffer_name))
     # Grab pointer to the slab
     slab_ptr = cython.address(slab[0, 0, 0])
-    # Look up the index of the FFTW plans for the passed slab
-    # and use this to look up the plans.
+    # Look up and remove the index of the FFTW plans
+    # for the passed slab.
     slab_address = cast(slab_ptr, 'Py_ssize_t')
-    fftw_plans_index = fftw_plans_mapping[slab_address]
-    plan_forward  = fftw_plans_forward[fftw_plans_index]
-    plan_backward = fftw_plans_backward[fftw_plans_index]
-    # Let FFTW do the cleanup
-    fftw_clean(slab_ptr, plan_forward, plan_backward)
-    # Note that the arrays fftw_plans_forward and fftw_plans_backward
-    # as well as the dict fftw_plans_mapping have not been altered.
-    # Thus, accessing the pointers in fftw_plans_forward or
-    # fftw_plans_backward for the newly freed plans will cause a
-    # segmentation fault. As this should not ever happen, we leave
-    # these as is.
+    fftw_plans_index = fftw_plans_mapping.pop(slab_address)
+    # Free the slab and destroy its plans
+    free_fftw_grid(slab_ptr, fftw_plans_index)
+
+# Function returning the layout of pencil decomposed grids
+# of a given gridsize.
+@cython.header(# Arguments
+               gridsize='Py_ssize_t',
+               # Locals
+               a='int',
+               b='int',
+               box_1='tuple',
+               box_2='tuple',
+               box_3='tuple',
+               box_real='tuple',
+               boxes_1='list',
+               boxes_2_col='list',
+               boxes_2_row='list',
+               boxes_3='list',
+               boxes_real='list',
+               comm_col='object',  # mpi4py.MPI.Intracomm
+               comm_row='object',  # mpi4py.MPI.Intracomm
+               edges_i='Py_ssize_t[::1]',
+               edges_j='Py_ssize_t[::1]',
+               edges_k='Py_ssize_t[::1]',
+               gridsize_complex='Py_ssize_t',
+               layout='tuple',
+               nprocs_col='int',
+               nprocs_row='int',
+               ℓ='int',
+               returns='tuple',
+               )
+def get_pencil_layout(gridsize):
+    """The nprocs processes are arranged in a 2D process grid of shape
+    (nprocs_row, nprocs_col), with process rank = a*nprocs_col + b
+    placed at (a, b). In real space, the pencils extend throughout
+    the entire k-dimension, with the i-dimension distributed over a
+    and the j-dimension distributed over b. A forward transformation
+    is then carried out in three steps, each consisting of
+    1D transformations along a complete dimension:
+    - 1: Real transformation along k.
+    - 2: Complex transformation along j, after redistributing the
+         pencils within the row of processes sharing a,
+         so that j is complete and k is distributed over b.
+    - 3: Complex transformation along i, after redistributing the
+         pencils within the column of processes sharing b,
+         so that i is complete and j is distributed over a.
+    As for the slabs, the Fourier space pencils are stored transposed,
+    with the local element [j, i, k] corresponding to the global
+    element [j + j_start, i, k + 2*kk_start], where j_start and kk_start
+    can be looked up through fourier_offsets(). Neither dimension need
+    be evenly divisible by the number of processes it is
+    distributed over.
+    The returned layout contains the sub-communicators and the global
+    index boxes (tuples of (start, stop) pairs) of all pencils
+    involved, for the local process as well as for all processes
+    within the relevant communicator.
+    """
+    layout = pencil_layouts.get(gridsize)
+    if layout:
+        return layout
+    # Arrange the processes in a 2D grid as square as possible,
+    # with the larger extent along the rows as the k-dimension
+    # in Fourier space only has gridsize//2 + 1 complex elements.
+    for nprocs_col in range(int(sqrt(nprocs)), 0, -1):
+        if nprocs%nprocs_col == 0:
+            break
+    nprocs_row = nprocs//nprocs_col
+    gridsize_complex = gridsize//2 + 1
+    if nprocs_row > gridsize or nprocs_col > gridsize_complex:
+        abort(f'Cannot distribute pencils of gridsize {gridsize} over a '
+              f'{nprocs_row}×{nprocs_col} process grid')
+    a = rank//nprocs_col
+    b = rank%nprocs_col
+    comm_row = comm.Split(a, b)
+    comm_col = comm.Split(b, a)
+    # The edges of the distributed dimensions,
+    # so that e.g. the ℓ'th part of the i-dimension
+    # spans edges_i[ℓ]:edges_i[ℓ + 1].
+    edges_i = asarray([ℓ*gridsize//nprocs_row for ℓ in range(nprocs_row + 1)],
+                      dtype=C2np['Py_ssize_t'])
+    edges_j = asarray([ℓ*gridsize//nprocs_col for ℓ in range(nprocs_col + 1)],
+                      dtype=C2np['Py_ssize_t'])
+    edges_k = asarray([ℓ*gridsize_complex//nprocs_col for ℓ in range(nprocs_col + 1)],
+                      dtype=C2np['Py_ssize_t'])
+    # Real space pencils of all processes in comm
+    boxes_real = [((edges_i[ℓ//nprocs_col], edges_i[ℓ//nprocs_col + 1]),
+                   (edges_j[ℓ%nprocs_col ], edges_j[ℓ%nprocs_col  + 1]),
+                   (0, gridsize),
+                   ) for ℓ in range(nprocs)]
+    box_real = boxes_real[rank]
+    # Pencils after step 1 (of all processes in comm_row)
+    boxes_1 = [((edges_i[a], edges_i[a + 1]),
+                (edges_j[ℓ], edges_j[ℓ + 1]),
+                (0, gridsize_complex),
+                ) for ℓ in range(nprocs_col)]
+    box_1 = boxes_1[b]
+    # Pencils during step 2 (of all processes in comm_row and
+    # of all processes in comm_col).
+    boxes_2_row = [((edges_i[a], edges_i[a + 1]),
+                    (0, gridsize),
+                    (edges_k[ℓ], edges_k[ℓ + 1]),
+                    ) for ℓ in range(nprocs_col)]
+    boxes_2_col = [((edges_i[ℓ], edges_i[ℓ + 1]),
+                    (0, gridsize),
+                    (edges_k[b], edges_k[b + 1]),
+                    ) for ℓ in range(nprocs_row)]
+    box_2 = boxes_2_row[b]
+    # Pencils during step 3 (of all processes in comm_col)
+    boxes_3 = [((0, gridsize),
+                (edges_i[ℓ], edges_i[ℓ + 1]),
+                (edges_k[b], edges_k[b + 1]),
+                ) for ℓ in range(nprocs_row)]
+    box_3 = boxes_3[a]
+    layout = (comm_row, comm_col,
+              box_real, boxes_real,
+              box_1, boxes_1,
+              box_2, boxes_2_row, boxes_2_col,
+              box_3, boxes_3,
+              )
+    pencil_layouts[gridsize] = layout
+    return layout
+# Cache storing results of the get_pencil_layout function.
+# The keys are the gridsizes.
+cython.declare(pencil_layouts='dict')
+pencil_layouts = {}
+
+# Function returning the shape of a box
+@cython.header(# Arguments
+               box='tuple',
+               # Locals
+               dim='int',
+               returns='tuple',
+               )
+def box_shape(box):
+    return tuple([box[dim][1] - box[dim][0] for dim in range(3)])
+
+# Function returning the slices into a grid covering the global
+# index box 'box' which picks out the part also
+# covered by 'otherbox'. If the boxes do not overlap,
+# None is returned.
+@cython.header(# Arguments
+               box='tuple',
+               otherbox='tuple',
+               # Locals
+               dim='int',
+               slices='list',
+               start='Py_ssize_t',
+               stop='Py_ssize_t',
+               returns='object',  # tuple or None
+               )
+def box_overlap(box, otherbox):
+    slices = []
+    for dim in range(3):
+        start = box[dim][0] if box[dim][0] > otherbox[dim][0] else otherbox[dim][0]
+        stop  = box[dim][1] if box[dim][1] < otherbox[dim][1] else otherbox[dim][1]
+        if start >= stop:
+            return None
+        slices.append(slice(start - box[dim][0], stop - box[dim][0]))
+    return tuple(slices)
+
+# Function for redistributing a global grid between two different
+# decompositions among the processes of a communicator
+@cython.header(# Arguments
+               communicator='object',  # mpi4py.MPI.Intracomm
+               sendgrid='object',      # np.ndarray
+               sendbox='tuple',
+               recvboxes='list',
+               recvgrid='object',      # np.ndarray
+               recvbox='tuple',
+               sendboxes='list',
+               # Locals
+               blocks='list',
+               factor='Py_ssize_t',
+               recvbuf='object',  # np.ndarray
+               recvcounts='int[::1]',
+               recvdispls='int[::1]',
+               sendbuf='object',  # np.ndarray
+               sendcounts='int[::1]',
+               senddispls='int[::1]',
+               slices='object',  # tuple or None
+               ℓ='int',
+               )
+def redistribute_boxes(communicator, sendgrid, sendbox, recvboxes, recvgrid, recvbox, sendboxes):
+    """The local sendgrid covers the global index box sendbox,
+    while recvboxes[ℓ] is the box to be covered by process ℓ
+    (within communicator) after the redistribution. Likewise, the local
+    recvgrid should end up covering recvbox, while sendboxes[ℓ] is the
+    box covered by process ℓ before the redistribution. The grids may
+    be real or complex, but they must be of the same type.
+    All communication is done through a single Alltoallv.
+    """
+    # Elements are communicated as one or more reals
+    factor = sendgrid.itemsize//np.dtype(C2np['real']).itemsize
+    # Pack the parts of the send grid to be send to each process
+    # contiguously together.
+    blocks = []
+    sendcounts = zeros(communicator.size, dtype=C2np['int'])
+    for ℓ in range(communicator.size):
+        slices = box_overlap(sendbox, recvboxes[ℓ])
+        if slices is None:
+            continue
+        blocks.append(sendgrid[slices].ravel())
+        sendcounts[ℓ] = factor*blocks[len(blocks) - 1].size
+    if blocks:
+        sendbuf = np.concatenate(blocks).view(C2np['real'])
+    else:
+        sendbuf = empty(0, dtype=C2np['real'])
+    recvcounts = zeros(communicator.size, dtype=C2np['int'])
+    for ℓ in range(communicator.size):
+        slices = box_overlap(recvbox, sendboxes[ℓ])
+        if slices is not None:
+            recvcounts[ℓ] = factor*np.prod(recvgrid[slices].shape)
+    senddispls = asarray(np.concatenate(([0], np.cumsum(sendcounts)[:-1])), dtype=C2np['int'])
+    recvdispls = asarray(np.concatenate(([0], np.cumsum(recvcounts)[:-1])), dtype=C2np['int'])
+    recvbuf = empty(np.sum(recvcounts), dtype=C2np['real'])
+    communicator.Alltoallv([sendbuf, (asarray(sendcounts), asarray(senddispls)), MPI_real],
+                           [recvbuf, (asarray(recvcounts), asarray(recvdispls)), MPI_real])
+    # Unpack the received blocks into the receive grid
+    for ℓ in range(communicator.size):
+        slices = box_overlap(recvbox, sendboxes[ℓ])
+        if slices is None:
+            continue
+        recvgrid[slices] = (recvbuf[recvdispls[ℓ]:(recvdispls[ℓ] + recvcounts[ℓ])]
+                            .view(recvgrid.dtype)
+                            .reshape(recvgrid[slices].shape)
+                            )
+
+# Function that returns a pencil decomposed grid
+@cython.pheader(# Arguments
+                gridsize='Py_ssize_t',
+                buffer_name='object',  # int or str
+                nullify='bint',
+                # Locals
+                box_3='tuple',
+                box_real='tuple',
+                fourier_shape='tuple',
+                memory='object',  # np.ndarray
+                pencil='real[:, :, ::1]',
+                pencil_fourier='object',  # np.ndarray
+                pencil_real='object',     # np.ndarray
+                real_shape='tuple',
+                returns='real[:, :, ::1]',
+                )
+def get_pencil(gridsize, buffer_name=0, nullify=False):
+    """The returned pencil is in real space, of shape
+    (size_local_i, size_local_j, 2*(gridsize//2 + 1)), with the last
+    dimension padded as for the slabs. The Fourier space pencil shares
+    its memory with the real space pencil and is returned by fft().
+    """
+    # If this pencil has already been constructed, fetch it
+    pencil = pencils.get((gridsize, buffer_name))
+    if pencil is not None:
+        if nullify:
+            pencil[...] = 0
+        return pencil
+    (_, _,
+     box_real, _,
+     _, _,
+     _, _, _,
+     box_3, _,
+     ) = get_pencil_layout(gridsize)
+    # Allocate memory large enough to hold both the real
+    # and the Fourier space pencil.
+    real_shape = box_shape(box_real)[:2] + (2*(gridsize//2 + 1), )
+    fourier_shape = (box_3[1][1] - box_3[1][0],
+                     gridsize,
+                     2*(box_3[2][1] - box_3[2][0]),
+                     )
+    memory = zeros(np.max([np.prod(real_shape), np.prod(fourier_shape)]), dtype=C2np['real'])
+    pencil_real = memory[:np.prod(real_shape)].reshape(real_shape)
+    pencil_fourier = memory[:np.prod(fourier_shape)].reshape(fourier_shape)
+    pencil = pencil_real
+    # Store this pencil and its Fourier space counterpart
+    pencils[gridsize, buffer_name] = pencil
+    pencils_mapping[memory.ctypes.data] = (gridsize, pencil_real, pencil_fourier)
+    record_mesh_memory()
+    return pencil
+# Cache storing pencils. The keys have the format (gridsize, buffer_name).
+cython.declare(pencils='dict')
+pencils = {}
+# Mapping from memory addresses of pencils to tuples of the form
+# (gridsize, real space pencil, Fourier space pencil).
+cython.declare(pencils_mapping='dict')
+pencils_mapping = {}
+# The complex type stored in Fourier space pencils
+cython.declare(pencil_complex='str')
+pencil_complex = 'complex64' if C2np['real'] is C2np['float'] else 'complex128'
+
+# Function for transfering data from domain grids to pencils
+@cython.header(# Arguments
+               domain_grid='real[:, :, ::1]',
+               gridsize='Py_ssize_t',
+               buffer_name='object',  # int or str
+               # Locals
+               box_real='tuple',
+               boxes_real='list',
+               domain_box='tuple',
+               domain_boxes='list',
+               domain_grid_noghosts='real[:, :, :]',
+               pencil='real[:, :, ::1]',
+               returns='real[:, :, ::1]',
+               )
+def pencil_decompose(domain_grid, gridsize, buffer_name):
+    pencil = get_pencil(gridsize, buffer_name)
+    (_, _,
+     box_real, boxes_real,
+     _, _,
+     _, _, _,
+     _, _,
+     ) = get_pencil_layout(gridsize)
+    domain_boxes = get_domain_boxes(gridsize)
+    domain_box = domain_boxes[rank]
+    # Domain grid without ghost layers and pseudo points
+    domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 3),
+                                       2:(domain_grid.shape[1] - 3),
+                                       2:(domain_grid.shape[2] - 3)]
+    redistribute_boxes(comm,
+                       asarray(domain_grid_noghosts), domain_box, boxes_real,
+                       asarray(pencil)[:, :, :gridsize], box_real, domain_boxes,
+                       )
+    return pencil
+
+# Function for transfering data from pencils to domain grids
+@cython.header(# Arguments
+               pencil='real[:, :, ::1]',
+               domain_grid='real[:, :, ::1]',
+               gridsize='Py_ssize_t',
+               # Locals
+               box_real='tuple',
+               boxes_real='list',
+               domain_box='tuple',
+               domain_boxes='list',
+               domain_grid_noghosts='real[:, :, :]',
+               returns='real[:, :, ::1]',
+               )
+def pencil_compose(pencil, domain_grid, gridsize):
+    (_, _,
+     box_real, boxes_real,
+     _, _,
+     _, _, _,
+     _, _,
+     ) = get_pencil_layout(gridsize)
+    domain_boxes = get_domain_boxes(gridsize)
+    domain_box = domain_boxes[rank]
+    # Domain grid without ghost layers and pseudo points
+    domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 3),
+                                       2:(domain_grid.shape[1] - 3),
+                                       2:(domain_grid.shape[2] - 3)]
+    redistribute_boxes(comm,
+                       asarray(pencil)[:, :, :gridsize], box_real, domain_boxes,
+                       asarray(domain_grid_noghosts), domain_box, boxes_real,
+                       )
+    # Populate pseudo points and ghost layers
+    communicate_domain(domain_grid, mode='populate')
+    return domain_grid
+
+# Function returning the global index boxes
+# of the domain grids of all processes.
+@cython.header(# Arguments
+               gridsize='Py_ssize_t',
+               # Locals
+               boxes='list',
+               dim='int',
+               indices='tuple',
+               size='Py_ssize_t[::1]',
+               ℓ='int',
+               returns='list',
+               )
+def get_domain_boxes(gridsize):
+    size = asarray([gridsize//domain_subdivisions[dim] for dim in range(3)],
+                   dtype=C2np['Py_ssize_t'])
+    boxes = []
+    for ℓ in range(nprocs):
+        indices = np.unravel_index(ℓ, asarray(domain_subdivisions))
+        boxes.append(tuple([(indices[dim]*size[dim], (indices[dim] + 1)*size[dim])
+                            for dim in range(3)]))
+    return boxes
+
+# Function performing Fourier transformations of pencil decomposed grids
+@cython.header(# Arguments
+               pencil='real[:, :, ::1]',
+               direction='str',
+               # Locals
+               box_1='tuple',
+               box_2='tuple',
+               box_3='tuple',
+               boxes_1='list',
+               boxes_2_col='list',
+               boxes_2_row='list',
+               boxes_3='list',
+               comm_col='object',  # mpi4py.MPI.Intracomm
+               comm_row='object',  # mpi4py.MPI.Intracomm
+               grid_1='object',  # np.ndarray
+               grid_2='object',  # np.ndarray
+               grid_3='object',  # np.ndarray
+               gridsize='Py_ssize_t',
+               pencil_fourier='object',  # np.ndarray
+               pencil_real='object',     # np.ndarray
+               returns='real[:, :, ::1]',
+               )
+def fft_pencil(pencil, direction):
+    """See the get_pencil_layout function for the steps involved.
+    The 1D transformations are carried out by NumPy. As for the slabs,
+    the transformations are unnormalized, in both directions.
+    The pencil in the other space is returned.
+    """
+    gridsize, pencil_real, pencil_fourier = pencils_mapping[asarray(pencil).ctypes.data]
+    (comm_row, comm_col,
+     _, _,
+     box_1, boxes_1,
+     box_2, boxes_2_row, boxes_2_col,
+     box_3, boxes_3,
+     ) = get_pencil_layout(gridsize)
+    if direction == 'forward':
+        # Step 1: Real transformation along k
+        grid_1 = np.fft.rfft(pencil_real[:, :, :gridsize], axis=2)
+        # Step 2: Complex transformation along j
+        grid_2 = empty(box_shape(box_2), dtype='complex128')
+        redistribute_boxes(comm_row, grid_1, box_1, boxes_2_row, grid_2, box_2, boxes_1)
+        grid_2 = np.fft.fft(grid_2, axis=1)
+        # Step 3: Complex transformation along i
+        grid_3 = empty(box_shape(box_3), dtype='complex128')
+        redistribute_boxes(comm_col, grid_2, box_2, boxes_3, grid_3, box_3, boxes_2_col)
+        grid_3 = np.fft.fft(grid_3, axis=0)
+        # Store the result transposed, as [j, i, k]
+        pencil_fourier.view(pencil_complex)[...] = grid_3.transpose([1, 0, 2])
+        return pencil_fourier
+    elif direction == 'backward':
+        # Undo step 3
+        grid_3 = np.fft.ifft(pencil_fourier.view(pencil_complex).transpose([1, 0, 2]), axis=0)
+        grid_2 = empty(box_shape(box_2), dtype='complex128')
+        redistribute_boxes(comm_col, grid_3, box_3, boxes_2_col, grid_2, box_2, boxes_3)
+        # Undo step 2
+        grid_2 = np.fft.ifft(grid_2, axis=1)
+        grid_1 = empty(box_shape(box_1), dtype='complex128')
+        redistribute_boxes(comm_row, grid_2, box_2, boxes_1, grid_1, box_1, boxes_2_row)
+        # Undo step 1. Remove the autoscaling provided by NumPy.
+        pencil_real[:, :, :gridsize] = np.fft.irfft(grid_1, gridsize, axis=2)*float(gridsize)**3
+        return pencil_real
+    abort('fft_pencil was called with the direction "{}", '
+          'which is neither "forward" nor "backward".'.format(direction))
+
+# Function returning the global j and kk (complex k) indices of the
+# first element of a local Fourier space slab or pencil.
+@cython.pheader(# Arguments
+                slab='real[:, :, ::1]',
+                # Locals
+                box_3='tuple',
+                gridsize='Py_ssize_t',
+                returns='tuple',
+                )
+def fourier_offsets(slab):
+    """Loops over Fourier space slabs or pencils should then use
+    j_global = j_start + j and kk = kk_start + k//2.
+    """
+    if not pencils_mapping or asarray(slab).ctypes.data not in pencils_mapping:
+        return slab.shape[0]*rank, 0
+    gridsize = pencils_mapping[asarray(slab).ctypes.data][0]
+    box_3 = get_pencil_layout(gridsize)[9]
+    return box_3[1][0], box_3[2][0]
+
+# Function for interpolating components to the φ grid and Fourier
+# transforming it, optionally using interlacing.
+@cython.pheader(# Arguments
+                component_or_components='object', # Component or list of Components
+                quantities='list',
+                # Locals
+                component='Component',
+                components='list',
+                i='Py_ssize_t',
+                j='Py_ssize_t',
+                j_global='Py_ssize_t',
+                k='Py_ssize_t',
+                key='tuple',
+                ki='Py_ssize_t',
+                kj='Py_ssize_t',
+                kk='Py_ssize_t',
+                phase_im='double',
+                phase_re='double',
+                slab='real[:, :, ::1]',
+                slab_jik='real*',
+                slab_shifted='real[:, :, ::1]',
+                slab_shifted_jik='real*',
+                slab_start_j='Py_ssize_t',
+                slab_start_kk='Py_ssize_t',
+                weights='list',
+                θ='double',
+                φ='real[:, :, ::1]',
+                returns='real[:, :, ::1]',
+                )
+def CIC_components2slab_fourier(component_or_components, quantities):
+    """The components are interpolated to the φ grid as in
+    CIC_components2φ, after which the grid is communicated to the slabs
+    (or pencils) and Fourier transformed. The returned Fourier space
+    slab is not deconvolved.
+    With pm_interlacing enabled, the particles are further interpolated
+    to a second grid, shifted by half a grid cell along each dimension.
+    Averaging the two in Fourier space, after correcting the phase of
+    the shifted grid, cancels the leading (odd) aliasing contributions.
+    Interlacing is only applied when all components are particles,
+    as fluid elements cannot be shifted.
+    The resulting slab of particle components is cached, so that a
+    subsequent call with the same particles at the same positions
+    (e.g. the power spectrum following the PM force or vice versa)
+    only needs to copy the cached slab, possibly rescaled. As the cache
+    holds an additional copy of the slab, it is only used when the
+    fourier_density_caching parameter is set.
+    """
+    components = (component_or_components if isinstance(component_or_components, list)
+                  else [component_or_components])
+    # Look up the slab in the cache
+    key, weights = get_fourier_density_key(components, quantities)
+    slab = fourier_density_cache_lookup(key, weights)
+    if slab is not None:
+        return slab
+    φ = CIC_components2φ(component_or_components, quantities)
+    slab = slab_decompose(φ, prepare_fft=True)
+    slab = fft(slab, 'forward')
+    if not pm_interlacing or any([component.representation != 'particles'
+                                  for component in components]):
+        fourier_density_cache_store(key, weights, slab)
+        return slab
+    # Interpolate to the shifted grid. The φ grid is reused.
+    φ = CIC_components2φ(component_or_components, quantities, shift=0.5)
+    slab_shifted = slab_decompose(φ, 'slab_interlaced', prepare_fft=True)
+    slab_shifted = fft(slab_shifted, 'forward')
+    # Average the two grids. As the shifted grid holds the field at
+    # positions displaced by -1/2 grid cell, its Fourier modes carry an
+    # additional phase of exp(-iθ), θ = π(ki + kj + kk)/φ_gridsize.
+    slab_start_j, slab_start_kk = fourier_offsets(slab)
+    for j in range(ℤ[slab.shape[0]]):
+        j_global = slab_start_j + j
+        if j_global > ℤ[φ_gridsize//2]:
+            kj = j_global - φ_gridsize
+        else:
+            kj = j_global
+        for i in range(φ_gridsize):
+            if i > ℤ[φ_gridsize//2]:
+                ki = i - φ_gridsize
+            else:
+                ki = i
+            for k in range(0, ℤ[slab.shape[2]], 2):
+                kk = slab_start_kk + k//2
+                θ = ℝ[π/φ_gridsize]*(ki + kj + kk)
+                phase_re = cos(θ)
+                phase_im = sin(θ)
+                slab_jik = cython.address(slab[j, i, k:])
+                slab_shifted_jik = cython.address(slab_shifted[j, i, k:])
+                slab_jik[0] = 0.5*(slab_jik[0] + slab_shifted_jik[0]*phase_re
+                                               - slab_shifted_jik[1]*phase_im)
+                slab_jik[1] = 0.5*(slab_jik[1] + slab_shifted_jik[0]*phase_im
+                                               + slab_shifted_jik[1]*phase_re)
+    fourier_density_cache_store(key, weights, slab)
+    return slab
+
+# Helper function for CIC_components2slab_fourier, constructing the
+# key of the Fourier space density cache along with the weights of the
+# components. A key of None is returned if the density cannot be cached.
+@cython.header(# Arguments
+               components='list',
+               quantities='list',
+               # Locals
+               component='Component',
+               factors='object',  # float or list
+               i='Py_ssize_t',
+               name='str',
+               order='list',
+               quantity='object',  # str or tuple
+               weights='list',
+               returns='tuple',
+               )
+def get_fourier_density_key(components, quantities):
+    """Only particle components interpolated with
+    quantities = [('particles', [...]), ...] are cached, as only their
+    state is fully tracked by component.state_count. Fluid quantities
+    (which are ignored by particle components) may be present as well.
+    The key consists of the instance_id and state of each component,
+    sorted so that the order of the components does not matter.
+    The weights are kept separate from the key, as the density is
+    linear in these.
+    """
+    if not fourier_density_caching:
+        return None, None
+    if any([component.representation != 'particles' for component in components]):
+        return None, None
+    weights = []
+    for quantity in quantities:
+        if isinstance(quantity, str):
+            name, factors = quantity, 1
+        else:
+            name, factors = quantity[0], quantity[1]
+        if name in ('ϱ', 'fluid elements'):
+            continue
+        if name != 'particles' or weights:
+            return None, None
+        if isinstance(factors, (int, float)):
+            factors = [factors]*len(components)
+        weights = [float(factor) for factor in factors]
+    if not weights:
+        return None, None
+    order = sorted([(component.instance_id, i) for i, component in enumerate(components)])
+    return (tuple([(components[i].instance_id, components[i].state_count) for _, i in order]),
+            [weights[i] for _, i in order])
+
+# Helper function for CIC_components2slab_fourier, looking up
+# the Fourier space density in the cache. If the cached density matches
+# the key and the weights up to a common factor, the returned slab is
+# populated with the correspondingly scaled cached density.
+# Otherwise, None is returned.
+@cython.header(# Arguments
+               key='tuple',
+               weights='list',
+               # Locals
+               i='Py_ssize_t',
+               ratio='double',
+               slab='real[:, :, ::1]',
+               weights_cached='list',
+               returns='object',  # real[:, :, ::1] or NoneType
+               )
+def fourier_density_cache_lookup(key, weights):
+    if key is None or key != fourier_density_cache.get('key'):
+        return None
+    weights_cached = fourier_density_cache['weights']
+    ratio = weights[0]/weights_cached[0]
+    for i in range(len(weights)):
+        if not isclose(weights[i], ratio*weights_cached[i], rel_tol=1e-12):
+            return None
+    masterprint('Reusing cached Fourier space density ...')
+    slab = fourier_density_cache['slab']
+    asarray(slab)[...] = ratio*fourier_density_cache['data']
+    masterprint('done')
+    return slab
+
+# Helper function for CIC_components2slab_fourier, storing
+# the Fourier space density in the cache. The slab itself is kept as
+# well, as it is a persistent buffer which the cached density
+# should be copied back into.
+@cython.header(# Arguments
+               key='tuple',
+               weights='list',
+               slab='real[:, :, ::1]',
+               )
+def fourier_density_cache_store(key, weights, slab):
+    fourier_density_cache.clear()
+    if key is None or 0 in weights:
+        return
+    fourier_density_cache['key'] = key
+    fourier_density_cache['weights'] = weights
+    fourier_density_cache['slab'] = slab
+    fourier_density_cache['data'] = asarray(slab).copy()
+    record_mesh_memory()
+# Cache of the most recently computed Fourier space density,
+# populated by fourier_density_cache_store.
+cython.declare(fourier_density_cache='dict')
+fourier_density_cache = {}
+
+# Function returning the number of bytes currently used by each kind
+# of grid held by this module, updating the high-water marks.
+@cython.header(# Locals
+               grid='object',  # np.ndarray
+               key='object',  # tuple
+               memory='dict',
+               name='str',
+               nbytes='Py_ssize_t',
+               returns='dict',
+               )
+def record_mesh_memory():
+    memory = {'FFTW slabs': 0, 'FFTW batch grids': 0, 'pencils': 0, 'Fourier density cache': 0}
+    for key in slabs:
+        memory['FFTW slabs'] += asarray(slabs[key]).nbytes
+    for key in fftw_batch_grids:
+        memory['FFTW batch grids'] += asarray(fftw_batch_grids[key]).nbytes
+    for key in pencils_mapping:
+        nbytes = 0
+        for grid in pencils_mapping[key][1:]:
+            if asarray(grid).nbytes > nbytes:
+                nbytes = asarray(grid).nbytes
+        memory['pencils'] += nbytes
+    if 'data' in fourier_density_cache:
+        memory['Fourier density cache'] = fourier_density_cache['data'].nbytes
+    for name, nbytes in memory.items():
+        if nbytes > mesh_memory_highwater.get(name, 0):
+            mesh_memory_highwater[name] = nbytes
+    return memory
+# Peak number of bytes used by each kind of grid
+cython.declare(mesh_memory_highwater='dict')
+mesh_memory_highwater = {}
+
+# Function for releasing the memory held by the caches of this module
+# and by the global buffers of the communication module.
+@cython.pheader(# Locals
+                batch_grid='real[::1]',
+                cached_address='Py_ssize_t',
+                freed='Py_ssize_t',
+                key='object',  # tuple
+                request='object',  # mpi4py.MPI.Prequest or bint
+                returns='Py_ssize_t',
+                )
+def release_mesh_memory():
+    """Grids are never freed during the time stepping, as they are
+    reused from step to step. Consequently, grids needed only at output
+    times (e.g. for power spectra of a larger gridsize than φ_gridsize)
+    or buffers enlarged by a single large exchange keep their memory
+    for the remainder of the run. This function should be called at
+    points where no grids or buffers are in use (e.g. after dumps).
+    All FFTW slabs, batch grids, pencils, cached communication requests
+    and global buffers are released, to be reallocated lazily when
+    needed again. Replanning FFTW is cheap, as the plans are
+    reconstructed from the wisdom. The Fourier space density cache
+    (if enabled by fourier_density_caching) is kept together with its
+    slab, as it is likely to be reused by the following PM step.
+    This function must be called by all processes. The number of bytes
+    freed by the local process is returned.
+    """
+    freed = sum(record_mesh_memory().values())
+    # Free the persistent communication requests
+    # together with the buffer specifications.
+    for request in decomposition_requests.values():
+        if request:
+            request.Free()
+    decomposition_requests.clear()
+    decomposition_specs.clear()
+    # The slab or pencil referenced by the Fourier space density cache
+    cached_address = -1
+    if 'slab' in fourier_density_cache:
+        cached_address = asarray(fourier_density_cache['slab']).ctypes.data
+    # Free FFTW slabs
+    for key in list(slabs):
+        if asarray(slabs[key]).ctypes.data == cached_address:
+            continue
+        if not cython.compiled:
+            slabs.pop(key)
+        else:
+            free_fftw_slab(key[0], key[1])
+    # Free the interleaved grids used by fft_batch
+    for key in fftw_batch_grids:
+        batch_grid = fftw_batch_grids[key]
+        free_fftw_grid(cython.address(batch_grid[0]), fftw_batches[key])
+    fftw_batch_grids.clear()
+    fftw_batches.clear()
+    # Drop the pencils, which are NumPy arrays
+    for key in list(pencils):
+        if asarray(pencils[key]).ctypes.data != cached_address:
+            pencils.pop(key)
+    for key in list(pencils_mapping):
+        if key != cached_address:
+            pencils_mapping.pop(key)
+    freed -= sum(record_mesh_memory().values())
+    # Shrink the global buffers
+    freed += release_buffers()
+    return freed
+
+# Function for printing the memory used by the global buffers and the
+# grids, with the current and peak number of bytes for each.
+@cython.pheader(# Arguments
+                heading='str',
+                # Locals
+                entries='dict',
+                entries_all='list',
+                label='str',
+                label_width='Py_ssize_t',
+                labels='list',
+                memory='dict',
+                name='object',  # Any hashable object
+                nbytes='Py_ssize_t',
+                nbytes_peak='Py_ssize_t',
+                row='list',
+                rows='list',
+                )
+def print_memory_report(heading=''):
+    """The memory is gathered from all processes. For each entry, the
+    largest amount used by any single process is shown together with
+    the sum over all processes. This function must be called by
+    all processes.
+    """
+    entries = {}
+    for name, (nbytes, nbytes_peak) in get_buffers_memory().items():
+        entries['buffer {!r}'.format(name)] = (nbytes, nbytes_peak)
+    memory = record_mesh_memory()
+    for label, nbytes in memory.items():
+        entries[label] = (nbytes, mesh_memory_highwater.get(label, nbytes))
+    entries_all = gather(entries)
+    if not master:
+        return
+    labels = []
+    for entries in entries_all:
+        for label in entries:
+            if label not in labels:
+                labels.append(label)
+    rows = [['', 'current (max)', 'peak (max)', 'current (total)']]
+    for label in labels + ['total']:
+        if label == 'total':
+            row = [label,
+                   np.max([sum([entry[0] for entry in entries.values()])
+                           for entries in entries_all]),
+                   np.max([sum([entry[1] for entry in entries.values()])
+                           for entries in entries_all]),
+                   sum([sum([entry[0] for entry in entries.values()])
+                        for entries in entries_all]),
+                   ]
+        else:
+            row = [label,
+                   np.max([entries.get(label, (0, 0))[0] for entries in entries_all]),
+                   np.max([entries.get(label, (0, 0))[1] for entries in entries_all]),
+                   sum([entries.get(label, (0, 0))[0] for entries in entries_all]),
+                   ]
+        rows.append([row[0]] + [format_bytes(nbytes) for nbytes in row[1:]])
+    label_width = np.max([len(row[0]) for row in rows])
+    masterprint('Memory report{}:'.format(' ({})'.format(heading) if heading else ''))
+    for row in rows:
+        masterprint('    {}  {}'.format(
+            row[0].ljust(label_width), '  '.join([cell.rjust(15) for cell in row[1:]])
+        ))
+
+# Function for formatting a number of bytes
+# using the appropriate binary prefix.
+@cython.header(# Arguments
+               nbytes='Py_ssize_t',
+               # Locals
+               unit='str',
+               value='double',
+               returns='str',
+               )
+def format_bytes(nbytes):
+    value = nbytes
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024:
+            break
+        value /= 1024
+    else:
+        unit = 'TiB'
+    if unit == 'B':
+        return '{} {}'.format(nbytes, unit)
+    return '{} {}'.format(significant_figures(value, 3, fmt='unicode'), unit)
 
 # Function for checking that the slabs satisfy the required symmetry
 # of a Fourier transformed real field.
 @cython.pheader(# Arguments
-                slab='double[:, :, ::1]',
+                slab='real[:, :, ::1]',
                 rel_tol='double',
                 abs_tol='double',
                 # Locals
                 bad_pairs='set',
-                global_slab='double[:, :, ::1]',
+                global_slab='real[:, :, ::1]',
                 gridsize='Py_ssize_t',
                 i='Py_ssize_t',
                 i_conj='Py_ssize_t',
@@ -1628,8 +2726,8 @@ def free_fftw_slab(gridsize, buffer_name):
                 plane='int',
                 re1='double',
                 re2='double',
-                slab_jik='double*',
-                slab_jik_conj='double*',
+                slab_jik='real*',
+                slab_jik_conj='real*',
                 slave='int',
                 t1='tuple',
                 t2='tuple',
@@ -1652,7 +2750,7 @@ def slabs_check_symmetry(slab, rel_tol=1e-9, abs_tol=machine_ϵ):
         global_slab = slab
     else:
         if master:
-            global_slab = empty((gridsize, gridsize, slab.shape[2]), dtype=C2np['double'])
+            global_slab = empty((gridsize, gridsize, slab.shape[2]), dtype=C2np['real'])
             global_slab[:slab.shape[0], :, :] = slab[...]
             for slave in range(1, nprocs):
                 j1 = slab.shape[0]*slave
@@ -1718,15 +2816,15 @@ def slabs_check_symmetry(slab, rel_tol=1e-9, abs_tol=machine_ϵ):
 
 # Function for differentiating domain grids
 @cython.pheader(# Arguments
-                grid='double[:, :, ::1]',
+                grid='real[:, :, ::1]',
                 dim='int',
                 h='double',
-                buffer_or_buffer_name='object',  # double[:, :, ::1] or int or str
+                buffer_or_buffer_name='object',  # real[:, :, ::1] or int or str
                 order='int',
                 direction='str',
                 noghosts='bint',
                 # Locals
-                buffer='double[:, :, ::1]',
+                buffer='real[:, :, ::1]',
                 buffer_i='Py_ssize_t',
                 buffer_j='Py_ssize_t',
                 buffer_k='Py_ssize_t',
@@ -1748,7 +2846,7 @@ def slabs_check_symmetry(slab, rel_tol=1e-9, abs_tol=machine_ϵ):
                 k='Py_ssize_t',
                 shape='tuple',
                 value='double',
-                returns='double[:, :, ::1]',
+                returns='real[:, :, ::1]',
                 )
 def diff_domain(grid, dim, h=1, buffer_or_buffer_name=0,
                 order=4, direction='forward', noghosts=True):
@@ -1796,7 +2894,7 @@ def diff_domain(grid, dim, h=1, buffer_or_buffer_name=0,
         else:
             shape = asarray(grid).shape
         buffer_name = buffer_or_buffer_name
-        buffer = get_buffer(shape, buffer_name, nullify=True)
+        buffer = get_buffer(shape, buffer_name, nullify=True, dtype='real')
     else:
         buffer = buffer_or_buffer_name
     # Do the differentiation and add the results to the buffer
@@ -1888,11 +2986,6 @@ def diff_domain(grid, dim, h=1, buffer_or_buffer_name=0,
     return buffer
 
 
-# Function pointer types used in this module
-pxd = """
-ctypedef double* (*func_dstar_ddd)(double, double, double)
-"""
-
 # Import declarations from fft.c
 pxd = """
 # FFT functionality via FFTW from fft.c
@@ -1907,16 +3000,21 @@ cdef extern from "fft.c":
         ptrdiff_t gridsize_local_j
         ptrdiff_t gridstart_local_i
         ptrdiff_t gridstart_local_j
-        double* grid
+        real* grid
         fftw_plan plan_forward
         fftw_plan plan_backward
+        char* wisdom
     # Functions
     fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
                                   ptrdiff_t gridsize_j,
                                   ptrdiff_t gridsize_k,
+                                  ptrdiff_t howmany,
                                   char*     rigor,
-                                  bint fftw_wisdom_reuse)
+                                  char*     wisdom)
     void fftw_execute(fftw_plan plan)
-    void fftw_clean(double* grid, fftw_plan plan_forward,
-                                  fftw_plan plan_backward)
+    void fftw_free_wisdom(char* wisdom)
+    const char* fftw_get_version()
+    void fftw_free_grid(real* grid, fftw_plan plan_forward,
+                                    fftw_plan plan_backward)
+    void fftw_clean()
 """
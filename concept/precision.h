@@ -0,0 +1,39 @@
+/*
+This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+Copyright © 2015-2017 Jeppe Mosgaard Dakin.
+
+CO𝘕CEPT is free software: You can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+CO𝘕CEPT is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+
+The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+The latest version of CO𝘕CEPT is available at
+https://github.com/jmd-dk/concept/
+*/
+
+
+
+#ifndef PRECISION_H
+#define PRECISION_H
+
+/* This file defines the floating-point type 'real', used for the
+values of all mesh grids (the potential, fluid and FFT grids).
+It is double unless the code is built with SINGLE_PRECISION defined,
+in which case it is float. Particle data are always double.
+*/
+#ifdef SINGLE_PRECISION
+typedef float real;
+#else
+typedef double real;
+#endif
+
+#endif
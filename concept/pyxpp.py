@@ -39,7 +39,8 @@ all arguments being filenames except the optional --no-optimization:
 
 In the first case where a .pyx file is created from a .py file,
 the following changes happens to the source code (in the .pyx file):
-- Insert the line 'cimport cython' at the very top,
+- Insert the lines 'cimport cython' and
+  'from cython.parallel cimport prange, threadid' at the very top,
   though below any __future__ imports.
 - Transform statements written over multiple lines into single lines.
   The exception is decorator statements, which remain multilined.
@@ -104,7 +105,9 @@ def cimport_cython(lines):
             and not line.lstrip().startswith('#')
             and not '__future__' in line
             ):
-            lines = lines[:i] + ['cimport cython\n'] + lines[i:]
+            lines = lines[:i] + ['cimport cython\n',
+                                 'from cython.parallel cimport prange, threadid\n',
+                                 ] + lines[i:]
             break
     return lines
 
@@ -1565,7 +1568,8 @@ def make_types(filename):
                                           '    ctypedef struct fftw_plan_struct:\n'
                                           '        pass\n'
                                           '    ctypedef fftw_plan_struct *fftw_plan',
-                    'fftw_return_struct': 'cdef extern from "fft.c":\n'
+                    'fftw_return_struct': 'from commons cimport real\n'
+                                          'cdef extern from "fft.c":\n'
                                           '    ctypedef struct fftw_plan_struct:\n'
                                           '        pass\n'
                                           '    ctypedef fftw_plan_struct *fftw_plan\n'
@@ -1574,9 +1578,11 @@ def make_types(filename):
                                           '        ptrdiff_t gridsize_local_j\n'
                                           '        ptrdiff_t gridstart_local_i\n'
                                           '        ptrdiff_t gridstart_local_j\n'
-                                          '        double* grid\n'
+                                          '        real* grid\n'
                                           '        fftw_plan plan_forward\n'
                                           '        fftw_plan plan_backward',
+                    # The floating-point type of mesh grids
+                    'real': 'from commons cimport real',
                     # GSL functions (... understood by make_pxd)
                     'gsl_...': 'from cython_gsl cimport *',
                     }
@@ -1950,9 +1956,10 @@ def make_pxd(filename):
         # variable name.
         vartype = vartype.replace('...', r'[_a-zA-Z0-9]*')
         # Search the entire .pyx file for string of the form
-        # varname = 'vartype'.
+        # varname = 'vartype', varname = 'vartype*'
+        # or varname = 'vartype[...]'.
         if re.search((  r"""(^|[,;(\s])[_a-zA-Z][_a-zA-Z0-9]*\s*="""
-                      + r"""\s*(?P<quote>['"]){vartype}\*?(?P=quote)"""
+                      + r"""\s*(?P<quote>['"]){vartype}(\*|\[[^'"]*\])?(?P=quote)"""
                       ).format(vartype=vartype),
                      code_str,
                      re.MULTILINE):
@@ -1961,9 +1968,9 @@ def make_pxd(filename):
             header_lines.append(vardeclaration)
             continue
         # For extension type attributes another syntax is used;
-        # vartype varname
+        # vartype varname (or vartype[...] varname)
         # Also search after this.
-        if re.search((  r"""\s*{vartype}\s*\*?\s*"""
+        if re.search((  r"""\s*{vartype}(\[[^\]]*\])?\s*\*?\s*"""
                       + r"""(^|[,;(\s])[_a-zA-Z][_a-zA-Z0-9]*\s*"""
                       ).format(vartype=vartype),
                      code_str,
@@ -99,7 +99,7 @@ class StandardSnapshot:
                    multi_index='tuple',
                    name='object',  # str or int
                    shape='tuple',
-                   slab='double[:, :, ::1]',
+                   slab='real[:, :, ::1]',
                    slab_end='Py_ssize_t',
                    slab_start='Py_ssize_t',
                    start_local='Py_ssize_t',
@@ -153,6 +153,14 @@ class StandardSnapshot:
                     momx_h5[start_local:end_local] = component.momx_mv[:component.N_local]
                     momy_h5[start_local:end_local] = component.momy_mv[:component.N_local]
                     momz_h5[start_local:end_local] = component.momz_mv[:component.N_local]
+                    # Save the optional particle data, if in use
+                    if component.use_masses:
+                        masses_h5 = component_h5.create_dataset('masses', shape,
+                                                                dtype=C2np['double'])
+                        masses_h5[start_local:end_local] = component.masses_mv[:component.N_local]
+                    if component.use_ids:
+                        ids_h5 = component_h5.create_dataset('ids', shape, dtype=np.uint64)
+                        ids_h5[start_local:end_local] = component.ids_mv[:component.N_local]
                     # Done saving this particle component
                     hdf5_file.flush()
                     Barrier()
@@ -278,19 +286,21 @@ class StandardSnapshot:
                     N_local='Py_ssize_t',
                     N_fluidvars='Py_ssize_t',
                     component='Component',
-                    domain_grid='double[:, :, ::1]',
+                    domain_grid='real[:, :, ::1]',
                     domain_size_i='Py_ssize_t',
                     domain_size_j='Py_ssize_t',
                     domain_size_k='Py_ssize_t',
                     end_local='Py_ssize_t',
                     eos_message='str',
                     fluidscalar='FluidScalar',
-                    grid='double*',
+                    grid='real*',
                     gridsize='Py_ssize_t',
                     i='Py_ssize_t',
+                    ids='unsigned long long int*',
                     independent='str',
                     index='Py_ssize_t',
                     mass='double',
+                    masses='double*',
                     momx='double*',
                     momy='double*',
                     momz='double*',
@@ -302,7 +312,7 @@ class StandardSnapshot:
                     representation='str',
                     shape='tuple',
                     size='Py_ssize_t',
-                    slab='double[:, :, ::1]',
+                    slab='real[:, :, ::1]',
                     slab_end='Py_ssize_t',
                     slab_start='Py_ssize_t',
                     snapshot_unit_length='double',
@@ -394,6 +404,30 @@ class StandardSnapshot:
                     momz_h5.read_direct(asarray(component.momz_mv),
                                         source_sel=np.s_[start_local:end_local],
                                         dest_sel=np.s_[:N_local])
+                    # Read in the individual particle masses,
+                    # if present in the snapshot.
+                    if 'masses' in component_h5:
+                        component.enable_particle_variable('masses')
+                        component_h5['masses'].read_direct(asarray(component.masses_mv),
+                                                           source_sel=np.s_[start_local:end_local],
+                                                           dest_sel=np.s_[:N_local])
+                        if snapshot_unit_mass != 1:
+                            masses = component.masses
+                            for i in range(N_local):
+                                masses[i] *= snapshot_unit_mass
+                    # Read in the particle IDs if these are in use.
+                    # If not present in the snapshot, the IDs are
+                    # given by the order of the particles within
+                    # the snapshot.
+                    if component.use_ids:
+                        if 'ids' in component_h5:
+                            component_h5['ids'].read_direct(asarray(component.ids_mv),
+                                                            source_sel=np.s_[start_local:end_local],
+                                                            dest_sel=np.s_[:N_local])
+                        else:
+                            ids = component.ids
+                            for i in range(N_local):
+                                ids[i] = start_local + i
                     # If the snapshot and the current run uses different
                     # systems of units, mulitply the component positions
                     # and momenta by the snapshot units.
@@ -546,9 +580,11 @@ class StandardSnapshot:
 @cython.cclass
 class Gadget2Snapshot:
     """This class represents snapshots of the "gadget2" type, meaning
-    the second type of snapshot native to GADGET2. Only GADGET2 type 1
-    (halo) particles, corresponding to dark matter particles, are
-    supported. It is however also possible to save a component with a
+    the second type of snapshot native to GADGET2. Only a single
+    component of dark matter particles is supported, which is saved as
+    GADGET2 type 1 (halo) particles. When loading, particles of all
+    types except type 0 (gas) are collected into this component.
+    It is however also possible to save a component with a
     species of "matter" as a Gadget2Snapshot.
     As is the case for the standard snapshot class, this class contains
     a list components (the components attribute) and dict of parameters
@@ -563,7 +599,8 @@ class Gadget2Snapshot:
     directly to this component. Finally, the ID attribute holds the
     GADGET IDs of particles. When constructing a Gadget2Snapshot
     instance by other means than by loading from a snapshot on disk,
-    these are generated in a somewhat arbitrary (but consistent)
+    these are taken from the component if it carries particle IDs, and
+    are otherwise generated in a somewhat arbitrary (but consistent)
     fashion.
     """
     # The properly written name of this snapshot type
@@ -598,7 +635,7 @@ class Gadget2Snapshot:
         public dict params
         public list components
         Component component
-        unsigned int[::1] ID
+        unsigned long long int[::1] ID
         """
         # Dict containing all the parameters of the snapshot
         self.params = {}
@@ -607,7 +644,8 @@ class Gadget2Snapshot:
         self.components = []
         # The actual component data
         self.component = None
-        # The ID of each particle (not used by the CO𝘕CEPT code)
+        # The ID of each particle (only used by the CO𝘕CEPT code
+        # when the particle_ids parameter is set).
         self.ID = None
 
     # Method for saving a GADGET2 snapshot of type 2 to disk
@@ -618,6 +656,8 @@ class Gadget2Snapshot:
                     N_local='Py_ssize_t',
                     i='int',
                     component='Component',
+                    id_size='Py_ssize_t',
+                    id_type='str',
                     unit='double',
                     returns='str',
                     )
@@ -625,7 +665,9 @@ class Gadget2Snapshot:
         """The snapshot data (positions and velocities) are stored in
         single precision. Only GADGET2 type 1 (halo) particles,
         corresponding to dark matter (or matter) particles,
-        are supported.
+        are supported. Individual particle masses are stored in a
+        MASS block, while particle IDs carried by the component
+        are stored using 8 bytes each.
         """
         masterprint('Saving GADGET2 snapshot "{}" ...'.format(filename))
         component = self.component
@@ -719,6 +761,12 @@ class Gadget2Snapshot:
                     if i == nprocs - 1:
                         f.write(struct.pack('i', 3*N*4))
         # Write the ID block in serial, one process at a time
+        if component.use_ids:
+            id_size = 8
+            id_type = 'unsigned long long int'
+        else:
+            id_size = 4
+            id_type = 'unsigned int'
         for i in range(nprocs):
             Barrier()
             if i == rank:
@@ -728,15 +776,37 @@ class Gadget2Snapshot:
                         # 8 = 4*1 + 4 = 4*sizeof(s) + sizeof(i)
                         f.write(struct.pack('I', 8))
                         f.write(struct.pack('4s', b'ID  '))
-                        # sizeof(i) + N*sizeof(I) + sizeof(i)
-                        f.write(struct.pack('I', 4 + N*4 + 4))
+                        # sizeof(i) + N*id_size + sizeof(i)
+                        f.write(struct.pack('I', 4 + N*id_size + 4))
                         f.write(struct.pack('I', 8))
-                        f.write(struct.pack('I', N*4))
+                        f.write(struct.pack('I', N*id_size))
                     # The data
-                    asarray(self.ID, dtype=C2np['unsigned int']).tofile(f)
+                    asarray(self.ID, dtype=C2np[id_type]).tofile(f)
                     # The closing int
                     if i == nprocs - 1:
-                        f.write(struct.pack('I', N*4))
+                        f.write(struct.pack('I', N*id_size))
+        # Write the MASS block in serial, one process at a time,
+        # if the particles have individual masses.
+        if component.use_masses:
+            unit = 1e+10*units.m_sun/header['HubbleParam']
+            for i in range(nprocs):
+                Barrier()
+                if i == rank:
+                    with open(filename, 'ab') as f:
+                        # The identifier
+                        if i == 0:
+                            # 8 = 4*1 + 4 = 4*sizeof(s) + sizeof(i)
+                            f.write(struct.pack('I', 8))
+                            f.write(struct.pack('4s', b'MASS'))
+                            # sizeof(i) + N*sizeof(f) + sizeof(i)
+                            f.write(struct.pack('I', 4 + N*4 + 4))
+                            f.write(struct.pack('I', 8))
+                            f.write(struct.pack('I', N*4))
+                        # The data
+                        (asarray(component.masses_mv[:N_local], dtype=C2np['float'])/unit).tofile(f)
+                        # The closing int
+                        if i == nprocs - 1:
+                            f.write(struct.pack('I', N*4))
         # Finalize progress messages
         masterprint('done')
         masterprint('done')
@@ -750,30 +820,47 @@ class Gadget2Snapshot:
                     # Locals
                     N='Py_ssize_t',
                     N_local='Py_ssize_t',
+                    N_type='Py_ssize_t',
                     blockname='str',
+                    blocks='dict',
+                    end_local='Py_ssize_t',
                     file_position='Py_ssize_t',
                     header='object',  # collections.OrderedDict
+                    i_end='Py_ssize_t',
+                    i_start='Py_ssize_t',
+                    id_size='Py_ssize_t',
+                    index_mass='Py_ssize_t',
                     mass='double',
+                    masses='object',  # np.ndarray
+                    masses_type='list',
                     name='str',
                     offset='Py_ssize_t',
                     size='unsigned int',
                     species='str',
                     start_local='Py_ssize_t',
+                    start_type='Py_ssize_t',
+                    t='int',
                     unit='double',
+                    use_masses='bint',
                     )
     def load(self, filename, only_params=False):
         """ It is assumed that the snapshot on the disk is a GADGET2
         snapshot of type 2 and that it uses single precision. The
         Gadget2Snapshot instance stores the data (positions and
-        velocities) in double precision. Only GADGET type 1 (halo)
-        particles, corresponding to dark matter particles,
-        are supported.
+        velocities) in double precision. The particles of all GADGET
+        types except type 0 (gas) are loaded into a single component
+        of dark matter particles. Unless these all share a common mass
+        given in the header, individual particle masses are read in,
+        in which case the common mass of the component is set to the
+        mean particle mass. Note that differing individual masses are
+        not supported by the force computations or the mesh assignment
+        (see individual_masses_differ).
         """
         if only_params:
             masterprint('Loading parameters of snapshot "{}" ...'.format(filename))
         else:
             masterprint('Loading snapshot "{}" ...'.format(filename))
-        # Only type 1 (halo) particles are supported
+        # All particles are loaded as GADGET halos
         name = 'GADGET halos'
         species = 'dark matter particles'
         # Read in the snapshot
@@ -815,11 +902,60 @@ class Gadget2Snapshot:
             self.params['boxsize'] = header['BoxSize']*unit
             self.params['Ωm']      = header['Omega0']
             self.params['ΩΛ']      = header['OmegaLambda']
+            # Locate the data of each of the remaining blocks
+            blocks = {}
+            while True:
+                f.seek(offset)
+                if not f.read(4):
+                    break
+                offset = self.new_block(f, offset)
+                blockname = self.read(f, '4s').decode('utf8')
+                offset = self.new_block(f, offset)
+                blocks[blockname] = f.tell()
+            # The gas particles (type 0) are skipped. As the particles
+            # are stored ordered by type, the remaining particles
+            # are found contiguously after these.
+            if header['Npart'][0] > 0:
+                masterwarn('The {} gas particles in "{}" will be ignored'
+                           .format(header['Npart'][0], filename))
+            N = sum(header['Npart'][1:])
+            # Compute a fair distribution
+            # of component data to the processes.
+            start_local, N_local = partition(N)
+            end_local = start_local + N_local
+            # Individual particle masses are needed unless all particle
+            # types in use have the same mass given in the header.
+            # The MASS block only contains masses of particles of the
+            # types whose mass in the header is 0.
+            unit = 1e+10*units.m_sun/header['HubbleParam']
+            masses_type = [header['Massarr'][t] for t in range(1, 6) if header['Npart'][t] > 0]
+            use_masses = (len(set(masses_type)) > 1 or 0 in masses_type)
+            mass = (masses_type[0] if masses_type else 0)*unit
+            if use_masses:
+                if 'MASS' not in blocks:
+                    abort('The GADGET2 snapshot "{}" has no MASS block, '
+                          'though not all particle masses are given in the header'
+                          .format(filename))
+                masses = empty(N_local, dtype=C2np['double'])
+                index_mass = header['Npart'][0] if header['Massarr'][0] == 0 else 0
+                start_type = 0
+                for t in range(1, 6):
+                    N_type = header['Npart'][t]
+                    # The local particles of this type
+                    i_start = start_local if start_local > start_type else start_type
+                    i_end = end_local if end_local < start_type + N_type else start_type + N_type
+                    if header['Massarr'][t] == 0:
+                        if i_end > i_start:
+                            f.seek(blocks['MASS'] + 4*(index_mass + i_start - start_type))
+                            masses[i_start - start_local:i_end - start_local] = (
+                                np.fromfile(f, dtype=C2np['float'], count=i_end - i_start)*unit)
+                        index_mass += N_type
+                    elif i_end > i_start:
+                        masses[i_start - start_local:i_end - start_local] = header['Massarr'][t]*unit
+                    start_type += N_type
+                mass = allreduce(np.sum(masses), op=MPI.SUM)/N
             # Construct a Component instance and pack it
             # into this snapshot's list of components.
-            N = header['Npart'][1]
-            unit = 1e+10*units.m_sun/header['HubbleParam']
-            mass = header['Massarr'][1]*unit
             self.component = Component(name, species, N, mass=mass)
             self.components = [self.component]
             # Done loading component attributes
@@ -827,16 +963,9 @@ class Gadget2Snapshot:
                 masterprint('done')
                 return
             masterprint('Reading in {} ({} {}) ...'.format(name, N, species))
-            # Compute a fair distribution
-            # of component data to the processes.
-            start_local, N_local = partition(N)
             # Read in the POS block. The positions are given in kpc/h.
-            offset = self.new_block(f, offset)
             unit = units.kpc/header['HubbleParam']
-            blockname = self.read(f, '4s').decode('utf8')  # "POS "
-            size = self.read(f, 'I')
-            offset = self.new_block(f, offset)
-            f.seek(12*start_local, 1)  # 12 = sizeof(float)*3
+            f.seek(blocks['POS '] + 12*(header['Npart'][0] + start_local))  # 12 = sizeof(float)*3
             file_position = f.tell()
             self.component.populate(asarray(np.fromfile(f, dtype=C2np['float'], count=3*N_local)
                                             [0::3], dtype=C2np['double'])*unit,
@@ -851,12 +980,9 @@ class Gadget2Snapshot:
                                     'posz')
             # Read in the VEL block. The velocities are peculiar
             # velocities u=a*dx/dt divided by sqrt(a), given in km/s.
-            offset = self.new_block(f, offset)
+            # The momenta are constructed using the common mass.
             unit = units.km/units.s*mass*header['Time']**1.5
-            blockname = self.read(f, '4s').decode('utf8')  # "VEL "
-            size = self.read(f, 'I')
-            offset = self.new_block(f, offset)
-            f.seek(12*start_local, 1)  # 12 = sizeof(float)*3
+            f.seek(blocks['VEL '] + 12*(header['Npart'][0] + start_local))  # 12 = sizeof(float)*3
             file_position = f.tell()
             self.component.populate(asarray(np.fromfile(f, dtype=C2np['float'], count=3*N_local)
                                             [0::3], dtype=C2np['double'])*unit,
@@ -869,15 +995,23 @@ class Gadget2Snapshot:
             self.component.populate(asarray(np.fromfile(f, dtype=C2np['float'], count=3*N_local)
                                             [2::3], dtype=C2np['double'])*unit,
                                     'momz')
-            # Read in the ID block.
+            # Read in the ID block. The IDs are stored using either
+            # 4 or 8 bytes, as determined from the size of the block.
             # The ID's will be distributed among all processes.
-            offset = self.new_block(f, offset)
-            blockname = self.read(f, '4s').decode('utf8')  # "ID  "
+            f.seek(blocks['ID  '] - 4)
             size = self.read(f, 'I')
-            offset = self.new_block(f, offset)
-            f.seek(4*start_local, 1)  # 4 = sizeof(unsigned int)
-            file_position = f.tell()
-            self.ID = np.fromfile(f, dtype=C2np['unsigned int'], count=N_local)
+            id_size = size//sum(header['Npart'])
+            f.seek(blocks['ID  '] + id_size*(header['Npart'][0] + start_local))
+            self.ID = asarray(np.fromfile(f,
+                                          dtype=C2np['unsigned int' if id_size == 4
+                                                     else 'unsigned long long int'],
+                                          count=N_local),
+                              dtype=C2np['unsigned long long int'])
+            if self.component.use_ids:
+                self.component.populate(self.ID, 'ids')
+            # Populate the component with the individual masses
+            if use_masses:
+                self.component.populate(masses, 'masses')
             # Done reading in particles
             masterprint('done')
             # Possible additional meta data ignored
@@ -885,8 +1019,7 @@ class Gadget2Snapshot:
         masterprint('done')
 
     # This method populate the snapshot with component data
-    # as well as ID's (which are not used by this code) and
-    # additional header information.
+    # as well as ID's and additional header information.
     @cython.pheader(# Arguments
                     components='list',
                     params='dict',
@@ -909,10 +1042,15 @@ class Gadget2Snapshot:
         component = components[0]
         self.component = component
         self.components = [component]
-        # The ID's of the local particles, generated such that
-        # the process with the lowest rank has the lowest ID's.
-        start_local = int(np.sum(smart_mpi(component.N_local, mpifun='allgather')[:rank]))
-        self.ID = arange(start_local, start_local + component.N_local, dtype=C2np['unsigned int'])
+        # The ID's of the local particles. Unless carried by the
+        # component, these are generated such that the process with
+        # the lowest rank has the lowest ID's.
+        if component.use_ids:
+            self.ID = component.ids_mv[:component.N_local]
+        else:
+            start_local = int(np.sum(smart_mpi(component.N_local, mpifun='allgather')[:rank]))
+            self.ID = arange(start_local, start_local + component.N_local,
+                             dtype=C2np['unsigned long long int'])
         # Populate snapshot with the passed scalefactor
         # and global parameters. If a params dict is passed,
         # use values from this instead.
@@ -949,7 +1087,9 @@ class Gadget2Snapshot:
         unit = 100*units.km/(units.s*units.Mpc)
         h = params['H0']/unit
         unit = 1e+10*units.m_sun/h
-        header['Massarr']       = [0.0, component.mass/unit, 0.0, 0.0, 0.0, 0.0]
+        # Individual particle masses are signalled by a vanishing mass
+        header['Massarr']       = [0.0, 0.0 if component.use_masses else component.mass/unit,
+                                   0.0, 0.0, 0.0, 0.0]
         header['Time']          = params['a']
         header['Redshift']      = 1/params['a'] - 1
         header['FlagSfr']       = 0
@@ -1250,6 +1390,39 @@ def out_of_bounds_check(component, snapshot_boxsize=-1):
                                                     unit_length),
                   )
 
+# Function which checks whether the individual masses of the particles
+# of a component differ from one another.
+@cython.pheader(# Arguments
+                component='Component',
+                # Locals
+                i='Py_ssize_t',
+                mass_max='double',
+                mass_min='double',
+                masses='double*',
+                returns='bint',
+                )
+def individual_masses_differ(component):
+    """The individual particle masses are carried along with the
+    particles, but the forces and the mesh assignments use the common
+    mass of the component, which for a snapshot with differing particle
+    masses is the mean mass. Callers making use of the masses should
+    therefore refuse components for which this function returns True.
+    This function must be called by all processes.
+    """
+    if component.representation != 'particles' or not component.use_masses:
+        return False
+    mass_min = ထ
+    mass_max = -ထ
+    masses = component.masses
+    for i in range(component.N_local):
+        if masses[i] < mass_min:
+            mass_min = masses[i]
+        if masses[i] > mass_max:
+            mass_max = masses[i]
+    mass_min = allreduce(mass_min, op=MPI.MIN)
+    mass_max = allreduce(mass_max, op=MPI.MAX)
+    return mass_min < mass_max
+
 
 
 # Construct tuple of possible filename extensions for snapshots
@@ -27,6 +27,9 @@ from commons import *
 # Cython imports
 cimport('from analysis import measure')
 cimport('from communication import communicate_domain, domain_subdivisions, exchange, smart_mpi')
+cimport('from communication import domain_cuts_x, domain_cuts_y, domain_cuts_z, domain_layout, '
+        '                          domain_size_x, domain_size_y, domain_size_z, '
+        '                          get_buffer, get_domains_balanced')
 cimport('from fluid import maccormack, apply_internal_sources')
 cimport('from integration import Spline, cosmic_time, scale_factor, ȧ')
 cimport('from linear import compute_cosmo, compute_transfers, realize')
@@ -167,17 +170,17 @@ class FluidScalar:
         public Py_ssize_t size
         public Py_ssize_t size_noghosts
         # The data itself
-        double* grid
-        public double[:, :, ::1] grid_mv
-        public double[:, :, :] grid_noghosts
+        real* grid
+        public real[:, :, ::1] grid_mv
+        public real[:, :, :] grid_noghosts
         # The starred buffer
-        double* gridˣ
-        public double[:, :, ::1] gridˣ_mv
-        public double[:, :, :] gridˣ_noghosts
+        real* gridˣ
+        public real[:, :, ::1] gridˣ_mv
+        public real[:, :, :] gridˣ_noghosts
         # The Δ buffer
-        double* Δ
-        public double[:, :, ::1] Δ_mv
-        public double[:, :, :] Δ_noghosts
+        real* Δ
+        public real[:, :, ::1] Δ_mv
+        public real[:, :, :] Δ_noghosts
         """
         # Number and index of fluid variable
         self.varnum = varnum
@@ -188,12 +191,12 @@ class FluidScalar:
         self.size = np.prod(self.shape)
         self.size_noghosts = np.prod(self.shape_noghosts)
         # The data itself
-        self.grid = malloc(self.size*sizeof('double'))
-        self.grid_mv = cast(self.grid, 'double[:self.shape[0], :self.shape[1], :self.shape[2]]')
+        self.grid = malloc(self.size*sizeof('real'))
+        self.grid_mv = cast(self.grid, 'real[:self.shape[0], :self.shape[1], :self.shape[2]]')
         self.grid_noghosts = self.grid_mv[:, :, :]
         # The starred buffer
-        self.gridˣ = malloc(self.size*sizeof('double'))
-        self.gridˣ_mv = cast(self.gridˣ, 'double[:self.shape[0], :self.shape[1], :self.shape[2]]')
+        self.gridˣ = malloc(self.size*sizeof('real'))
+        self.gridˣ_mv = cast(self.gridˣ, 'real[:self.shape[0], :self.shape[1], :self.shape[2]]')
         self.gridˣ_noghosts = self.gridˣ_mv[:, :, :]
         # Due to the Unicode NFKC normalization done by pure Python,
         # attributes with a ˣ in their name need to be set in following
@@ -203,8 +206,8 @@ class FluidScalar:
             setattr(self, 'gridˣ_mv'      , self.gridˣ_mv      )
             setattr(self, 'gridˣ_noghosts', self.gridˣ_noghosts)
         # The Δ buffer
-        self.Δ = malloc(self.size*sizeof('double'))
-        self.Δ_mv = cast(self.Δ, 'double[:self.shape[0], :self.shape[1], :self.shape[2]]')
+        self.Δ = malloc(self.size*sizeof('real'))
+        self.Δ_mv = cast(self.Δ, 'real[:self.shape[0], :self.shape[1], :self.shape[2]]')
         self.Δ_noghosts = self.Δ_mv[:, :, :]
 
     # Method for resizing all grids of this scalar fluid
@@ -224,16 +227,16 @@ class FluidScalar:
         self.shape_noghosts = tuple([s + 1 for s in shape_nopseudo_noghost])
         self.size_noghosts = np.prod(self.shape_noghosts)
         # The data itself
-        self.grid = realloc(self.grid, self.size*sizeof('double'))
-        self.grid_mv = cast(self.grid, 'double[:self.shape[0], :self.shape[1], :self.shape[2]]')
+        self.grid = realloc(self.grid, self.size*sizeof('real'))
+        self.grid_mv = cast(self.grid, 'real[:self.shape[0], :self.shape[1], :self.shape[2]]')
         self.grid_noghosts = self.grid_mv[2:(self.grid_mv.shape[0] - 2),
                                           2:(self.grid_mv.shape[1] - 2),
                                           2:(self.grid_mv.shape[2] - 2)]
         # Nullify the newly allocated data grid
         self.nullify_grid()
         # The starred buffer
-        self.gridˣ = realloc(self.gridˣ, self.size*sizeof('double'))
-        self.gridˣ_mv = cast(self.gridˣ, 'double[:self.shape[0], :self.shape[1], :self.shape[2]]')
+        self.gridˣ = realloc(self.gridˣ, self.size*sizeof('real'))
+        self.gridˣ_mv = cast(self.gridˣ, 'real[:self.shape[0], :self.shape[1], :self.shape[2]]')
         self.gridˣ_noghosts = self.gridˣ_mv[2:(self.gridˣ_mv.shape[0] - 2),
                                             2:(self.gridˣ_mv.shape[1] - 2),
                                             2:(self.gridˣ_mv.shape[2] - 2)]
@@ -247,8 +250,8 @@ class FluidScalar:
         # Nullify the newly allocated starred buffer
         self.nullify_gridˣ()
         # The starred buffer
-        self.Δ = realloc(self.Δ, self.size*sizeof('double'))
-        self.Δ_mv = cast(self.Δ, 'double[:self.shape[0], :self.shape[1], :self.shape[2]]')
+        self.Δ = realloc(self.Δ, self.size*sizeof('real'))
+        self.Δ_mv = cast(self.Δ, 'real[:self.shape[0], :self.shape[1], :self.shape[2]]')
         self.Δ_noghosts = self.Δ_mv[2:(self.Δ_mv.shape[0] - 2),
                                     2:(self.Δ_mv.shape[1] - 2),
                                     2:(self.Δ_mv.shape[2] - 2)]
@@ -260,7 +263,7 @@ class FluidScalar:
                     a='double',
                     # Locals
                     i='Py_ssize_t',
-                    grid='double*',
+                    grid='real*',
                     shape='Py_ssize_t*',
                     )
     def scale_grid(self, a):
@@ -274,7 +277,7 @@ class FluidScalar:
     # Method for nullifying the data grid
     @cython.pheader(# Locals
                     i='Py_ssize_t',
-                    grid='double*',
+                    grid='real*',
                     shape='Py_ssize_t*',
                     )
     def nullify_grid(self):
@@ -288,7 +291,7 @@ class FluidScalar:
     # Method for nullifying the starred grid
     @cython.pheader(# Locals
                     i='Py_ssize_t',
-                    gridˣ='double*',
+                    gridˣ='real*',
                     shape='Py_ssize_t*',
                     )
     def nullify_gridˣ(self):
@@ -302,7 +305,7 @@ class FluidScalar:
     # Method for nullifying the Δ buffer
     @cython.pheader(# Locals
                     i='Py_ssize_t',
-                    Δ='double*',
+                    Δ='real*',
                     shape='Py_ssize_t*',
                     )
     def nullify_Δ(self):
@@ -370,12 +373,17 @@ class Component:
         public str representation
         public str species
         public str species_class
+        public Py_ssize_t instance_id
+        public Py_ssize_t state_count
         # Particle attributes
         public Py_ssize_t N
         public Py_ssize_t N_allocated
         public Py_ssize_t N_local
         public double mass
         public double softening
+        # Particle data arena
+        double* particle_data
+        Py_ssize_t particle_data_size
         # Particle data
         double* posx
         double* posy
@@ -393,6 +401,13 @@ class Component:
         public double[::1] momz_mv
         public list pos_mv
         public list mom_mv
+        # Optional particle data
+        public bint use_ids
+        public bint use_masses
+        unsigned long long int* ids
+        double* masses
+        public unsigned long long int[::1] ids_mv
+        public double[::1] masses_mv
         # Particle Δ buffers
         double* Δposx
         double* Δposy
@@ -473,6 +488,16 @@ class Component:
                         self.forces[species_force[0]] = species_force[1]
         # Determine the representation based on the species
         self.representation = get_representation(self.species)
+        # Counter which is incremented whenever the particle positions
+        # or fluid variables are changed, allowing for cached data
+        # derived from these to be validated.
+        self.state_count = 0
+        # Number uniquely identifying this component instance
+        # throughout the run, unlike its id() which may be reused
+        # after garbage collection.
+        global component_instances
+        component_instances += 1
+        self.instance_id = component_instances
         # Particle attributes
         self.mass        = mass
         self.N_allocated = 1
@@ -495,56 +520,39 @@ class Component:
         # Once this component has been populated with data,
         # this attribute will store the total mass of this component.
         self._Σmass_present = -1
-        # Particle data
-        self.posx = malloc(self.N_allocated*sizeof('double'))
-        self.posy = malloc(self.N_allocated*sizeof('double'))
-        self.posz = malloc(self.N_allocated*sizeof('double'))
-        self.momx = malloc(self.N_allocated*sizeof('double'))
-        self.momy = malloc(self.N_allocated*sizeof('double'))
-        self.momz = malloc(self.N_allocated*sizeof('double'))
-        self.posx_mv = cast(self.posx, 'double[:self.N_allocated]')
-        self.posy_mv = cast(self.posy, 'double[:self.N_allocated]')
-        self.posz_mv = cast(self.posz, 'double[:self.N_allocated]')
-        self.momx_mv = cast(self.momx, 'double[:self.N_allocated]')
-        self.momy_mv = cast(self.momy, 'double[:self.N_allocated]')
-        self.momz_mv = cast(self.momz, 'double[:self.N_allocated]')
-        # Pack particle data into a pointer array of pointers
-        # and a list of memoryviews.
-        self.pos = malloc(3*sizeof('double*'))
-        self.pos[0] = self.posx
-        self.pos[1] = self.posy
-        self.pos[2] = self.posz
-        self.mom = malloc(3*sizeof('double*'))
-        self.mom[0] = self.momx
-        self.mom[1] = self.momy
-        self.mom[2] = self.momz
-        self.pos_mv = [self.posx_mv, self.posy_mv, self.posz_mv]
-        self.mom_mv = [self.momx_mv, self.momy_mv, self.momz_mv]
-        # Particle data buffers
+        # Particle data and data buffers. The variables are
+        # placed in a common arena by allocate_particle_data,
+        # which also packs them into the pointer arrays of pointers
+        # and lists of memoryviews below.
+        self.pos  = malloc(3*sizeof('double*'))
+        self.mom  = malloc(3*sizeof('double*'))
+        self.Δmom = malloc(3*sizeof('double*'))
+        # The optional particle IDs and individual masses are kept
+        # outside of the arena. They are only allocated in full
+        # once enabled, see enable_particle_variable.
+        self.use_ids    = False
+        self.use_masses = False
+        self.ids    = malloc(1*sizeof('unsigned long long int'))
+        self.masses = malloc(1*sizeof('double'))
+        self.ids_mv    = cast(self.ids,    'unsigned long long int[:1]')
+        self.masses_mv = cast(self.masses, 'double[:1]')
+        self.particle_data_size = 0
+        self.allocate_particle_data(self.N_allocated)
+        if self.representation == 'particles' and particle_ids:
+            self.enable_particle_variable('ids')
+        # The Δ buffers of the positions are not in use and are
+        # not part of the arena.
         self.Δposx = malloc(self.N_allocated*sizeof('double'))
         self.Δposy = malloc(self.N_allocated*sizeof('double'))
         self.Δposz = malloc(self.N_allocated*sizeof('double'))
-        self.Δmomx = malloc(self.N_allocated*sizeof('double'))
-        self.Δmomy = malloc(self.N_allocated*sizeof('double'))
-        self.Δmomz = malloc(self.N_allocated*sizeof('double'))
         self.Δposx_mv = cast(self.Δposx, 'double[:self.N_allocated]')
         self.Δposy_mv = cast(self.Δposy, 'double[:self.N_allocated]')
         self.Δposz_mv = cast(self.Δposz, 'double[:self.N_allocated]')
-        self.Δmomx_mv = cast(self.Δmomx, 'double[:self.N_allocated]')
-        self.Δmomy_mv = cast(self.Δmomy, 'double[:self.N_allocated]')
-        self.Δmomz_mv = cast(self.Δmomz, 'double[:self.N_allocated]')
-        # Pack particle data buffers into a pointer array of pointers
-        # and a list of memoryviews.
         self.Δpos = malloc(3*sizeof('double*'))
         self.Δpos[0] = self.Δposx
         self.Δpos[1] = self.Δposy
         self.Δpos[2] = self.Δposz
-        self.Δmom = malloc(3*sizeof('double*'))
-        self.Δmom[0] = self.Δmomx
-        self.Δmom[1] = self.Δmomy
-        self.Δmom[2] = self.Δmomz
         self.Δpos_mv = [self.Δposx_mv, self.Δposy_mv, self.Δposz_mv]
-        self.Δmom_mv = [self.Δmomx_mv, self.Δmomy_mv, self.Δmomz_mv]
         # Fluid attributes
         self.N_fluidvars = N_fluidvars
         self.shape = (1, 1, 1)
@@ -688,19 +696,27 @@ class Component:
                     a='double',
                     fluid_indices='object',  # tuple or int-like
                     fluidscalar='FluidScalar',
+                    ids_mv='unsigned long long int[::1]',
                     index='Py_ssize_t',
                     mv1D='double[::1]',
-                    mv3D='double[:, :, :]',
+                    mv3D='real[:, :, :]',
                     )
     def populate(self, data, var, multi_index=0, buffer=False):
         """For fluids, the data should not include pseudo 
         or ghost points.
         If buffer is True, the Δ buffers will be populated
         instead of the data arrays.
+        Populating the optional particle variables 'ids' or 'masses'
+        enables these on the component.
         """
+        self.state_count += 1
         if self.representation == 'particles':
-            mv1D = data
-            self.N_local = mv1D.shape[0]
+            if var == 'ids':
+                ids_mv = asarray(data, dtype=C2np['unsigned long long int'])
+                self.N_local = ids_mv.shape[0]
+            else:
+                mv1D = data
+                self.N_local = mv1D.shape[0]
             # Enlarge data attributes if necessary
             if self.N_allocated < self.N_local:
                 self.resize(self.N_local)
@@ -735,10 +751,16 @@ class Component:
                     self.Δmomz_mv[:self.N_local] = mv1D[:]
                 else:
                     self.momz_mv [:self.N_local] = mv1D[:]
+            elif var == 'masses':
+                self.enable_particle_variable('masses')
+                self.masses_mv[:self.N_local] = mv1D[:]
+            elif var == 'ids':
+                self.enable_particle_variable('ids')
+                self.ids_mv[:self.N_local] = ids_mv[:]
             elif master:
                 abort('Wrong component attribute name "{}"!'.format(var))
         elif self.representation == 'fluid':
-            mv3D = data
+            mv3D = asarray(data, dtype=C2np['real'])
             # The fluid scalar will be given as
             # self.fluidvars[index][multi_index],
             # where index is an int and multi_index is a tuple of ints.
@@ -793,6 +815,120 @@ class Component:
             else:
                 communicate_domain(fluidscalar.grid_mv, mode='populate')
 
+    # Method which (re)allocates the particle data arena, placing each of
+    # the particle variables and their Δ buffers within it.
+    @cython.header(# Arguments
+                   N_allocated='Py_ssize_t',
+                   # Locals
+                   N_copy='Py_ssize_t',
+                   data='double*',
+                   data_mv='double[::1]',
+                   offset='Py_ssize_t',
+                   size='Py_ssize_t',
+                   stride='Py_ssize_t',
+                   v='Py_ssize_t',
+                   variable_mv='double[::1]',
+                   variables_mv='list',
+                   )
+    def allocate_particle_data(self, N_allocated):
+        """All particle variables (posx, posy, posz, momx, momy, momz,
+        Δmomx, Δmomy, Δmomz) live in a single block of memory, one after
+        the other. Each variable starts at a 64 byte boundary, so that
+        loops over the variables may be vectorized using aligned loads.
+        Reallocating the particle data thus amounts to a single
+        allocation, with the existing values copied over
+        (as many as fit).
+        """
+        # The number of doubles between the starts of consecutive
+        # variables, rounded up to a whole number of 64 byte lines.
+        # An additional line is allocated to allow for the alignment.
+        stride = (N_allocated + 7)//8*8
+        size = 9*stride + 8
+        data = malloc(size*sizeof('double'))
+        data_mv = cast(data, 'double[:size]')
+        # The offset (in doubles) to the first 64 byte boundary
+        if not cython.compiled:
+            offset = 0
+        else:
+            offset = (64 - cast(data, 'Py_ssize_t')%64)%64//8
+        # Copy over the existing data and free the old arena
+        variables_mv = [data_mv[offset + v*stride:offset + v*stride + N_allocated]
+                        for v in range(9)]
+        if self.particle_data_size > 0:
+            N_copy = N_allocated if N_allocated < self.N_allocated else self.N_allocated
+            for v, variable_mv in enumerate(self.pos_mv + self.mom_mv + self.Δmom_mv):
+                variables_mv[v][:N_copy] = variable_mv[:N_copy]
+            free(self.particle_data)
+        self.particle_data = data
+        self.particle_data_size = size
+        self.N_allocated = N_allocated
+        # Assign the particle data memory views and pointers
+        (self.posx_mv, self.posy_mv, self.posz_mv,
+         self.momx_mv, self.momy_mv, self.momz_mv,
+         self.Δmomx_mv, self.Δmomy_mv, self.Δmomz_mv) = variables_mv
+        self.posx  = cython.address(self.posx_mv[:])
+        self.posy  = cython.address(self.posy_mv[:])
+        self.posz  = cython.address(self.posz_mv[:])
+        self.momx  = cython.address(self.momx_mv[:])
+        self.momy  = cython.address(self.momy_mv[:])
+        self.momz  = cython.address(self.momz_mv[:])
+        self.Δmomx = cython.address(self.Δmomx_mv[:])
+        self.Δmomy = cython.address(self.Δmomy_mv[:])
+        self.Δmomz = cython.address(self.Δmomz_mv[:])
+        # Repack particle data into pointer arrays of pointers
+        # and lists of memoryviews.
+        self.pos[0], self.pos[1], self.pos[2] = self.posx, self.posy, self.posz
+        self.mom[0], self.mom[1], self.mom[2] = self.momx, self.momy, self.momz
+        self.Δmom[0], self.Δmom[1], self.Δmom[2] = self.Δmomx, self.Δmomy, self.Δmomz
+        self.pos_mv = [self.posx_mv, self.posy_mv, self.posz_mv]
+        self.mom_mv = [self.momx_mv, self.momy_mv, self.momz_mv]
+        self.Δmom_mv = [self.Δmomx_mv, self.Δmomy_mv, self.Δmomz_mv]
+        # Reallocate the optional particle data alongside the arena
+        self.allocate_optional_particle_data()
+
+    # Method which (re)allocates the enabled optional particle data
+    @cython.header()
+    def allocate_optional_particle_data(self):
+        if self.use_ids:
+            self.ids = realloc(self.ids, self.N_allocated*sizeof('unsigned long long int'))
+            self.ids_mv = cast(self.ids, 'unsigned long long int[:self.N_allocated]')
+        if self.use_masses:
+            self.masses = realloc(self.masses, self.N_allocated*sizeof('double'))
+            self.masses_mv = cast(self.masses, 'double[:self.N_allocated]')
+
+    # Method for enabling one of the optional particle variables
+    @cython.pheader(# Arguments
+                    variable='str',
+                    )
+    def enable_particle_variable(self, variable):
+        """The optional particle variables are the particle IDs ('ids')
+        and the individual particle masses ('masses'). These are carried
+        along whenever the particles are communicated, sorted or saved
+        to snapshots, but are not allocated at all unless enabled,
+        either through the particle_ids parameter or by loading in a
+        snapshot containing them. Newly enabled IDs are nullified while
+        newly enabled masses are set to the common mass of the component.
+        Note that the common mass is still the one used when computing
+        the forces and the drifts.
+        """
+        if self.representation != 'particles':
+            abort('Cannot enable particle variable "{}" on fluid component "{}"'
+                  .format(variable, self.name))
+        if variable == 'ids':
+            if self.use_ids:
+                return
+            self.use_ids = True
+            self.allocate_optional_particle_data()
+            self.ids_mv[...] = 0
+        elif variable == 'masses':
+            if self.use_masses:
+                return
+            self.use_masses = True
+            self.allocate_optional_particle_data()
+            self.masses_mv[...] = self.mass
+        else:
+            abort('Unknown optional particle variable "{}"'.format(variable))
+
     # This method will grow/shrink the data attributes.
     # Note that it will update N_allocated but not N_local.
     @cython.pheader(# Arguments
@@ -803,53 +939,21 @@ class Component:
                     s='Py_ssize_t',
                     shape_nopseudo_noghosts='tuple',
                     size='Py_ssize_t',
+                    size_grown='Py_ssize_t',
                     s_old='Py_ssize_t',
                     )
     def resize(self, size_or_shape_nopseudo_noghosts):
         if self.representation == 'particles':
             size = size_or_shape_nopseudo_noghosts
+            # When enlarging already allocated data, allocate some
+            # headroom as well, so that repeated small enlargements
+            # (e.g. by exchange) do not each lead to a reallocation.
+            if 1 < self.N_allocated < size:
+                size_grown = cast(ceil(self.N_allocated*particle_growth_factor), 'Py_ssize_t')
+                if size_grown > size:
+                    size = size_grown
             if size != self.N_allocated:
-                self.N_allocated = size
-                # Reallocate particle data
-                self.posx = realloc(self.posx, self.N_allocated*sizeof('double'))
-                self.posy = realloc(self.posy, self.N_allocated*sizeof('double'))
-                self.posz = realloc(self.posz, self.N_allocated*sizeof('double'))
-                self.momx = realloc(self.momx, self.N_allocated*sizeof('double'))
-                self.momy = realloc(self.momy, self.N_allocated*sizeof('double'))
-                self.momz = realloc(self.momz, self.N_allocated*sizeof('double'))
-                # Reassign particle data memory views
-                self.posx_mv = cast(self.posx, 'double[:self.N_allocated]')
-                self.posy_mv = cast(self.posy, 'double[:self.N_allocated]')
-                self.posz_mv = cast(self.posz, 'double[:self.N_allocated]')
-                self.momx_mv = cast(self.momx, 'double[:self.N_allocated]')
-                self.momy_mv = cast(self.momy, 'double[:self.N_allocated]')
-                self.momz_mv = cast(self.momz, 'double[:self.N_allocated]')
-                # Repack particle data into pointer arrays of pointers
-                # and lists of memoryviews.
-                self.pos[0], self.pos[1], self.pos[2] = self.posx, self.posy, self.posz
-                self.mom[0], self.mom[1], self.mom[2] = self.momx, self.momy, self.momz
-                self.pos_mv = [self.posx_mv, self.posy_mv, self.posz_mv]
-                self.mom_mv = [self.momx_mv, self.momy_mv, self.momz_mv]
-                # Reallocate particle buffers
-                #self.Δposx = realloc(self.Δposx, self.N_allocated*sizeof('double'))
-                #self.Δposy = realloc(self.Δposy, self.N_allocated*sizeof('double'))
-                #self.Δposz = realloc(self.Δposz, self.N_allocated*sizeof('double'))
-                self.Δmomx = realloc(self.Δmomx, self.N_allocated*sizeof('double'))
-                self.Δmomy = realloc(self.Δmomy, self.N_allocated*sizeof('double'))
-                self.Δmomz = realloc(self.Δmomz, self.N_allocated*sizeof('double'))
-                # Reassign particle buffer memory views
-                #self.Δposx_mv = cast(self.Δposx, 'double[:self.N_allocated]')
-                #self.Δposy_mv = cast(self.Δposy, 'double[:self.N_allocated]')
-                #self.Δposz_mv = cast(self.Δposz, 'double[:self.N_allocated]')
-                self.Δmomx_mv = cast(self.Δmomx, 'double[:self.N_allocated]')
-                self.Δmomy_mv = cast(self.Δmomy, 'double[:self.N_allocated]')
-                self.Δmomz_mv = cast(self.Δmomz, 'double[:self.N_allocated]')
-                # Repack particle buffers into pointer arrays of
-                # pointers and lists of memoryviews.
-                self.Δpos[0], self.Δpos[1], self.Δpos[2] = self.Δposx, self.Δposy, self.Δposz
-                self.Δmom[0], self.Δmom[1], self.Δmom[2] = self.Δmomx, self.Δmomy, self.Δmomz
-                self.Δpos_mv = [self.Δposx_mv, self.Δposy_mv, self.Δposz_mv]
-                self.Δmom_mv = [self.Δmomx_mv, self.Δmomy_mv, self.Δmomz_mv]
+                self.allocate_particle_data(size)
                 # Nullify the newly allocated Δ buffer
                 self.nullify_Δ()
         elif self.representation == 'fluid':
@@ -1018,15 +1122,26 @@ class Component:
     @cython.header(# Arguments
                    ᔑdt='dict',
                    # Locals
+                   balanced='bint',
+                   drift_fac='double',
                    i='Py_ssize_t',
                    momx='double*',
                    momy='double*',
                    momz='double*',
+                   owners='int*',
+                   owners_mv='int[::1]',
                    posx='double*',
+                   posx_i='double',
                    posy='double*',
+                   posy_i='double',
                    posz='double*',
+                   posz_i='double',
+                   x_index='int',
+                   y_index='int',
+                   z_index='int',
                    )
     def drift(self, ᔑdt):
+        self.state_count += 1
         if self.representation == 'particles':
             masterprint('Drifting {} ...'.format(self.name))
             posx = self.posx
@@ -1035,19 +1150,62 @@ class Component:
             momx = self.momx
             momy = self.momy
             momz = self.momz
-            # Update positions
-            for i in range(self.N_local):
-                posx[i] += momx[i]*ℝ[ᔑdt['a⁻²']/self.mass]
-                posy[i] += momy[i]*ℝ[ᔑdt['a⁻²']/self.mass]
-                posz[i] += momz[i]*ℝ[ᔑdt['a⁻²']/self.mass]
-                # Toroidal boundaries
-                posx[i] = mod(posx[i], boxsize)
-                posy[i] = mod(posy[i], boxsize)
-                posz[i] = mod(posz[i], boxsize)
+            drift_fac = ᔑdt['a⁻²']/self.mass
+            # The rank of the process in charge of the domain of each
+            # particle is found while drifting, saving the exchange
+            # function from making another pass over the positions.
+            owners_mv = get_buffer(self.N_local, 'exchange_owners', dtype='int')
+            owners = cython.address(owners_mv[:])
+            # Whether the load-balanced decomposition is in effect
+            # is looked up now, as it changes during the run.
+            balanced = get_domains_balanced()
+            # Update positions. The particles are distributed
+            # over num_threads threads.
+            for i in prange(self.N_local, nogil=True, num_threads=num_threads):
+                posx_i = posx[i] + momx[i]*drift_fac
+                posy_i = posy[i] + momy[i]*drift_fac
+                posz_i = posz[i] + momz[i]*drift_fac
+                # Toroidal boundaries. This is the mod function
+                # written out, so that it can run without the GIL.
+                posx_i = fmod(posx_i, boxsize)
+                posy_i = fmod(posy_i, boxsize)
+                posz_i = fmod(posz_i, boxsize)
+                if posx_i < 0:
+                    posx_i = posx_i + boxsize
+                if posy_i < 0:
+                    posy_i = posy_i + boxsize
+                if posz_i < 0:
+                    posz_i = posz_i + boxsize
+                posx[i] = posx_i
+                posy[i] = posy_i
+                posz[i] = posz_i
+                # Find the owner of the particle. This is the
+                # which_domain function written out, so that it can
+                # run without the GIL.
+                if ℤ[nprocs == 1]:
+                    continue
+                if balanced:
+                    x_index = 0
+                    while (    x_index < ℤ[domain_subdivisions[0] - 1]
+                           and posx_i >= domain_cuts_x[x_index + 1]):
+                        x_index = x_index + 1
+                    y_index = 0
+                    while (    y_index < ℤ[domain_subdivisions[1] - 1]
+                           and posy_i >= domain_cuts_y[x_index, y_index + 1]):
+                        y_index = y_index + 1
+                    z_index = 0
+                    while (    z_index < ℤ[domain_subdivisions[2] - 1]
+                           and posz_i >= domain_cuts_z[x_index, y_index, z_index + 1]):
+                        z_index = z_index + 1
+                else:
+                    x_index = cast(posx_i/domain_size_x, 'int')
+                    y_index = cast(posy_i/domain_size_y, 'int')
+                    z_index = cast(posz_i/domain_size_z, 'int')
+                owners[i] = domain_layout[x_index, y_index, z_index]
             masterprint('done')
             # Some partiles may have drifted out of the local domain.
             # Exchange particles to the correct processes.
-            exchange(self)
+            exchange(self, owners=owners_mv)
         elif self.representation == 'fluid':
             # Evolve the fluid using the MacCormack method
             masterprint('Evolving fluid variables (flux terms) of {} ...'.format(self.name))
@@ -1544,13 +1702,11 @@ class Component:
         # Free particle data
         # (fluid data lives on FluidScalar instances).
         free(self.pos)
-        free(self.posx)
-        free(self.posy)
-        free(self.posz)
         free(self.mom)
-        free(self.momx)
-        free(self.momy)
-        free(self.momz)
+        free(self.Δmom)
+        free(self.particle_data)
+        free(self.ids)
+        free(self.masses)
 
     # String representation
     def __repr__(self):
@@ -1625,3 +1781,8 @@ internally_defined_names = {'buffer', 'total'}
 # Names of all implemented fluid variables in order
 cython.declare(fluidvar_names='tuple')
 fluidvar_names = ('ϱ', 'J', 'σ', 'fluidvar 3')
+
+# Counter of instantiated components,
+# used to set the instance_id of each component.
+cython.declare(component_instances='Py_ssize_t')
+component_instances = 0
@@ -0,0 +1,81 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015-2017 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from communication import get_domains_balanced, rebalance_domains, which_domain
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the initial conditions, distributed according to the
+# regular domain decomposition.
+component = load(initial_conditions, compare_params=False, only_components=True)[0]
+
+# Begin analysis
+masterprint('Analyzing {} data using {} processes ...'.format(this_test, nprocs))
+
+# Rebalance the domain decomposition. The computation time is made to
+# differ between the processes, so that the load-balanced domains
+# differ from the regular ones.
+rebalance_domains([component], float(1 + rank))
+if not get_domains_balanced():
+    abort('The domain decomposition was not rebalanced')
+
+# Drift the particles so that the largest displacement is a tenth of
+# the box, moving many particles across domain boundaries.
+mom_max = 0
+if component.N_local > 0:
+    mom_max = np.max(np.abs(np.concatenate((component.momx_mv[:component.N_local],
+                                            component.momy_mv[:component.N_local],
+                                            component.momz_mv[:component.N_local],
+                                            ))))
+mom_max = allreduce(mom_max, op=MPI.MAX)
+if mom_max == 0:
+    abort('The particles of the initial conditions are at rest')
+component.drift({'a⁻²': 0.1*boxsize*component.mass/mom_max})
+
+# Check that no particles were lost in the exchange
+N = allreduce(component.N_local, op=MPI.SUM)
+if N != component.N:
+    abort('{} particles are present after the drift, but {} were expected'
+          .format(N, component.N))
+
+# Check that every particle resides on the process
+# in charge of its load-balanced domain.
+posx = component.posx_mv[:component.N_local]
+posy = component.posy_mv[:component.N_local]
+posz = component.posz_mv[:component.N_local]
+N_misplaced = allreduce(sum([which_domain(posx[i], posy[i], posz[i]) != rank
+                             for i in range(component.N_local)]), op=MPI.SUM)
+if N_misplaced:
+    abort('After drifting within the load-balanced domain decomposition, {} '
+          'particles reside on processes not in charge of their domains'
+          .format(N_misplaced))
+
+# Done analyzing
+masterprint('done')
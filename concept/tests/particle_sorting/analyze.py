@@ -0,0 +1,82 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015-2017 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in data from the CO𝘕CEPT snapshots and the recorded timings
+sortings = ('none', 'morton', 'hilbert')
+components = {}
+times = {}
+for sorting in sortings:
+    fname = glob('{}/output_{}/snapshot_a=*'.format(this_dir, sorting))[0]
+    components[sorting] = load(fname, compare_params=False).components[0]
+    times[sorting] = float(open('{}/time_{}'.format(this_dir, sorting)).read())
+
+# Report the timings
+for sorting in sortings:
+    masterprint('Run {} took {}'
+                .format('without particle sorting' if sorting == 'none'
+                        else 'using {} sorting'.format(sorting.capitalize()),
+                        time_since(time() - times[sorting])))
+for sorting in sortings[1:]:
+    masterprint('Speedup of {} sorting: {}'
+                .format(sorting.capitalize(),
+                        significant_figures(times['none']/times[sorting], 3, fmt='unicode')))
+
+# Begin analysis
+masterprint('Analyzing {} data ...'.format(this_test))
+
+# The sorting changes the order of the particles, and so particles
+# cannot be compared one by one. Instead, the particle distributions
+# are compared through their number counts on a grid.
+gridsize = 16
+counts = {}
+for sorting in sortings:
+    component = components[sorting]
+    counts[sorting], edges = np.histogramdd(np.array([component.posx,
+                                                      component.posy,
+                                                      component.posz]).T,
+                                            bins=gridsize, range=[(0, boxsize)]*3)
+
+# Printout error message for unsuccessful test.
+# The order of the particles changes the order in which their masses
+# are summed onto the mesh, and so only agreement up to round-off
+# errors is expected. A particle sitting right on the edge of a cell
+# may then end up in a neighbouring cell, and so a few
+# discrepancies are allowed.
+tol = 1e-4
+for sorting in sortings[1:]:
+    if np.sum(np.abs(counts[sorting] - counts['none'])) > tol*components['none'].N:
+        abort('The particle distributions with and without {} sorting do not agree!'
+              .format(sorting.capitalize()))
+
+# Done analyzing
+masterprint('done')
@@ -0,0 +1,72 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015-2017 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in data from the CO𝘕CEPT snapshots and the recorded timings
+pp_kernels = ('plain', 'tiled')
+components = {}
+times = {}
+for pp_kernel in pp_kernels:
+    fname = glob('{}/output_{}/snapshot_a=*'.format(this_dir, pp_kernel))[0]
+    components[pp_kernel] = load(fname, compare_params=False).components[0]
+    times[pp_kernel] = float(open('{}/time_{}'.format(this_dir, pp_kernel)).read())
+
+# Report the timings
+for pp_kernel in pp_kernels:
+    masterprint('Run using the {} kernel took {}'
+                .format(pp_kernel, time_since(time() - times[pp_kernel])))
+masterprint('Speedup of the tiled kernel: {}'
+            .format(significant_figures(times['plain']/times['tiled'], 3, fmt='unicode')))
+
+# Begin analysis
+masterprint('Analyzing {} data ...'.format(this_test))
+
+# As both runs use a single process, the particle order is the same
+# in both snapshots. Compute the distance between corresponding
+# particles, taking the periodicity of the box into account.
+Δx = components['tiled'].posx - components['plain'].posx
+Δy = components['tiled'].posy - components['plain'].posy
+Δz = components['tiled'].posz - components['plain'].posz
+Δx -= boxsize*np.round(Δx/boxsize)
+Δy -= boxsize*np.round(Δy/boxsize)
+Δz -= boxsize*np.round(Δz/boxsize)
+dist = np.sqrt(Δx**2 + Δy**2 + Δz**2)
+
+# Printout error message for unsuccessful test.
+# The two kernels sum up the forces in different orders,
+# and so only agreement up to round-off errors is expected.
+tol = 1e-6
+if np.max(dist/boxsize) > tol:
+    abort('The plain and the tiled PP kernel yield different results!')
+
+# Done analyzing
+masterprint('done')
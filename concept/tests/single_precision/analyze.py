@@ -0,0 +1,80 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015-2017 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the power spectra
+nprocs_list = sorted(int(dname[(dname.index('double_') + 7):])
+                     for dname in [os.path.basename(dname)
+                                   for dname in glob('{}/output_double_*'.format(this_dir))])
+powerspecs = {'double': {n: {} for n in nprocs_list},
+              'single': {n: {} for n in nprocs_list}}
+for precision in powerspecs.keys():
+    for n in nprocs_list:
+        for fname in glob('{}/output_{}_{}/powerspec_a=*'.format(this_dir, precision, n)):
+            if fname.endswith('.png'):
+                continue
+            a = float(re.search('a=(.*)', fname).group(1))
+            k, power, _ = np.loadtxt(fname, unpack=True)
+            powerspecs[precision][n][a] = (k, power)
+a_values = sorted(powerspecs['double'][nprocs_list[0]].keys())
+
+# Begin analysis
+masterprint('Analyzing {} data ...'.format(this_test))
+
+# Plot the relative difference between the power spectra
+# of the single and double precision runs.
+fig_file = this_dir + '/result.png'
+fig, ax = plt.subplots(len(nprocs_list), sharex=True, sharey=True)
+rel_diffs = {}
+for n, ax_i in zip(nprocs_list, ax):
+    for a in a_values:
+        k, power_double = powerspecs['double'][n][a]
+        k, power_single = powerspecs['single'][n][a]
+        rel_diffs[n, a] = np.abs(power_single - power_double)/power_double
+        ax_i.semilogy(k, machine_ϵ + rel_diffs[n, a], '.', alpha=0.7, label='$a={}$'.format(a))
+    ax_i.set_ylabel('$|P_{{\mathrm{{s}}{n}}} - P_{{\mathrm{{d}}{n}}}|/P_{{\mathrm{{d}}{n}}}$'
+                    .format(n=n))
+ax[-1].set_xlabel(r'$k$ $\mathrm{{[{}]}}^{{-1}}$'.format(unit_length))
+fig.subplots_adjust(hspace=0)
+plt.setp([ax_i.get_xticklabels() for ax_i in ax[:-1]], visible=False)
+ax[0].legend(loc='best').get_frame().set_alpha(0.7)
+plt.tight_layout()
+plt.savefig(fig_file)
+
+# Printout error message for unsuccessful test
+tol = 1e-3
+if any(np.mean(rel_diff) > tol for rel_diff in rel_diffs.values()):
+    abort('Some or all single precision runs with nprocs = {} yielded power spectra\n'
+          'different from their double precision counterparts!\n'
+          'See "{}" for a visualization.'
+          .format(nprocs_list, fig_file))
+
+# Done analyzing
+masterprint('done')
@@ -0,0 +1,85 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015-2017 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in data from the initial conditions and the CO𝘕CEPT snapshots
+tree_opening_angles = ('1', '0.5', '0.25')
+component_ic = load('{}/IC.hdf5'.format(this_dir), compare_params=False).components[0]
+fname = glob('{}/output_pp/snapshot_a=*'.format(this_dir))[0]
+component_pp = load(fname, compare_params=False).components[0]
+components_tree = {}
+for tree_opening_angle in tree_opening_angles:
+    fname = glob('{}/output_tree_{}/snapshot_a=*'.format(this_dir, tree_opening_angle))[0]
+    components_tree[tree_opening_angle] = load(fname, compare_params=False).components[0]
+
+# Begin analysis
+masterprint('Analyzing {} data ...'.format(this_test))
+
+# Function computing the root mean square distance between
+# corresponding particles of two components, taking the periodicity
+# of the box into account. As all runs use a single process, the
+# particle order is the same in all snapshots.
+def rms_distance(component_1, component_2):
+    Δx = component_1.posx - component_2.posx
+    Δy = component_1.posy - component_2.posy
+    Δz = component_1.posz - component_2.posz
+    Δx -= boxsize*np.round(Δx/boxsize)
+    Δy -= boxsize*np.round(Δy/boxsize)
+    Δz -= boxsize*np.round(Δz/boxsize)
+    return np.sqrt(np.mean(Δx**2 + Δy**2 + Δz**2))
+
+# The error of each tree run is measured as the distance to the PP
+# result, relative to the displacement of the particles in the PP run.
+displacement = rms_distance(component_pp, component_ic)
+errors = {tree_opening_angle: rms_distance(components_tree[tree_opening_angle],
+                                           component_pp)/displacement
+          for tree_opening_angle in tree_opening_angles}
+for tree_opening_angle in tree_opening_angles:
+    masterprint('Relative error using an opening angle of {}: {}'
+                .format(tree_opening_angle,
+                        significant_figures(errors[tree_opening_angle], 3, fmt='unicode')))
+
+# Printout error message for unsuccessful test.
+# The error should shrink as the opening angle is made smaller,
+# with the smallest opening angle giving results close to PP.
+for tree_opening_angle_large, tree_opening_angle_small in zip(tree_opening_angles[:-1],
+                                                              tree_opening_angles[1:]):
+    if errors[tree_opening_angle_small] >= errors[tree_opening_angle_large]:
+        abort('The error of the tree method does not decrease when lowering the opening angle '
+              'from {} to {}'.format(tree_opening_angle_large, tree_opening_angle_small))
+tol = 1e-2
+if errors[tree_opening_angles[-1]] > tol:
+    abort('The tree method with an opening angle of {} does not agree with the PP method'
+          .format(tree_opening_angles[-1]))
+
+# Done analyzing
+masterprint('done')
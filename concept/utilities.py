@@ -33,8 +33,8 @@ cimport('from analysis import measure')
 cimport('from communication import domain_subdivisions, exchange')
 cimport('import graphics')
 cimport('from integration import initiate_time')
-cimport('from mesh import CIC_particles2fluid')
-cimport('from snapshot import get_snapshot_type, snapshot_extensions')
+cimport('from mesh import CIC_particles2fluid, get_fftw_slab')
+cimport('from snapshot import get_snapshot_type, individual_masses_differ, snapshot_extensions')
 cimport('from species import get_representation')
 cimport('from snapshot import load, save')
 
@@ -327,6 +327,7 @@ def locate_snapshots(path):
 # specified by the special_params['snapshot_filename'] parameter.
 @cython.pheader(# Locals
                 basename='str',
+                component='Component',
                 index='int',
                 ext='str',
                 output_dir='str',
@@ -342,6 +343,12 @@ def powerspec():
     snapshot_filename = special_params['snapshot_filename']
     # Read in the snapshot
     snapshot = load(snapshot_filename, compare_params=False)
+    # The mesh assignment uses the common mass of each component
+    for component in snapshot.components:
+        if individual_masses_differ(component):
+            abort('Cannot compute the power spectrum of "{}", as the particles of component '
+                  '"{}" have differing individual masses, which are not supported by the '
+                  'mesh assignment'.format(snapshot_filename, component.name))
     # Construct output filename based on the snapshot filename.
     # Importantly, remove any file extension signalling a snapshot.
     output_dir, basename = os.path.split(snapshot_filename)
@@ -403,6 +410,25 @@ def render():
     graphics.render(snapshot.components, output_filename,
                     True, '.renders_{}'.format(basename))
 
+# Function that acquires FFTW wisdom for each of the gridsizes
+# specified by the special_params['gridsizes'] parameter.
+@cython.pheader(# Locals
+                gridsize='Py_ssize_t',
+                )
+def wisdom():
+    """The wisdom is acquired with the rigor specified by the
+    fftw_wisdom_rigor parameter and saved to the FFTW wisdom store.
+    Wisdom already present in the store at the same or a higher rigor
+    is left untouched, meaning that the utility can safely be rerun.
+    In pure Python mode, NumPy is used for the FFTs and so no wisdom
+    is acquired.
+    """
+    if not cython.compiled:
+        masterwarn('No FFTW wisdom is acquired in pure Python mode')
+        return
+    for gridsize in special_params['gridsizes']:
+        get_fftw_slab(gridsize)
+
 # Function for printing all informations within a snapshot
 @cython.pheader(# Locals
                 alt_str='str',